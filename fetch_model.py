@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+Downloads a model file into the image, the helper behind fetch_model and fetch_model_2.
+
+    fetch_model <url> <file name below models/> [huggingface token] [--sha256 <checksum>]
+
+The file is looked up in the shared cache first (FETCH_MODEL_CACHE_DIR, a BuildKit
+cache mount shared by all image builds), then fetched from the local model server
+(start_model_server.sh, FETCH_MODEL_MIRROR) and last from the URL. Servers that
+support ranges are downloaded from in parallel ranged GETs into <file>.part, with
+the finished parts in <file>.part.json, so a download that was interrupted resumes
+where it stopped when the command runs again. Servers without ranges (python -m
+http.server) are read in one stream. Downloads are checked against a SHA256 when
+one is known (--sha256, or the one HuggingFace reports for LFS files) and stored
+in the cache under their SHA256.
+"""
+
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote, urlparse
+
+# Directory the file names are relative to
+FETCH_MODEL_DEST = os.environ.get("FETCH_MODEL_DEST", "models")
+# Local model server tried before the URL (see start_model_server.sh), empty to skip it
+FETCH_MODEL_MIRROR = os.environ.get("FETCH_MODEL_MIRROR", "http://localhost:54893")
+# Content-addressed cache shared by image builds, empty to disable it
+FETCH_MODEL_CACHE_DIR = os.environ.get("FETCH_MODEL_CACHE_DIR", "")
+# Number of ranged GETs running at the same time
+FETCH_MODEL_CONNECTIONS = int(os.environ.get("FETCH_MODEL_CONNECTIONS", 8))
+# Size of one ranged GET in MiB
+FETCH_MODEL_PART_SIZE_MB = int(os.environ.get("FETCH_MODEL_PART_SIZE_MB", 64))
+# Number of times a download from the URL is resumed after a failure
+FETCH_MODEL_RETRIES = int(os.environ.get("FETCH_MODEL_RETRIES", 3))
+# First backoff between retries in milliseconds, doubled after every attempt
+FETCH_MODEL_RETRY_BACKOFF_MS = int(os.environ.get("FETCH_MODEL_RETRY_BACKOFF_MS", 1000))
+# Seconds a request may wait for data before it fails
+FETCH_MODEL_TIMEOUT_S = float(os.environ.get("FETCH_MODEL_TIMEOUT_S", 60))
+
+# Downloads are written next to their target under this suffix, then renamed
+PART_SUFFIX = ".part"
+# Parts of an interrupted download that are already on disk
+PROGRESS_SUFFIX = ".part.json"
+# Size of the reads of a response body and of the file when hashing it
+READ_SIZE = 1024**2
+# Time between two progress lines of a download in seconds
+PROGRESS_INTERVAL_S = 10
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class FetchError(Exception):
+    """
+    The file could not be downloaded.
+    """
+
+
+class _RetryableError(Exception):
+    """
+    A download attempt failed in a way another attempt may not.
+    """
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+
+def load_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    # Written to a temporary file and renamed, a crash leaves the old version
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(temp, path)
+
+
+def remove(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def link_or_copy(source, target):
+    """
+    Put a file at target under a temporary name and rename it, hard linked if both are on the same file system.
+    """
+    temp = f"{target}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        try:
+            os.link(source, temp)
+        except OSError:
+            shutil.copyfile(source, temp)
+        os.replace(temp, target)
+    except BaseException:
+        remove(temp)
+        raise
+
+
+def sha256_header(headers):
+    """
+    Returns the SHA256 in HuggingFace's X-Linked-Etag header, or None.
+    """
+    value = (headers.get("X-Linked-Etag") or "").removeprefix("W/").strip('"').lower()
+    return value if SHA256_PATTERN.match(value) else None
+
+
+class _RedirectHandler(urllib.request.HTTPRedirectHandler):
+    """
+    Keeps the headers of the redirects (HuggingFace reports the SHA256 of LFS files on
+    them) and does not send the token to other hosts, like the CDN of signed URLs.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.headers = []
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        self.headers.append(headers)
+        request = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if request is not None and urlparse(newurl).netloc != urlparse(req.full_url).netloc:
+            request.remove_header("Authorization")
+        return request
+
+
+class ModelCache:
+    """
+    Downloaded models by SHA256, in <path>/blobs/<sha256>, and the SHA256 of the
+    file last downloaded from every URL, in <path>/urls/<sha256 of the URL>.json.
+
+    Files are written under a temporary name and renamed, so builds running at the
+    same time can share the directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def blob(self, sha256):
+        return os.path.join(self.path, "blobs", sha256)
+
+    def _record(self, url):
+        return os.path.join(self.path, "urls", hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def sha256(self, url):
+        """
+        Returns the SHA256 of the file last downloaded from a URL, or None.
+        """
+        return load_json(self._record(url), {}).get("sha256")
+
+    def install(self, sha256, path):
+        """
+        Put the cached file with a SHA256 at path; returns False if it is not cached.
+        """
+        if not sha256 or not os.path.isfile(self.blob(sha256)):
+            return False
+        link_or_copy(self.blob(sha256), path)
+        return True
+
+    def store(self, path, sha256, url):
+        """
+        Add a downloaded file; the cache is best-effort, errors are only reported.
+        """
+        try:
+            os.makedirs(os.path.dirname(self.blob(sha256)), exist_ok=True)
+            os.makedirs(os.path.dirname(self._record(url)), exist_ok=True)
+            if not os.path.isfile(self.blob(sha256)):
+                link_or_copy(path, self.blob(sha256))
+            write_json(self._record(url), {"url": url, "sha256": sha256, "size": os.path.getsize(path)})
+        except OSError as e:
+            print(f"⚠️ Could not add {path} to the cache {self.path}: {e}")
+
+
+class _Progress:
+    """
+    Prints the progress of a download every PROGRESS_INTERVAL_S.
+    """
+
+    def __init__(self, name, size, done=0):
+        self.name = name
+        self.size = size
+        self.done = done
+        self.started = time.perf_counter()
+        self.reported = self.started
+        self.first = done
+        self.lock = threading.Lock()
+
+    def add(self, count):
+        with self.lock:
+            self.done += count
+            now = time.perf_counter()
+            if now - self.reported < PROGRESS_INTERVAL_S:
+                return
+            self.reported = now
+            rate = (self.done - self.first) / 1024**2 / max(now - self.started, 1e-6)
+            percent = f"{self.done * 100 // self.size}% of {self.size / 1024**2:.0f} MB" if self.size else f"{self.done / 1024**2:.0f} MB"
+            print(f"⏳ {self.name}: {percent} ({rate:.0f} MB/s)")
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        rate = (self.done - self.first) / 1024**2 / max(elapsed, 1e-6)
+        return f"{self.done / 1024**2:.0f} MB in {elapsed:.1f} s ({rate:.0f} MB/s)"
+
+
+class ModelFetcher:
+    """
+    Downloads model files from the cache, the local model server or their URL.
+
+    Args:
+        dest (str, optional): Directory the file names are relative to
+        mirror (str, optional): Local model server, "" to skip it
+        cache_dir (str, optional): Shared cache directory, "" to disable it
+        connections (int, optional): Ranged GETs running at the same time
+        part_size (int, optional): Size of one ranged GET in bytes
+        retries (int, optional): Times a download from the URL is resumed after a failure
+        timeout (float, optional): Seconds a request may wait for data
+    """
+
+    def __init__(self, dest=None, mirror=None, cache_dir=None, connections=None, part_size=None, retries=None, timeout=None):
+        self.dest = FETCH_MODEL_DEST if dest is None else dest
+        self.mirror = FETCH_MODEL_MIRROR if mirror is None else mirror
+        cache_dir = FETCH_MODEL_CACHE_DIR if cache_dir is None else cache_dir
+        self.cache = ModelCache(cache_dir) if cache_dir else None
+        self.connections = FETCH_MODEL_CONNECTIONS if connections is None else connections
+        self.part_size = FETCH_MODEL_PART_SIZE_MB * 1024**2 if part_size is None else part_size
+        self.retries = FETCH_MODEL_RETRIES if retries is None else retries
+        self.timeout = FETCH_MODEL_TIMEOUT_S if timeout is None else timeout
+
+    def fetch(self, url, filename, token=None, sha256=None):
+        """
+        Download a file to <dest>/<filename>.
+
+        Args:
+            url (str): Where to download the file from, e.g. a HuggingFace resolve URL
+            filename (str): Path of the file below dest, also its path on the local model server
+            token (str, optional): HuggingFace access token, only sent to the URL
+            sha256 (str, optional): Expected SHA256 of the file
+
+        Returns:
+            str: Where the file came from, "cache", "mirror" or "url"
+
+        Raises:
+            FetchError: The file could not be downloaded from the URL
+        """
+        path = os.path.join(self.dest, filename)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        sha256 = sha256.lower() if sha256 else None
+
+        if self.cache is not None and self.cache.install(sha256 or self.cache.sha256(url), path):
+            print(f"✅ Copied from the build cache: {filename}")
+            return "cache"
+
+        sources = []
+        if self.mirror:
+            sources.append(("mirror", f"{self.mirror.rstrip('/')}/{quote(filename)}", {}, 0))
+        sources.append(("url", url, {"Authorization": f"Bearer {token}"} if token else {}, self.retries))
+        for source, source_url, headers, retries in sources:
+            print(f"📦 Fetching {filename} from {source_url}")
+            try:
+                digest = self.download(source_url, path, headers, sha256, retries)
+            except FetchError as e:
+                if source == "mirror":
+                    print(f"⚠️ Local cache miss ({e}), falling back to {url}")
+                    continue
+                raise
+            if self.cache is not None and digest:
+                self.cache.store(path, digest, url)
+            print(f"✅ Downloaded {filename} from {source_url}")
+            return source
+
+    def download(self, url, path, headers=None, sha256=None, retries=None):
+        """
+        Download a URL to path, resuming an earlier download of it.
+
+        Returns:
+            str: SHA256 of the file, None if it was not needed (no expected SHA256 and no cache)
+
+        Raises:
+            FetchError: The download failed, or the file does not have the expected SHA256
+        """
+        headers = headers or {}
+        retries = self.retries if retries is None else retries
+        backoff = FETCH_MODEL_RETRY_BACKOFF_MS / 1000
+        for attempt in range(retries + 1):
+            try:
+                return self._attempt(url, path, headers, sha256)
+            except _RetryableError as e:
+                if attempt == retries:
+                    raise FetchError(str(e)) from e
+                print(f"⚠️ {e}, resuming in {backoff:.1f} s")
+            time.sleep(backoff)
+            backoff *= 2
+
+    def _open(self, url, headers, range_header=None):
+        redirects = _RedirectHandler()
+        request = urllib.request.Request(url, headers=dict(headers))
+        if range_header:
+            request.add_header("Range", range_header)
+        response = urllib.request.build_opener(redirects).open(request, timeout=self.timeout)
+        return response, redirects.headers
+
+    def _attempt(self, url, path, headers, sha256):
+        name = os.path.relpath(path, self.dest)
+        try:
+            response, redirect_headers = self._open(url, headers, "bytes=0-0")
+        except urllib.error.HTTPError as e:
+            if e.code == 416:
+                # Empty files have no byte 0
+                return self._stream(url, path, headers, sha256, name)
+            if e.code < 500 and e.code not in (408, 429):
+                raise FetchError(f"{url}: HTTP {e.code}") from e
+            raise _RetryableError(f"{url}: HTTP {e.code}") from e
+        except (OSError, http.client.HTTPException) as e:
+            raise _RetryableError(f"{url}: {e}") from e
+
+        with response:
+            reported = next(filter(None, map(sha256_header, [*redirect_headers, response.headers])), None)
+            if sha256 and reported and reported != sha256:
+                raise FetchError(f"{url} reports SHA256 {reported}, expected {sha256}")
+            sha256 = sha256 or reported
+            content_range = response.headers.get("Content-Range", "")
+            if response.status != 206 or "/" not in content_range or content_range.endswith("/*"):
+                # No ranges, the response is the whole file
+                return self._write_stream(response, path, sha256, name)
+            response.read()
+            size = int(content_range.rsplit("/", 1)[1])
+            etag = response.headers.get("ETag") or ""
+            validator = response.headers.get("Last-Modified") if not etag or etag.startswith("W/") else etag
+            final_url = response.geturl()
+
+        # Parts go straight to where the redirects led, the token only to the host it was meant for
+        part_headers = dict(headers) if urlparse(final_url).netloc == urlparse(url).netloc else {}
+        if validator:
+            # A file replaced between two parts makes the server send all of it instead
+            part_headers["If-Range"] = validator
+        return self._download_parts(url, final_url, path, part_headers, size, validator, sha256, name)
+
+    def _stream(self, url, path, headers, sha256, name):
+        try:
+            response, _ = self._open(url, headers)
+        except urllib.error.HTTPError as e:
+            raise FetchError(f"{url}: HTTP {e.code}") from e
+        except (OSError, http.client.HTTPException) as e:
+            raise _RetryableError(f"{url}: {e}") from e
+        with response:
+            return self._write_stream(response, path, sha256, name)
+
+    def _write_stream(self, response, path, sha256, name):
+        part_path = path + PART_SUFFIX
+        remove(path + PROGRESS_SUFFIX)
+        length = response.headers.get("Content-Length")
+        size = int(length) if length and length.isdigit() else None
+        progress = _Progress(name, size)
+        digest = hashlib.sha256()
+        written = 0
+        try:
+            with open(part_path, "wb") as f:
+                while True:
+                    chunk = response.read(READ_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    digest.update(chunk)
+                    written += len(chunk)
+                    progress.add(len(chunk))
+        except (OSError, http.client.HTTPException) as e:
+            remove(part_path)
+            raise _RetryableError(f"{response.geturl()}: {e}") from e
+        if size is not None and written != size:
+            remove(part_path)
+            raise _RetryableError(f"{response.geturl()}: short read ({written} of {size} bytes)")
+        print(f"⬇️ {name}: {progress.summary()}")
+        return self._finish(part_path, path, digest.hexdigest(), sha256)
+
+    def _download_parts(self, url, final_url, path, headers, size, validator, sha256, name):
+        part_path = path + PART_SUFFIX
+        progress_path = path + PROGRESS_SUFFIX
+        parts = [(offset, min(offset + self.part_size, size)) for offset in range(0, size, self.part_size)]
+        record = {"url": url, "size": size, "validator": validator, "part_size": self.part_size}
+        saved = load_json(progress_path, {})
+        done = set()
+        if (
+            validator
+            and {key: saved.get(key) for key in record} == record
+            and os.path.isfile(part_path)
+            and os.path.getsize(part_path) == size
+        ):
+            done = {tuple(part) for part in saved.get("done", [])}
+            print(f"⏯️ Resuming {name}, {len(done)} of {len(parts)} parts are already on disk")
+        else:
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+
+        progress = _Progress(name, size, sum(end - start for start, end in done))
+        lock = threading.Lock()
+        errors = []
+        pending = [part for part in parts if part not in done]
+        with ThreadPoolExecutor(max_workers=max(1, min(self.connections, len(pending)))) as pool:
+            futures = {pool.submit(self._fetch_part, final_url, headers, part_path, part, progress): part for part in pending}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except (OSError, http.client.HTTPException, _RetryableError) as e:
+                    errors.append(e)
+                    continue
+                with lock:
+                    done.add(futures[future])
+                    write_json(progress_path, {**record, "done": sorted(done)})
+        if errors:
+            raise _RetryableError(f"{len(errors)} of {len(parts)} parts of {name} failed, the first with: {errors[0]}")
+
+        print(f"⬇️ {name}: {progress.summary()} over {min(self.connections, len(parts))} connections")
+        digest = file_sha256(part_path) if sha256 or self.cache is not None else None
+        return self._finish(part_path, path, digest, sha256)
+
+    def _fetch_part(self, url, headers, part_path, part, progress):
+        start, end = part
+        response, _ = self._open(url, headers, f"bytes={start}-{end - 1}")
+        with response:
+            if response.status != 206 or not response.headers.get("Content-Range", "").startswith(f"bytes {start}-"):
+                raise _RetryableError(f"{url} changed or ignored the range of bytes {start}-{end - 1}")
+            offset = start
+            fd = os.open(part_path, os.O_WRONLY)
+            try:
+                while offset < end:
+                    chunk = response.read(min(READ_SIZE, end - offset))
+                    if not chunk:
+                        break
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+                    progress.add(len(chunk))
+            finally:
+                os.close(fd)
+        if offset != end:
+            raise _RetryableError(f"short read of bytes {start}-{end - 1} ({offset - start} bytes)")
+
+    def _finish(self, part_path, path, digest, sha256):
+        if sha256 and digest != sha256:
+            remove(part_path, path + PROGRESS_SUFFIX)
+            raise FetchError(f"SHA256 mismatch for {path}: got {digest}, expected {sha256}")
+        os.replace(part_path, path)
+        remove(path + PROGRESS_SUFFIX)
+        return digest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("url", help="where to download the file from, e.g. a HuggingFace resolve URL")
+    parser.add_argument("filename", help="path of the file below FETCH_MODEL_DEST, also its path on the local model server")
+    parser.add_argument("token", nargs="?", default="", help="HuggingFace access token, only sent to the URL")
+    parser.add_argument("--sha256", default=None, help="expected SHA256 of the file")
+    args = parser.parse_args()
+
+    try:
+        ModelFetcher().fetch(args.url, args.filename, args.token or None, args.sha256)
+    except FetchError as e:
+        print(f"❌ Could not download {args.filename}: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+# Async HTTP client for the ComfyUI API used by rp_handler.py
+
+import asyncio
+import json
+import os
+
+import aiohttp
+
+# Total timeout of a single ComfyUI request in seconds
+COMFY_HTTP_TIMEOUT_S = float(os.environ.get("COMFY_HTTP_TIMEOUT_S", 60))
+# Timeout for establishing a connection to ComfyUI in seconds
+COMFY_HTTP_CONNECT_TIMEOUT_S = float(os.environ.get("COMFY_HTTP_CONNECT_TIMEOUT_S", 5))
+# Number of times a failed request is retried
+COMFY_HTTP_RETRIES = int(os.environ.get("COMFY_HTTP_RETRIES", 3))
+# First backoff between retries in milliseconds, doubled after every attempt
+COMFY_HTTP_RETRY_BACKOFF_MS = int(os.environ.get("COMFY_HTTP_RETRY_BACKOFF_MS", 100))
+# Maximum number of pooled keep-alive connections to ComfyUI
+COMFY_HTTP_POOL_SIZE = int(os.environ.get("COMFY_HTTP_POOL_SIZE", 16))
+
+# Status codes that are worth retrying
+RETRY_STATUSES = {502, 503, 504}
+
+
+class ComfyHTTPError(Exception):
+    """
+    Raised when ComfyUI answers with an unexpected status code.
+    """
+
+    def __init__(self, method, url, status, text):
+        super().__init__(f"{method} {url} returned HTTP {status}: {text[:500]}")
+        self.status = status
+        self.text = text
+
+
+class ComfyResponse:
+    """
+    A fully read ComfyUI response.
+    """
+
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    @property
+    def text(self):
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class ComfyClient:
+    """
+    All HTTP traffic to ComfyUI goes through one pooled keep-alive session.
+
+    Timeouts and the retry policy live here: idempotent requests (GET) are retried on
+    connection errors, timeouts and 502/503/504; other requests are only retried when
+    the connection could not be established, so a prompt is never queued twice.
+
+    The session is created lazily on the running event loop and re-created if the
+    client is used from a different loop.
+
+    If set, on_connection_error is called with the exception whenever a request finally
+    fails because ComfyUI could not be reached or dropped the connection.
+    """
+
+    def __init__(self, retries=None, timeout_s=None, connect_timeout_s=None, pool_size=None, on_connection_error=None):
+        self.retries = COMFY_HTTP_RETRIES if retries is None else retries
+        self.timeout = aiohttp.ClientTimeout(
+            total=timeout_s or COMFY_HTTP_TIMEOUT_S,
+            connect=connect_timeout_s or COMFY_HTTP_CONNECT_TIMEOUT_S,
+        )
+        self.pool_size = pool_size or COMFY_HTTP_POOL_SIZE
+        self.on_connection_error = on_connection_error
+        self._session = None
+        self._loop = None
+
+    def _get_session(self):
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                timeout=self.timeout,
+            )
+            self._loop = loop
+        return self._session
+
+    async def close(self):
+        """
+        Close the pooled session.
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+    async def request(self, method, url, json_body=None, data=None, retries=None, timeout=None):
+        """
+        Send a request and read the whole response.
+
+        Args:
+            method (str): HTTP method
+            url (str): Full URL
+            json_body (dict, optional): Body sent as JSON
+            data (optional): Body, or a callable returning a fresh body for every attempt
+            retries (int, optional): Overrides the configured number of retries
+            timeout (aiohttp.ClientTimeout, optional): Overrides the configured timeouts
+
+        Returns:
+            ComfyResponse: The response, whatever its status code
+        """
+        retries = self.retries if retries is None else retries
+        idempotent = method.upper() in ("GET", "HEAD")
+        backoff = COMFY_HTTP_RETRY_BACKOFF_MS / 1000
+
+        for attempt in range(retries + 1):
+            last_attempt = attempt == retries
+            try:
+                body = data() if callable(data) else data
+                async with self._get_session().request(
+                    method, url, json=json_body, data=body, timeout=timeout or self.timeout
+                ) as response:
+                    result = ComfyResponse(response.status, await response.read())
+                if idempotent and result.status in RETRY_STATUSES and not last_attempt:
+                    print(f"runpod-worker-comfy - {method} {url} returned {result.status}, retrying")
+                else:
+                    return result
+            except aiohttp.ClientConnectorError as e:
+                if last_attempt:
+                    self._connection_failed(e)
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if last_attempt or not idempotent:
+                    if isinstance(e, aiohttp.ServerDisconnectedError):
+                        self._connection_failed(e)
+                    raise
+
+            await asyncio.sleep(backoff)
+            backoff *= 2
+
+    def _connection_failed(self, error):
+        if self.on_connection_error is not None:
+            self.on_connection_error(error)
+
+    async def get_json(self, url, **kwargs):
+        """
+        GET a URL and decode its JSON body.
+
+        Raises:
+            ComfyHTTPError: The response status was not 200
+        """
+        response = await self.request("GET", url, **kwargs)
+        if response.status != 200:
+            raise ComfyHTTPError("GET", url, response.status, response.text)
+        return response.json()
+
+    async def post_json(self, url, payload, **kwargs):
+        """
+        POST a JSON payload and decode the JSON answer.
+
+        Raises:
+            ComfyHTTPError: The response status was not 200
+        """
+        response = await self.request("POST", url, json_body=payload, **kwargs)
+        if response.status != 200:
+            raise ComfyHTTPError("POST", url, response.status, response.text)
+        return response.json()
@@ -0,0 +1,339 @@
+# Completion tracking over the ComfyUI websocket for rp_handler.py
+
+import asyncio
+import json
+import os
+import time
+import uuid
+
+import websockets
+
+# First delay of the /history fallback poll in milliseconds
+COMFY_FALLBACK_POLL_MIN_MS = int(os.environ.get("COMFY_FALLBACK_POLL_MIN_MS", 50))
+# Number of finished prompts the shared dispatcher remembers for late waiters
+DISPATCHER_MAX_FINISHED = 1000
+
+
+class ExecutionError(Exception):
+    """
+    Raised when ComfyUI reports that a prompt failed or was interrupted.
+    """
+
+    def __init__(self, message, data=None):
+        super().__init__(message)
+        self.data = data or {}
+
+
+async def poll_history(fetch_history, prompt_id, max_attempts, min_delay_ms=None, max_delay_ms=1000):
+    """
+    Poll /history for a prompt until it has an entry, backing off adaptively.
+
+    Args:
+        fetch_history (callable): Coroutine function returning the /history/<prompt_id> response
+        prompt_id (str): The prompt to wait for
+        max_attempts (int): Maximum number of /history requests
+        min_delay_ms (int, optional): First delay between requests, doubled after every miss
+        max_delay_ms (int, optional): Largest delay between requests
+
+    Returns:
+        dict: The history response containing the prompt, or None if it never appeared
+    """
+    delay = (min_delay_ms or COMFY_FALLBACK_POLL_MIN_MS) / 1000
+    max_delay = max_delay_ms / 1000
+
+    for _ in range(max_attempts):
+        try:
+            history = await fetch_history(prompt_id)
+            entry = history.get(prompt_id)
+            if entry and (entry.get("outputs") or entry.get("status", {}).get("completed") is not None):
+                return history
+        except Exception as e:
+            print(f"runpod-worker-comfy - ⚠️ History fetch error: {e}")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+    return None
+
+
+class CompletionTracker:
+    """
+    Follows the ComfyUI websocket for one client_id and signals when a prompt is done.
+
+    The socket is opened before the prompt is queued (so no event can be missed) and
+    /history is only requested once the prompt has finished. If the socket drops,
+    waiting falls back to polling /history with adaptive backoff.
+
+    Args:
+        host (str): ComfyUI host:port
+        fetch_history (callable): Coroutine function returning the /history/<prompt_id> response
+        client_id (str, optional): The client_id used for the socket and the queued prompt
+        on_message (callable, optional): Called with every decoded JSON message (e.g. for relaying)
+        on_binary (callable, optional): Called with every binary frame (previews)
+        poll_interval_ms (int, optional): Largest delay between /history requests when polling
+    """
+
+    def __init__(
+        self, host, fetch_history, client_id=None, on_message=None, on_binary=None, poll_interval_ms=1000
+    ):
+        self.host = host
+        self.fetch_history = fetch_history
+        self.poll_interval_ms = poll_interval_ms
+        self.client_id = client_id or uuid.uuid4().hex
+        self.on_message = on_message
+        self.on_binary = on_binary
+        self.connected = False
+        self._ws = None
+        self._reader = None
+        self._closed = asyncio.Event()
+        self._finished = {}
+        self._events = {}
+
+    async def connect(self):
+        """
+        Open the websocket and start reading events.
+
+        Returns:
+            bool: True when connected, False if callers will have to rely on polling
+        """
+        uri = f"ws://{self.host}/ws?clientId={self.client_id}"
+        try:
+            self._ws = await websockets.connect(uri, max_size=None)
+        except Exception as e:
+            print(f"runpod-worker-comfy - ⚠️ Could not open ComfyUI websocket, falling back to polling: {e}")
+            self._closed.set()
+            return False
+
+        self.connected = True
+        self._reader = asyncio.create_task(self._read())
+        return True
+
+    async def _read(self):
+        try:
+            async for raw in self._ws:
+                # Binary frames are previews, they carry no completion information
+                if isinstance(raw, bytes):
+                    if self.on_binary:
+                        self.on_binary(raw)
+                    continue
+                try:
+                    message = json.loads(raw)
+                except json.JSONDecodeError:
+                    continue
+
+                self._handle(message)
+                if self.on_message:
+                    self.on_message(message)
+        except Exception as e:
+            print(f"runpod-worker-comfy - ⚠️ ComfyUI websocket dropped: {e}")
+        finally:
+            self.connected = False
+            self._closed.set()
+
+    def _handle(self, message):
+        msg_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if prompt_id is None:
+            return
+
+        if msg_type == "executing" and data.get("node") is None:
+            self._finish(prompt_id, None)
+        elif msg_type == "execution_success":
+            self._finish(prompt_id, None)
+        elif msg_type == "execution_error":
+            self._finish(
+                prompt_id,
+                ExecutionError(
+                    f"{data.get('node_type', 'node')} {data.get('node_id', '')}: "
+                    f"{data.get('exception_message', 'execution error')}".strip(),
+                    data,
+                ),
+            )
+        elif msg_type == "execution_interrupted":
+            self._finish(prompt_id, ExecutionError("Execution was interrupted", data))
+
+    def _finish(self, prompt_id, error):
+        # The first terminal event wins; execution_error is followed by executing=None
+        if prompt_id in self._finished:
+            return
+        self._finished[prompt_id] = (time.monotonic(), error)
+        event = self._events.get(prompt_id)
+        if event:
+            event.set()
+
+    async def wait(self, prompt_id, max_attempts):
+        """
+        Wait until the prompt has finished and return its /history response.
+
+        Args:
+            prompt_id (str): The prompt to wait for
+            max_attempts (int): Maximum number of /history requests used in polling mode
+
+        Returns:
+            dict: The /history response for the prompt, or None if it could not be obtained
+
+        Raises:
+            ExecutionError: ComfyUI reported an error for the prompt
+        """
+        event = self._events.setdefault(prompt_id, asyncio.Event())
+        if prompt_id in self._finished:
+            event.set()
+
+        done = asyncio.create_task(event.wait())
+        closed = asyncio.create_task(self._closed.wait())
+        try:
+            await asyncio.wait({done, closed}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            done.cancel()
+            closed.cancel()
+
+        if prompt_id in self._finished:
+            _, error = self._finished[prompt_id]
+            if error:
+                raise error
+            # execution_success arrives just before ComfyUI stores the history entry,
+            # so allow a few very short retries before giving up
+            return await poll_history(
+                self.fetch_history, prompt_id, max_attempts, min_delay_ms=10, max_delay_ms=self.poll_interval_ms
+            )
+
+        print("runpod-worker-comfy - ⚠️ Websocket unavailable, polling /history instead")
+        history = await poll_history(
+            self.fetch_history, prompt_id, max_attempts, max_delay_ms=self.poll_interval_ms
+        )
+        if history:
+            status = history[prompt_id].get("status", {})
+            if status.get("status_str") == "error":
+                raise ExecutionError("ComfyUI reported an error for the prompt", status)
+        return history
+
+    async def close(self):
+        """
+        Close the websocket and stop the reader.
+        """
+        if self._ws is not None:
+            try:
+                await self._ws.close()
+            except Exception:
+                pass
+        if self._reader is not None:
+            try:
+                await self._reader
+            except Exception:
+                pass
+        self.connected = False
+
+
+class EventDispatcher(CompletionTracker):
+    """
+    One ComfyUI websocket shared by all jobs of the worker, routing events by prompt_id.
+
+    Every prompt is queued with the dispatcher's client_id and a prompt_id chosen by
+    the job, which subscribes to it before queueing, so a job only receives its own
+    prompt's messages. Messages without a prompt_id go to every subscriber; binary
+    frames (previews) go to the prompt that is executing. ComfyUI's status messages
+    keep `queue_remaining` up to date.
+
+    The socket is opened by connect() and re-opened by the next connect() after it
+    dropped; prompts waiting at that moment fall back to polling /history.
+
+    Args:
+        fetch_history (callable): Coroutine function returning the /history/<prompt_id> response
+        client_id (str, optional): The client_id used for the socket and all queued prompts
+        poll_interval_ms (int, optional): Largest delay between /history requests when polling
+    """
+
+    def __init__(self, fetch_history, client_id=None, poll_interval_ms=1000):
+        super().__init__(
+            None,
+            fetch_history,
+            client_id=client_id,
+            on_message=self._dispatch,
+            on_binary=self._dispatch_binary,
+            poll_interval_ms=poll_interval_ms,
+        )
+        self.queue_remaining = 0
+        self.executing = None
+        self.connects = 0
+        self._subscribers = {}
+        self._loop = None
+        self._connecting = None
+
+    async def connect(self, host=None):
+        """
+        Make sure the socket to host is open on the current event loop.
+
+        Returns:
+            bool: True when connected, False if waiting will have to rely on polling
+        """
+        loop = asyncio.get_running_loop()
+        host = host or self.host
+        if self.connected and self._loop is loop and self.host == host:
+            return True
+
+        if self._loop is not loop:
+            # The old loop's socket and events cannot be used any more
+            self._events.clear()
+            self._ws = None
+            self._reader = None
+            self._connecting = asyncio.Lock()
+            self._loop = loop
+
+        # Jobs starting together share one connection attempt
+        async with self._connecting:
+            if self.connected and self.host == host:
+                return True
+            await self.close()
+            self.host = host
+            self._ws = None
+            self._reader = None
+            self._closed = asyncio.Event()
+            self.connects += 1
+            return await super().connect()
+
+    def subscribe(self, prompt_id, on_message=None, on_binary=None):
+        """
+        Route the messages of a prompt to the given callbacks. Call it before queueing.
+        """
+        self._subscribers[prompt_id] = (on_message, on_binary)
+
+    def unsubscribe(self, prompt_id):
+        """
+        Forget a prompt once its job is done.
+        """
+        self._subscribers.pop(prompt_id, None)
+        self._finished.pop(prompt_id, None)
+        self._events.pop(prompt_id, None)
+
+    def _dispatch(self, message):
+        msg_type = message.get("type")
+        data = message.get("data") or {}
+
+        if msg_type == "status":
+            exec_info = (data.get("status") or {}).get("exec_info") or {}
+            self.queue_remaining = exec_info.get("queue_remaining", self.queue_remaining)
+
+        prompt_id = data.get("prompt_id")
+        if msg_type == "execution_start" or (msg_type == "executing" and data.get("node") is not None):
+            self.executing = prompt_id
+        elif msg_type == "executing" and prompt_id == self.executing:
+            self.executing = None
+
+        if prompt_id is None:
+            subscribers = list(self._subscribers.values())
+        else:
+            subscribers = [self._subscribers[prompt_id]] if prompt_id in self._subscribers else []
+        for on_message, _ in subscribers:
+            if on_message:
+                on_message(message)
+
+    def _dispatch_binary(self, frame):
+        on_message, on_binary = self._subscribers.get(self.executing, (None, None))
+        if on_binary:
+            on_binary(frame)
+
+    def _finish(self, prompt_id, error):
+        super()._finish(prompt_id, error)
+        # Prompts of other clients finish here too, keep only the most recent ones
+        while len(self._finished) > DISPATCHER_MAX_FINISHED:
+            self._finished.pop(next(iter(self._finished)))
@@ -0,0 +1,98 @@
+# Coalescing of identical jobs that run at the same time
+
+import asyncio
+import os
+
+from job_concurrency import MAX_CONCURRENT_JOBS
+
+# Let identical jobs running at the same time share one ComfyUI execution (on by default only when jobs can overlap)
+INFLIGHT_DEDUP_ENABLED = (
+    os.environ.get("INFLIGHT_DEDUP_ENABLED", "true" if MAX_CONCURRENT_JOBS > 1 else "false").lower() == "true"
+)
+
+
+class _Render:
+    def __init__(self, release):
+        self.task = None
+        self.release = release
+        self.listeners = []
+        self.waiters = 0
+
+
+class InflightJobs:
+    """
+    Runs identical jobs (equal keys, see result_key()) once and hands the result to all of them.
+
+    The first job starts the render, later ones wait for it; each job then delivers
+    the result itself. The render is not tied to the job that started it: when a
+    waiting job is cancelled only that job stops waiting, and the render is only
+    cancelled once no job waits for it any more. An exception raised by the render
+    reaches every waiting job.
+    """
+
+    def __init__(self):
+        self.started = 0
+        self.joined = 0
+        self._renders = {}
+
+    async def run(self, key, render, deliver=None, listener=None, release=None):
+        """
+        Run render() for key, or wait for the render of an identical job that is already running.
+
+        Args:
+            key (str): The job's key
+            render (callable): Coroutine function producing the result, called with the
+                list of the listeners of the jobs waiting for it
+            deliver (callable, optional): Coroutine function turning the result into this job's result
+            listener (optional): Added to the render's listeners while this job waits
+            release (callable, optional): Called with the result once every job that
+                waited for it has delivered it (given by the job that starts the render)
+
+        Returns:
+            tuple: (the result, True if this job joined a render started by another job)
+        """
+        entry = self._renders.get(key)
+        joined = entry is not None
+        if joined:
+            self.joined += 1
+        else:
+            entry = _Render(release)
+            entry.task = asyncio.ensure_future(render(entry.listeners))
+            self._renders[key] = entry
+            entry.task.add_done_callback(lambda _: self._forget(key, entry))
+            self.started += 1
+
+        entry.waiters += 1
+        if listener is not None:
+            entry.listeners.append(listener)
+        try:
+            try:
+                result = await asyncio.shield(entry.task)
+            finally:
+                if listener is not None:
+                    entry.listeners.remove(listener)
+            if deliver is None:
+                return dict(result), joined
+            return await deliver(result), joined
+        finally:
+            entry.waiters -= 1
+            if entry.waiters == 0:
+                self._finished(key, entry)
+
+    def _finished(self, key, entry):
+        if not entry.task.done():
+            # Nobody is interested in the result any more, a new identical job starts afresh
+            entry.task.cancel()
+            self._forget(key, entry)
+        elif entry.release and not entry.task.cancelled() and entry.task.exception() is None:
+            entry.release(entry.task.result())
+
+    def _forget(self, key, entry):
+        if self._renders.get(key) is entry:
+            del self._renders[key]
+
+    def running(self):
+        """
+        Returns the number of renders in progress.
+        """
+        return len(self._renders)
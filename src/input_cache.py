@@ -0,0 +1,199 @@
+# Content-addressed cache of input images already sitting in ComfyUI's input directory
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from input_images import iter_b64decode
+
+# Directory where ComfyUI stores uploaded images
+COMFY_INPUT_PATH = os.environ.get("COMFY_INPUT_PATH", "/comfyui/input")
+# Reuse input images that were already uploaded by an earlier job
+INPUT_CACHE_ENABLED = os.environ.get("INPUT_CACHE_ENABLED", "true").lower() == "true"
+# Disk budget for cached input images in bytes
+INPUT_CACHE_MAX_BYTES = int(os.environ.get("INPUT_CACHE_MAX_BYTES", 2 * 1024**3))
+
+# Cached files are named rp_<first 32 hex chars of the sha256><ext>
+CACHE_FILE_PATTERN = re.compile(r"^rp_([0-9a-f]{32})(\.[A-Za-z0-9]+)?$")
+# Node types whose "image" input names a file in the input directory
+LOAD_IMAGE_CLASSES = ("LoadImage", "LoadImageMask", "LoadImageOutput")
+
+
+def digest_b64(data):
+    """
+    Hash the decoded bytes of a base64 string without holding them all in memory.
+
+    Args:
+        data (str): The base64 encoded image
+
+    Returns:
+        tuple: The hex sha256 of the decoded bytes and their size
+
+    Raises:
+        binascii.Error: The data is not valid base64
+    """
+    sha = hashlib.sha256()
+    size = 0
+    for chunk in iter_b64decode(data):
+        sha.update(chunk)
+        size += len(chunk)
+    return sha.hexdigest(), size
+
+
+def cache_filename(digest, name):
+    """
+    Returns the content-addressed filename for an image, keeping the extension of its original name.
+    """
+    ext = os.path.splitext(name)[1].lower() or ".png"
+    return f"rp_{digest[:32]}{ext}"
+
+
+def rewrite_image_inputs(workflow, filenames):
+    """
+    Point the image loaders of a workflow at other filenames.
+
+    Args:
+        workflow (dict): The workflow, it is not modified
+        filenames (dict): Maps the image name used in the request to the filename in the input directory
+
+    Returns:
+        dict: The workflow with the loader inputs replaced (changed nodes are copies)
+    """
+    if not filenames:
+        return workflow
+
+    rewritten = dict(workflow)
+    for node_id, node in workflow.items():
+        if not isinstance(node, dict) or not str(node.get("class_type", "")).startswith(LOAD_IMAGE_CLASSES):
+            continue
+        image = node.get("inputs", {}).get("image")
+        if isinstance(image, str) and image in filenames:
+            rewritten[node_id] = {**node, "inputs": {**node["inputs"], "image": filenames[image]}}
+    return rewritten
+
+
+class InputImageCache:
+    """
+    Index of content-addressed input images in ComfyUI's input directory.
+
+    The index is rebuilt from the rp_* files on disk at startup, so it survives
+    handler restarts. When the files exceed the byte budget, the least recently
+    used ones are deleted, skipping images pinned by running jobs.
+
+    Args:
+        input_dir (str): ComfyUI's input directory
+        max_bytes (int): Disk budget for cached images
+    """
+
+    def __init__(self, input_dir=COMFY_INPUT_PATH, max_bytes=INPUT_CACHE_MAX_BYTES):
+        self.input_dir = input_dir
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_evicted = 0
+        self._pins = {}
+        self._lock = threading.Lock()
+        self._scan()
+
+    def _scan(self):
+        try:
+            files = []
+            for entry in os.scandir(self.input_dir):
+                match = CACHE_FILE_PATTERN.match(entry.name)
+                if match and entry.is_file():
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, match.group(1), entry.name, stat.st_size))
+        except FileNotFoundError:
+            return
+
+        # Oldest first, so the most recently written files are evicted last
+        for _, key, filename, size in sorted(files):
+            self.entries[key] = (filename, size)
+            self.total_bytes += size
+
+    def lookup(self, digest):
+        """
+        Returns the cached filename for a digest, or None on a miss.
+        """
+        key = digest[:32]
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and os.path.exists(os.path.join(self.input_dir, entry[0])):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                # Deleted behind our back
+                del self.entries[key]
+                self.total_bytes -= entry[1]
+            self.misses += 1
+            return None
+
+    def add(self, digest, filename, size):
+        """
+        Record an uploaded image and evict old ones if the budget is exceeded.
+        """
+        key = digest[:32]
+        with self._lock:
+            previous = self.entries.pop(key, None)
+            if previous:
+                self.total_bytes -= previous[1]
+            self.entries[key] = (filename, size)
+            self.total_bytes += size
+            self._evict()
+
+    def pin(self, digests):
+        """
+        Protect images from eviction while a job uses them.
+        """
+        with self._lock:
+            for digest in digests:
+                self._pins[digest[:32]] = self._pins.get(digest[:32], 0) + 1
+
+    def unpin(self, digests):
+        """
+        Release images pinned with pin().
+        """
+        with self._lock:
+            for digest in digests:
+                key = digest[:32]
+                count = self._pins.get(key, 0) - 1
+                if count > 0:
+                    self._pins[key] = count
+                else:
+                    self._pins.pop(key, None)
+
+    def _evict(self):
+        for key in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key in self._pins:
+                continue
+            filename, size = self.entries.pop(key)
+            self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.input_dir, filename))
+            except FileNotFoundError:
+                pass
+            self.evictions += 1
+            self.bytes_evicted += size
+            print(f"runpod-worker-comfy - evicted cached input image {filename}")
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and the current size of the cache.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes_evicted": self.bytes_evicted,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+            }
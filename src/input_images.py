@@ -0,0 +1,75 @@
+# Streaming upload of base64 encoded input images for rp_handler.py
+
+import base64
+import os
+import re
+
+import aiohttp
+
+# Number of base64 characters decoded at a time (a multiple of 4)
+COMFY_UPLOAD_CHUNK_CHARS = int(os.environ.get("COMFY_UPLOAD_CHUNK_CHARS", 256 * 1024)) // 4 * 4
+
+_WHITESPACE = re.compile(r"\s")
+
+
+def iter_b64decode(data, chunk_chars=None):
+    """
+    Decode a base64 string piece by piece.
+
+    Only one chunk of decoded bytes is alive at a time, so decoding a large image does
+    not need a second full-size copy next to the base64 string. Whitespace and line
+    breaks are ignored.
+
+    Args:
+        data (str): The base64 encoded data
+        chunk_chars (int, optional): Number of characters decoded per chunk
+
+    Yields:
+        bytes: The decoded data, in order
+
+    Raises:
+        binascii.Error: The data is not valid base64
+    """
+    chunk_chars = chunk_chars or COMFY_UPLOAD_CHUNK_CHARS
+    carry = ""
+
+    for start in range(0, len(data), chunk_chars):
+        piece = data[start:start + chunk_chars]
+        if _WHITESPACE.search(piece):
+            # Drop whitespace so the 4-character alignment is kept
+            piece = _WHITESPACE.sub("", piece)
+        piece = carry + piece
+        usable = len(piece) - len(piece) % 4
+        carry = piece[usable:]
+        if usable:
+            yield base64.b64decode(piece[:usable], validate=True)
+
+    if carry:
+        yield base64.b64decode(carry, validate=True)
+
+
+async def _stream(data, chunk_chars):
+    for chunk in iter_b64decode(data, chunk_chars):
+        yield chunk
+
+
+def image_form(name, data, chunk_chars=None):
+    """
+    Build the multipart body for ComfyUI's /upload/image with a streamed image part.
+
+    Args:
+        name (str): The filename the image is stored under
+        data (str): The base64 encoded image
+        chunk_chars (int, optional): Number of characters decoded per chunk
+
+    Returns:
+        aiohttp.MultipartWriter: The form, decoding the image while it is sent
+    """
+    form = aiohttp.MultipartWriter("form-data")
+    image_part = form.append(
+        aiohttp.payload.AsyncIterablePayload(_stream(data, chunk_chars), content_type="image/png")
+    )
+    image_part.set_content_disposition("form-data", name="image", filename=name)
+    overwrite_part = form.append("true")
+    overwrite_part.set_content_disposition("form-data", name="overwrite")
+    return form
@@ -0,0 +1,118 @@
+# How many jobs a worker runs at the same time
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+# Maximum number of jobs a worker runs at the same time (1 keeps one job per worker)
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", 1))
+# No further jobs are taken while ComfyUI has this many prompts queued or running
+COMFY_MAX_QUEUE_DEPTH = int(os.environ.get("COMFY_MAX_QUEUE_DEPTH", 2))
+# How often a held back job fetch checks again for a free slot
+FETCH_POLL_S = 0.05
+
+
+class JobConcurrency:
+    """
+    Limits the jobs of a worker, by count and by the depth of ComfyUI's queue.
+
+    Jobs overlap where one is uploading, queued or delivering outputs while another
+    one renders. Newer RunPod SDKs ask concurrency_modifier() before taking more jobs;
+    older ones only lower their fetch rate on concurrency_controller(), so gate()
+    holds their job fetches back until a job has finished. slot() enforces the limit
+    on jobs that were handed over anyway.
+
+    Args:
+        dispatcher (EventDispatcher): Source of ComfyUI's queue_remaining
+        max_jobs (int, optional): Maximum number of jobs at the same time
+        max_queue_depth (int, optional): ComfyUI queue depth at which no more jobs are taken
+    """
+
+    def __init__(self, dispatcher, max_jobs=None, max_queue_depth=None):
+        self.dispatcher = dispatcher
+        self.max_jobs = max(1, max_jobs or MAX_CONCURRENT_JOBS)
+        self.max_queue_depth = max(1, max_queue_depth or COMFY_MAX_QUEUE_DEPTH)
+        self.running = 0
+        self.peak = 0
+        # Ids of the jobs taken through gate() that have not finished yet
+        self.fetched = set()
+        self._loop = None
+        self._changed = None
+
+    def saturated(self):
+        """
+        Returns True while ComfyUI's queue is deep enough to keep the GPU busy.
+        """
+        return self.dispatcher.queue_remaining >= self.max_queue_depth
+
+    def concurrency_modifier(self, current):
+        """
+        RunPod concurrency_modifier: the number of jobs the worker should run now.
+        """
+        if self.saturated():
+            return max(1, min(current, self.running))
+        return self.max_jobs
+
+    def concurrency_controller(self):
+        """
+        RunPod concurrency_controller (older SDKs): True while the worker is full.
+        """
+        return self.running >= self.max_jobs or self.saturated()
+
+    def can_fetch(self):
+        """
+        Returns True while the worker has room for another job.
+        """
+        if not self.fetched:
+            return True
+        return len(self.fetched) < self.max_jobs and not self.saturated()
+
+    def gate(self, get_job):
+        """
+        Wraps the SDK's job fetch so that it waits for room before asking for a job.
+
+        Args:
+            get_job (coroutine function): Returns a job, a list of jobs or None
+
+        Returns:
+            coroutine function: The gated fetch, finished() releases its jobs
+        """
+
+        async def gated_get_job(*args, **kwargs):
+            while not self.can_fetch():
+                await asyncio.sleep(FETCH_POLL_S)
+            jobs = await get_job(*args, **kwargs)
+            for job in jobs if isinstance(jobs, list) else [jobs]:
+                if job:
+                    self.fetched.add(job["id"])
+            return jobs
+
+        return gated_get_job
+
+    def finished(self, job_id):
+        """
+        Makes room for the next job fetch.
+        """
+        self.fetched.discard(job_id)
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Wait until fewer than max_jobs jobs run, and count this one while it runs.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._changed = asyncio.Condition()
+            self.running = 0
+
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.running < self.max_jobs)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self.running -= 1
+                self._changed.notify()
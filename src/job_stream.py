@@ -0,0 +1,209 @@
+# Live progress and preview events for the streaming handler
+
+import asyncio
+import base64
+import io
+import json
+import os
+import struct
+import time
+
+try:
+    from PIL import Image
+except ImportError:  # Previews are passed on as they are
+    Image = None
+
+# Register the streaming handler (for RunPod's /stream) instead of the plain one
+STREAM_OUTPUT = os.environ.get("STREAM_OUTPUT", "false").lower() == "true"
+# Minimum time between two progress events of a job in milliseconds
+STREAM_PROGRESS_MIN_INTERVAL_MS = int(os.environ.get("STREAM_PROGRESS_MIN_INTERVAL_MS", 500))
+# Stream ComfyUI's preview images (ComfyUI has to run with a --preview-method)
+STREAM_PREVIEWS = os.environ.get("STREAM_PREVIEWS", "false").lower() == "true"
+# Minimum time between two preview events of a job in milliseconds
+STREAM_PREVIEW_MIN_INTERVAL_MS = int(os.environ.get("STREAM_PREVIEW_MIN_INTERVAL_MS", 1000))
+# Previews are scaled down to fit into a square of this size in pixels
+STREAM_PREVIEW_MAX_SIZE = int(os.environ.get("STREAM_PREVIEW_MAX_SIZE", 256))
+
+# Event types of ComfyUI's binary websocket frames
+PREVIEW_IMAGE = 1
+PREVIEW_IMAGE_WITH_METADATA = 4
+# Image types of PREVIEW_IMAGE frames
+PREVIEW_FORMATS = {1: "image/jpeg", 2: "image/png"}
+
+
+def parse_preview(frame):
+    """
+    Extract the image of a binary ComfyUI preview frame.
+
+    Args:
+        frame (bytes): The websocket frame
+
+    Returns:
+        tuple: (mime type, image bytes, node id or None), or None for other frames
+    """
+    if len(frame) < 8:
+        return None
+    (event,) = struct.unpack(">I", frame[:4])
+    if event == PREVIEW_IMAGE:
+        (image_type,) = struct.unpack(">I", frame[4:8])
+        return PREVIEW_FORMATS.get(image_type, "image/jpeg"), frame[8:], None
+    if event == PREVIEW_IMAGE_WITH_METADATA:
+        (length,) = struct.unpack(">I", frame[4:8])
+        try:
+            metadata = json.loads(frame[8:8 + length])
+        except ValueError:
+            return None
+        return metadata.get("image_type", "image/jpeg"), frame[8 + length:], metadata.get("node_id")
+    return None
+
+
+def downscale(image, mime, max_size):
+    """
+    Shrink a preview to fit into max_size x max_size pixels, as JPEG.
+
+    Returns:
+        tuple: (mime type, image bytes); unchanged if Pillow is missing or it is small enough
+    """
+    if Image is None:
+        return mime, image
+    try:
+        with Image.open(io.BytesIO(image)) as picture:
+            if max(picture.size) <= max_size and mime == "image/jpeg":
+                return mime, image
+            picture.thumbnail((max_size, max_size))
+            buffer = io.BytesIO()
+            picture.convert("RGB").save(buffer, format="JPEG", quality=75)
+            return "image/jpeg", buffer.getvalue()
+    except Exception:
+        return mime, image
+
+
+class JobEvents:
+    """
+    Turns a job's ComfyUI websocket messages into rate-limited stream events.
+
+    Events are dicts with a "type" of "queued", "executing", "progress" or "preview";
+    they are collected in `queue` for the streaming handler to yield. Progress events
+    are sent at most every progress_interval_ms (a new node or a finished node is
+    always sent), previews at most every preview_interval_ms.
+
+    Args:
+        previews (bool, optional): Emit preview events
+        progress_interval_ms (int, optional): Minimum time between progress events
+        preview_interval_ms (int, optional): Minimum time between preview events
+        preview_max_size (int, optional): Previews are scaled down to this size
+    """
+
+    def __init__(self, previews=None, progress_interval_ms=None, preview_interval_ms=None, preview_max_size=None):
+        self.previews = STREAM_PREVIEWS if previews is None else previews
+        self.progress_interval = (
+            STREAM_PROGRESS_MIN_INTERVAL_MS if progress_interval_ms is None else progress_interval_ms
+        ) / 1000
+        self.preview_interval = (
+            STREAM_PREVIEW_MIN_INTERVAL_MS if preview_interval_ms is None else preview_interval_ms
+        ) / 1000
+        self.preview_max_size = preview_max_size or STREAM_PREVIEW_MAX_SIZE
+        self.queue = asyncio.Queue()
+        self.prompt_id = None
+        self.node = None
+        self.step = 0
+        self.steps = 0
+        self.dropped = 0
+        self._class_types = {}
+        self._last_progress = None
+        self._last_preview = None
+        self._preview_task = None
+
+    def started(self, workflow):
+        """
+        Remember the node types of the workflow that is about to be queued.
+        """
+        self._class_types = {
+            node_id: node.get("class_type") for node_id, node in workflow.items() if isinstance(node, dict)
+        }
+        self.steps = len(self._class_types)
+
+    def queued(self, prompt_id):
+        self.prompt_id = prompt_id
+        self._emit({"type": "queued", "prompt_id": prompt_id})
+
+    def _emit(self, event):
+        self.queue.put_nowait(event)
+
+    def _node_event(self, event_type, node):
+        return {
+            "type": event_type,
+            "node": node,
+            "class_type": self._class_types.get(node),
+            "step": self.step,
+            "steps": self.steps,
+        }
+
+    def on_message(self, message):
+        """
+        Handle a decoded JSON websocket message.
+        """
+        data = message.get("data") or {}
+        if self.prompt_id and data.get("prompt_id") not in (None, self.prompt_id):
+            return
+
+        if message.get("type") == "executing" and data.get("node") is not None:
+            self.node = data["node"]
+            self.step += 1
+            self._last_progress = None
+            self._emit(self._node_event("executing", self.node))
+        elif message.get("type") == "progress":
+            now = time.monotonic()
+            value, maximum = data.get("value"), data.get("max")
+            due = self._last_progress is None or now - self._last_progress >= self.progress_interval
+            if not due and value != maximum:
+                self.dropped += 1
+                return
+            self._last_progress = now
+            node = data.get("node") or self.node
+            self._emit({**self._node_event("progress", node), "value": value, "max": maximum})
+
+    def on_binary(self, frame):
+        """
+        Handle a binary websocket frame (previews).
+
+        Previews are scaled down in a thread, so the websocket reader is not blocked;
+        frames arriving while the last one is still being scaled down are dropped.
+        """
+        if not self.previews:
+            return
+        now = time.monotonic()
+        if self._last_preview is not None and now - self._last_preview < self.preview_interval:
+            self.dropped += 1
+            return
+        if self._preview_task is not None and not self._preview_task.done():
+            self.dropped += 1
+            return
+        preview = parse_preview(frame)
+        if preview is None:
+            return
+        mime, image, node = preview
+        self._last_preview = now
+        if Image is None:
+            self._emit_preview(node or self.node, mime, image)
+            return
+        self._preview_task = asyncio.get_running_loop().create_task(self._scale_preview(node or self.node, mime, image))
+
+    async def _scale_preview(self, node, mime, image):
+        mime, image = await asyncio.to_thread(downscale, image, mime, self.preview_max_size)
+        self._emit_preview(node, mime, image)
+
+    def _emit_preview(self, node, mime, image):
+        self._emit({
+            "type": "preview",
+            "node": node,
+            "mime": mime,
+            "image": base64.b64encode(image).decode("utf-8"),
+        })
+
+    async def flush(self):
+        """
+        Wait for the preview being scaled down, so it is queued before the job result.
+        """
+        if self._preview_task is not None:
+            await self._preview_task
@@ -0,0 +1,283 @@
+# Worker metrics, served in the Prometheus text format and/or appended to a JSONL file
+
+import bisect
+import json
+import os
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Port of the Prometheus endpoint (GET /metrics), 0 disables it
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+# File a metrics snapshot is appended to as one JSON line every METRICS_INTERVAL_S (empty: disabled)
+METRICS_JSONL_PATH = os.environ.get("METRICS_JSONL_PATH", "")
+# Seconds between two snapshots in METRICS_JSONL_PATH
+METRICS_INTERVAL_S = float(os.environ.get("METRICS_INTERVAL_S", 60))
+
+# Upper bounds of the stage latency histogram buckets in seconds
+STAGE_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Prefix of all metric names
+PREFIX = "comfy_worker_"
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram as Prometheus expects it.
+    """
+
+    def __init__(self, buckets=STAGE_BUCKETS_S):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """
+        Returns (upper bound, observations up to it) pairs, ending with +Inf.
+        """
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+def family(name, kind, help_text, samples):
+    """
+    Returns a metric family: its name (without PREFIX), type, help and (labels, value) samples.
+    """
+    return {"name": name, "type": kind, "help": help_text, "samples": samples}
+
+
+def system_stats_families(stats):
+    """
+    Returns the RAM and per-device VRAM gauges of a ComfyUI /system_stats response.
+    """
+    system = stats.get("system") or {}
+    devices = stats.get("devices") or []
+    families = []
+    for key in ("ram_total", "ram_free"):
+        if isinstance(system.get(key), (int, float)):
+            families.append(family(f"{key}_bytes", "gauge", f"ComfyUI {key.replace('_', ' ')}", [({}, system[key])]))
+    for key in ("vram_total", "vram_free", "torch_vram_total", "torch_vram_free"):
+        samples = [
+            ({"device": str(device.get("name", device.get("index", "")))}, device[key])
+            for device in devices
+            if isinstance(device.get(key), (int, float))
+        ]
+        if samples:
+            families.append(family(f"{key}_bytes", "gauge", f"ComfyUI {key.replace('_', ' ')} per device", samples))
+    return families
+
+
+def fetch_system_stats(host, timeout_s=2):
+    """
+    Returns ComfyUI's /system_stats, or None when ComfyUI does not answer.
+    """
+    try:
+        with urllib.request.urlopen(f"http://{host}/system_stats", timeout=timeout_s) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+class WorkerMetrics:
+    """
+    Counts jobs, stage latencies and transferred bytes, and reports them together
+    with the gauges of the worker's other components.
+
+    Recording on the job path only updates counters under a lock; gauges (caches,
+    queue depth, relay, ComfyUI's RAM and VRAM) are collected when a snapshot is taken.
+
+    Args:
+        collect (callable, optional): Returns further metric families (see family()) when a snapshot is taken
+    """
+
+    def __init__(self, collect=None):
+        self.collect = collect
+        self.jobs = {"started": 0, "completed": 0, "failed": 0}
+        self.bytes = {}
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._writer = None
+        self._stopped = threading.Event()
+
+    def job_started(self):
+        with self._lock:
+            self.jobs["started"] += 1
+
+    def job_finished(self, result, stages=None):
+        """
+        Count a finished job and add its stage timings (milliseconds, see JobTimings.as_dict()).
+        """
+        ok = isinstance(result, dict) and result.get("status") == "success"
+        with self._lock:
+            self.jobs["completed" if ok else "failed"] += 1
+            for stage, ms in (stages or {}).items():
+                histogram = self.stages.get(stage)
+                if histogram is None:
+                    histogram = self.stages[stage] = Histogram()
+                histogram.observe(ms / 1000)
+
+    def add_bytes(self, kind, count):
+        """
+        Count bytes transferred, e.g. input images uploaded to ComfyUI or outputs stored in the bucket.
+        """
+        with self._lock:
+            self.bytes[kind] = self.bytes.get(kind, 0) + count
+
+    def families(self):
+        """
+        Returns all metric families, the worker's own and the collected ones.
+        """
+        with self._lock:
+            families = [
+                family(f"jobs_{status}_total", "counter", f"Jobs {status}", [({}, count)]) for status, count in self.jobs.items()
+            ]
+            families.append(
+                family(
+                    "transferred_bytes_total",
+                    "counter",
+                    "Bytes of input images and outputs transferred",
+                    [({"kind": kind}, count) for kind, count in sorted(self.bytes.items())],
+                )
+            )
+            stages = [(stage, histogram.cumulative(), histogram.sum, histogram.count) for stage, histogram in sorted(self.stages.items())]
+        families.append(family("stage_seconds", "histogram", "Duration of the stages of a job", stages))
+
+        if self.collect:
+            try:
+                families.extend(self.collect())
+            except Exception as e:
+                print(f"runpod-worker-comfy - ⚠️ Could not collect metrics: {e}")
+        return families
+
+    def prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.families():
+            name = PREFIX + metric["name"]
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            if metric["type"] == "histogram":
+                for stage, buckets, total, count in metric["samples"]:
+                    for bound, observed in buckets:
+                        lines.append(f"{name}_bucket{_format_labels({'stage': stage, 'le': _format_value(bound)})} {observed}")
+                    lines.append(f"{name}_sum{_format_labels({'stage': stage})} {_format_value(total)}")
+                    lines.append(f"{name}_count{_format_labels({'stage': stage})} {count}")
+                continue
+            for labels, value in metric["samples"]:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        Returns the metrics as a JSON-serialisable dict.
+
+        Unlabelled metrics map to their value, labelled ones to a dict keyed by the
+        label values; histograms give the count, sum and per-bucket counts per stage.
+        """
+        snapshot = {"time": round(time.time(), 3)}
+        for metric in self.families():
+            if metric["type"] == "histogram":
+                snapshot[metric["name"]] = {
+                    stage: {"count": count, "sum": round(total, 6), "buckets": {_format_value(bound): n for bound, n in buckets}}
+                    for stage, buckets, total, count in metric["samples"]
+                }
+            elif len(metric["samples"]) == 1 and not metric["samples"][0][0]:
+                snapshot[metric["name"]] = metric["samples"][0][1]
+            else:
+                snapshot[metric["name"]] = {",".join(map(str, labels.values())): value for labels, value in metric["samples"]}
+        return snapshot
+
+    def serve(self, port=None, jsonl_path=None, interval_s=None):
+        """
+        Start the Prometheus endpoint and the JSONL writer (daemon threads) as configured.
+
+        Returns:
+            int: The port of the endpoint, or None when it is disabled
+        """
+        port = METRICS_PORT if port is None else port
+        jsonl_path = METRICS_JSONL_PATH if jsonl_path is None else jsonl_path
+        interval_s = interval_s or METRICS_INTERVAL_S
+
+        if jsonl_path and self._writer is None:
+            self._writer = threading.Thread(target=self._write, args=(jsonl_path, interval_s), name="metrics-jsonl", daemon=True)
+            self._writer.start()
+
+        if not port or self._server is not None:
+            return self._server.server_address[1] if self._server else None
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        # port -1 picks a free port, for tests
+        self._server = ThreadingHTTPServer(("0.0.0.0", max(port, 0)), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"runpod-worker-comfy - metrics served on port {self._server.server_address[1]}")
+        return self._server.server_address[1]
+
+    def _write(self, path, interval_s):
+        while not self._stopped.wait(interval_s):
+            self.write_snapshot(path)
+
+    def write_snapshot(self, path):
+        """
+        Append one snapshot to path as a JSON line.
+        """
+        try:
+            with open(path, "a") as f:
+                f.write(json.dumps(self.snapshot()) + "\n")
+        except OSError as e:
+            print(f"runpod-worker-comfy - ⚠️ Could not write metrics to {path}: {e}")
+
+    def stop(self):
+        """
+        Stop the endpoint and the JSONL writer.
+        """
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self._writer = None
@@ -0,0 +1,333 @@
+# In-memory index of the model files ComfyUI can load, to fail jobs naming missing models at once
+
+import os
+import threading
+import time
+
+import yaml
+
+# Check the models named by loader nodes before queueing a workflow
+MODEL_INDEX_ENABLED = os.environ.get("MODEL_INDEX_ENABLED", "true").lower() == "true"
+# ComfyUI's own model directory, one subdirectory per folder (checkpoints, loras, ...)
+COMFY_MODELS_PATH = os.environ.get("COMFY_MODELS_PATH", "/comfyui/models")
+# ComfyUI's extra model paths, e.g. the folders on the network volume
+EXTRA_MODEL_PATHS_CONFIG = os.environ.get("EXTRA_MODEL_PATHS_CONFIG", "/comfyui/extra_model_paths.yaml")
+# Shortest time between two checks of the model directories for changes after a miss, in seconds
+MODEL_INDEX_RESCAN_MIN_S = float(os.environ.get("MODEL_INDEX_RESCAN_MIN_S", 2))
+
+# Beginning of every error message of the check
+ERROR_PREFIX = "Missing model"
+# Folder names ComfyUI still accepts for the folders it renamed
+LEGACY_FOLDERS = {"unet": "diffusion_models", "clip": "text_encoders", "t2i_adapter": "controlnet"}
+# Inputs naming a model file, and the folder it is looked up in, per loader node type. Other
+# node types are not checked, their inputs of the same names may point anywhere (e.g. the
+# ckpt_name of FILM VFI lies in the custom node's own directory)
+CHECKPOINT_INPUTS = {"ckpt_name": "checkpoints"}
+LOADER_INPUTS = {
+    "CheckpointLoaderSimple": CHECKPOINT_INPUTS,
+    "CheckpointLoader": CHECKPOINT_INPUTS,
+    "ImageOnlyCheckpointLoader": CHECKPOINT_INPUTS,
+    "unCLIPCheckpointLoader": CHECKPOINT_INPUTS,
+    "LoraLoader": {"lora_name": "loras"},
+    "LoraLoaderModelOnly": {"lora_name": "loras"},
+    "VAELoader": {"vae_name": "vae"},
+    "UNETLoader": {"unet_name": "diffusion_models"},
+    "CLIPLoader": {"clip_name": "text_encoders"},
+    "DualCLIPLoader": {f"clip_name{i}": "text_encoders" for i in range(1, 3)},
+    "TripleCLIPLoader": {f"clip_name{i}": "text_encoders" for i in range(1, 4)},
+    "QuadrupleCLIPLoader": {f"clip_name{i}": "text_encoders" for i in range(1, 5)},
+    "CLIPVisionLoader": {"clip_name": "clip_vision"},
+    "ControlNetLoader": {"control_net_name": "controlnet"},
+    "DiffControlNetLoader": {"control_net_name": "controlnet"},
+    "StyleModelLoader": {"style_model_name": "style_models"},
+    "GLIGENLoader": {"gligen_name": "gligen"},
+    "HypernetworkLoader": {"hypernetwork_name": "hypernetworks"},
+    "UpscaleModelLoader": {"model_name": "upscale_models"},
+    "PhotoMakerLoader": {"photomaker_model_name": "photomaker"},
+}
+# Values that are not files (built-in VAEs, "no model" choices of custom nodes)
+NOT_FILES = {"", "None", "none", "taesd", "taesdxl", "taesd3", "taef1", "pixel_space"}
+# Directories changed this recently are scanned again on the next refresh (file systems with a coarse mtime)
+MTIME_SLACK_S = 2
+
+
+def folder_name(name):
+    return LEGACY_FOLDERS.get(name, name)
+
+
+def model_references(workflow):
+    """
+    Returns the model files the loader nodes (see LOADER_INPUTS) of a workflow in API format load.
+
+    Returns:
+        list: (node_id, class_type, input name, folder, file name) for every loader input
+    """
+    references = []
+    for node_id, node in workflow.items():
+        if not isinstance(node, dict):
+            continue
+        class_type = node.get("class_type")
+        folders = LOADER_INPUTS.get(class_type, {})
+        for name, value in (node.get("inputs") or {}).items():
+            folder = folders.get(name)
+            if folder is None or not isinstance(value, str) or value in NOT_FILES:
+                continue
+            references.append((node_id, class_type, name, folder, value.replace("\\", "/")))
+    return references
+
+
+def model_roots(models_path=None, config_path=None):
+    """
+    Returns the directories of every model folder, in the order ComfyUI searches them.
+
+    ComfyUI's own model directory comes first, then the paths of extra_model_paths.yaml
+    (paths marked is_default are searched before all others).
+
+    Returns:
+        dict: Folder name -> list of directories
+    """
+    models_path = COMFY_MODELS_PATH if models_path is None else models_path
+    config_path = EXTRA_MODEL_PATHS_CONFIG if config_path is None else config_path
+    roots = {}
+
+    def add(folder, path, first=False):
+        paths = roots.setdefault(folder_name(folder), [])
+        path = os.path.normpath(path)
+        if path in paths:
+            return
+        if first:
+            paths.insert(0, path)
+        else:
+            paths.append(path)
+
+    try:
+        for entry in sorted(os.scandir(models_path), key=lambda entry: entry.name):
+            if entry.is_dir():
+                add(entry.name, entry.path)
+    except OSError:
+        pass
+
+    try:
+        with open(config_path) as f:
+            config = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        config = {}
+    except (OSError, yaml.YAMLError) as e:
+        print(f"runpod-worker-comfy - ⚠️ Could not read {config_path}, its model paths are not indexed: {e}")
+        config = {}
+
+    # Parsed like ComfyUI's load_extra_path_config()
+    config_dir = os.path.dirname(os.path.abspath(config_path))
+    for section in config.values():
+        if not isinstance(section, dict):
+            continue
+        section = dict(section)
+        base_path = section.pop("base_path", None)
+        if base_path:
+            base_path = os.path.expandvars(os.path.expanduser(base_path))
+            if not os.path.isabs(base_path):
+                base_path = os.path.join(config_dir, base_path)
+        is_default = section.pop("is_default", False)
+        for folder, paths in section.items():
+            for path in str(paths).split("\n"):
+                if not path:
+                    continue
+                if base_path:
+                    path = os.path.join(base_path, path)
+                elif not os.path.isabs(path):
+                    path = os.path.join(config_dir, path)
+                add(folder, path, first=is_default)
+    return roots
+
+
+class ModelIndex:
+    """
+    Every file in the model directories, for checking workflows without touching the disk.
+
+    The index is built once (see build()) and refreshed incrementally: refresh() stats
+    the directories seen so far and scans again only those whose mtime changed, which
+    also works on the network volume where inotify does not see other writers. The
+    handler refreshes when a workflow names a file the index does not know, at most
+    every MODEL_INDEX_RESCAN_MIN_S. Lookups are dict reads and safe while another
+    thread refreshes.
+
+    Args:
+        models_path (str, optional): ComfyUI's model directory
+        config_path (str, optional): ComfyUI's extra_model_paths.yaml
+        rescan_min_s (float, optional): Shortest time between two refreshes
+    """
+
+    def __init__(self, models_path=None, config_path=None, rescan_min_s=None):
+        self.models_path = models_path
+        self.config_path = config_path
+        self.rescan_min_s = MODEL_INDEX_RESCAN_MIN_S if rescan_min_s is None else rescan_min_s
+        self.roots = {}
+        self.built = False
+        self.refreshed_at = 0.0
+        # Folder -> file name relative to its root -> paths of the file under the folder's roots
+        self._files = {}
+        # (folder, directory) -> (mtime in ns or None to scan again, root)
+        self._dirs = {}
+        # (folder, directory) -> names of the files directly in the directory
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def build(self, force=False):
+        """
+        Scan all model directories, unless the index was built already.
+        """
+        with self._lock:
+            if self.built and not force:
+                return
+            started = time.perf_counter()
+            self.roots = model_roots(self.models_path, self.config_path)
+            self._files = {}
+            self._dirs = {}
+            self._entries = {}
+            for folder, roots in self.roots.items():
+                for root in roots:
+                    self._scan(folder, root, root)
+            self.built = True
+            self.refreshed_at = time.monotonic()
+            count = sum(len(files) for files in self._files.values())
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            print(f"runpod-worker-comfy - indexed {count} model files in {len(self.roots)} folders in {elapsed_ms:.0f} ms")
+
+    def refresh(self, force=False):
+        """
+        Scan the directories that changed since they were last scanned, unless the last refresh is recent.
+
+        Returns:
+            bool: True if any directory changed
+        """
+        if not self.built:
+            self.build()
+            return True
+        with self._lock:
+            if not force and time.monotonic() - self.refreshed_at < self.rescan_min_s:
+                return False
+            self.refreshed_at = time.monotonic()
+            changed = False
+            for key, (mtime, root) in list(self._dirs.items()):
+                folder, path = key
+                try:
+                    current = os.stat(path).st_mtime_ns
+                except OSError:
+                    # Its subdirectories are gone too and dropped on their own turn
+                    self._drop(key)
+                    changed = True
+                    continue
+                if current != mtime:
+                    self._scan(folder, root, path)
+                    changed = True
+            for folder, roots in self.roots.items():
+                for root in roots:
+                    if (folder, root) not in self._dirs and os.path.isdir(root):
+                        self._scan(folder, root, root)
+                        changed = True
+            return changed
+
+    def _scan(self, folder, root, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            entries = list(os.scandir(path))
+        except OSError:
+            return
+        key = (folder, path)
+        self._drop(key)
+        if time.time() - mtime / 1e9 < MTIME_SLACK_S:
+            # Files added within the same mtime tick would not change it again
+            mtime = None
+        files = self._files.setdefault(folder, {})
+        names = set()
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            if is_dir:
+                if (folder, entry.path) not in self._dirs:
+                    self._scan(folder, root, entry.path)
+                continue
+            name = os.path.relpath(entry.path, root).replace(os.sep, "/")
+            files.setdefault(name, set()).add(entry.path)
+            names.add(name)
+        self._dirs[key] = (mtime, root)
+        self._entries[key] = names
+
+    def _drop(self, key):
+        folder, path = key
+        self._dirs.pop(key, None)
+        files = self._files.get(folder, {})
+        for name in self._entries.pop(key, ()):
+            paths = files.get(name)
+            if paths is None:
+                continue
+            paths.discard(os.path.join(path, os.path.basename(name)))
+            if not paths:
+                del files[name]
+
+    def covers(self, folder):
+        """
+        Returns True if at least one directory of a folder exists, so a missing file is really missing.
+        """
+        return any((folder, root) in self._dirs for root in self.roots.get(folder, ()))
+
+    def find(self, folder, name):
+        """
+        Returns the path ComfyUI would load a model file from, or None if the index does not know it.
+
+        Args:
+            folder (str): Model folder, e.g. "loras" (legacy names like "unet" are accepted)
+            name (str): File name relative to the folder, as in a workflow
+        """
+        paths = self.paths(folder, name)
+        return paths[0] if paths else None
+
+    def paths(self, folder, name):
+        """
+        Returns every copy of a model file the index knows, in the order ComfyUI searches them.
+        """
+        folder = folder_name(folder)
+        name = name.replace("\\", "/")
+        known = self._files.get(folder, {}).get(name)
+        if not known:
+            return []
+        known = set(known)
+        ordered = []
+        for root in self.roots.get(folder, ()):
+            path = os.path.normpath(os.path.join(root, name))
+            if path in known:
+                ordered.append(path)
+                known.discard(path)
+        return ordered + sorted(known)
+
+    def files(self, folder):
+        """
+        Returns the names of the files of a folder, sorted.
+        """
+        with self._lock:
+            return sorted(self._files.get(folder_name(folder), {}))
+
+    def missing(self, workflow):
+        """
+        Returns the problems of a workflow's loader inputs, an empty list if all files are known.
+
+        Folders without any existing directory are not checked.
+        """
+        errors = []
+        for node_id, class_type, name, folder, value in model_references(workflow):
+            if self.covers(folder) and self.find(folder, value) is None:
+                errors.append(f"node {node_id} ({class_type}): {name} {value!r} not found in {folder}")
+        return errors
+
+    def error_message(self, workflow):
+        """
+        Returns the missing models of a workflow as one message, or None if there are none.
+        """
+        errors = self.missing(workflow)
+        if not errors:
+            return None
+        return f"{ERROR_PREFIX}: " + "; ".join(errors)
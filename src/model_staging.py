@@ -0,0 +1,281 @@
+# Copies the models a workflow loads from the network volume to local disk, just before it is queued
+
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from model_index import model_references
+
+# Copy the models of each job to local disk on demand (replaces COPY_MODELS, which copies all of them at boot)
+MODEL_STAGING_ENABLED = os.environ.get("MODEL_STAGING_ENABLED", "false").lower() == "true"
+# Model directory on the network volume, files below it are staged
+MODEL_STAGING_SOURCE = os.environ.get("MODEL_STAGING_SOURCE", "/runpod-volume/models")
+# Local directory with the staged models, searched by ComfyUI before all others (see extra_model_paths.yaml)
+MODEL_STAGING_PATH = os.environ.get("MODEL_STAGING_PATH", "/comfyui/models_staged")
+# Disk budget for staged models in bytes, least recently used models are deleted beyond it
+MODEL_STAGING_MAX_BYTES = int(os.environ.get("MODEL_STAGING_MAX_BYTES", 40 * 1024**3))
+# Number of models copied at the same time
+MODEL_STAGING_CONCURRENCY = int(os.environ.get("MODEL_STAGING_CONCURRENCY", 4))
+# Size of the chunks a model is copied in, in MiB
+MODEL_STAGING_CHUNK_MB = int(os.environ.get("MODEL_STAGING_CHUNK_MB", 16))
+
+# Copies in progress are written next to their target under this suffix, then renamed
+PART_SUFFIX = ".staging"
+# Time between two progress lines of a copy in seconds
+PROGRESS_INTERVAL_S = 5
+
+
+def is_below(path, directory):
+    return os.path.commonpath([path, directory]) == directory
+
+
+class ModelStaging:
+    """
+    Local copies of the network volume's models, made when a job needs them.
+
+    stage() copies the models a workflow loads that are only on the network volume
+    to the staging directory, which ComfyUI searches first, so it loads them from
+    local disk. Copies run in a thread pool and are written under a temporary name
+    and renamed, so ComfyUI never sees a partial file; jobs needing a model that is
+    being copied wait for the same copy. When the staged models exceed the byte
+    budget, the least recently used ones are deleted, skipping models pinned by
+    running jobs. A model that does not fit is not staged and ComfyUI loads it from
+    the network volume, as it would without staging.
+
+    The index is rebuilt from the files on disk at startup, so it survives handler
+    restarts.
+
+    Args:
+        index (ModelIndex): Where the models of a workflow are
+        source (str, optional): Model directory on the network volume
+        path (str, optional): Local staging directory
+        max_bytes (int, optional): Disk budget for staged models
+        concurrency (int, optional): Number of models copied at the same time
+    """
+
+    def __init__(self, index, source=None, path=None, max_bytes=None, concurrency=None):
+        self.index = index
+        self.source = os.path.normpath(MODEL_STAGING_SOURCE if source is None else source)
+        self.path = os.path.normpath(MODEL_STAGING_PATH if path is None else path)
+        self.max_bytes = MODEL_STAGING_MAX_BYTES if max_bytes is None else max_bytes
+        self.concurrency = MODEL_STAGING_CONCURRENCY if concurrency is None else concurrency
+        # Path relative to the staging directory -> size in bytes, least recently used first
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.reserved_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_evicted = 0
+        self.bytes_copied = 0
+        self.skipped = 0
+        # Path relative to the staging directory -> [bytes copied, size] of the copies in progress
+        self.progress = {}
+        self._pins = {}
+        self._copies = {}
+        self._pool = None
+        self._lock = threading.Lock()
+        self._scan()
+
+    def _scan(self):
+        files = []
+        for directory, _, names in os.walk(self.path):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if name.endswith(PART_SUFFIX):
+                        # Left behind by a copy that was interrupted
+                        os.remove(path)
+                        continue
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, os.path.relpath(path, self.path), stat.st_size))
+
+        # Oldest first, so the most recently used models are evicted last
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total_bytes += size
+
+    def sources(self, workflow):
+        """
+        Returns the models of a workflow that are only on the network volume.
+
+        Returns:
+            dict: Path relative to the staging directory -> path on the network volume
+        """
+        sources = {}
+        for _, _, _, folder, name in model_references(workflow):
+            paths = self.index.paths(folder, name)
+            if any(not is_below(path, self.source) and not is_below(path, self.path) for path in paths):
+                # Part of the image, already on local disk
+                continue
+            source = next((path for path in paths if is_below(path, self.source)), None)
+            if source is not None:
+                sources[os.path.relpath(source, self.source)] = source
+        return sources
+
+    def stage(self, workflow):
+        """
+        Copy the models of a workflow to local disk and pin them. Blocks until they are copied.
+
+        Returns:
+            list: The pinned models, to be released with unpin() once the job is done
+        """
+        sources = self.sources(workflow)
+        if not sources:
+            return []
+
+        copies = []
+        with self._lock:
+            for name, source in sources.items():
+                self._pins[name] = self._pins.get(name, 0) + 1
+                if name in self.entries and os.path.exists(os.path.join(self.path, name)):
+                    self.entries.move_to_end(name)
+                    self.hits += 1
+                    try:
+                        # The order is rebuilt from the mtimes after a restart
+                        os.utime(os.path.join(self.path, name))
+                    except OSError:
+                        pass
+                    continue
+                if name in self.entries:
+                    # Deleted behind our back
+                    self.total_bytes -= self.entries.pop(name)
+                self.misses += 1
+                copy = self._copies.get(name)
+                if copy is None:
+                    copy = self._copies[name] = self._copy_pool().submit(self._copy, name, source)
+                copies.append((name, copy))
+
+        for name, copy in copies:
+            try:
+                copy.result()
+            except Exception as e:
+                print(f"runpod-worker-comfy - ⚠️ Could not stage {name}, ComfyUI loads it from the network volume: {e}")
+        return list(sources)
+
+    def unpin(self, names):
+        """
+        Release models pinned by stage().
+        """
+        with self._lock:
+            for name in names:
+                count = self._pins.get(name, 0) - 1
+                if count > 0:
+                    self._pins[name] = count
+                else:
+                    self._pins.pop(name, None)
+
+    def _copy_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="model-staging")
+        return self._pool
+
+    def _copy(self, name, source):
+        try:
+            size = os.path.getsize(source)
+            if not self._reserve(size):
+                with self._lock:
+                    self.skipped += 1
+                print(f"runpod-worker-comfy - not staging {name} ({size / 1024**3:.1f} GB), it does not fit into the staging budget")
+                return False
+            try:
+                self._copy_file(name, source, size)
+            finally:
+                with self._lock:
+                    self.reserved_bytes -= size
+            with self._lock:
+                self.entries[name] = size
+                self.entries.move_to_end(name)
+                self.total_bytes += size
+                self.bytes_copied += size
+            return True
+        finally:
+            with self._lock:
+                self._copies.pop(name, None)
+                self.progress.pop(name, None)
+
+    def _copy_file(self, name, source, size):
+        target = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        part = f"{target}.{uuid.uuid4().hex[:8]}{PART_SUFFIX}"
+        print(f"runpod-worker-comfy - staging {name} ({size / 1024**2:.0f} MB) from the network volume")
+        started = time.perf_counter()
+        reported = started
+        self.progress[name] = [0, size]
+        buffer = bytearray(MODEL_STAGING_CHUNK_MB * 1024**2)
+        view = memoryview(buffer)
+        try:
+            with open(source, "rb") as src, open(part, "wb") as dst:
+                while True:
+                    count = src.readinto(buffer)
+                    if not count:
+                        break
+                    dst.write(view[:count])
+                    self.progress[name][0] += count
+                    if time.perf_counter() - reported >= PROGRESS_INTERVAL_S:
+                        reported = time.perf_counter()
+                        print(f"runpod-worker-comfy - staging {name}: {self.progress[name][0] * 100 // max(size, 1)}%")
+            os.replace(part, target)
+        except BaseException:
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+            raise
+        elapsed = time.perf_counter() - started
+        print(f"runpod-worker-comfy - staged {name} in {elapsed:.1f} s ({size / 1024**2 / max(elapsed, 1e-6):.0f} MB/s)")
+
+    def _reserve(self, size):
+        """
+        Make room for a model of the given size, returns False if it cannot fit.
+        """
+        with self._lock:
+            if size > self.max_bytes:
+                return False
+            for name in list(self.entries):
+                if self.total_bytes + self.reserved_bytes + size <= self.max_bytes:
+                    break
+                if name in self._pins:
+                    continue
+                self._evict(name)
+            if self.total_bytes + self.reserved_bytes + size > self.max_bytes:
+                return False
+            os.makedirs(self.path, exist_ok=True)
+            if shutil.disk_usage(self.path).free < size:
+                return False
+            self.reserved_bytes += size
+            return True
+
+    def _evict(self, name):
+        size = self.entries.pop(name)
+        self.total_bytes -= size
+        try:
+            os.remove(os.path.join(self.path, name))
+        except FileNotFoundError:
+            pass
+        self.evictions += 1
+        self.bytes_evicted += size
+        print(f"runpod-worker-comfy - evicted staged model {name}")
+
+    def stats(self):
+        """
+        Returns the hit/miss counters, the size of the staged models and the copies in progress.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes_evicted": self.bytes_evicted,
+                "bytes_copied": self.bytes_copied,
+                "skipped": self.skipped,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "copying": {name: list(progress) for name, progress in self.progress.items()},
+            }
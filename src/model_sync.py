@@ -0,0 +1,497 @@
+"""
+Manifest-driven sync of the bucket's models, custom nodes and snapshots to the network volume.
+
+Replaces the three `aws s3 sync --delete` calls of start.sh, which list the whole
+bucket on every boot. The bucket holds a manifest (see `manifest` below) with the
+key, size, ETag and optionally SHA256 of every object; the worker keeps the last
+manifest and what it synced in a state file on the volume. A boot fetches the
+manifest with If-None-Match, compares it with the state and the files on disk,
+and downloads only new and changed objects, in parallel ranged GETs. Interrupted
+downloads resume where they stopped, every download is verified (SHA256, or the
+MD5 ETag of single-part uploads) before it is renamed into place, and objects
+removed from the manifest are deleted locally.
+
+    python3 model_sync.py sync                 # exit code 2 without a manifest in the bucket
+    python3 model_sync.py manifest [--sha256-from /runpod-volume] [--upload]
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+# Bucket holding the models, custom nodes and snapshots
+MODEL_SYNC_BUCKET = os.environ.get("MODEL_SYNC_BUCKET", "stable-diffusion-bucket-gjbm2")
+# Key of the manifest in the bucket
+MODEL_SYNC_MANIFEST_KEY = os.environ.get("MODEL_SYNC_MANIFEST_KEY", "manifest.json")
+# Directory the keys are synced into, "models/..." lands in <root>/models/...
+MODEL_SYNC_ROOT = os.environ.get("MODEL_SYNC_ROOT", "/runpod-volume")
+# What was synced, kept next to the files
+MODEL_SYNC_STATE_PATH = os.environ.get("MODEL_SYNC_STATE_PATH", "/runpod-volume/.model_sync_state.json")
+# S3 endpoint (empty: AWS)
+MODEL_SYNC_ENDPOINT_URL = os.environ.get("MODEL_SYNC_ENDPOINT_URL", "")
+# Number of ranged GETs running at the same time, over all objects
+MODEL_SYNC_CONCURRENCY = int(os.environ.get("MODEL_SYNC_CONCURRENCY", 16))
+# Size of one ranged GET in MiB
+MODEL_SYNC_PART_SIZE_MB = int(os.environ.get("MODEL_SYNC_PART_SIZE_MB", 64))
+# Number of times a failed GET is retried
+MODEL_SYNC_RETRIES = int(os.environ.get("MODEL_SYNC_RETRIES", 3))
+# First backoff between retries in milliseconds, doubled after every attempt
+MODEL_SYNC_RETRY_BACKOFF_MS = int(os.environ.get("MODEL_SYNC_RETRY_BACKOFF_MS", 200))
+
+# Key prefixes put into a new manifest, the directories start.sh used to sync
+MANIFEST_PREFIXES = ("models/", "custom_nodes/", "snapshots/")
+# Downloads are written next to their target under this suffix, then renamed
+PART_SUFFIX = ".sync"
+# Parts of an interrupted download that are already on disk
+PROGRESS_SUFFIX = ".sync.json"
+# Exit code of "sync" when the bucket has no manifest (start.sh falls back to aws s3 sync)
+EXIT_NO_MANIFEST = 2
+# Size of the reads of a response body and of the file when hashing it
+READ_SIZE = 1024**2
+
+
+class NoManifest(Exception):
+    pass
+
+
+def get_client(endpoint_url=None, concurrency=None):
+    """
+    Returns an S3 client with a connection pool for the parallel GETs.
+
+    Credentials come from the environment (start.sh exports them from the BUCKET_* variables).
+    """
+    concurrency = MODEL_SYNC_CONCURRENCY if concurrency is None else concurrency
+    return boto3.session.Session().client(
+        "s3",
+        endpoint_url=(MODEL_SYNC_ENDPOINT_URL if endpoint_url is None else endpoint_url) or None,
+        config=Config(
+            signature_version="s3v4",
+            # Every GET is retried on its own, see _with_retries()
+            retries={"total_max_attempts": 1, "mode": "standard"},
+            max_pool_connections=concurrency * 2,
+        ),
+    )
+
+
+def _with_retries(action, description, retries=None):
+    retries = MODEL_SYNC_RETRIES if retries is None else retries
+    backoff = MODEL_SYNC_RETRY_BACKOFF_MS / 1000
+    for attempt in range(retries + 1):
+        try:
+            return action()
+        except ClientError as e:
+            # Only server errors and throttling are worth another attempt, not 304, 404 or 412
+            status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 500
+            if attempt == retries or (status < 500 and status != 429):
+                raise
+            print(f"runpod-worker-comfy - {description} failed ({e}), retrying")
+        except (BotoCoreError, OSError) as e:
+            if attempt == retries:
+                raise
+            print(f"runpod-worker-comfy - {description} failed ({e}), retrying")
+        time.sleep(backoff)
+        backoff *= 2
+
+
+def normalize_etag(etag):
+    return (etag or "").strip('"')
+
+
+def file_digest(path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+
+def load_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    # Written to a temporary file and renamed, a crash leaves the old version
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(temp, path)
+
+
+def fetch_manifest(client, bucket, key, etag=None):
+    """
+    Returns (manifest, ETag); the manifest is None if it still has the given ETag.
+
+    Raises:
+        NoManifest: The bucket has no manifest
+    """
+    params = {"Bucket": bucket, "Key": key}
+    if etag:
+        params["IfNoneMatch"] = f'"{etag}"'
+    try:
+        response = _with_retries(lambda: client.get_object(**params), "Fetching the manifest")
+    except ClientError as e:
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        if status == 304:
+            return None, etag
+        if status == 404:
+            raise NoManifest(f"s3://{bucket}/{key} does not exist") from e
+        raise
+    return json.loads(response["Body"].read()), normalize_etag(response.get("ETag"))
+
+
+def build_manifest(client, bucket, prefixes=MANIFEST_PREFIXES, sha256_root=None):
+    """
+    Returns a manifest of every object below the prefixes.
+
+    Args:
+        sha256_root (str, optional): Local copy of the bucket to take SHA256 checksums from;
+            objects whose local copy has a different size get none
+    """
+    objects = []
+    paginator = client.get_paginator("list_objects_v2")
+    for prefix in prefixes:
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                if item["Key"].endswith("/"):
+                    continue
+                entry = {"key": item["Key"], "size": item["Size"], "etag": normalize_etag(item.get("ETag"))}
+                local = os.path.join(sha256_root, item["Key"]) if sha256_root else None
+                if local and os.path.isfile(local) and os.path.getsize(local) == item["Size"]:
+                    entry["sha256"] = file_digest(local, "sha256")
+                objects.append(entry)
+    return {"version": 1, "created": round(time.time()), "objects": objects}
+
+
+def plan(manifest, state, root):
+    """
+    Compare a manifest with the state and the files on disk.
+
+    Returns:
+        tuple: (objects to download, local paths to delete, number of unchanged objects)
+    """
+    synced = state.get("objects", {})
+    wanted = {}
+    downloads = []
+    unchanged = 0
+    for entry in manifest.get("objects", []):
+        key = entry["key"]
+        if key.endswith("/") or ".." in key.split("/"):
+            continue
+        wanted[key] = entry
+        previous = synced.get(key)
+        path = os.path.join(root, key)
+        if previous == entry and os.path.isfile(path) and os.path.getsize(path) == entry["size"]:
+            unchanged += 1
+        else:
+            downloads.append(entry)
+    deletions = [os.path.join(root, key) for key in synced if key not in wanted]
+    return downloads, deletions, unchanged
+
+
+class _Download:
+    """
+    One object being downloaded in parts into <path>.sync, with the finished parts in <path>.sync.json.
+    """
+
+    def __init__(self, entry, root, part_size):
+        self.entry = entry
+        self.key = entry["key"]
+        self.size = entry["size"]
+        self.path = os.path.join(root, self.key)
+        self.part_path = self.path + PART_SUFFIX
+        self.progress_path = self.path + PROGRESS_SUFFIX
+        self.part_size = part_size
+        self.parts = [(offset, min(offset + part_size, self.size)) for offset in range(0, self.size, part_size)]
+        self.done = set()
+        self.failed = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        """
+        Returns the parts still to fetch, keeping those of an interrupted download of the same object.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        progress = load_json(self.progress_path, {})
+        if (
+            progress.get("etag") == self.entry["etag"]
+            and progress.get("size") == self.size
+            and progress.get("part_size") == self.part_size
+            and os.path.isfile(self.part_path)
+            and os.path.getsize(self.part_path) == self.size
+        ):
+            self.done = {tuple(part) for part in progress.get("done", [])}
+        else:
+            with open(self.part_path, "wb") as f:
+                f.truncate(self.size)
+        return [part for part in self.parts if part not in self.done]
+
+    def part_finished(self, part):
+        """
+        Record a part; returns True when it was the last one.
+        """
+        with self.lock:
+            self.done.add(part)
+            write_json(
+                self.progress_path,
+                {"etag": self.entry["etag"], "size": self.size, "part_size": self.part_size, "done": sorted(self.done)},
+            )
+            return len(self.done) == len(self.parts)
+
+    def verify(self):
+        if self.entry.get("sha256"):
+            if file_digest(self.part_path, "sha256") != self.entry["sha256"]:
+                raise ValueError("SHA256 mismatch")
+        elif self.entry.get("etag") and "-" not in self.entry["etag"]:
+            # Single-part uploads have the MD5 of the content as ETag, multipart uploads do not
+            if file_digest(self.part_path, "md5") != self.entry["etag"]:
+                raise ValueError("MD5 mismatch")
+        elif os.path.getsize(self.part_path) != self.size:
+            raise ValueError("size mismatch")
+
+    def discard(self):
+        for path in (self.part_path, self.progress_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class ModelSync:
+    """
+    Syncs the objects of a bucket's manifest to a local directory.
+
+    Args:
+        client: The S3 client
+        bucket (str, optional): The bucket
+        root (str, optional): Local directory the keys are synced into
+        state_path (str, optional): The state file
+        manifest_key (str, optional): Key of the manifest
+        concurrency (int, optional): Ranged GETs running at the same time
+        part_size (int, optional): Size of one ranged GET in bytes
+    """
+
+    def __init__(self, client, bucket=None, root=None, state_path=None, manifest_key=None, concurrency=None, part_size=None):
+        self.client = client
+        self.bucket = MODEL_SYNC_BUCKET if bucket is None else bucket
+        self.root = MODEL_SYNC_ROOT if root is None else root
+        self.state_path = MODEL_SYNC_STATE_PATH if state_path is None else state_path
+        self.manifest_key = MODEL_SYNC_MANIFEST_KEY if manifest_key is None else manifest_key
+        self.concurrency = MODEL_SYNC_CONCURRENCY if concurrency is None else concurrency
+        self.part_size = MODEL_SYNC_PART_SIZE_MB * 1024**2 if part_size is None else part_size
+        self._state_lock = threading.Lock()
+        self._verify_seconds = 0.0
+
+    def sync(self):
+        """
+        Bring the local directory up to date with the manifest.
+
+        Returns:
+            dict: Counters and the time spent per step in milliseconds
+
+        Raises:
+            NoManifest: The bucket has no manifest
+        """
+        started = time.perf_counter()
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        # Workers booting at the same time share the volume, one syncs and the others find it done
+        with open(self.state_path + ".lock", "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            except OSError as e:
+                print(f"runpod-worker-comfy - ⚠️ Could not lock {self.state_path}, syncing without the lock: {e}")
+            waited = time.perf_counter()
+            report = self._sync()
+        report["lock_ms"] = round((waited - started) * 1000, 1)
+        report["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return report
+
+    def _sync(self):
+        report = {}
+        state = load_json(self.state_path, {})
+
+        step = time.perf_counter()
+        manifest, etag = fetch_manifest(self.client, self.bucket, self.manifest_key, state.get("manifest_etag"))
+        report["manifest_changed"] = manifest is not None
+        if manifest is None:
+            manifest = state.get("manifest", {})
+        report["manifest_ms"] = self._elapsed(step)
+
+        step = time.perf_counter()
+        downloads, deletions, unchanged = plan(manifest, state, self.root)
+        report["plan_ms"] = self._elapsed(step)
+
+        state = {"manifest_etag": etag, "manifest": manifest, "objects": dict(state.get("objects", {}))}
+        step = time.perf_counter()
+        deleted = 0
+        for path in deletions:
+            try:
+                os.remove(path)
+                deleted += 1
+            except FileNotFoundError:
+                pass
+        for key in list(state["objects"]):
+            if os.path.join(self.root, key) in deletions:
+                del state["objects"][key]
+        report["delete_ms"] = self._elapsed(step)
+
+        step = time.perf_counter()
+        finished, failed = self._download(downloads, state)
+        report["download_ms"] = self._elapsed(step)
+        report["verify_ms"] = round(self._verify_seconds * 1000, 1)
+
+        write_json(self.state_path, state)
+        report.update(
+            {
+                "objects": len(manifest.get("objects", [])),
+                "unchanged": unchanged,
+                "downloaded": len(finished),
+                "bytes": sum(entry["size"] for entry in finished),
+                "deleted": deleted,
+                "failed": failed,
+            }
+        )
+        return report
+
+    def _download(self, entries, state):
+        finished = []
+        failed = []
+        if not entries:
+            return finished, failed
+
+        downloads = []
+        tasks = []
+        for entry in entries:
+            download = _Download(entry, self.root, self.part_size)
+            try:
+                parts = download.open()
+            except OSError as e:
+                failed.append(entry["key"])
+                print(f"runpod-worker-comfy - ⚠️ Could not download {entry['key']}: {e}")
+                continue
+            downloads.append(download)
+            if parts:
+                tasks.extend((download, part) for part in parts)
+            else:
+                # Empty, or every part was fetched before an interruption
+                tasks.append((download, None))
+        print(f"runpod-worker-comfy - syncing {len(downloads)} objects ({sum(d.size for d in downloads) / 1024**3:.2f} GB) from s3://{self.bucket}")
+
+        def run(download, part):
+            # The other parts of a failed object are still fetched, the next boot resumes with them
+            try:
+                if part is not None:
+                    self._fetch_part(download, part)
+                    if not download.part_finished(part):
+                        return
+                self._finish(download)
+                with self._state_lock:
+                    state["objects"][download.key] = download.entry
+                    finished.append(download.entry)
+                    # Progress survives an interrupted boot
+                    write_json(self.state_path, state)
+            except Exception as e:
+                with download.lock:
+                    first = download.failed is None
+                    download.failed = str(e)
+                if first:
+                    print(f"runpod-worker-comfy - ⚠️ Could not download {download.key}: {e}")
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="model-sync") as pool:
+            for future in [pool.submit(run, download, part) for download, part in tasks]:
+                future.result()
+
+        failed.extend(download.key for download in downloads if download.failed)
+        return finished, failed
+
+    def _fetch_part(self, download, part):
+        start, end = part
+
+        def get():
+            response = self.client.get_object(
+                Bucket=self.bucket, Key=download.key, Range=f"bytes={start}-{end - 1}", IfMatch=f'"{download.entry["etag"]}"'
+            )
+            offset = start
+            fd = os.open(download.part_path, os.O_WRONLY)
+            try:
+                body = response["Body"]
+                while True:
+                    chunk = body.read(READ_SIZE)
+                    if not chunk:
+                        break
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+            finally:
+                os.close(fd)
+            if offset != end:
+                raise OSError(f"short read of bytes {start}-{end - 1} ({offset - start} bytes)")
+
+        _with_retries(get, f"Downloading bytes {start}-{end - 1} of {download.key}")
+
+    def _finish(self, download):
+        started = time.perf_counter()
+        try:
+            download.verify()
+        except ValueError:
+            download.discard()
+            raise
+        finally:
+            with self._state_lock:
+                self._verify_seconds += time.perf_counter() - started
+        os.replace(download.part_path, download.path)
+        try:
+            os.remove(download.progress_path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _elapsed(started):
+        return round((time.perf_counter() - started) * 1000, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("sync", help="sync the manifest's objects to MODEL_SYNC_ROOT")
+    manifest = commands.add_parser("manifest", help="list the bucket and write a manifest")
+    manifest.add_argument("--sha256-from", default=None, help="local copy of the bucket to take SHA256 checksums from")
+    manifest.add_argument("--upload", action="store_true", help="store the manifest in the bucket instead of printing it")
+    args = parser.parse_args()
+
+    client = get_client()
+    if args.command == "manifest":
+        result = build_manifest(client, MODEL_SYNC_BUCKET, sha256_root=args.sha256_from)
+        body = json.dumps(result, indent=1)
+        if args.upload:
+            client.put_object(Bucket=MODEL_SYNC_BUCKET, Key=MODEL_SYNC_MANIFEST_KEY, Body=body.encode("utf-8"), ContentType="application/json")
+            print(f"runpod-worker-comfy - wrote a manifest of {len(result['objects'])} objects to s3://{MODEL_SYNC_BUCKET}/{MODEL_SYNC_MANIFEST_KEY}")
+        else:
+            print(body)
+        return 0
+
+    try:
+        report = ModelSync(client).sync()
+    except NoManifest as e:
+        print(f"runpod-worker-comfy - {e}")
+        return EXIT_NO_MANIFEST
+    print(json.dumps({"event": "model_sync", **report}))
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
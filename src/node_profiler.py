@@ -0,0 +1,216 @@
+# Per-node execution times from ComfyUI's websocket events, aggregated over the worker's lifetime
+
+import atexit
+import hashlib
+import json
+import os
+import signal
+import time
+from collections import deque
+
+# Measure how long every node of every job runs
+NODE_PROFILER_ENABLED = os.environ.get("NODE_PROFILER_ENABLED", "true").lower() == "true"
+# File the aggregated profile is written to when the worker shuts down (empty: only logged)
+NODE_PROFILE_PATH = os.environ.get("NODE_PROFILE_PATH", "")
+# Most recent durations kept per class_type, node and workflow for the percentiles
+NODE_PROFILE_MAX_SAMPLES = int(os.environ.get("NODE_PROFILE_MAX_SAMPLES", 1000))
+
+
+def workflow_fingerprint(workflow):
+    """
+    Returns a short name for the shape of a workflow: its node IDs and class types.
+
+    Jobs that only differ in their inputs (prompt, seed, images) share the fingerprint.
+    """
+    shape = sorted((str(node_id), str(node.get("class_type", ""))) for node_id, node in workflow.items() if isinstance(node, dict))
+    return "wf-" + hashlib.sha1(json.dumps(shape).encode("utf-8")).hexdigest()[:8]
+
+
+def percentiles(samples):
+    """
+    Returns the nearest-rank p50, p90, p99 and the maximum of the samples in milliseconds.
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+
+    def rank(p):
+        return round(ordered[min(len(ordered) - 1, max(0, int(len(ordered) * p + 0.5) - 1))], 1)
+
+    return {"p50_ms": rank(0.5), "p90_ms": rank(0.9), "p99_ms": rank(0.99), "max_ms": round(ordered[-1], 1)}
+
+
+class JobProfile:
+    """
+    Turns the websocket events of one job into the durations of its nodes.
+
+    A node runs from its "executing" event until the next "executing" (another node,
+    or None when the prompt is done), "executed", "execution_success" or
+    "execution_error" event. Nodes listed by "execution_cached" are recorded with no
+    duration. A node that is still running when the job ends is not recorded.
+
+    Args:
+        workflow (dict): The workflow the job queued
+    """
+
+    def __init__(self, workflow):
+        self.workflow = workflow
+        self.fingerprint = workflow_fingerprint(workflow)
+        self.nodes = []
+        self._running = None
+
+    def class_type(self, node_id):
+        node = self.workflow.get(str(node_id))
+        return str(node.get("class_type", "unknown")) if isinstance(node, dict) else "unknown"
+
+    def on_message(self, message):
+        """
+        Take one websocket message of the job's prompt.
+        """
+        msg_type = message.get("type")
+        data = message.get("data") or {}
+
+        if msg_type == "execution_cached":
+            for node_id in data.get("nodes") or []:
+                self._record(node_id, 0.0, cached=True)
+        elif msg_type == "executing":
+            self._end()
+            if data.get("node") is not None:
+                self._running = (str(data["node"]), time.perf_counter(), 0)
+        elif msg_type == "progress" and self._running and str(data.get("node")) == self._running[0]:
+            node_id, started, _ = self._running
+            self._running = (node_id, started, data.get("max") or 0)
+        elif msg_type in ("executed", "execution_success", "execution_error", "execution_interrupted"):
+            self._end(completed=msg_type != "execution_interrupted")
+
+    def _end(self, completed=True):
+        if self._running is None:
+            return
+        node_id, started, steps = self._running
+        self._running = None
+        if completed:
+            self._record(node_id, (time.perf_counter() - started) * 1000, cached=False, steps=steps)
+
+    def _record(self, node_id, ms, cached, steps=0):
+        entry = {"node": str(node_id), "class_type": self.class_type(node_id), "cached": cached, "ms": round(ms, 1)}
+        if steps:
+            entry["steps"] = steps
+        self.nodes.append(entry)
+
+
+class _Stats:
+    def __init__(self, max_samples):
+        self.count = 0
+        self.cached = 0
+        self.total_ms = 0.0
+        self.samples = deque(maxlen=max_samples)
+
+    def add(self, ms, cached=False):
+        if cached:
+            self.cached += 1
+            return
+        self.count += 1
+        self.total_ms += ms
+        self.samples.append(ms)
+
+    def as_dict(self):
+        stats = {"count": self.count, "cached": self.cached, "total_ms": round(self.total_ms, 1)}
+        stats.update(percentiles(self.samples))
+        return stats
+
+
+class NodeProfiler:
+    """
+    Aggregates the node durations of all jobs per class_type and per workflow.
+
+    Totals and counts cover the worker's lifetime; the percentiles are computed over
+    the most recent max_samples durations of each class_type, node and workflow.
+
+    Args:
+        max_samples (int, optional): Durations kept per class_type, node and workflow
+    """
+
+    def __init__(self, max_samples=None):
+        self.max_samples = max_samples or NODE_PROFILE_MAX_SAMPLES
+        self.jobs = 0
+        self.started = time.time()
+        self._class_types = {}
+        self._workflows = {}
+
+    def _stats(self, table, key):
+        stats = table.get(key)
+        if stats is None:
+            stats = table[key] = _Stats(self.max_samples)
+        return stats
+
+    def record(self, profile):
+        """
+        Add the node durations of a finished job.
+        """
+        if not profile.nodes:
+            return
+        self.jobs += 1
+        workflow = self._workflows.get(profile.fingerprint)
+        if workflow is None:
+            workflow = self._workflows[profile.fingerprint] = {"execution": _Stats(self.max_samples), "nodes": {}}
+
+        execution_ms = 0.0
+        for entry in profile.nodes:
+            self._stats(self._class_types, entry["class_type"]).add(entry["ms"], entry["cached"])
+            self._stats(workflow["nodes"], f"{entry['node']} {entry['class_type']}").add(entry["ms"], entry["cached"])
+            execution_ms += entry["ms"]
+        workflow["execution"].add(execution_ms)
+
+    def summary(self):
+        """
+        Returns the aggregated profile, class types ordered by their total time.
+        """
+
+        def by_total(table):
+            ordered = sorted(table.items(), key=lambda item: item[1].total_ms, reverse=True)
+            return {key: stats.as_dict() for key, stats in ordered}
+
+        return {
+            "jobs": self.jobs,
+            "since": round(self.started),
+            "class_types": by_total(self._class_types),
+            "workflows": {
+                fingerprint: {"execution": workflow["execution"].as_dict(), "nodes": by_total(workflow["nodes"])}
+                for fingerprint, workflow in self._workflows.items()
+            },
+        }
+
+    def dump(self, path=None):
+        """
+        Log the profile as one JSON line and write it to path, if given.
+        """
+        if not self.jobs:
+            return
+        summary = self.summary()
+        print(json.dumps({"event": "node_profile", **summary}))
+        if path:
+            try:
+                with open(path, "w") as f:
+                    json.dump(summary, f, indent=2)
+            except OSError as e:
+                print(f"runpod-worker-comfy - ⚠️ Could not write the node profile to {path}: {e}")
+
+    def dump_on_shutdown(self, path=None):
+        """
+        Dump the profile when the worker exits, also when it is stopped with SIGTERM.
+        """
+        path = NODE_PROFILE_PATH if path is None else path
+        atexit.register(self.dump, path)
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def on_sigterm(signum, frame):
+            atexit.unregister(self.dump)
+            self.dump(path)
+            if callable(previous):
+                previous(signum, frame)
+            elif previous != signal.SIG_IGN:
+                # Terminate as the default handler would
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                os.kill(os.getpid(), signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, on_sigterm)
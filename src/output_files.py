@@ -0,0 +1,132 @@
+# Lookup of output files that are not listed in a prompt's history
+
+import os
+import threading
+
+# Video files looked for when the history has no outputs, in order of preference
+FALLBACK_VIDEO_TYPES = [
+    ("mp4", "video/mp4"),
+    ("webm", "video/webm"),
+    ("webp", "image/webp"),
+]
+# Prefix of the videos written by our video workflows
+LEGACY_VIDEO_PREFIX = "output_video"
+# Node types that save videos under their "filename_prefix"
+VIDEO_NODE_CLASSES = ("VHS_VideoCombine", "SaveWEBM", "SaveVideo", "SaveAnimatedWEBP")
+
+
+def video_prefixes(workflow):
+    """
+    Returns the filename prefixes the video nodes of a workflow save under.
+
+    generate.py gives every job a unique prefix through the {{SAVE-WEBM}} node, which
+    makes the prefix enough to find that job's video.
+    """
+    prefixes = []
+    for node in (workflow or {}).values():
+        if not isinstance(node, dict):
+            continue
+        prefix = node.get("inputs", {}).get("filename_prefix")
+        title = node.get("_meta", {}).get("title", "")
+        if isinstance(prefix, str) and prefix and (node.get("class_type") in VIDEO_NODE_CLASSES or "{{SAVE-WEBM}}" in title):
+            prefixes.append(prefix)
+    return prefixes
+
+
+class DirectoryIndex:
+    """
+    Names and modification times of the files in one directory.
+
+    The directory is only listed again when its own mtime changed (a file was added,
+    removed or renamed), and only new files are stat'ed, so repeated lookups do not
+    cost a scan of the whole directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.scans = 0
+        self._dir_mtime = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        try:
+            dir_mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self.files = {}
+            self._dir_mtime = None
+            return
+        if dir_mtime == self._dir_mtime:
+            return
+
+        files = {}
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                known = self.files.get(entry.name)
+                if known is not None:
+                    files[entry.name] = known
+                    continue
+                try:
+                    if entry.is_file():
+                        files[entry.name] = entry.stat().st_mtime
+                except FileNotFoundError:
+                    pass
+        self.files = files
+        self._dir_mtime = dir_mtime
+        self.scans += 1
+
+    def newest(self, prefix, extension, since=None):
+        """
+        Returns the name of the newest file with the given prefix and extension, or None.
+
+        Args:
+            prefix (str): Start of the filename
+            extension (str): Extension without the dot
+            since (float, optional): Ignore files modified before this timestamp
+        """
+        with self._lock:
+            self.refresh()
+            suffix = f".{extension}"
+            matches = [
+                (mtime, name)
+                for name, mtime in self.files.items()
+                if name.startswith(prefix) and name.endswith(suffix) and (since is None or mtime >= since)
+            ]
+        return max(matches)[1] if matches else None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def directory_index(path):
+    """
+    Returns the shared index of a directory.
+    """
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = DirectoryIndex(path)
+        return index
+
+
+def find_video(output_dir, prefixes=None, since=None):
+    """
+    Find a job's video in the output directory when the history does not list it.
+
+    Args:
+        output_dir (str): ComfyUI's output directory
+        prefixes (list, optional): Filename prefixes of the job's video nodes, see video_prefixes()
+        since (float, optional): Ignore files modified before this timestamp (the job start)
+
+    Returns:
+        tuple: (path, extension, mime) of the newest matching file, or None
+    """
+    for prefix in prefixes or [LEGACY_VIDEO_PREFIX]:
+        subfolder, name = os.path.split(prefix)
+        index = directory_index(os.path.join(output_dir, subfolder))
+        for extension, mime in FALLBACK_VIDEO_TYPES:
+            found = index.newest(name, extension, since)
+            if found:
+                return os.path.join(index.path, found), extension, mime
+    return None
@@ -0,0 +1,293 @@
+# Keeps ComfyUI's output directory from growing without bound
+
+import os
+import threading
+import time
+
+# Directory where ComfyUI writes the generated files
+COMFY_OUTPUT_PATH = os.environ.get("COMFY_OUTPUT_PATH", "/comfyui/output")
+# Remove old output files in the background
+OUTPUT_RETENTION_ENABLED = os.environ.get("OUTPUT_RETENTION_ENABLED", "true").lower() == "true"
+# Delete output files as soon as they were returned or uploaded
+OUTPUT_RETENTION_DELETE_DELIVERED = os.environ.get("OUTPUT_RETENTION_DELETE_DELIVERED", "true").lower() == "true"
+# Disk budget for the output directory in bytes, least recently used files are deleted beyond it
+OUTPUT_RETENTION_MAX_BYTES = int(os.environ.get("OUTPUT_RETENTION_MAX_BYTES", 10 * 1024**3))
+# Output files older than this are deleted, in seconds (0 keeps them)
+OUTPUT_RETENTION_MAX_AGE_S = float(os.environ.get("OUTPUT_RETENTION_MAX_AGE_S", 24 * 3600))
+# Time between two sweeps of the output directory in seconds
+OUTPUT_RETENTION_INTERVAL_S = float(os.environ.get("OUTPUT_RETENTION_INTERVAL_S", 60))
+
+# Files written this long before the oldest running job started are still treated as
+# its own (file systems with a coarse mtime)
+MTIME_SLACK_S = 2
+
+
+def stale_nodes(outputs, output_dir):
+    """
+    Returns the ids of output nodes whose files are listed in the history but gone.
+
+    ComfyUI does not run an output node again for an identical prompt, it reports the
+    files of the earlier run, which may have been deleted since.
+    """
+    nodes = []
+    for node_id, node_output in outputs.items():
+        files = [
+            item
+            for items in node_output.values()
+            if isinstance(items, list)
+            for item in items
+            if isinstance(item, dict) and item.get("type", "output") == "output" and "filename" in item
+        ]
+        if any(not os.path.exists(os.path.join(output_dir, f.get("subfolder", ""), f["filename"])) for f in files):
+            nodes.append(node_id)
+    return nodes
+
+
+def resave_workflow(workflow, node_ids, tag):
+    """
+    Give the filename_prefix of some nodes a suffix so ComfyUI runs them again.
+
+    Only the changed save nodes are executed again, everything upstream still comes
+    from ComfyUI's cache.
+
+    Args:
+        workflow (dict): The workflow, it is not modified
+        node_ids (list): The output nodes to run again
+        tag (str): Appended to their filename_prefix
+    """
+    rewritten = dict(workflow)
+    for node_id in node_ids:
+        node = workflow.get(node_id)
+        if isinstance(node, dict) and "filename_prefix" in node.get("inputs", {}):
+            inputs = {**node["inputs"], "filename_prefix": f"{node['inputs']['filename_prefix']}_{tag}"}
+            rewritten[node_id] = {**node, "inputs": inputs}
+    return rewritten
+
+
+class OutputRetention:
+    """
+    Deletes output files once they were delivered, and enforces an age and size budget.
+
+    A background thread deletes delivered files and sweeps the output directory every
+    interval_s seconds: files older than max_age_s are removed, then the least recently
+    used files until the directory fits into max_bytes. Files are never deleted while
+    they are pinned (a job is delivering them), and the sweep leaves every file alone
+    that was written after the oldest running job started.
+
+    Args:
+        output_dir (str): ComfyUI's output directory
+        max_bytes (int): Disk budget for the output directory
+        max_age_s (float): Maximum age of output files, 0 disables it
+        interval_s (float): Time between two sweeps
+        delete_delivered (bool): Delete files as soon as they were delivered
+    """
+
+    def __init__(
+        self,
+        output_dir=COMFY_OUTPUT_PATH,
+        max_bytes=OUTPUT_RETENTION_MAX_BYTES,
+        max_age_s=OUTPUT_RETENTION_MAX_AGE_S,
+        interval_s=OUTPUT_RETENTION_INTERVAL_S,
+        delete_delivered=OUTPUT_RETENTION_DELETE_DELIVERED,
+    ):
+        self.output_dir = os.path.realpath(output_dir)
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.interval_s = interval_s
+        self.delete_delivered = delete_delivered
+
+        self.sweeps = 0
+        self.delivered_deleted = 0
+        self.expired = 0
+        self.evicted = 0
+        self.bytes_reclaimed = 0
+        self.bytes = 0
+        self.files = 0
+
+        self._running_jobs = {}
+        self._pins = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- jobs ----------------------------------------------------------------------
+
+    def job_started(self, job_id, started=None):
+        """
+        Protect every file written from now on until job_finished() is called.
+        """
+        with self._lock:
+            self._running_jobs[job_id] = time.time() if started is None else started
+        self.start()
+
+    def job_finished(self, job_id):
+        with self._lock:
+            self._running_jobs.pop(job_id, None)
+
+    def pin(self, paths):
+        """
+        Protect files from deletion while a job delivers them.
+        """
+        with self._lock:
+            for path in paths:
+                path = os.path.realpath(path)
+                self._pins[path] = self._pins.get(path, 0) + 1
+
+    def unpin(self, paths):
+        released = False
+        with self._lock:
+            for path in paths:
+                path = os.path.realpath(path)
+                count = self._pins.get(path, 0) - 1
+                if count > 0:
+                    self._pins[path] = count
+                else:
+                    self._pins.pop(path, None)
+                    released = released or path in self._pending
+        if released:
+            # Delivered meanwhile, delete it now
+            self._wake.set()
+
+    def delivered(self, paths):
+        """
+        Hand over files that were returned or uploaded; they are deleted in the background.
+        """
+        if not self.delete_delivered:
+            return
+        with self._lock:
+            for path in paths:
+                path = os.path.realpath(path)
+                # Never touch anything outside the output directory
+                if path.startswith(self.output_dir + os.sep):
+                    self._pending.add(path)
+        self._wake.set()
+
+    # --- background thread ---------------------------------------------------------
+
+    def start(self):
+        """
+        Start the background thread, if it is not running yet.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="output-retention", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self):
+        next_sweep = time.monotonic()
+        while not self._stop.is_set():
+            # Cleared before working, so files delivered meanwhile wake us up again
+            self._wake.clear()
+            try:
+                self.delete_pending()
+                if time.monotonic() >= next_sweep:
+                    self.sweep()
+                    next_sweep = time.monotonic() + self.interval_s
+            except Exception as e:
+                print(f"runpod-worker-comfy - output retention failed: {e}")
+            self._wake.wait(max(0.0, next_sweep - time.monotonic()))
+
+    # --- deleting ------------------------------------------------------------------
+
+    def _remove(self, path):
+        # Checked again under the lock, a job may have pinned the file since it was picked
+        with self._lock:
+            if os.path.realpath(path) in self._pins:
+                return None
+            try:
+                size = os.stat(path).st_size
+                os.remove(path)
+            except FileNotFoundError:
+                return 0
+            self.bytes_reclaimed += size
+        return size
+
+    def delete_pending(self):
+        """
+        Delete the delivered files that are not pinned by another job.
+        """
+        with self._lock:
+            ready = [path for path in self._pending if path not in self._pins]
+            self._pending.difference_update(ready)
+
+        for path in ready:
+            removed = self._remove(path)
+            if removed is None:
+                with self._lock:
+                    self._pending.add(path)
+            elif removed:
+                self.delivered_deleted += 1
+
+    def sweep(self):
+        """
+        Delete expired files, then the least recently used ones until the budget is met.
+        """
+        now = time.time()
+        with self._lock:
+            oldest_job = min(self._running_jobs.values(), default=None)
+            pinned = set(self._pins)
+        protect_after = None if oldest_job is None else oldest_job - MTIME_SLACK_S
+
+        files = []
+        for root, _, names in os.walk(self.output_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((max(stat.st_atime, stat.st_mtime), stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, _, size, _ in files)
+        files.sort()
+        kept = 0
+        for used, mtime, size, path in files:
+            protected = path in pinned or (protect_after is not None and mtime >= protect_after)
+            expired = self.max_age_s and now - mtime > self.max_age_s
+            if protected or not (expired or total > self.max_bytes):
+                kept += 1
+                continue
+            removed = self._remove(path)
+            if removed is None:
+                kept += 1
+            elif removed:
+                total -= size
+                if expired:
+                    self.expired += 1
+                else:
+                    self.evicted += 1
+
+        reclaimed = self.bytes_reclaimed
+        self.sweeps += 1
+        self.bytes = total
+        self.files = kept
+        if len(files) != kept:
+            print(
+                f"runpod-worker-comfy - output retention removed {len(files) - kept} file(s), "
+                f"{total} bytes in use, {reclaimed} bytes reclaimed in total"
+            )
+
+    def stats(self):
+        """
+        Returns the deletion counters and the size of the output directory at the last sweep.
+        """
+        return {
+            "sweeps": self.sweeps,
+            "delivered_deleted": self.delivered_deleted,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "bytes_reclaimed": self.bytes_reclaimed,
+            "bytes": self.bytes,
+            "files": self.files,
+        }
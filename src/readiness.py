@@ -0,0 +1,120 @@
+# Worker-level readiness gate for the ComfyUI API
+
+import asyncio
+import os
+import time
+
+import aiohttp
+
+# Endpoint used to probe ComfyUI, cheap compared to rendering the index page
+COMFY_READY_PROBE_PATH = os.environ.get("COMFY_READY_PROBE_PATH", "/system_stats")
+# How long to wait for ComfyUI to become reachable, in seconds
+COMFY_READY_TIMEOUT_S = float(os.environ.get("COMFY_READY_TIMEOUT_S", 3600))
+# First delay between probes in milliseconds, doubled after every failed probe
+COMFY_READY_BACKOFF_MIN_MS = int(os.environ.get("COMFY_READY_BACKOFF_MIN_MS", 50))
+# Largest delay between probes in milliseconds
+COMFY_READY_BACKOFF_MAX_MS = int(os.environ.get("COMFY_READY_BACKOFF_MAX_MS", 2000))
+
+UNKNOWN = "unknown"
+PROBING = "probing"
+READY = "ready"
+DOWN = "down"
+
+
+class ComfyReadiness:
+    """
+    Tracks whether ComfyUI is reachable, so warm jobs do not have to ask.
+
+    The first call to ensure_ready() probes ComfyUI with exponential backoff; once it
+    answered, the state stays "ready" and ensure_ready() returns without any request.
+    mark_down() (called by the client on connection failures) makes the next call
+    probe again. Concurrent callers share a single probe.
+
+    Args:
+        client (ComfyClient): The client used for probing
+        timeout_s (float, optional): How long a probe may take before giving up
+    """
+
+    def __init__(self, client, timeout_s=None, probe_path=None):
+        self.client = client
+        self.timeout_s = COMFY_READY_TIMEOUT_S if timeout_s is None else timeout_s
+        self.probe_path = probe_path or COMFY_READY_PROBE_PATH
+        self.state = UNKNOWN
+        self.system_stats = None
+        self.probes = 0
+        self.ready_since = None
+        self._lock = None
+        self._loop = None
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def mark_down(self, reason=None):
+        """
+        Forget that ComfyUI was ready; the next ensure_ready() probes again.
+        """
+        # Failures during a probe are handled by the probe itself
+        if self.state == READY:
+            print(f"runpod-worker-comfy - ComfyUI connection failed, will re-probe before the next job ({reason})")
+            self.state = DOWN
+
+    async def ensure_ready(self, base_url):
+        """
+        Wait until ComfyUI is reachable.
+
+        Args:
+            base_url (str): ComfyUI base URL, e.g. http://127.0.0.1:8188
+
+        Returns:
+            bool: True if ComfyUI is ready, False if it did not answer within the timeout
+        """
+        if self.state == READY:
+            return True
+
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+
+        async with self._lock:
+            # Another job may have finished probing while we waited for the lock
+            if self.state == READY:
+                return True
+            return await self._probe(base_url)
+
+    async def _probe(self, base_url):
+        self.state = PROBING
+        url = f"{base_url}{self.probe_path}"
+        deadline = time.monotonic() + self.timeout_s
+        delay = COMFY_READY_BACKOFF_MIN_MS / 1000
+        started = time.monotonic()
+
+        while True:
+            self.probes += 1
+            try:
+                response = await self.client.request("GET", url, retries=0)
+                if response.status == 200:
+                    self.state = READY
+                    self.ready_since = time.monotonic()
+                    try:
+                        self.system_stats = response.json()
+                    except ValueError:
+                        self.system_stats = None
+                    print(
+                        f"runpod-worker-comfy - API is reachable "
+                        f"(after {(self.ready_since - started) * 1000:.0f} ms, {self.probes} probe(s) in total)"
+                    )
+                    return True
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                # ComfyUI is not up (yet)
+                pass
+
+            if time.monotonic() + delay > deadline:
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, COMFY_READY_BACKOFF_MAX_MS / 1000)
+
+        self.state = DOWN
+        print(f"runpod-worker-comfy - Failed to connect to server at {url} within {self.timeout_s:.0f} s.")
+        return False
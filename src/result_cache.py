@@ -0,0 +1,123 @@
+# Cache of job results, keyed by the canonical form of the workflow and its input images
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+from input_cache import rewrite_image_inputs
+
+# Return the stored result of an identical earlier job instead of running ComfyUI again
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "false").lower() == "true"
+# How long a result is reused, in seconds (bucket URLs are never reused beyond their expiry)
+RESULT_CACHE_TTL_S = int(os.environ.get("RESULT_CACHE_TTL_S", 3600))
+# Memory budget for cached results (base64 outputs count in full) in bytes
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 256 * 1024**2))
+
+
+def canonical_workflow(workflow, image_digests=None):
+    """
+    Returns the workflow in a form that is equal for equal renders.
+
+    Node titles and other "_meta" data are dropped, and images sent with the
+    request are referred to by the hash of their content instead of their name.
+
+    Args:
+        workflow (dict): The request's workflow
+        image_digests (dict, optional): Maps the image names of the request to their sha256
+
+    Returns:
+        str: JSON with sorted keys
+    """
+    workflow = rewrite_image_inputs(workflow, {name: f"sha256:{digest}" for name, digest in (image_digests or {}).items()})
+    nodes = {
+        node_id: {key: value for key, value in node.items() if key != "_meta"} if isinstance(node, dict) else node
+        for node_id, node in workflow.items()
+    }
+    return json.dumps(nodes, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def result_key(workflow, image_digests=None, delivery=""):
+    """
+    Returns the cache key of a job.
+
+    Args:
+        workflow (dict): The request's workflow
+        image_digests (dict, optional): Maps the image names of the request to their sha256
+        delivery (str, optional): How outputs are delivered (e.g. the bucket), a result is only reused for the same
+    """
+    sha = hashlib.sha256(delivery.encode("utf-8") + b"\0")
+    sha.update(canonical_workflow(workflow, image_digests).encode("utf-8"))
+    return sha.hexdigest()
+
+
+class ResultCache:
+    """
+    In-memory LRU cache of successful job results with a TTL.
+
+    Args:
+        ttl_s (int): How long a result is reused, in seconds
+        max_bytes (int): Memory budget, the least recently used results are evicted beyond it
+    """
+
+    def __init__(self, ttl_s=None, max_bytes=None):
+        self.ttl_s = RESULT_CACHE_TTL_S if ttl_s is None else ttl_s
+        self.max_bytes = RESULT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Returns the stored result for key, or None.
+        """
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, result, ttl_s=None):
+        """
+        Store a result. Results larger than the whole budget are not stored.
+
+        Args:
+            key (str): See result_key()
+            result (dict): The job result
+            ttl_s (int, optional): A shorter lifetime, e.g. the expiry of the URLs in it
+        """
+        ttl_s = self.ttl_s if ttl_s is None else min(ttl_s, self.ttl_s)
+        size = len(json.dumps(result))
+        if ttl_s <= 0 or size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (time.monotonic() + ttl_s, result, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def stats(self):
+        """
+        Returns the cache counters.
+        """
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -2,72 +2,88 @@
 
 import runpod
 from runpod.serverless.utils import rp_upload
+from runpod.serverless.modules import rp_scale
 import json
-import urllib.request
-import urllib.parse
-import time
 import os
-import glob
-import requests
 import base64
-from io import BytesIO
+import mimetypes
+import time
 import uuid
 import asyncio
 import socket
-import websockets  # ✅ added for WebSocket logging
-
-# Time to wait between API check attempts in milliseconds
-COMFY_API_AVAILABLE_INTERVAL_MS = 100
-# Maximum number of API check attempts
-COMFY_API_AVAILABLE_MAX_RETRIES = 100000
-# Time to wait between poll attempts in milliseconds
+from concurrent.futures import ThreadPoolExecutor
+
+from comfy_client import ComfyClient
+from comfy_events import EventDispatcher, ExecutionError
+from input_images import image_form
+from input_cache import InputImageCache, INPUT_CACHE_ENABLED, cache_filename, digest_b64, rewrite_image_inputs
+from readiness import ComfyReadiness
+from output_files import find_video, video_prefixes
+from s3_upload import upload_output, S3_PRESIGNED_URL_EXPIRES_S
+from ws_relay import ProgressRelay
+from job_stream import JobEvents, STREAM_OUTPUT
+from job_concurrency import JobConcurrency, MAX_CONCURRENT_JOBS
+from result_cache import ResultCache, RESULT_CACHE_ENABLED, result_key
+from inflight import InflightJobs, INFLIGHT_DEDUP_ENABLED
+from timings import JobTimings
+from node_profiler import JobProfile, NodeProfiler, NODE_PROFILER_ENABLED
+from metrics import WorkerMetrics, family, fetch_system_stats, system_stats_families
+from trace_capture import JobTrace, TraceWriter, TRACE_CAPTURE_PATH
+from workflow_schema import WorkflowSchemaCache, WORKFLOW_SCHEMA_CHECK, ERROR_PREFIX
+from model_index import ModelIndex, MODEL_INDEX_ENABLED
+from model_staging import ModelStaging, MODEL_STAGING_ENABLED
+from warmup import WARMUP_TIMEOUT_S, WARMUP_WORKFLOWS, load_workflows, warm_up
+from output_retention import OutputRetention, OUTPUT_RETENTION_ENABLED, resave_workflow, stale_nodes
+
+# Longest wait between /history poll attempts in milliseconds (polling is only used when the websocket drops)
 COMFY_POLLING_INTERVAL_MS = int(os.environ.get("COMFY_POLLING_INTERVAL_MS", 1000))
 # Maximum number of poll attempts
 COMFY_POLLING_MAX_RETRIES = int(os.environ.get("COMFY_POLLING_MAX_RETRIES", 100000))
+# Maximum number of input images uploaded to ComfyUI at the same time
+COMFY_UPLOAD_CONCURRENCY = int(os.environ.get("COMFY_UPLOAD_CONCURRENCY", 4))
+# Maximum number of output files encoded or uploaded at the same time
+COMFY_OUTPUT_WORKERS = int(os.environ.get("COMFY_OUTPUT_WORKERS", 4))
+# History keys that list output files, and the type reported for them
+OUTPUT_KINDS = {"images": "image", "gifs": "video", "videos": "video"}
 # Host where ComfyUI is running
 COMFY_HOST = "127.0.0.1:8188"
 # Enforce a clean state after each job is done
 # see https://docs.runpod.io/docs/handler-additional-controls#refresh-worker
 REFRESH_WORKER = os.environ.get("REFRESH_WORKER", "false").lower() == "true"
 
-# --- WebSocket listener for ComfyUI progress (DEBUGGING only) ---
-async def listen_to_ws(stop_event, job_id, detailed_logging=True):
-    comfy_uri = f"ws://{COMFY_HOST}/ws"
-    relay_uri = os.environ.get("BACKEND_WS_URL", "ws://185.254.136.244:8765/")
-
-    try:
-        async with websockets.connect(comfy_uri) as comfy_ws, \
-                   websockets.connect(relay_uri) as relay_ws:
-
-            print("📡 Connected to ComfyUI WS and relay WS.")
-
-            while not stop_event.is_set():
-                try:
-                    msg = await asyncio.wait_for(comfy_ws.recv(), timeout=1)
-                    parsed_msg = json.loads(msg)
-
-                    if detailed_logging:
-                        print("🧠 WS:", json.dumps(parsed_msg, indent=2))
-
-                    # Wrap with job_id before relaying
-                    wrapped = json.dumps({
-                        "job_id": job_id,
-                        "comfy": parsed_msg
-                    })
-
-                    await relay_ws.send(wrapped)
-                    if detailed_logging:
-                        print(f"📤 Relayed to backend WS with job_id: {job_id}")
-
-                except asyncio.TimeoutError:
-                    continue
-                except Exception as e:
-                    print(f"⚠️ Error in WS relay loop: {e}")
-                    break
-
-    except Exception as e:
-        print(f"❌ WebSocket connection error: {e}")
-
+# Shared, pooled HTTP client for every ComfyUI call
+comfy_client = ComfyClient()
+# Probed once, and again only after a connection to ComfyUI failed
+readiness = ComfyReadiness(comfy_client)
+comfy_client.on_connection_error = readiness.mark_down
+# Content-addressed cache of input images already uploaded to ComfyUI
+input_cache = InputImageCache() if INPUT_CACHE_ENABLED else None
+# Deletes delivered output files and keeps the output directory within its budget
+output_retention = OutputRetention() if OUTPUT_RETENTION_ENABLED else None
+# ComfyUI's node definitions, for checking workflows before they are queued
+workflow_schemas = WorkflowSchemaCache(comfy_client, readiness) if WORKFLOW_SCHEMA_CHECK else None
+# The model files on disk, for failing jobs that name missing models before they are queued
+model_index = ModelIndex() if MODEL_INDEX_ENABLED else None
+# Local copies of the network volume's models, made for the jobs that load them
+model_staging = ModelStaging(model_index) if MODEL_STAGING_ENABLED and model_index is not None else None
+# Results of earlier jobs, returned again for identical requests
+result_cache = ResultCache() if RESULT_CACHE_ENABLED else None
+# Identical jobs running at the same time share one render
+inflight_jobs = InflightJobs() if INFLIGHT_DEDUP_ENABLED else None
+# Durations of the nodes of all jobs, per class_type and workflow
+node_profiler = NodeProfiler() if NODE_PROFILER_ENABLED else None
+# One ComfyUI websocket for all jobs, routing events by prompt_id
+event_dispatcher = EventDispatcher(lambda prompt_id: get_history(prompt_id), poll_interval_ms=COMFY_POLLING_INTERVAL_MS)
+# Limits the jobs running at the same time
+job_concurrency = JobConcurrency(event_dispatcher)
+# ✅ WebSocket relay for ComfyUI progress, kept open across jobs
+progress_relay = ProgressRelay()
+# Sanitized traces of the jobs, for replaying them in benchmarks
+trace_writer = TraceWriter(TRACE_CAPTURE_PATH) if TRACE_CAPTURE_PATH else None
+# Job counters and stage latencies, served with the gauges from collect_metrics()
+worker_metrics = WorkerMetrics(lambda: collect_metrics())
+# Created on first use, see output_pool()
+_output_pool = None
 
 def validate_input(job_input):
     """
@@ -111,46 +127,74 @@ def validate_input(job_input):
     return {"workflow": workflow, "images": images}, None
 
 
-def check_server(url, retries=5000, delay=50):
+async def check_workflow(workflow):
     """
-    Check if a server is reachable via HTTP GET request
+    Check a workflow against the model files on disk and ComfyUI's node definitions.
 
-    Args:
-    - url (str): The URL to check
-    - retries (int, optional): The number of times to attempt connecting to the server. Default is 50
-    - delay (int, optional): The time in milliseconds to wait between retries. Default is 500
+    Both are cached; they are refreshed once when they reject a workflow, in case
+    models or custom nodes were added since.
 
     Returns:
-    bool: True if the server is reachable within the given number of retries, otherwise False
+        str: The error message, or None if the workflow can be queued
+    """
+    if model_index is not None:
+        if not model_index.built:
+            await asyncio.to_thread(model_index.build)
+        error_message = model_index.error_message(workflow)
+        if error_message and await asyncio.to_thread(model_index.refresh):
+            error_message = model_index.error_message(workflow)
+        if error_message:
+            return error_message
+
+    if workflow_schemas is not None:
+        base_url = f"http://{COMFY_HOST}"
+        schema = await workflow_schemas.get(base_url)
+        error_message = schema.error_message(workflow) if schema is not None else None
+        if error_message and error_message.startswith(ERROR_PREFIX) and await workflow_schemas.refresh(base_url):
+            error_message = workflow_schemas.schema.error_message(workflow)
+        return error_message
+    return None
+
+
+async def upload_image(name, image_data, semaphore, filename=None):
     """
+    Upload one base64 encoded image, decoding it while it is streamed to ComfyUI.
 
-    for i in range(retries):
+    Args:
+        name (str): The name of the image in the request
+        image_data (str): The base64 encoded image
+        semaphore (asyncio.Semaphore): Limits the number of concurrent uploads
+        filename (str, optional): The filename the image is stored under, defaults to name
+
+    Returns:
+        tuple: (success message, None) or (None, error message)
+    """
+    filename = filename or name
+    async with semaphore:
         try:
-            response = requests.get(url)
+            # The form is built per attempt so retries can resend it
+            response = await comfy_client.request(
+                "POST", f"http://{COMFY_HOST}/upload/image", data=lambda: image_form(filename, image_data)
+            )
+        except Exception as e:
+            return None, f"Error uploading {name}: {e}"
 
-            # If the response status code is 200, the server is up and running
-            if response.status_code == 200:
-                print(f"runpod-worker-comfy - API is reachable")
-                return True
-        except requests.RequestException as e:
-            # If an exception occurs, the server may not be ready
-            pass
+    if response.status != 200:
+        return None, f"Error uploading {name}: {response.text}"
+    # Decoded size, without reading the image again
+    worker_metrics.add_bytes("input_upload", len(image_data) * 3 // 4)
+    return f"Successfully uploaded {name}", None
 
-        # Wait for the specified delay before retrying
-        time.sleep(delay / 1000)
 
-    print(
-        f"runpod-worker-comfy - Failed to connect to server at {url} after {retries} attempts."
-    )
-    return False
-
-def upload_images(images):
+async def upload_images(images):
     """
     Upload a list of base64 encoded images to the ComfyUI server using the /upload/image endpoint.
 
+    Up to COMFY_UPLOAD_CONCURRENCY images are uploaded at the same time.
+
     Args:
         images (list): A list of dictionaries, each containing the 'name' of the image and the 'image' as a base64 encoded string.
-        server_address (str): The address of the ComfyUI server.
+                       An optional 'filename' overrides the name the image is stored under.
 
     Returns:
         list: A list of responses from the server for each image upload.
@@ -158,28 +202,14 @@ def upload_images(images):
     if not images:
         return {"status": "success", "message": "No images to upload", "details": []}
 
-    responses = []
-    upload_errors = []
-
     print(f"runpod-worker-comfy - image(s) upload")
 
-    for image in images:
-        name = image["name"]
-        image_data = image["image"]
-        blob = base64.b64decode(image_data)
-
-        # Prepare the form data
-        files = {
-            "image": (name, BytesIO(blob), "image/png"),
-            "overwrite": (None, "true"),
-        }
-
-        # POST request to upload the image
-        response = requests.post(f"http://{COMFY_HOST}/upload/image", files=files)
-        if response.status_code != 200:
-            upload_errors.append(f"Error uploading {name}: {response.text}")
-        else:
-            responses.append(f"Successfully uploaded {name}")
+    semaphore = asyncio.Semaphore(COMFY_UPLOAD_CONCURRENCY)
+    results = await asyncio.gather(
+        *(upload_image(image["name"], image["image"], semaphore, image.get("filename")) for image in images)
+    )
+    responses = [ok for ok, _ in results if ok]
+    upload_errors = [error for _, error in results if error]
 
     if upload_errors:
         print(f"runpod-worker-comfy - image(s) upload with errors")
@@ -197,25 +227,114 @@ def upload_images(images):
     }
 
 
-def queue_workflow(workflow):
+def image_digests(images):
+    """
+    Hash the request's images, once per job (see stage_input_images() and job_result_key()).
+
+    Returns:
+        list: (hex sha256, size) of every image
+
+    Raises:
+        binascii.Error: An image is not valid base64
+    """
+    return [digest_b64(image["image"]) for image in images or []]
+
+
+async def stage_input_images(images, workflow, digests=None):
+    """
+    Make the request's images available to ComfyUI, skipping the ones it already has.
+
+    Every image is hashed; images whose content is already in the input directory are
+    not uploaded again, the others are uploaded under their content-addressed name.
+    The workflow's LoadImage inputs are rewritten to the stored filenames.
+
+    Args:
+        images (list): The request's images (may be None)
+        workflow (dict): The request's workflow
+        digests (list, optional): The images' digests if the job computed them already, see image_digests()
+
+    Returns:
+        tuple: (upload result as returned by upload_images, rewritten workflow, pinned digests)
+    """
+    if not images or input_cache is None:
+        return await upload_images(images), workflow, []
+
+    if digests is None:
+        digests = []
+        errors = []
+        for image in images:
+            try:
+                digests.append(await asyncio.to_thread(digest_b64, image["image"]))
+            except Exception as e:
+                errors.append(f"Error uploading {image['name']}: {e}")
+        if errors:
+            return {"status": "error", "message": "Some images failed to upload", "details": errors}, workflow, []
+
+    filenames = {}
+    reused = []
+    to_upload = []
+    new_entries = {}
+    for image, (digest, size) in zip(images, digests):
+        stored = input_cache.lookup(digest)
+        if stored:
+            reused.append(f"Reused cached {image['name']}")
+        else:
+            stored = cache_filename(digest, image["name"])
+            if stored not in new_entries:
+                to_upload.append({**image, "filename": stored})
+                new_entries[stored] = (digest, size)
+        filenames[image["name"]] = stored
+
+    pinned = [digest for digest, _ in digests]
+    input_cache.pin(pinned)
+
+    upload_result = await upload_images(to_upload)
+    if upload_result["status"] != "success":
+        input_cache.unpin(pinned)
+        return upload_result, workflow, []
+
+    for stored, (digest, size) in new_entries.items():
+        input_cache.add(digest, stored, size)
+
+    print(f"runpod-worker-comfy - input image cache: {input_cache.stats()}")
+    upload_result = {**upload_result, "details": reused + upload_result["details"]}
+    return upload_result, rewrite_image_inputs(workflow, filenames), pinned
+
+
+def job_result_key(workflow, images, digests=None):
+    """
+    Returns the result cache key of a job: its workflow, the content of its images and where outputs go.
+    """
+    if digests is None:
+        digests = image_digests(images)
+    names = {image["name"]: digest for image, (digest, _) in zip(images or [], digests)}
+    return result_key(workflow, names, os.environ.get("BUCKET_ENDPOINT_URL", ""))
+
+
+async def queue_workflow(workflow, client_id=None, prompt_id=None):
     """
     Queue a workflow to be processed by ComfyUI
 
     Args:
         workflow (dict): A dictionary containing the workflow to be processed
+        client_id (str, optional): The websocket client that receives the execution events
+        prompt_id (str, optional): The ID to queue the prompt under
 
     Returns:
         dict: The JSON response from ComfyUI after processing the workflow
     """
 
     # The top level element "prompt" is required by ComfyUI
-    data = json.dumps({"prompt": workflow}).encode("utf-8")
+    payload = {"prompt": workflow}
+    if client_id:
+        payload["client_id"] = client_id
+    if prompt_id:
+        payload["prompt_id"] = prompt_id
 
-    req = urllib.request.Request(f"http://{COMFY_HOST}/prompt", data=data)
-    return json.loads(urllib.request.urlopen(req).read())
+    return await comfy_client.post_json(f"http://{COMFY_HOST}/prompt", payload)
 
 
-def get_history(prompt_id):
+async def get_history(prompt_id):
     """
     Retrieve the history of a given prompt using its ID
 
@@ -225,8 +344,7 @@ def get_history(prompt_id):
     Returns:
         dict: The history of the prompt, containing all the processing steps and results
     """
-    with urllib.request.urlopen(f"http://{COMFY_HOST}/history/{prompt_id}") as response:
-        return json.loads(response.read())
+    return await comfy_client.get_json(f"http://{COMFY_HOST}/history/{prompt_id}")
 
 
 def base64_encode(img_path):
@@ -244,102 +362,199 @@ def base64_encode(img_path):
         return f"{encoded_string}"
 
 
-def process_output_images(outputs, job_id):
+def collect_outputs(outputs):
+    """
+    List every file a workflow produced, in the order ComfyUI reports them.
+
+    Args:
+        outputs (dict): The "outputs" of a history entry, keyed by node id
+
+    Returns:
+        list: One dict per file with 'node_id', 'filename', 'subfolder', 'type' and 'mime'
+    """
+    files = []
+    for node_id, node_output in outputs.items():
+        for key, kind in OUTPUT_KINDS.items():
+            for item in node_output.get(key) or []:
+                # Previews live in ComfyUI's temp directory, they are not results
+                if not isinstance(item, dict) or item.get("type") == "temp" or "filename" not in item:
+                    continue
+                # VHS_VideoCombine reports its own format, e.g. "video/h264-mp4"
+                mime = mimetypes.guess_type(item["filename"])[0] or item.get("format") or "application/octet-stream"
+                files.append({
+                    "node_id": node_id,
+                    "filename": item["filename"],
+                    "subfolder": item.get("subfolder", ""),
+                    # SaveWEBM and SaveVideo report their videos as "images"
+                    "type": "video" if mime.startswith("video/") else kind,
+                    "mime": mime,
+                })
+    return files
+
+
+def output_paths(outputs):
+    """
+    Returns the local paths of the files collect_outputs() finds in a history entry's outputs.
+    """
+    output_dir = os.environ.get("COMFY_OUTPUT_PATH", "/comfyui/output")
+    return [f"{output_dir}/{os.path.join(output['subfolder'], output['filename'])}" for output in collect_outputs(outputs)]
+
+
+def output_pool():
+    """
+    Returns the thread pool that encodes and uploads output files.
+    """
+    global _output_pool
+    if _output_pool is None:
+        _output_pool = ThreadPoolExecutor(max_workers=COMFY_OUTPUT_WORKERS, thread_name_prefix="comfy-output")
+    return _output_pool
+
+
+def deliver_output(output, local_path, job_id, use_bucket, timings=None):
+    """
+    Upload one output file to the bucket, or base64 encode it.
+
+    Returns:
+        tuple: (output dict with a 'url' or 'data' key, None) or (None, error message)
+    """
+    started = time.perf_counter()
+    try:
+        if use_bucket:
+            delivered = {**output, "url": upload_output(job_id, local_path, output["mime"])}
+        else:
+            delivered = {**output, "data": base64_encode(local_path)}
+        worker_metrics.add_bytes("storage_upload" if use_bucket else "output_encode", os.path.getsize(local_path))
+        return delivered, None
+    except Exception as e:
+        return None, f"Error delivering {output['filename']}: {e}"
+    finally:
+        if timings:
+            timings.add("storage_upload" if use_bucket else "output_encode", time.perf_counter() - started)
+
+
+def process_output_images(outputs, job_id, workflow=None, since=None, timings=None):
     """
     This function takes the "outputs" from image generation and the job ID,
-    then determines the correct way to return the image, either as a direct URL
-    to an AWS S3 bucket or as a base64 encoded string, depending on the
+    then determines the correct way to return the images, either as direct URLs
+    to an AWS S3 bucket or as base64 encoded strings, depending on the
     environment configuration.
 
     Args:
         outputs (dict): A dictionary containing the outputs from image generation,
                         typically includes node IDs and their respective output data.
         job_id (str): The unique identifier for the job.
+        workflow (dict, optional): The job's workflow, its video filename prefixes are
+                                   used when the outputs do not list any file.
+        since (float, optional): The job's start time, older files are never returned
+                                 by the fallback lookup.
+        timings (JobTimings, optional): Receives the time spent encoding or uploading,
+                                        summed over the files
 
     Returns:
-        dict: A dictionary with the status ('success' or 'error') and the message,
-              which is either the URL to the image in the AWS S3 bucket or a base64
-              encoded string of the image. In case of error, the message details the issue.
+        dict: A dictionary with the status ('success' or 'error'), the message and,
+              on success, the list of 'outputs'. Every output has the 'node_id',
+              'filename', 'type' and 'mime' of the file and either the 'url' of the
+              file in the AWS S3 bucket or its base64 encoded 'data'. The message is
+              the URL or base64 string of the last output, as in earlier versions.
+              In case of error, the message details the issue.
 
     The function works as follows:
     - It first determines the output path for the images from an environment variable,
       defaulting to "/comfyui/output" if not set.
-    - It then iterates through the outputs to find the filenames of the generated images.
-    - After confirming the existence of the image in the output folder, it checks if the
-      AWS S3 bucket is configured via the BUCKET_ENDPOINT_URL environment variable.
-    - If AWS S3 is configured, it uploads the image to the bucket and returns the URL.
-    - If AWS S3 is not configured, it encodes the image in base64 and returns the string.
-    - If the image file does not exist in the output folder, it returns an error status
-      with a message indicating the missing image file.
+    - It then collects the filenames of all generated images and videos (videos are
+      reported under "gifs"/"videos" by VHS_VideoCombine). Previews are skipped.
+    - The images that exist in the output folder are uploaded to the AWS S3 bucket if
+      BUCKET_ENDPOINT_URL is configured, or base64 encoded otherwise. Up to
+      COMFY_OUTPUT_WORKERS files are processed at the same time.
+    - If none of the files exist in the output folder and AWS S3 is configured, it looks
+      for the job's video by filename prefix in an index of the output folder, and
+      otherwise returns an error status with a message indicating the missing file.
     """
 
     # The path where ComfyUI stores the generated images
     COMFY_OUTPUT_PATH = os.environ.get("COMFY_OUTPUT_PATH", "/comfyui/output")
 
-    output_images = {}
-
-    for node_id, node_output in outputs.items():
-        if "images" in node_output:
-            for image in node_output["images"]:
-                output_images = os.path.join(image["subfolder"], image["filename"])
+    found = collect_outputs(outputs)
 
-    print(f"runpod-worker-comfy - image generation is done")
+    print(f"runpod-worker-comfy - image generation is done ({len(found)} output file(s))")
 
-    # expected image output folder
-    local_image_path = f"{COMFY_OUTPUT_PATH}/{output_images}"
-
-    print(f"runpod-worker-comfy - {local_image_path}")
+    paths = output_paths(outputs)
+    # Pinned before they are looked at, so retention cannot delete them between the check and the upload
+    if output_retention:
+        output_retention.pin(paths)
+    try:
+        existing = []
+        missing = []
+        for output, local_image_path in zip(found, paths):
+            # expected image output folder
+            print(f"runpod-worker-comfy - {local_image_path}")
+            if os.path.exists(local_image_path):
+                existing.append((output, local_image_path))
+            else:
+                missing.append(local_image_path)
 
-    # The image is in the output folder
-    if os.path.exists(local_image_path):
-        if os.environ.get("BUCKET_ENDPOINT_URL", False):
-            # URL to image in AWS S3
-            image = rp_upload.upload_image(job_id, local_image_path)
-            print(
-                "runpod-worker-comfy - the image was generated and uploaded to AWS S3"
-            )
-        else:
-            # base64 image
-            image = base64_encode(local_image_path)
-            print(
-                "runpod-worker-comfy - the image was generated and converted to base64"
+        use_bucket = bool(os.environ.get("BUCKET_ENDPOINT_URL", False))
+        results = list(
+            output_pool().map(
+                lambda item: deliver_output(item[0], item[1], job_id, use_bucket, timings), existing
             )
-            
+        )
+    finally:
+        if output_retention:
+            output_retention.unpin(paths)
+
+    # The images are in the output folder
+    if existing:
+        if output_retention:
+            output_retention.delivered([path for (output, _), (_, path) in zip(results, existing) if output])
+        delivered = [
+            {key: value for key, value in output.items() if key != "subfolder"}
+            for output, _ in results
+            if output
+        ]
+        errors = [error for _, error in results if error]
+        errors += [f"the image does not exist in the specified output folder: {path}" for path in missing]
+
+        if not delivered:
+            print(f"runpod-worker-comfy - no output could be delivered: {errors}")
+            return {"status": "error", "message": errors[0], "details": errors}
+
+        print(
+            f"runpod-worker-comfy - {len(delivered)} output(s) were generated and "
+            + ("uploaded to AWS S3" if use_bucket else "converted to base64")
+        )
         if os.environ.get("DETAILED_COMFY_LOGGING", "true").lower() == "true":
-            print(f"Published image/video URL: {image}")
-        return {
+            for output in delivered:
+                print(f"Published image/video URL: {output.get('url', output.get('data'))}")
+
+        last = delivered[-1]
+        result = {
             "status": "success",
-            "message": image,
+            "message": last.get("url", last.get("data")),
+            "outputs": delivered,
         }
+        if errors:
+            result["errors"] = errors
+        return result
     else:
+        local_image_path = missing[-1] if missing else f"{COMFY_OUTPUT_PATH}/"
+
         # If no image was found, try looking for a fallback video file
         if os.environ.get("BUCKET_ENDPOINT_URL", False):
-            for ext, mime in [
-                ("mp4", "video/mp4"),       # ✅ Add H.264 MP4 support
-                ("webm", "video/webm"),
-                ("webp", "image/webp")
-            ]:
-                pattern = os.path.join(COMFY_OUTPUT_PATH, f"output_video*.{ext}")
-                matching_files = glob.glob(pattern)
-                if matching_files:
-                    # ✅ Pick the most recently modified file
-                    latest_video = max(matching_files, key=os.path.getmtime)
-                    try:
-                        random_name = str(uuid.uuid4())[:8]
-                        filename = f"{random_name}.{ext}"
-                        video_url = rp_upload.upload_file_to_bucket(
-                            file_name=filename,
-                            file_location=latest_video,
-                            prefix=job_id,
-                            extra_args={"ContentType": mime}
-                        )
-                        print(f"runpod-worker-comfy - video was generated and uploaded to AWS S3 ({video_url})")
-                        return {
-                            "status": "success",
-                            "message": video_url
-                        }
-                    except Exception as e:
-                        print(f"runpod-worker-comfy - failed to upload fallback video {latest_video}: {e}")
+            video = find_video(COMFY_OUTPUT_PATH, video_prefixes(workflow), since)
+            if video:
+                latest_video, ext, mime = video
+                try:
+                    video_url = upload_output(job_id, latest_video, mime)
+                    print(f"runpod-worker-comfy - video was generated and uploaded to AWS S3 ({video_url})")
+                    if output_retention:
+                        output_retention.delivered([latest_video])
+                    return {
+                        "status": "success",
+                        "message": video_url
+                    }
+                except Exception as e:
+                    print(f"runpod-worker-comfy - failed to upload fallback video {latest_video}: {e}")
         else:
             print("runpod-worker-comfy - S3 not configured, skipping video upload fallback.")
 
@@ -350,7 +565,81 @@ def process_output_images(outputs, job_id):
             "message": f"the image does not exist in the specified output folder: {local_image_path}",
         }
 
-async def handler(job):
+async def run_job(job, events=None):
+    """
+    Runs a job, see process_job(), and adds the timings of its stages to the result.
+    """
+    timings = JobTimings()
+    trace = JobTrace(job) if trace_writer is not None and trace_writer.sample() else None
+    worker_metrics.job_started()
+    try:
+        result = await process_job(job, events, timings, trace)
+    except BaseException:
+        worker_metrics.job_finished(None)
+        raise
+    finally:
+        job_concurrency.finished(job["id"])
+
+    timings.finish()
+    stages = timings.as_dict() if timings.enabled else None
+    worker_metrics.job_finished(result, stages)
+    if trace:
+        await asyncio.to_thread(trace_writer.write, trace.finish(result, stages))
+    if stages is not None and isinstance(result, dict):
+        result = {**result, "timings": stages}
+        timings.log(job["id"], result)
+    return result
+
+
+class RenderListener:
+    """
+    Passes the websocket events of a render to one of the jobs waiting for it.
+
+    A render runs for the job that started it and for identical jobs that joined
+    it (see InflightJobs), each of them streams, traces and relays the events under
+    its own job id.
+    """
+
+    def __init__(self, job, events=None, trace=None):
+        self.job_id = job["id"]
+        self.events = events
+        self.trace = trace
+
+    def on_message(self, message):
+        progress_relay.publish(self.job_id, message)
+        if self.trace:
+            self.trace.on_message(message)
+        if self.events:
+            prompt_id = (message.get("data") or {}).get("prompt_id")
+            if self.events.prompt_id is None and prompt_id:
+                # Joined after the prompt was queued
+                self.events.queued(prompt_id)
+            self.events.on_message(message)
+
+    def on_binary(self, frame):
+        if self.events and self.events.previews:
+            self.events.on_binary(frame)
+
+    def queued(self, prompt_id):
+        if self.events:
+            self.events.queued(prompt_id)
+
+
+async def process_job(job, events=None, timings=None, trace=None):
+    """
+    Runs a job from validation to delivered outputs.
+
+    Args:
+        job (dict): The RunPod job
+        events (JobEvents, optional): Collects progress events when the job is streamed
+        timings (JobTimings, optional): Receives the durations of the stages
+        trace (JobTrace, optional): Records the websocket events of the job
+
+    Returns:
+        dict: The job result
+    """
+    timings = timings or JobTimings(enabled=False)
+    job_started = time.time()
     current_worker = socket.gethostname()
     
     DETAILED_LOGGING = os.environ.get("DETAILED_COMFY_LOGGING", "true").lower() == "true"
@@ -377,8 +666,17 @@ async def handler(job):
             print(f"🔁 Restart trigger received without specific target. Restarting current worker ({current_worker})...")
     
         os.execv(sys.executable, ['python'] + sys.argv)
+
+    # ✅ Return the node profile aggregated over this worker's jobs
+    if isinstance(job_input, dict) and job_input.get("type") == "node_profile":
+        if node_profiler is None:
+            return {"error": "The node profiler is disabled (NODE_PROFILER_ENABLED=false)"}
+        return {"node_profile": node_profiler.summary(), "worker": current_worker}
     
-    validated_data, error_message = validate_input(job_input)
+    with timings.stage("validate"):
+        validated_data, error_message = validate_input(job_input)
+        if error_message is None and isinstance(validated_data["workflow"], dict):
+            error_message = await check_workflow(validated_data["workflow"])
     if error_message:
         print(f"❌ Validation error: {error_message}")
         return {"error": error_message}
@@ -389,91 +687,410 @@ async def handler(job):
     if DETAILED_LOGGING:
         print(f"runpod-worker-comfy - Workflow input: {json.dumps(workflow)[:500]}...")
 
-    if not check_server(f"http://{COMFY_HOST}", COMFY_API_AVAILABLE_MAX_RETRIES, COMFY_API_AVAILABLE_INTERVAL_MS):
+    # ✅ An identical earlier job answers without touching ComfyUI
+    cache_key = None
+    digests = None
+    skip_cache = isinstance(job_input, dict) and job_input.get("cache") is False
+    with timings.stage("cache_lookup"):
+        if (result_cache is not None or inflight_jobs is not None) and not skip_cache:
+            try:
+                # Hashed once, the input image cache reuses the digests
+                digests = await asyncio.to_thread(image_digests, images)
+                cache_key = job_result_key(workflow, images, digests)
+            except Exception as e:
+                print(f"runpod-worker-comfy - ⚠️ Could not compute the result cache key: {e}")
+        cached = result_cache.get(cache_key) if cache_key and result_cache is not None else None
+    if cached is not None:
+        print("runpod-worker-comfy - returning the cached result of an identical job")
+        return {**cached, "cached": True, "refresh_worker": REFRESH_WORKER}
+
+    if events:
+        events.started(workflow)
+    listener = RenderListener(job, events, trace)
+    rendered = {}
+
+    def render(listeners):
+        return render_job(workflow, images, listeners, DETAILED_LOGGING, digests)
+
+    async def deliver(result):
+        rendered.update(result, at=time.perf_counter())
+        if "history" not in result:
+            return {key: value for key, value in result.items() if key != "timings"}
+        # Encoding and uploading block, keep them off the event loop
+        with timings.stage("outputs"):
+            images_result = await asyncio.to_thread(
+                process_output_images, result["history"], job["id"], result["workflow"], job_started, timings
+            )
+        if images_result.get("status") != "success":
+            print(f"❌ process_output_images failed: {images_result}")
+        return images_result
+
+    if output_retention:
+        output_retention.job_started(job["id"], job_started)
+    try:
+        # ✅ An identical job that is running already renders for this one too
+        joined = False
+        requested = time.perf_counter()
+        if cache_key and inflight_jobs is not None:
+            result, joined = await inflight_jobs.run(cache_key, render, deliver, listener, release_render)
+        else:
+            shared = await render([listener])
+            try:
+                result = await deliver(shared)
+            finally:
+                release_render(shared)
+    finally:
+        if output_retention:
+            output_retention.job_finished(job["id"])
+
+    if joined:
+        timings.add("shared_render", rendered.get("at", time.perf_counter()) - requested)
+        print("runpod-worker-comfy - delivering the outputs of an identical job that ran at the same time")
+    elif "timings" in rendered:
+        timings.merge(rendered["timings"])
+    if result.get("status") != "success":
+        return result
+
+    if cache_key and result_cache is not None and not joined and "errors" not in result:
+        # Presigned URLs must still work when the result is returned again
+        has_urls = any("url" in output for output in result.get("outputs", []))
+        result_cache.put(cache_key, result, ttl_s=S3_PRESIGNED_URL_EXPIRES_S - 60 if has_urls else None)
+
+    result = {**result, "refresh_worker": REFRESH_WORKER}
+    if joined:
+        result["deduplicated"] = True
+    print("runpod-worker-comfy - handler completed.")
+    return result
+
+
+def release_render(rendered):
+    """
+    Lets output retention delete the outputs of a render once every job waiting for it has delivered them.
+    """
+    if output_retention and rendered.get("pinned"):
+        output_retention.unpin(rendered["pinned"])
+
+
+async def render_job(workflow, images, listeners, DETAILED_LOGGING, digests=None):
+    """
+    Runs a validated workflow on ComfyUI, in a slot of its own, for the jobs listening to it.
+
+    The outputs are not delivered here, every job waiting for the render delivers
+    them itself. They are pinned against output retention until release_render().
+
+    Args:
+        workflow (dict): The workflow
+        images (list): The request's input images (may be None)
+        listeners (list): RenderListener of every job waiting for the render, jobs may join later
+        DETAILED_LOGGING (bool): Print details
+        digests (list, optional): The images' digests, see image_digests()
+
+    Returns:
+        dict: The ComfyUI outputs ('history'), the workflow that was run, the pinned
+        output paths ('pinned') and the JobTimings of the render, or an error
+    """
+    timings = JobTimings()
+    requested = time.perf_counter()
+    async with job_concurrency.slot():
+        timings.add("slot_wait", time.perf_counter() - requested)
+        result = await run_render(workflow, images, listeners, DETAILED_LOGGING, timings, digests)
+    return {**result, "timings": timings}
+
+
+async def run_render(workflow, images, listeners, DETAILED_LOGGING, timings, digests=None):
+    with timings.stage("readiness"):
+        ready = await readiness.ensure_ready(f"http://{COMFY_HOST}")
+    if not ready:
         print("❌ ComfyUI API is not reachable.")
         return {"error": "ComfyUI API is not reachable"}
 
-    upload_result = upload_images(images)
+    with timings.stage("upload"):
+        upload_result, workflow, pinned_images = await stage_input_images(images, workflow, digests)
     if upload_result["status"] == "error":
         print(f"❌ Image upload failed: {upload_result}")
         return upload_result
 
-    try:
-        queued_workflow = queue_workflow(workflow)
-        prompt_id = queued_workflow["prompt_id"]
-        print(f"runpod-worker-comfy - queued workflow with ID {prompt_id}")
-    except Exception as e:
-        print(f"❌ Exception while queuing workflow: {e}")
-        return {"error": f"Error queuing workflow: {str(e)}"}
+    # ✅ Copy the models the workflow loads from the network volume to local disk
+    staged_models = []
+    if model_staging is not None:
+        with timings.stage("models"):
+            if not model_index.built:
+                await asyncio.to_thread(model_index.build)
+            staged_models = await asyncio.to_thread(model_staging.stage, workflow)
 
-    # ✅ Start WebSocket listener if logging enabled and loop available
-    ws_task = None
-    ws_stop_event = None
-    try:
-        loop = asyncio.get_running_loop()
-        ws_stop_event = asyncio.Event()
-        ws_task = loop.create_task(
-            listen_to_ws(ws_stop_event, job_id=job["id"], detailed_logging=True)
-        )
-        print("🚀 WebSocket listener task started.")
-    except RuntimeError:
-        print("❌ No running event loop. Skipping WebSocket listener.")
+    # ✅ Relay progress to the backend over the worker's relay connection
+    relay_uri = os.environ.get("BACKEND_WS_URL", "ws://185.254.136.244:8765/")
+    if relay_uri:
+        progress_relay.detailed_logging = DETAILED_LOGGING
+        progress_relay.start(relay_uri)
+
+    profile = JobProfile(workflow) if node_profiler is not None else None
+
+    def on_message(message):
+        timings.on_message(message)
+        if profile:
+            profile.on_message(message)
+        for listener in list(listeners):
+            listener.on_message(message)
+
+    def on_binary(frame):
+        for listener in list(listeners):
+            listener.on_binary(frame)
+
+    prompt_ids = []
+
+    async def queue(prompt):
+        # Subscribe first, so none of the prompt's events can be missed
+        prompt_id = str(uuid.uuid4())
+        prompt_ids.append(prompt_id)
+        event_dispatcher.subscribe(prompt_id, on_message, on_binary)
+        with timings.stage("queue"):
+            queued_workflow = await queue_workflow(prompt, client_id=event_dispatcher.client_id, prompt_id=prompt_id)
+        if queued_workflow["prompt_id"] != prompt_id:
+            # ComfyUI versions without client-chosen prompt IDs
+            prompt_id = queued_workflow["prompt_id"]
+            prompt_ids.append(prompt_id)
+            event_dispatcher.subscribe(prompt_id, on_message, on_binary)
+        for listener in list(listeners):
+            listener.queued(prompt_id)
+        return prompt_id
+
+    async def wait(prompt_id):
+        started = time.perf_counter()
+        try:
+            return await event_dispatcher.wait(prompt_id, COMFY_POLLING_MAX_RETRIES)
+        finally:
+            timings.comfy_wait(started, time.perf_counter())
+
+    # ✅ Make sure the shared ComfyUI websocket is open before queueing
+    await event_dispatcher.connect(COMFY_HOST)
 
-    print(f"runpod-worker-comfy - wait until image generation is complete")
-    retries = 0
-    history = {}
     try:
-        while retries < COMFY_POLLING_MAX_RETRIES:
-            try:
-                history = get_history(prompt_id)
-                if prompt_id in history:
-                    prompt_data = history[prompt_id]
-                    if "outputs" in prompt_data and prompt_data["outputs"]:
-                        print("runpod-worker-comfy - ✅ Outputs detected, generation complete.")
-                        break
-            except Exception as e:
-                print(f"runpod-worker-comfy - ⚠️ History fetch error: {e}")
-            await asyncio.sleep(COMFY_POLLING_INTERVAL_MS / 1000)
-            retries += 1
-        else:
+        try:
+            prompt_id = await queue(workflow)
+            print(f"runpod-worker-comfy - queued workflow with ID {prompt_id}")
+        except Exception as e:
+            print(f"❌ Exception while queuing workflow: {e}")
+            return {"error": f"Error queuing workflow: {str(e)}"}
+
+        print(f"runpod-worker-comfy - wait until image generation is complete")
+        try:
+            history = await wait(prompt_id)
+        except ExecutionError as e:
+            print(f"❌ Workflow execution failed: {e}")
+            return {"error": f"Workflow execution failed: {str(e)}"}
+        except Exception as e:
+            print(f"❌ Exception while waiting for history: {e}")
+            return {"error": f"Error waiting for image generation: {str(e)}"}
+
+        if not history:
             print("❌ Max retries reached while waiting for image generation.")
             return {"error": "Max retries reached while waiting for image generation"}
-    except Exception as e:
-        print(f"❌ Exception while polling for history: {e}")
-        return {"error": f"Error waiting for image generation: {str(e)}"}
+        print("runpod-worker-comfy - ✅ Outputs detected, generation complete.")
 
-    try:
-        outputs = history[prompt_id].get("outputs", {})
-        if not outputs:
-            print("❌ No outputs in history object.")
-            return {"error": "No outputs found for prompt"}
+        try:
+            outputs = history[prompt_id].get("outputs", {})
+
+            # ComfyUI reports the files of an earlier identical prompt, which may be deleted by now
+            stale = stale_nodes(outputs, os.environ.get("COMFY_OUTPUT_PATH", "/comfyui/output")) if output_retention else []
+            if stale:
+                print(f"runpod-worker-comfy - outputs of node(s) {stale} were already removed, saving them again")
+                prompt_id = await queue(resave_workflow(workflow, stale, str(uuid.uuid4())[:8]))
+                history = await wait(prompt_id) or {}
+                outputs = history.get(prompt_id, {}).get("outputs", {})
+
+            if not outputs:
+                print("❌ No outputs in history object.")
+                return {"error": "No outputs found for prompt"}
+
+            # Kept until every job waiting for the render has delivered them
+            pinned = output_paths(outputs) if output_retention else []
+            if pinned:
+                output_retention.pin(pinned)
+            return {"history": outputs, "workflow": workflow, "pinned": pinned}
+
+        except Exception as e:
+            print(f"❌ Unexpected exception during final processing: {e}")
+            return {"error": f"Unhandled error while finalizing result: {str(e)}"}
+
+    finally:
+        if pinned_images:
+            input_cache.unpin(pinned_images)
+        if staged_models:
+            model_staging.unpin(staged_models)
+
+        for prompt_id in prompt_ids:
+            event_dispatcher.unsubscribe(prompt_id)
+        if profile:
+            node_profiler.record(profile)
+
+        # ✅ Give the relay a moment to send this job's last messages
+        await progress_relay.drain()
+        if DETAILED_LOGGING:
+            print(f"runpod-worker-comfy - relay: {progress_relay.stats()}")
 
-        images_result = process_output_images(outputs, job["id"])
-        if images_result.get("status") != "success":
-            print(f"❌ process_output_images failed: {images_result}")
-            return images_result
 
-        result = {**images_result, "refresh_worker": REFRESH_WORKER}
+async def handler(job):
+    return await run_job(job)
 
-        # ✅ Cleanly shut down WebSocket listener
-        if ws_task:
-            print("🛑 Stopping WebSocket listener...")
-            ws_stop_event.set()
-            await ws_task
-            print("✅ WebSocket listener stopped.")
 
-        print("runpod-worker-comfy - handler completed.")
-        return result
+async def stream_handler(job):
+    """
+    Streaming variant of the handler for RunPod's /stream endpoint.
 
-    except Exception as e:
-        print(f"❌ Unexpected exception during final processing: {e}")
-        return {"error": f"Unhandled error while finalizing result: {str(e)}"}
+    Yields progress events (and previews, if enabled) while the job runs, and the
+    job result as the last item.
+    """
+    events = JobEvents()
+    task = asyncio.create_task(run_job(job, events))
+    try:
+        while True:
+            next_event = asyncio.ensure_future(events.queue.get())
+            await asyncio.wait({task, next_event}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_event.done():
+                next_event.cancel()
+                break
+            yield next_event.result()
+
+        await events.flush()
+        while not events.queue.empty():
+            yield events.queue.get_nowait()
+        yield task.result()
+    finally:
+        # The caller stopped listening
+        if not task.done():
+            task.cancel()
+
+
+def collect_metrics():
+    """
+    Returns the gauges and counters of the worker's components for worker_metrics.
+
+    Runs in the metrics thread; ComfyUI's RAM and VRAM are read from /system_stats.
+    """
+    families = [
+        family("jobs_running", "gauge", "Jobs running on this worker", [({}, job_concurrency.running)]),
+        family("comfy_queue_remaining", "gauge", "Prompts queued or running in ComfyUI", [({}, event_dispatcher.queue_remaining)]),
+    ]
+
+    caches = {"result": result_cache, "input": input_cache, "model": model_staging}
+    for counter in ("hits", "misses"):
+        samples = [({"cache": name}, cache.stats()[counter]) for name, cache in caches.items() if cache is not None]
+        families.append(family(f"cache_{counter}_total", "counter", f"Cache {counter}", samples))
+    if model_staging is not None:
+        staging = model_staging.stats()
+        families.append(family("staged_model_bytes", "gauge", "Size of the models staged on local disk", [({}, staging["bytes"])]))
+        families.append(family("staged_model_copy_bytes_total", "counter", "Bytes copied from the network volume", [({}, staging["bytes_copied"])]))
+    if inflight_jobs is not None:
+        families.append(family("deduplicated_jobs_total", "counter", "Jobs that joined an identical running job", [({}, inflight_jobs.joined)]))
+
+    relay = progress_relay.stats()
+    families.append(family("relay_connected", "gauge", "Whether the progress relay is connected", [({}, relay["connected"])]))
+    for counter, help_text in (
+        ("sent", "Progress messages relayed"),
+        ("dropped", "Progress messages dropped because the relay queue was full"),
+        ("reconnects", "Reconnects of the progress relay"),
+    ):
+        families.append(family(f"relay_{counter}_total", "counter", help_text, [({}, relay[counter])]))
+
+    system_stats = fetch_system_stats(COMFY_HOST)
+    if system_stats:
+        families.extend(system_stats_families(system_stats))
+    return families
 
 
 # ✅ Async wrapper for handler
 async def async_handler(job):
     return await handler(job)
 
+async def run_warmup_prompt(workflow):
+    """
+    Queue a warm-up workflow and wait until ComfyUI has run it.
+    """
+    prompt_id = str(uuid.uuid4())
+    event_dispatcher.subscribe(prompt_id)
+    try:
+        await queue_workflow(workflow, client_id=event_dispatcher.client_id, prompt_id=prompt_id)
+        try:
+            return await asyncio.wait_for(event_dispatcher.wait(prompt_id, COMFY_POLLING_MAX_RETRIES), WARMUP_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            # Jobs must not queue behind a warm-up that is stuck
+            await cancel_prompt(prompt_id)
+            raise
+    finally:
+        event_dispatcher.unsubscribe(prompt_id)
+
+
+async def cancel_prompt(prompt_id):
+    """
+    Remove a prompt from ComfyUI's queue, or interrupt it if it is running already.
+    """
+    try:
+        await comfy_client.request("POST", f"http://{COMFY_HOST}/queue", json_body={"delete": [prompt_id]})
+        # Older ComfyUI versions ignore the prompt id and interrupt whatever runs, only warm-ups run now
+        await comfy_client.request("POST", f"http://{COMFY_HOST}/interrupt", json_body={"prompt_id": prompt_id})
+    except Exception as e:
+        print(f"runpod-worker-comfy - ⚠️ Could not cancel prompt {prompt_id}: {e}")
+
+
+async def upload_warmup_image(name, data):
+    """
+    Store the input image of warm-up workflows in ComfyUI.
+    """
+    result = await upload_images([{"name": name, "image": base64.b64encode(data).decode("utf-8")}])
+    if result["status"] != "success":
+        raise RuntimeError(f"{result['message']}: {result['details']}")
+
+
+async def warm_up_models(spec=None):
+    """
+    Run the WARMUP_WORKFLOWS in a minimal variant, so the first job finds their models loaded.
+
+    Returns:
+        dict: The warm-up report, or None without warm-up workflows
+    """
+    workflows = load_workflows(WARMUP_WORKFLOWS if spec is None else spec)
+    if not workflows:
+        return None
+    await event_dispatcher.connect(COMFY_HOST)
+    return await warm_up(workflows, run_warmup_prompt, upload_warmup_image)
+
+
+async def wait_for_comfy():
+    """
+    Probe ComfyUI once before the worker takes jobs, so warm jobs skip the check,
+    and load the models of the warm-up workflows. The model directories are indexed
+    meanwhile.
+    """
+    index_build = asyncio.create_task(asyncio.to_thread(model_index.build)) if model_index is not None else None
+    try:
+        if await readiness.ensure_ready(f"http://{COMFY_HOST}"):
+            if workflow_schemas is not None:
+                await workflow_schemas.get(f"http://{COMFY_HOST}")
+            await warm_up_models()
+            return True
+        return False
+    finally:
+        if index_build is not None:
+            await index_build
+        # The worker runs its own event loop, the session and socket are re-created there
+        await event_dispatcher.close()
+        await comfy_client.close()
+
 # ✅ Register handler with RunPod
 if __name__ == "__main__":
-    runpod.serverless.start({"handler": async_handler})
+    asyncio.run(wait_for_comfy())
+    if node_profiler is not None:
+        node_profiler.dump_on_shutdown()
+    worker_metrics.serve()
+    if STREAM_OUTPUT:
+        config = {"handler": stream_handler, "return_aggregate_stream": True}
+    else:
+        config = {"handler": async_handler}
+    if MAX_CONCURRENT_JOBS > 1:
+        # Newer SDKs ask the modifier, older ones lower their fetch rate on the controller
+        config["concurrency_modifier"] = job_concurrency.concurrency_modifier
+        config["concurrency_controller"] = job_concurrency.concurrency_controller
+        # runpod 1.3.6 ignores both for the number of jobs it takes, only fetch with room for the job
+        rp_scale.get_job = job_concurrency.gate(rp_scale.get_job)
+    runpod.serverless.start(config)
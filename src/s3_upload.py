@@ -0,0 +1,210 @@
+# Multipart upload of output files to the S3 bucket
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from runpod.serverless.utils import rp_upload
+
+# Size of one part of a multipart upload in MiB (S3 needs at least 5 MiB)
+S3_UPLOAD_PART_SIZE_MB = max(5, int(os.environ.get("S3_UPLOAD_PART_SIZE_MB", 16)))
+# Files larger than this are uploaded in parts, in MiB
+S3_UPLOAD_MULTIPART_THRESHOLD_MB = int(os.environ.get("S3_UPLOAD_MULTIPART_THRESHOLD_MB", S3_UPLOAD_PART_SIZE_MB))
+# Number of parts uploaded at the same time
+S3_UPLOAD_CONCURRENCY = int(os.environ.get("S3_UPLOAD_CONCURRENCY", 8))
+# Number of times a failed part is retried
+S3_UPLOAD_RETRIES = int(os.environ.get("S3_UPLOAD_RETRIES", 3))
+# First backoff between part retries in milliseconds, doubled after every attempt
+S3_UPLOAD_RETRY_BACKOFF_MS = int(os.environ.get("S3_UPLOAD_RETRY_BACKOFF_MS", 200))
+# Lifetime of the returned presigned URLs in seconds
+S3_PRESIGNED_URL_EXPIRES_S = int(os.environ.get("S3_PRESIGNED_URL_EXPIRES_S", 604800))
+
+# S3 allows at most this many parts per upload
+MAX_PARTS = 10000
+
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+_part_pool = None
+
+
+def get_client():
+    """
+    Returns the shared S3 client, or None when the bucket is not configured.
+
+    The client (and its connection pool) lives as long as the worker; it is only
+    created again when the bucket settings change.
+    """
+    global _client, _client_key
+    key = (
+        os.environ.get("BUCKET_ENDPOINT_URL"),
+        os.environ.get("BUCKET_ACCESS_KEY_ID"),
+        os.environ.get("BUCKET_SECRET_ACCESS_KEY"),
+    )
+    if not all(key):
+        return None
+
+    with _client_lock:
+        if _client is None or _client_key != key:
+            endpoint_url, access_key_id, secret_access_key = key
+            _client = boto3.session.Session().client(
+                "s3",
+                endpoint_url=endpoint_url,
+                aws_access_key_id=access_key_id,
+                aws_secret_access_key=secret_access_key,
+                region_name=rp_upload.extract_region_from_url(endpoint_url),
+                config=Config(
+                    signature_version="s3v4",
+                    # Every part is retried on its own, see _with_retries()
+                    retries={"total_max_attempts": 1, "mode": "standard"},
+                    max_pool_connections=S3_UPLOAD_CONCURRENCY * 2,
+                ),
+            )
+            _client_key = key
+        return _client
+
+
+def _get_part_pool():
+    global _part_pool
+    with _client_lock:
+        if _part_pool is None:
+            _part_pool = ThreadPoolExecutor(max_workers=S3_UPLOAD_CONCURRENCY, thread_name_prefix="s3-part")
+        return _part_pool
+
+
+def _with_retries(action, description, retries=None):
+    retries = S3_UPLOAD_RETRIES if retries is None else retries
+    backoff = S3_UPLOAD_RETRY_BACKOFF_MS / 1000
+    for attempt in range(retries + 1):
+        try:
+            return action()
+        except (BotoCoreError, ClientError, OSError) as e:
+            if attempt == retries:
+                raise
+            print(f"runpod-worker-comfy - {description} failed ({e}), retrying")
+            time.sleep(backoff)
+            backoff *= 2
+
+
+def _read_part(path, offset, size):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def upload_file(client, path, bucket, key, content_type, part_size=None, threshold=None):
+    """
+    Upload a file, in parallel parts if it is large.
+
+    Every part is read from disk when it is sent and retried on its own; a failed
+    multipart upload is aborted so no orphaned parts are left in the bucket.
+
+    Args:
+        client: The S3 client
+        path (str): The file to upload
+        bucket (str): The bucket name
+        key (str): The object key
+        content_type (str): The object's content type
+        part_size (int, optional): Part size in bytes
+        threshold (int, optional): Files larger than this are uploaded in parts, in bytes
+
+    Returns:
+        dict: 'bytes', 'parts' and 'seconds' of the upload
+    """
+    part_size = part_size or S3_UPLOAD_PART_SIZE_MB * 1024**2
+    threshold = S3_UPLOAD_MULTIPART_THRESHOLD_MB * 1024**2 if threshold is None else threshold
+    size = os.path.getsize(path)
+    started = time.monotonic()
+
+    if size <= threshold:
+        _with_retries(
+            lambda: client.put_object(
+                Bucket=bucket, Key=key, Body=_read_part(path, 0, size), ContentType=content_type
+            ),
+            f"upload of {key}",
+        )
+        return {"bytes": size, "parts": 1, "seconds": time.monotonic() - started}
+
+    # Grow the parts if the file would need more than S3 allows
+    part_size = max(part_size, -(-size // MAX_PARTS))
+    offsets = list(range(0, size, part_size))
+
+    upload_id = client.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)["UploadId"]
+
+    def send(number, offset):
+        response = _with_retries(
+            lambda: client.upload_part(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                Body=_read_part(path, offset, part_size),
+            ),
+            f"part {number} of {key}",
+        )
+        return {"PartNumber": number, "ETag": response["ETag"]}
+
+    futures = []
+    try:
+        futures = [_get_part_pool().submit(send, number, offset) for number, offset in enumerate(offsets, start=1)]
+        parts = [future.result() for future in futures]
+        _with_retries(
+            lambda: client.complete_multipart_upload(
+                Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            ),
+            f"completing {key}",
+        )
+    except Exception:
+        for future in futures:
+            future.cancel()
+        try:
+            client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except (BotoCoreError, ClientError) as e:
+            print(f"runpod-worker-comfy - could not abort the upload of {key}: {e}")
+        raise
+
+    return {"bytes": size, "parts": len(parts), "seconds": time.monotonic() - started}
+
+
+def upload_output(job_id, path, content_type):
+    """
+    Upload an output file to the bucket and return a presigned URL for it.
+
+    The object is stored as <job_id>/<random name><extension> in the bucket named
+    after the current month, like rp_upload does. When the bucket credentials are not
+    set, rp_upload's local fallback is used.
+
+    Args:
+        job_id (str): The job the file belongs to
+        path (str): The file to upload
+        content_type (str): The file's mime type
+
+    Returns:
+        str: The URL of the uploaded file
+    """
+    extension = os.path.splitext(path)[1]
+    file_name = f"{str(uuid.uuid4())[:8]}{extension}"
+
+    client = get_client()
+    if client is None:
+        if content_type.startswith("image/"):
+            return rp_upload.upload_image(job_id, path)
+        return rp_upload.upload_file_to_bucket(
+            file_name=file_name, file_location=path, prefix=job_id, extra_args={"ContentType": content_type}
+        )
+
+    bucket = time.strftime("%m-%y")
+    key = f"{job_id}/{file_name}"
+    stats = upload_file(client, path, bucket, key, content_type)
+    print(
+        f"runpod-worker-comfy - uploaded {stats['bytes']} bytes in {stats['parts']} part(s) "
+        f"in {stats['seconds']:.2f} s to {bucket}/{key}"
+    )
+    return client.generate_presigned_url(
+        "get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=S3_PRESIGNED_URL_EXPIRES_S
+    )
@@ -12,6 +12,9 @@ if [ "$LIVE_PATCH" == "true" ]; then
 
     # Get laetest rp_handler script
     wget -O /rp_handler.py "https://raw.githubusercontent.com/gjbm2/runpod-worker-comfy/main/src/rp_handler.py?$(date +%s%N)" 
+    for module in comfy_events comfy_client input_images input_cache readiness output_files output_retention s3_upload ws_relay job_stream job_concurrency result_cache inflight warmup timings node_profiler metrics trace_capture workflow_schema model_index model_staging model_sync; do
+        wget -O "/$module.py" "https://raw.githubusercontent.com/gjbm2/runpod-worker-comfy/main/src/$module.py?$(date +%s%N)"
+    done
     wget -O /comfyui/extra_model_paths.yaml "https://raw.githubusercontent.com/gjbm2/runpod-worker-comfy/main/src/extra_model_paths.yaml?$(date +%s%N)" 
     wget -O /restore_snapshot.sh "https://raw.githubusercontent.com/gjbm2/runpod-worker-comfy/refs/heads/main/src/restore_snapshot.sh?$(date +%s%N)" 
     chmod +x /restore_snapshot.sh
@@ -50,15 +53,26 @@ if [ "$AWS_SYNC" == "true" ]; then
     export AWS_ACCESS_KEY_ID="$BUCKET_ACCESS_KEY_ID"
     export AWS_SECRET_ACCESS_KEY="$BUCKET_SECRET_ACCESS_KEY"
     export AWS_DEFAULT_REGION="$BUCKET_AWS_REGION"
-    aws s3 sync s3://stable-diffusion-bucket-gjbm2/models /runpod-volume/models --no-progress --delete
-    aws s3 sync s3://stable-diffusion-bucket-gjbm2/custom_nodes /runpod-volume/custom_nodes --no-progress --delete
-    aws s3 sync s3://stable-diffusion-bucket-gjbm2/snapshots /runpod-volume/snapshots --no-progress --delete
+    # Fetch only what changed since the last boot, as listed in the bucket's manifest (see model_sync.py)
+    python3 /model_sync.py sync
+    sync_status=$?
+    if [ $sync_status -ne 0 ]; then
+        echo "runpod-worker-comfy: manifest sync did not complete (exit code $sync_status), falling back to aws s3 sync"
+        aws s3 sync s3://stable-diffusion-bucket-gjbm2/models /runpod-volume/models --no-progress --delete
+        aws s3 sync s3://stable-diffusion-bucket-gjbm2/custom_nodes /runpod-volume/custom_nodes --no-progress --delete
+        aws s3 sync s3://stable-diffusion-bucket-gjbm2/snapshots /runpod-volume/snapshots --no-progress --delete
+    fi
 fi
 
 if [ "$COPY_MODELS" == "true" ]; then
-    # copy them over for performance reasons...
-    cp -v -u -r /runpod-volume/models/* /comfyui/models/
-    #cp -v -u  /runpod-volume/models/diffusion_models/[NAME HERE] /comfyui/models/diffusion_models/[NAME HERE]
+    if [ "$MODEL_STAGING_ENABLED" == "true" ]; then
+        # the handler copies each model when the first job needs it (model_staging.py)
+        echo "runpod-worker-comfy: MODEL_STAGING_ENABLED is set, models are staged on demand instead of copied at boot"
+    else
+        # copy them over for performance reasons...
+        cp -v -u -r /runpod-volume/models/* /comfyui/models/
+        #cp -v -u  /runpod-volume/models/diffusion_models/[NAME HERE] /comfyui/models/diffusion_models/[NAME HERE]
+    fi
 fi
 
 if [ "$COPY_SNAPSHOTS" == "true" ]; then
@@ -81,16 +95,22 @@ echo
 echo "== INIT COMPLETE =="
 echo 
 
+# Previews are only sent by ComfyUI when a preview method is set
+COMFY_PREVIEW_ARGS=""
+if [ "$STREAM_PREVIEWS" == "true" ]; then
+    COMFY_PREVIEW_ARGS="--preview-method auto"
+fi
+
 # Serve the API and don't shutdown the container
 if [ "$SERVE_API_LOCALLY" == "true" ]; then
     echo "runpod-worker-comfy: Starting ComfyUI"
-    python3 /comfyui/main.py --force-fp16 --disable-auto-launch --disable-metadata --listen &
+    python3 /comfyui/main.py --force-fp16 --disable-auto-launch --disable-metadata --listen $COMFY_PREVIEW_ARGS &
 
     echo "runpod-worker-comfy: Starting RunPod Handler"
     python3 -u /rp_handler.py --rp_serve_api --rp_api_host=0.0.0.0
 else
     echo "runpod-worker-comfy: Starting ComfyUI"
-    python3 /comfyui/main.py --disable-auto-launch --disable-metadata &
+    python3 /comfyui/main.py --disable-auto-launch --disable-metadata $COMFY_PREVIEW_ARGS &
 
     echo "runpod-worker-comfy: Starting RunPod Handler"
     python3 -u /rp_handler.py
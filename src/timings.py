@@ -0,0 +1,114 @@
+# Where the time of a job goes, returned with its result and logged as one JSON line
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Record stage timings, return them under "timings" and log them per job
+JOB_TIMINGS_ENABLED = os.environ.get("JOB_TIMINGS_ENABLED", "true").lower() == "true"
+
+
+class JobTimings:
+    """
+    Collects the duration of the stages of one job in milliseconds.
+
+    Stages timed around a block (stage()) are wall times; durations added from
+    several threads (add()) are summed, e.g. the encoding of outputs that run in
+    parallel. When disabled, every method returns at once.
+
+    Args:
+        enabled (bool, optional): Record anything at all
+    """
+
+    def __init__(self, enabled=None):
+        self.enabled = JOB_TIMINGS_ENABLED if enabled is None else enabled
+        self.started = time.perf_counter()
+        self.ended = None
+        self.stages = {}
+        self.execution_started = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the enclosed block as stage name (added up if it runs more than once).
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        """
+        Add seconds to stage name. Thread-safe.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def merge(self, other):
+        """
+        Add the stages of other, e.g. those of a render this job started.
+        """
+        if not self.enabled:
+            return
+        with other._lock:
+            stages = dict(other.stages)
+        for name, seconds in stages.items():
+            self.add(name, seconds)
+
+    def on_message(self, message):
+        """
+        Notice when ComfyUI starts executing the job's prompt (a websocket message of the prompt).
+        """
+        if self.enabled and self.execution_started is None and message.get("type") == "execution_start":
+            self.execution_started = time.perf_counter()
+
+    def comfy_wait(self, start, end):
+        """
+        Split the wait for ComfyUI into the time in its queue and the execution.
+
+        Without an execution_start message (e.g. when polling) it all counts as execution.
+        """
+        if not self.enabled:
+            return
+        started = self.execution_started
+        if started is not None and started <= end:
+            # It may have started while the prompt was still being queued
+            started = max(started, start)
+            self.add("queue_wait", started - start)
+            self.add("execution", end - started)
+        else:
+            self.add("execution", end - start)
+        self.execution_started = None
+
+    def finish(self):
+        """
+        Stop the clock of the total, so the result and the log report the same.
+        """
+        self.ended = time.perf_counter()
+
+    def as_dict(self):
+        """
+        Returns the stages and the total (so far, or until finish()) in milliseconds.
+        """
+        with self._lock:
+            stages = {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()}
+        stages["total"] = round(((self.ended or time.perf_counter()) - self.started) * 1000, 1)
+        return stages
+
+    def log(self, job_id, result):
+        """
+        Print the timings of a finished job as one JSON line.
+        """
+        if not self.enabled:
+            return
+        status = result.get("status") or ("error" if "error" in result else "success")
+        print(json.dumps({"event": "job_timings", "job_id": job_id, "status": status, "timings_ms": self.as_dict()}))
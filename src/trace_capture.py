@@ -0,0 +1,259 @@
+# Sanitized traces of production jobs, appended to a JSONL file for replaying them in benchmarks
+
+import json
+import os
+import random
+import threading
+import time
+
+from input_cache import LOAD_IMAGE_CLASSES
+from model_index import LOADER_INPUTS
+
+# File job traces are appended to (empty: capture disabled), e.g. on the network volume
+TRACE_CAPTURE_PATH = os.environ.get("TRACE_CAPTURE_PATH", "")
+# Share of the jobs that are traced, between 0 and 1
+TRACE_CAPTURE_SAMPLE_RATE = float(os.environ.get("TRACE_CAPTURE_SAMPLE_RATE", 1.0))
+
+# Inputs whose strings name an option (sampler, scheduler, ...) rather than free text, kept as they are
+ENUM_INPUTS = {
+    "sampler_name",
+    "scheduler",
+    "upscale_method",
+    "crop",
+    "weight_dtype",
+    "type",
+    "mode",
+    "method",
+    "format",
+    "interpolation",
+    "resampling",
+    "channel",
+    "noise_mode",
+}
+# Inputs naming model files (see model_index), kept as they are on any node; all other strings
+# (prompts, file name prefixes, base64 data) are free text and replaced by a size marker
+MODEL_INPUTS = {name for inputs in LOADER_INPUTS.values() for name in inputs}
+
+
+def size_marker(text):
+    return f"<{len(text)} chars>"
+
+
+def decoded_size(data):
+    """
+    Returns the size in bytes of base64 encoded data, without decoding it.
+    """
+    return len(data) * 3 // 4 - data[-2:].count("=")
+
+
+def image_placeholders(images):
+    """
+    Returns a neutral name for every input image of a request, e.g. "photo.png" -> "image_0.png".
+    """
+    placeholders = {}
+    for image in images or []:
+        if isinstance(image, dict) and isinstance(image.get("name"), str) and image["name"] not in placeholders:
+            ext = os.path.splitext(image["name"])[1].lower() or ".png"
+            placeholders[image["name"]] = f"image_{len(placeholders)}{ext}"
+    return placeholders
+
+
+def is_link(value):
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+
+def sanitize_value(name, value):
+    if isinstance(value, str):
+        return value if name in ENUM_INPUTS or name in MODEL_INPUTS else size_marker(value)
+    if is_link(value):
+        return value
+    if isinstance(value, list):
+        return [sanitize_value(name, item) for item in value]
+    if isinstance(value, dict):
+        return {key: sanitize_value(key, item) for key, item in value.items()}
+    return value
+
+
+def sanitize_workflow(workflow, placeholders=None):
+    """
+    Returns the shape of a workflow: nodes, class types, links, numbers and model and option names.
+
+    Free text (prompts, file name prefixes, inline images) is replaced by a size
+    marker, also inside nested inputs; the images of image loaders are replaced by
+    their placeholders (see image_placeholders()). Node titles and other "_meta"
+    data are dropped.
+    """
+    placeholders = placeholders or {}
+    shape = {}
+    for node_id, node in workflow.items():
+        if not isinstance(node, dict):
+            continue
+        class_type = node.get("class_type")
+        inputs = {}
+        for name, value in (node.get("inputs") or {}).items():
+            if name == "image" and isinstance(value, str) and str(class_type).startswith(LOAD_IMAGE_CLASSES):
+                inputs[name] = placeholders.get(value, "image.png")
+            else:
+                inputs[name] = sanitize_value(name, value)
+        shape[str(node_id)] = {"class_type": class_type, "inputs": inputs}
+    return shape
+
+
+def image_sizes(images, placeholders=None):
+    """
+    Returns the placeholder name and decoded size in bytes of every base64 input image.
+    """
+    placeholders = placeholders or image_placeholders(images)
+    sizes = []
+    for image in images or []:
+        if isinstance(image, dict):
+            data = image.get("image") or ""
+            sizes.append({"name": placeholders.get(image.get("name"), "image.png"), "bytes": decoded_size(data)})
+    return sizes
+
+
+def output_sizes(result):
+    """
+    Returns the type and size of every output of a result, without its payload.
+    """
+    sizes = []
+    for output in result.get("outputs") or []:
+        entry = {"type": output.get("type"), "mime": output.get("mime")}
+        if "data" in output:
+            entry["bytes"] = decoded_size(output["data"])
+        sizes.append(entry)
+    return sizes
+
+
+class JobTrace:
+    """
+    Records what a job asked for and how it ran, without its payloads.
+
+    Args:
+        job (dict): The RunPod job
+    """
+
+    def __init__(self, job):
+        self.job_id = job.get("id")
+        self.recorded_at = time.time()
+        self.started = time.perf_counter()
+        self.events = []
+        job_input = job.get("input")
+        if isinstance(job_input, str):
+            try:
+                job_input = json.loads(job_input)
+            except json.JSONDecodeError:
+                job_input = None
+        job_input = job_input if isinstance(job_input, dict) else {}
+        workflow = job_input.get("workflow")
+        placeholders = image_placeholders(job_input.get("images"))
+        self.workflow = sanitize_workflow(workflow, placeholders) if isinstance(workflow, dict) else None
+        self.images = image_sizes(job_input.get("images"), placeholders)
+
+    def on_message(self, message):
+        """
+        Add a websocket message of the job's prompt to the timeline.
+        """
+        if message.get("type") == "status":
+            # Broadcast queue updates, not part of the prompt
+            return
+        data = message.get("data") or {}
+        event = [round((time.perf_counter() - self.started) * 1000, 1), message.get("type")]
+        if "node" in data:
+            event.append(data["node"])
+        elif "node_id" in data:
+            event.append(data["node_id"])
+        elif message.get("type") == "execution_cached":
+            event.append(data.get("nodes"))
+        self.events.append(event)
+
+    def finish(self, result, stages=None):
+        """
+        Returns the trace of the finished job as a dict.
+        """
+        result = result if isinstance(result, dict) else {}
+        status = result.get("status") or ("error" if "error" in result else "success")
+        trace = {
+            "job_id": self.job_id,
+            "recorded_at": round(self.recorded_at, 3),
+            "status": status,
+            "workflow": self.workflow,
+            "images": self.images,
+            "outputs": output_sizes(result),
+            "events": self.events,
+        }
+        if stages:
+            trace["timings"] = stages
+        for flag in ("cached", "deduplicated"):
+            if result.get(flag):
+                trace[flag] = True
+        return trace
+
+
+class TraceWriter:
+    """
+    Appends traces to a JSONL file, one line per job. Thread-safe.
+
+    Args:
+        path (str): The JSONL file
+        sample_rate (float, optional): Share of the jobs that are traced
+    """
+
+    def __init__(self, path, sample_rate=None):
+        self.path = path
+        self.sample_rate = TRACE_CAPTURE_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.written = 0
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """
+        Returns True if the next job should be traced.
+        """
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def write(self, trace):
+        line = json.dumps(trace, separators=(",", ":")) + "\n"
+        try:
+            with self._lock, open(self.path, "a") as f:
+                f.write(line)
+            self.written += 1
+        except OSError as e:
+            print(f"runpod-worker-comfy - ⚠️ Could not write the job trace to {self.path}: {e}")
+
+
+def read_traces(path):
+    """
+    Returns the traces of a JSONL file in the order they were recorded; unreadable lines are skipped.
+    """
+    traces = []
+    with open(path) as f:
+        for line in f:
+            try:
+                trace = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(trace, dict) and isinstance(trace.get("workflow"), dict):
+                traces.append(trace)
+    return sorted(traces, key=lambda trace: trace.get("recorded_at", 0))
+
+
+def node_durations(events):
+    """
+    Returns how long each node ran in milliseconds, from the event timeline of a trace.
+
+    A node runs from its "executing" event until the next "executing" event or the end of the prompt.
+    """
+    durations = {}
+    running = None
+    for event in events:
+        at, msg_type = event[0], event[1]
+        node = event[2] if len(event) > 2 else None
+        if running is not None and msg_type in (
+            "executing", "executed", "execution_success", "execution_error", "execution_interrupted"
+        ):
+            node_id, started = running
+            durations[node_id] = durations.get(node_id, 0.0) + at - started
+            running = None
+        if msg_type == "executing" and node is not None:
+            running = (str(node), at)
+    return durations
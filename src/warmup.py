@@ -0,0 +1,164 @@
+# Loads the models of known workflows into ComfyUI before the worker takes jobs
+
+import copy
+import glob
+import json
+import os
+import struct
+import time
+import zlib
+
+from input_cache import LOAD_IMAGE_CLASSES
+
+# Workflows (files or directories of .json files, comma separated) run in a minimal variant at startup
+WARMUP_WORKFLOWS = os.environ.get("WARMUP_WORKFLOWS", "")
+# Longest time a single warm-up prompt may take, in seconds
+WARMUP_TIMEOUT_S = float(os.environ.get("WARMUP_TIMEOUT_S", 600))
+# Size of the latent images of the warm-up prompts in pixels
+WARMUP_IMAGE_SIZE = int(os.environ.get("WARMUP_IMAGE_SIZE", 64))
+
+# Input image given to the image loaders of warm-up prompts
+WARMUP_IMAGE_NAME = "rp_warmup.png"
+# Output nodes replaced by PreviewImage, so warm-ups leave nothing in the output directory
+SAVE_IMAGE_CLASSES = ("SaveImage", "Image Save", "SaveWEBM", "SaveAnimatedWEBP", "SaveAnimatedPNG")
+# Output nodes of VIDEO inputs, replaced by PreviewAny
+SAVE_VIDEO_CLASSES = ("SaveVideo",)
+
+
+def load_workflows(spec):
+    """
+    Read the warm-up workflows.
+
+    Args:
+        spec (str): Comma separated files or directories (all *.json files in them)
+
+    Returns:
+        list: (name, workflow) tuples; unreadable files are skipped
+    """
+    paths = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        if os.path.isdir(entry):
+            paths.extend(sorted(glob.glob(os.path.join(entry, "*.json"))))
+        else:
+            paths.extend(sorted(glob.glob(entry)))
+
+    workflows = []
+    for path in paths:
+        try:
+            with open(path) as f:
+                workflow = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"runpod-worker-comfy - ⚠️ Skipping warm-up workflow {path}: {e}")
+            continue
+        # Exports of the API format only, the UI format has no class_type per node
+        if isinstance(workflow, dict) and all(isinstance(node, dict) and "class_type" in node for node in workflow.values()):
+            workflows.append((os.path.basename(path), workflow))
+        else:
+            print(f"runpod-worker-comfy - ⚠️ Skipping warm-up workflow {path}: not in API format")
+    return workflows
+
+
+def minimal_variant(workflow, size=None):
+    """
+    Returns a copy of the workflow that loads the same models but renders almost nothing.
+
+    Latent sizes are set to size x size with one image (and one frame), samplers to
+    one step, image loaders read WARMUP_IMAGE_NAME and image and video saves become
+    previews.
+    """
+    size = size or WARMUP_IMAGE_SIZE
+    variant = copy.deepcopy(workflow)
+    for node in variant.values():
+        class_type = str(node.get("class_type", ""))
+        inputs = node.setdefault("inputs", {})
+
+        if "Latent" in class_type or class_type.endswith("ToVideo"):
+            for name in ("width", "height"):
+                if isinstance(inputs.get(name), int):
+                    inputs[name] = size
+            for name in ("batch_size", "length"):
+                if isinstance(inputs.get(name), int):
+                    inputs[name] = 1
+        if isinstance(inputs.get("steps"), int):
+            inputs["steps"] = 1
+        if class_type.startswith(LOAD_IMAGE_CLASSES) and isinstance(inputs.get("image"), str):
+            inputs["image"] = WARMUP_IMAGE_NAME
+        if class_type in SAVE_IMAGE_CLASSES:
+            node["class_type"] = "PreviewImage"
+            node["inputs"] = {"images": inputs["images"]} if "images" in inputs else {}
+        if class_type in SAVE_VIDEO_CLASSES:
+            node["class_type"] = "PreviewAny"
+            node["inputs"] = {"source": inputs["video"]} if "video" in inputs else {}
+        if class_type == "VHS_VideoCombine":
+            inputs["save_output"] = False
+    return variant
+
+
+def blank_png(width, height):
+    """
+    Returns a grey RGB PNG of the given size.
+    """
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    rows = b"".join(b"\x00" + b"\x80" * (width * 3) for _ in range(height))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows))
+        + chunk(b"IEND", b"")
+    )
+
+
+def loads_image(workflow):
+    """
+    Returns True if a workflow has an image loader node, which needs the warm-up image.
+    """
+    return any(str(node.get("class_type", "")).startswith(LOAD_IMAGE_CLASSES) for node in workflow.values())
+
+
+async def warm_up(workflows, run_prompt, upload=None):
+    """
+    Run the minimal variant of every workflow, one after the other.
+
+    A failing warm-up is reported and skipped; models loaded before the failure stay loaded.
+    When the blank input image cannot be uploaded, the workflows loading an image are skipped.
+
+    Args:
+        workflows (list): (name, workflow) tuples, see load_workflows()
+        run_prompt (callable): Coroutine function that queues a workflow and waits for it
+        upload (callable, optional): Coroutine function storing (name, png bytes) as a ComfyUI input image
+
+    Returns:
+        dict: Seconds per workflow and in total, and the errors
+    """
+    started = time.monotonic()
+    report = {"workflows": {}, "errors": {}}
+
+    image_error = None
+    if upload is not None and any(loads_image(workflow) for _, workflow in workflows):
+        size = WARMUP_IMAGE_SIZE
+        try:
+            await upload(WARMUP_IMAGE_NAME, blank_png(size, size))
+        except Exception as e:
+            image_error = f"Upload of the warm-up image failed: {e}"
+            print(f"runpod-worker-comfy - ⚠️ {image_error}, skipping the workflows that load an image")
+
+    for name, workflow in workflows:
+        if image_error and loads_image(workflow):
+            report["errors"][name] = image_error
+            continue
+        workflow_started = time.monotonic()
+        try:
+            await run_prompt(minimal_variant(workflow))
+        except Exception as e:
+            report["errors"][name] = str(e)
+            print(f"runpod-worker-comfy - ⚠️ Warm-up of {name} failed: {e}")
+        seconds = round(time.monotonic() - workflow_started, 3)
+        report["workflows"][name] = seconds
+        print(f"runpod-worker-comfy - warm-up of {name} took {seconds} s")
+
+    report["total_s"] = round(time.monotonic() - started, 3)
+    print(f"runpod-worker-comfy - warm-up of {len(workflows)} workflow(s) took {report['total_s']} s")
+    return report
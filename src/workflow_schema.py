@@ -0,0 +1,216 @@
+# Pre-flight check of workflows against the node definitions ComfyUI reports on /object_info
+
+import asyncio
+import os
+import time
+
+# Check workflows against ComfyUI's node definitions before queueing them
+WORKFLOW_SCHEMA_CHECK = os.environ.get("WORKFLOW_SCHEMA_CHECK", "true").lower() == "true"
+# Shortest time between two fetches of /object_info after a workflow was rejected, in seconds
+WORKFLOW_SCHEMA_REFRESH_MIN_S = float(os.environ.get("WORKFLOW_SCHEMA_REFRESH_MIN_S", 30))
+
+# Beginning of every error message of the check
+ERROR_PREFIX = "Invalid workflow"
+# At most this many problems are listed in the error message
+MAX_ERRORS = 10
+# Options marking enum inputs whose files are uploaded with the job (the enum lists the files seen so far)
+UPLOAD_OPTIONS = ("image_upload", "video_upload", "audio_upload", "upload")
+
+
+def _normalize(value):
+    # Model names in subfolders use the server's path separator, jobs may use either
+    return value.replace("\\", "/") if isinstance(value, str) else value
+
+
+class _NodeType:
+    __slots__ = ("required", "enums", "outputs")
+
+    def __init__(self, definition):
+        inputs = definition.get("input") or {}
+        required = inputs.get("required") or {}
+        optional = inputs.get("optional") or {}
+        self.required = tuple(required)
+        self.enums = {}
+        for name, spec in list(required.items()) + list(optional.items()):
+            choices = _choices(spec)
+            if choices is not None:
+                self.enums[name] = choices
+        self.outputs = len(definition.get("output") or ())
+
+
+def _choices(spec):
+    """
+    Returns the allowed values of an enum input spec, or None for other inputs and uploads.
+    """
+    if not isinstance(spec, (list, tuple)) or not spec:
+        return None
+    options = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+    if any(options.get(flag) for flag in UPLOAD_OPTIONS):
+        return None
+    if isinstance(spec[0], list):
+        values = spec[0]
+    elif spec[0] == "COMBO" and isinstance(options.get("options"), list):
+        values = options["options"]
+    else:
+        return None
+    return frozenset(_normalize(value) for value in values)
+
+
+def _is_link(value):
+    return (
+        isinstance(value, list)
+        and len(value) == 2
+        and isinstance(value[0], (str, int))
+        and isinstance(value[1], int)
+        and not isinstance(value[1], bool)
+    )
+
+
+class WorkflowSchema:
+    """
+    The node definitions of a ComfyUI instance, prepared for checking workflows.
+
+    check() finds the problems ComfyUI would otherwise only report after the prompt
+    was queued, or in the middle of executing it: unknown node types (missing custom
+    nodes), missing required inputs, values not among the choices of an enum input
+    (sampler names, model files) and links to nodes or outputs that do not exist.
+    Value ranges and the types of linked outputs are left to ComfyUI.
+
+    Args:
+        object_info (dict): ComfyUI's /object_info response
+    """
+
+    def __init__(self, object_info):
+        self.node_types = {name: _NodeType(definition) for name, definition in object_info.items() if isinstance(definition, dict)}
+        self.fetched_at = time.monotonic()
+
+    def check(self, workflow):
+        """
+        Returns the problems of a workflow in API format, an empty list if there are none.
+        """
+        errors = []
+        for node_id, node in workflow.items():
+            if not isinstance(node, dict) or "class_type" not in node:
+                errors.append(f"node {node_id} has no class_type")
+                continue
+            class_type = node["class_type"]
+            node_type = self.node_types.get(class_type)
+            if node_type is None:
+                errors.append(f"node {node_id}: unknown node type {class_type!r} (is the custom node installed?)")
+                continue
+
+            inputs = node.get("inputs") or {}
+            for name in node_type.required:
+                if name not in inputs:
+                    errors.append(f"node {node_id} ({class_type}): missing required input {name!r}")
+
+            for name, value in inputs.items():
+                if _is_link(value):
+                    source = workflow.get(str(value[0]))
+                    if not isinstance(source, dict):
+                        errors.append(f"node {node_id} ({class_type}): input {name!r} is linked to missing node {value[0]}")
+                        continue
+                    source_type = self.node_types.get(source.get("class_type"))
+                    if source_type is not None and not 0 <= value[1] < source_type.outputs:
+                        errors.append(
+                            f"node {node_id} ({class_type}): input {name!r} is linked to output {value[1]} of node "
+                            f"{value[0]} ({source.get('class_type')}), which has {source_type.outputs} output(s)"
+                        )
+                    continue
+                choices = node_type.enums.get(name)
+                if choices is None:
+                    continue
+                if not isinstance(value, (str, int, float, bool)):
+                    # Lists and dicts are unhashable and no choice anyway
+                    errors.append(f"node {node_id} ({class_type}): {name} must be one of its choices, not a {type(value).__name__}")
+                elif _normalize(value) not in choices:
+                    errors.append(f"node {node_id} ({class_type}): {value!r} is not a valid {name}")
+        return errors
+
+    def error_message(self, workflow):
+        """
+        Returns the problems of a workflow as one message, or None if there are none.
+        """
+        errors = self.check(workflow)
+        if not errors:
+            return None
+        more = f" (and {len(errors) - MAX_ERRORS} more)" if len(errors) > MAX_ERRORS else ""
+        return f"{ERROR_PREFIX}: " + "; ".join(errors[:MAX_ERRORS]) + more
+
+
+class WorkflowSchemaCache:
+    """
+    Fetches /object_info once and keeps it until ComfyUI restarts.
+
+    A restart is noticed by the readiness gate probing ComfyUI again. Models and
+    custom nodes may also appear while ComfyUI runs, so a rejected workflow may
+    trigger one refresh (see refresh()), at most every WORKFLOW_SCHEMA_REFRESH_MIN_S.
+    A failed fetch is retried by the next job after the same interval.
+
+    Args:
+        client (ComfyClient): Client used to fetch /object_info
+        readiness (ComfyReadiness): Readiness gate of the same ComfyUI
+    """
+
+    def __init__(self, client, readiness, refresh_min_s=None):
+        self.client = client
+        self.readiness = readiness
+        self.refresh_min_s = WORKFLOW_SCHEMA_REFRESH_MIN_S if refresh_min_s is None else refresh_min_s
+        self.schema = None
+        self.fetches = 0
+        # ready_since of the ComfyUI the schema was fetched from (also after a failed fetch)
+        self._fetched_for = None
+        # time.monotonic() of the last failed fetch
+        self._failed_at = None
+        self._lock = None
+        self._loop = None
+
+    async def get(self, base_url):
+        """
+        Returns the schema, or None while ComfyUI is not ready or has no usable /object_info.
+        """
+        if not self.readiness.ready:
+            return None
+        if self._fetched_for == self.readiness.ready_since and not self._retry_due():
+            return self.schema
+
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        async with self._lock:
+            # Concurrent jobs share a single fetch
+            if self._fetched_for != self.readiness.ready_since or self._retry_due():
+                await self._fetch(base_url)
+        return self.schema
+
+    def _retry_due(self):
+        return self._failed_at is not None and time.monotonic() - self._failed_at >= self.refresh_min_s
+
+    async def refresh(self, base_url):
+        """
+        Fetch the schema again unless it is recent.
+
+        Returns:
+            bool: True if a new schema was fetched
+        """
+        if self.schema is not None and time.monotonic() - self.schema.fetched_at < self.refresh_min_s:
+            return False
+        return await self._fetch(base_url)
+
+    async def _fetch(self, base_url):
+        self._fetched_for = self.readiness.ready_since
+        self.fetches += 1
+        try:
+            object_info = await self.client.get_json(f"{base_url}/object_info", retries=0)
+            # Several MB with many custom nodes, prepared off the event loop
+            schema = await asyncio.to_thread(WorkflowSchema, object_info)
+        except Exception as e:
+            print(f"runpod-worker-comfy - ⚠️ Could not load the node definitions, workflows are not checked: {e}")
+            self.schema = None
+            self._failed_at = time.monotonic()
+            return False
+        self.schema = schema
+        self._failed_at = None
+        print(f"runpod-worker-comfy - loaded the definitions of {len(schema.node_types)} node types")
+        return True
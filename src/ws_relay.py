@@ -0,0 +1,218 @@
+# Worker-lifetime relay of ComfyUI progress messages to the backend websocket
+
+import asyncio
+import json
+import os
+from collections import deque
+
+import websockets
+
+# Maximum number of messages waiting to be relayed, older ones are dropped beyond it
+RELAY_QUEUE_SIZE = int(os.environ.get("RELAY_QUEUE_SIZE", 1000))
+# Longest wait between two reconnect attempts in seconds
+RELAY_RECONNECT_MAX_S = float(os.environ.get("RELAY_RECONNECT_MAX_S", 10))
+# How long a finished job waits for its messages to be relayed, in seconds
+RELAY_DRAIN_TIMEOUT_S = float(os.environ.get("RELAY_DRAIN_TIMEOUT_S", 2))
+
+# Message types where only the latest one per job and node matters
+COALESCED_TYPES = ("progress", "progress_state")
+
+
+def coalesce_key(job_id, message):
+    """
+    Returns the key under which a message replaces an earlier one, or None.
+    """
+    if not isinstance(message, dict) or message.get("type") not in COALESCED_TYPES:
+        return None
+    data = message.get("data") or {}
+    return (job_id, message["type"], data.get("prompt_id"), data.get("node"))
+
+
+class ProgressRelay:
+    """
+    Forwards ComfyUI messages, wrapped with their job id, to the backend websocket.
+
+    One connection is kept for the lifetime of the worker and re-established with
+    backoff when it drops. publish() never blocks: messages go into a bounded queue
+    where a progress message replaces the queued one of the same job and node, and
+    the oldest messages are dropped when the queue is full.
+
+    Args:
+        max_queue (int): Maximum number of queued messages
+        detailed_logging (bool): Print every relayed message
+    """
+
+    def __init__(self, max_queue=None, detailed_logging=False):
+        self.max_queue = max_queue or RELAY_QUEUE_SIZE
+        self.detailed_logging = detailed_logging
+        self.uri = None
+        self.connected = False
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.reconnects = 0
+
+        self._queue = deque()
+        self._latest = {}
+        self._loop = None
+        self._task = None
+        self._wake = None
+        self._idle = None
+
+    def start(self, uri):
+        """
+        Make sure the relay task runs on the current event loop and talks to uri.
+        """
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop and self.uri == uri:
+            return
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            self._task.cancel()
+        if self._loop is not loop:
+            # Queued messages belong to the old loop's jobs
+            self._queue.clear()
+            self._latest.clear()
+            self._wake = asyncio.Event()
+            self._idle = asyncio.Event()
+            self._idle.set()
+            self._loop = loop
+        self.uri = uri
+        self.connected = False
+        self._task = loop.create_task(self._run())
+
+    def publish(self, job_id, message):
+        """
+        Queue a message for relaying. Never blocks.
+        """
+        if self._task is None:
+            return
+
+        key = coalesce_key(job_id, message)
+        if key is not None and key in self._latest:
+            # Replace the superseded message where it waits in the queue
+            self._latest[key][1] = message
+            self.coalesced += 1
+            return
+
+        if len(self._queue) >= self.max_queue:
+            self._drop_one()
+
+        entry = [job_id, message, key]
+        self._queue.append(entry)
+        if key is not None:
+            self._latest[key] = entry
+        self._idle.clear()
+        self._wake.set()
+
+    def _drop_one(self):
+        # Progress is the cheapest to lose, the next tick brings a newer value anyway
+        for entry in self._queue:
+            if entry[2] is not None:
+                self._queue.remove(entry)
+                break
+        else:
+            entry = self._queue.popleft()
+        if entry[2] is not None:
+            self._latest.pop(entry[2], None)
+        self.dropped += 1
+
+    def _pop(self):
+        entry = self._queue.popleft()
+        if entry[2] is not None:
+            self._latest.pop(entry[2], None)
+        return entry
+
+    async def _run(self):
+        backoff = 0.5
+        while True:
+            try:
+                async with websockets.connect(self.uri) as relay_ws:
+                    print("📡 Connected to relay WS.")
+                    self.connected = True
+                    backoff = 0.5
+                    await self._send_all(relay_ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ WebSocket connection error: {e}")
+            self.connected = False
+            self.reconnects += 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RELAY_RECONNECT_MAX_S)
+
+    async def _send_all(self, relay_ws):
+        # Notice a dropped connection while idle, not only on the next send
+        closed = asyncio.ensure_future(relay_ws.wait_closed())
+        try:
+            while True:
+                if not self._queue:
+                    self._idle.set()
+                    self._wake.clear()
+                    woken = asyncio.ensure_future(self._wake.wait())
+                    await asyncio.wait({closed, woken}, return_when=asyncio.FIRST_COMPLETED)
+                    woken.cancel()
+                    if closed.done():
+                        raise ConnectionError("relay connection closed")
+                    continue
+
+                await self._send_one(relay_ws)
+        finally:
+            closed.cancel()
+
+    async def _send_one(self, relay_ws):
+
+        job_id, message, _ = entry = self._pop()
+        try:
+            await relay_ws.send(json.dumps({"job_id": job_id, "comfy": message}))
+        except Exception:
+            # Keep the message for the next connection
+            self._queue.appendleft(entry)
+            if entry[2] is not None:
+                self._latest.setdefault(entry[2], entry)
+            raise
+        self.sent += 1
+        if self.detailed_logging:
+            print("🧠 WS:", json.dumps(message, indent=2))
+            print(f"📤 Relayed to backend WS with job_id: {job_id}")
+
+    async def drain(self, timeout=None):
+        """
+        Wait until the queued messages are relayed.
+
+        Returns:
+            bool: False if the relay is disconnected or the timeout expired first
+        """
+        if self._task is None or not self.connected or self._loop is not asyncio.get_running_loop():
+            return not self._queue
+        try:
+            await asyncio.wait_for(self._idle.wait(), RELAY_DRAIN_TIMEOUT_S if timeout is None else timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self):
+        """
+        Stop the relay task and close its connection.
+        """
+        if self._task is not None and self._loop is asyncio.get_running_loop():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self.connected = False
+
+    def stats(self):
+        """
+        Returns the relay counters.
+        """
+        return {
+            "connected": self.connected,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "reconnects": self.reconnects,
+            "queued": len(self._queue),
+        }
@@ -0,0 +1,125 @@
+"""
+Event loop lag benchmark: blocking ComfyUI calls vs. the async ComfyClient.
+
+Runs the ComfyUI calls a job makes (index check, image upload, queue, history)
+against a slow fake ComfyUI while a probe coroutine measures how late the event
+loop wakes it up. The "before" run replays the previous urllib/requests based
+calls inside the coroutine; the "after" run uses comfy_client.
+
+    python -m tests.bench_loop_lag [--latency 0.2] [--jobs 5]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+import urllib.request
+
+import aiohttp
+import requests
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from comfy_client import ComfyClient
+from tests.fake_comfyui import FakeComfyUI, PNG_BYTES
+
+WORKFLOW = {"9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI"}}}
+IMAGE = {"name": "input.png", "image": base64.b64encode(PNG_BYTES).decode("utf-8")}
+
+
+async def measure_loop_lag(stop_event, interval=0.005):
+    """
+    Measure the scheduling delay of the event loop until stop_event is set.
+
+    Returns:
+        float: The largest delay in seconds between when the probe should have woken up and when it did
+    """
+    max_lag = 0.0
+    while not stop_event.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        max_lag = max(max_lag, time.perf_counter() - start - interval)
+    return max_lag
+
+
+async def blocking_job(host):
+    # What the handler used to do: synchronous I/O directly on the event loop
+    requests.get(f"http://{host}")
+    files = {
+        "image": (IMAGE["name"], base64.b64decode(IMAGE["image"]), "image/png"),
+        "overwrite": (None, "true"),
+    }
+    requests.post(f"http://{host}/upload/image", files=files)
+    data = json.dumps({"prompt": WORKFLOW}).encode("utf-8")
+    prompt_id = json.loads(urllib.request.urlopen(urllib.request.Request(f"http://{host}/prompt", data=data)).read())[
+        "prompt_id"
+    ]
+    with urllib.request.urlopen(f"http://{host}/history/{prompt_id}") as response:
+        json.loads(response.read())
+
+
+async def async_job(host, client):
+    await client.request("GET", f"http://{host}")
+
+    def form():
+        data = aiohttp.FormData()
+        data.add_field("image", base64.b64decode(IMAGE["image"]), filename=IMAGE["name"], content_type="image/png")
+        data.add_field("overwrite", "true")
+        return data
+
+    await client.request("POST", f"http://{host}/upload/image", data=form)
+    prompt_id = (await client.post_json(f"http://{host}/prompt", {"prompt": WORKFLOW}))["prompt_id"]
+    await client.get_json(f"http://{host}/history/{prompt_id}")
+
+
+async def run(job, jobs):
+    stop = asyncio.Event()
+    probe = asyncio.create_task(measure_loop_lag(stop))
+    await asyncio.sleep(0.02)
+    start = time.perf_counter()
+    for _ in range(jobs):
+        await job()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return await probe, elapsed
+
+
+async def compare(latency=0.2, jobs=5):
+    """
+    Run both variants against a fake ComfyUI with the given per-request latency.
+
+    Returns:
+        dict: Max loop lag and wall time in seconds for "before" and "after"
+    """
+    comfy = FakeComfyUI(latency=latency, execution_time=0).start()
+    client = ComfyClient()
+    try:
+        before_lag, before_time = await run(lambda: blocking_job(comfy.host), jobs)
+        after_lag, after_time = await run(lambda: async_job(comfy.host, client), jobs)
+    finally:
+        await client.close()
+        comfy.stop()
+    return {
+        "before": {"max_loop_lag_s": before_lag, "wall_s": before_time},
+        "after": {"max_loop_lag_s": after_lag, "wall_s": after_time},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds every fake ComfyUI response takes")
+    parser.add_argument("--jobs", type=int, default=5, help="number of jobs to run per variant")
+    args = parser.parse_args()
+
+    result = asyncio.run(compare(args.latency, args.jobs))
+    for name, values in result.items():
+        print(
+            f"{name:>6}: max loop lag {values['max_loop_lag_s'] * 1000:8.1f} ms, "
+            f"wall {values['wall_s'] * 1000:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+Helpers for tests that talk to FakeComfyUI directly, without rp_handler.
+"""
+
+import asyncio
+import json
+import urllib.request
+
+
+def fetch_history_from(host):
+    """
+    Returns an async history fetch for CompletionTracker and EventDispatcher.
+    """
+
+    def fetch(prompt_id):
+        with urllib.request.urlopen(f"http://{host}/history/{prompt_id}") as response:
+            return json.loads(response.read())
+
+    return lambda prompt_id: asyncio.to_thread(fetch, prompt_id)
+
+
+def queue_on(host, workflow, client_id, prompt_id=None):
+    """
+    Queues a workflow like rp_handler does and returns its prompt id.
+    """
+    payload = {"prompt": workflow, "client_id": client_id}
+    if prompt_id is not None:
+        payload["prompt_id"] = prompt_id
+    req = urllib.request.Request(f"http://{host}/prompt", data=json.dumps(payload).encode("utf-8"))
+    return json.loads(urllib.request.urlopen(req).read())["prompt_id"]
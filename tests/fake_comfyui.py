@@ -0,0 +1,396 @@
+"""
+A small stand-in for the ComfyUI HTTP/websocket API used by the tests.
+
+The server runs on its own event loop in a background thread, so the code under
+test can talk to it with blocking or async clients alike.
+"""
+
+import asyncio
+import os
+import struct
+import threading
+import time
+import uuid
+
+from aiohttp import web, WSMsgType
+
+# 1x1 transparent PNG
+PNG_BYTES = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+
+class FakeComfyUI:
+    """
+    Fake ComfyUI server.
+
+    Args:
+        output_dir (str, optional): Where "generated" images are written
+        execution_time (float): Seconds a prompt takes to "run"
+        progress_steps (int): Number of progress events sent while running
+        fail_with (str, optional): When set, every prompt fails with this exception message
+        latency (float): Seconds every HTTP response is delayed by
+        input_dir (str, optional): Where uploaded images are written
+        port (int): Port to listen on, 0 picks a free one (pass the port of a stopped fake to "restart" it)
+        previews (bool): Send a binary PNG preview frame after every progress event
+        node_times (dict, optional): Seconds each node of a class_type runs before the next one starts,
+            e.g. {"CheckpointLoaderSimple": 0.5}; the sampling phase (execution_time) follows the nodes.
+            A node's "_meta": {"fake_seconds": ...} overrides it for that node
+        output_size (int, optional): Size of every output file in bytes (a PNG padded with zeros)
+        object_info (dict, optional): Served on /object_info (404 without it)
+    """
+
+    def __init__(
+        self,
+        output_dir=None,
+        execution_time=0.2,
+        progress_steps=3,
+        fail_with=None,
+        latency=0.0,
+        input_dir=None,
+        port=0,
+        previews=False,
+        node_times=None,
+        output_size=None,
+        object_info=None,
+    ):
+        self.output_dir = output_dir
+        self.input_dir = input_dir
+        self.execution_time = execution_time
+        self.progress_steps = progress_steps
+        self.fail_with = fail_with
+        self.latency = latency
+        self.previews = previews
+        self.node_times = node_times or {}
+        self.output_size = output_size
+        self.object_info = object_info
+        self.object_info_requests = 0
+
+        self.prompts = {}
+        self.history = {}
+        self.completed_at = {}
+        self.history_requests = 0
+        self.system_stats_requests = 0
+        self.interrupts = 0
+        # Prompt ids deleted from the queue with POST /queue
+        self.deleted = []
+        self.relayed = []
+        self.relay_sockets = set()
+        self.relay_connections = 0
+        self.uploads = {}
+        self.sockets = {}
+
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._counter = 0
+        self._executing = None
+        self._running = None
+        self._interrupted = None
+        self.queue_remaining = 0
+        self.max_queue_remaining = 0
+        self._output_cache = {}
+        self.port = port
+
+    @property
+    def host(self):
+        return f"127.0.0.1:{self.port}"
+
+    # --- lifecycle -----------------------------------------------------------------
+
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start_site())
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        # Open websockets would keep the shutdown waiting
+        self.drop_websockets()
+        future = asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop)
+        future.result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    async def _start_site(self):
+        # Like ComfyUI, prompts run one after the other
+        self._executing = asyncio.Lock()
+        self._interrupted = asyncio.Event()
+        app = web.Application(middlewares=[self._delay])
+        app.router.add_get("/", self._index)
+        app.router.add_get("/system_stats", self._system_stats)
+        app.router.add_get("/object_info", self._object_info)
+        app.router.add_post("/prompt", self._prompt)
+        app.router.add_get("/history/{prompt_id}", self._history)
+        app.router.add_post("/upload/image", self._upload_image)
+        app.router.add_post("/interrupt", self._interrupt)
+        app.router.add_post("/queue", self._queue)
+        app.router.add_get("/ws", self._ws)
+        app.router.add_get("/relay", self._relay)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def drop_websockets(self):
+        """
+        Close every open websocket (/ws and /relay), as if the connections had died.
+        """
+
+        async def close_all():
+            for ws in list(self.sockets.values()) + list(self.relay_sockets):
+                await ws.close()
+
+        asyncio.run_coroutine_threadsafe(close_all(), self._loop).result(timeout=5)
+
+    # --- handlers ------------------------------------------------------------------
+
+    @web.middleware
+    async def _delay(self, request, handler):
+        if self.latency and request.path not in ("/ws", "/relay"):
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    async def _index(self, request):
+        return web.Response(text="ComfyUI")
+
+    async def _system_stats(self, request):
+        self.system_stats_requests += 1
+        return web.json_response(
+            {
+                "system": {"os": "posix", "comfyui_version": "fake", "ram_total": 64 * 2**30, "ram_free": 48 * 2**30},
+                "devices": [{"name": "cuda:0 Fake GPU", "type": "cuda", "index": 0, "vram_total": 24 * 2**30, "vram_free": 20 * 2**30}],
+            }
+        )
+
+    async def _object_info(self, request):
+        self.object_info_requests += 1
+        if self.object_info is None:
+            return web.Response(status=404)
+        return web.json_response(self.object_info)
+
+    async def _prompt(self, request):
+        body = await request.json()
+        prompt_id = body.get("prompt_id") or str(uuid.uuid4())
+        self.prompts[prompt_id] = body
+        asyncio.get_running_loop().create_task(
+            self._run_queued(prompt_id, body["prompt"], body.get("client_id"))
+        )
+        return web.json_response({"prompt_id": prompt_id, "number": len(self.prompts), "node_errors": {}})
+
+    async def _history(self, request):
+        self.history_requests += 1
+        prompt_id = request.match_info["prompt_id"]
+        if prompt_id in self.history:
+            return web.json_response({prompt_id: self.history[prompt_id]})
+        return web.json_response({})
+
+    async def _upload_image(self, request):
+        form = await request.post()
+        image = form["image"]
+        self.uploads[image.filename] = image.file.read()
+        if self.input_dir:
+            with open(os.path.join(self.input_dir, image.filename), "wb") as f:
+                f.write(self.uploads[image.filename])
+        return web.json_response({"name": image.filename, "subfolder": "", "type": "input"})
+
+    async def _interrupt(self, request):
+        # Like ComfyUI, only the prompt that is running is interrupted
+        self.interrupts += 1
+        if self._running is not None:
+            self._interrupted.set()
+        return web.Response()
+
+    async def _queue(self, request):
+        # Like ComfyUI, deleting only removes prompts that have not started yet
+        body = await request.json()
+        self.deleted.extend(body.get("delete", []))
+        return web.Response()
+
+    async def _ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        sid = request.query.get("clientId") or uuid.uuid4().hex
+        self.sockets[sid] = ws
+        await ws.send_json({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": 0}}, "sid": sid}})
+        async for _ in ws:
+            pass
+        if self.sockets.get(sid) is ws:
+            del self.sockets[sid]
+        return ws
+
+    async def _relay(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.relay_sockets.add(ws)
+        self.relay_connections += 1
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT:
+                    self.relayed.append(msg.json())
+        finally:
+            self.relay_sockets.discard(ws)
+        return ws
+
+    # --- execution -----------------------------------------------------------------
+
+    async def _send(self, client_id, msg_type, data):
+        # Like ComfyUI: messages go to the owning client, or to everybody without one
+        targets = [self.sockets[client_id]] if client_id in self.sockets else []
+        if client_id is None:
+            targets = list(self.sockets.values())
+        for ws in targets:
+            try:
+                await ws.send_json({"type": msg_type, "data": data})
+            except Exception:
+                pass
+
+    async def _send_preview(self, client_id):
+        # PREVIEW_IMAGE event (1) with a PNG (2), as sent with --preview-method
+        ws = self.sockets.get(client_id)
+        if ws is not None:
+            try:
+                await ws.send_bytes(struct.pack(">II", 1, 2) + PNG_BYTES)
+            except Exception:
+                pass
+
+    async def _send_status(self):
+        # Broadcast, like ComfyUI's queue updates
+        await self._send(None, "status", {"status": {"exec_info": {"queue_remaining": self.queue_remaining}}})
+
+    async def _run_queued(self, prompt_id, workflow, client_id):
+        self.queue_remaining += 1
+        self.max_queue_remaining = max(self.max_queue_remaining, self.queue_remaining)
+        await self._send_status()
+        try:
+            async with self._executing:
+                if prompt_id not in self.deleted:
+                    await self._execute(prompt_id, workflow, client_id)
+        finally:
+            self.queue_remaining -= 1
+            await self._send_status()
+
+    async def _sleep(self, seconds):
+        # Returns True when the prompt was interrupted meanwhile
+        if seconds <= 0:
+            await asyncio.sleep(0)
+            return self._interrupted.is_set()
+        try:
+            await asyncio.wait_for(self._interrupted.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        return self._interrupted.is_set()
+
+    async def _execute(self, prompt_id, workflow, client_id):
+        self._running = prompt_id
+        self._interrupted.clear()
+        try:
+            await self._run_nodes(prompt_id, workflow, client_id)
+        finally:
+            self._running = None
+
+    async def _run_nodes(self, prompt_id, workflow, client_id):
+        await self._send(client_id, "execution_start", {"prompt_id": prompt_id})
+        node_ids = list(workflow)
+        interrupted = False
+        for node_id in node_ids:
+            await self._send(client_id, "executing", {"node": node_id, "prompt_id": prompt_id})
+            node = workflow[node_id] if isinstance(workflow[node_id], dict) else {}
+            seconds = (node.get("_meta") or {}).get("fake_seconds", self.node_times.get(node.get("class_type"), 0))
+            if await self._sleep(seconds):
+                interrupted = True
+                break
+
+        steps = max(self.progress_steps, 1)
+        for step in range(steps if not interrupted else 0):
+            if await self._sleep(self.execution_time / steps):
+                interrupted = True
+                break
+            await self._send(
+                client_id,
+                "progress",
+                {"value": step + 1, "max": steps, "prompt_id": prompt_id, "node": node_ids[-1] if node_ids else None},
+            )
+            if self.previews:
+                await self._send_preview(client_id)
+
+        if interrupted:
+            await self._send(client_id, "execution_interrupted", {"prompt_id": prompt_id, "node_id": node_ids[-1] if node_ids else None})
+            self.history[prompt_id] = {
+                "outputs": {},
+                "status": {"status_str": "error", "completed": False, "messages": []},
+            }
+        elif self.fail_with:
+            await self._send(
+                client_id,
+                "execution_error",
+                {
+                    "prompt_id": prompt_id,
+                    "node_id": node_ids[-1] if node_ids else None,
+                    "node_type": "KSampler",
+                    "exception_message": self.fail_with,
+                },
+            )
+            self.history[prompt_id] = {
+                "outputs": {},
+                "status": {"status_str": "error", "completed": False, "messages": []},
+            }
+        else:
+            outputs = self._write_outputs(workflow)
+            await self._send(client_id, "execution_success", {"prompt_id": prompt_id})
+            self.history[prompt_id] = {
+                "outputs": outputs,
+                "status": {"status_str": "success", "completed": True, "messages": []},
+            }
+
+        self.completed_at[prompt_id] = time.monotonic()
+        await self._send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+
+    def _write_outputs(self, workflow):
+        save_nodes = [node_id for node_id, node in workflow.items() if node.get("class_type") == "SaveImage"]
+        # Like ComfyUI, every save node writes one image per latent in the batch
+        batch_size = max(
+            [node["inputs"].get("batch_size", 1) for node in workflow.values() if node.get("class_type") == "EmptyLatentImage"]
+            or [1]
+        )
+        outputs = {}
+        for node_id in save_nodes or ["9"]:
+            # Like ComfyUI, an unchanged save node is not run again, its earlier files are reported
+            cache_key = (node_id, repr(sorted(workflow.get(node_id, {}).get("inputs", {}).items())), batch_size)
+            if cache_key in self._output_cache:
+                outputs[node_id] = {"images": self._output_cache[cache_key]}
+                continue
+            images = []
+            for _ in range(batch_size):
+                self._counter += 1
+                prefix = workflow.get(node_id, {}).get("inputs", {}).get("filename_prefix", "ComfyUI")
+                # Like ComfyUI, a prefix like "images/rome" saves into a subfolder
+                subfolder, name = os.path.split(prefix)
+                filename = f"{name}_{self._counter:05}_.png"
+                if self.output_dir:
+                    os.makedirs(os.path.join(self.output_dir, subfolder), exist_ok=True)
+                    with open(os.path.join(self.output_dir, subfolder, filename), "wb") as f:
+                        f.write(PNG_BYTES)
+                        if self.output_size and self.output_size > len(PNG_BYTES):
+                            f.write(bytes(self.output_size - len(PNG_BYTES)))
+                images.append({"filename": filename, "subfolder": subfolder, "type": "output"})
+            self._output_cache[cache_key] = images
+            outputs[node_id] = {"images": images}
+        return outputs
@@ -0,0 +1,143 @@
+"""
+A small HuggingFace stand-in for the fetch_model tests.
+
+Resolve URLs (/<repo>/resolve/<revision>/<file>) answer with a redirect to a CDN
+URL on another host name, with the SHA256 of the file in X-Linked-Etag like
+HuggingFace does for LFS files. The CDN serves ranges and If-Range, can delay
+every request and can fail chosen ranges a number of times. It runs in a
+background thread like fake_s3.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+
+class FakeHuggingFace:
+    """
+    Fake HuggingFace server.
+
+    Args:
+        token (str, optional): Access token resolve URLs require, None to allow anonymous downloads
+        latency (float): Seconds every CDN request is delayed by
+        fail_ranges (dict, optional): Maps a Range header to the number of times it fails with HTTP 500
+    """
+
+    def __init__(self, token=None, latency=0.0, fail_ranges=None):
+        self.token = token
+        self.latency = latency
+        self.fail_ranges = dict(fail_ranges or {})
+        # Path in the repository -> content
+        self.files = {}
+        # Path in the repository -> X-Linked-Etag to report instead of the SHA256 of the content
+        self.linked_etags = {}
+        # (path, Range header or None, Authorization header or None) of every CDN request
+        self.gets = []
+        self.resolves = []
+        self.max_parallel_gets = 0
+        self._parallel_gets = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def url(self, name, repo="org/model"):
+        return f"http://127.0.0.1:{self.port}/{repo}/resolve/main/{name}"
+
+    def start(self):
+        fake = self
+
+        class Handler(_Handler):
+            server_fake = fake
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = unquote(urlparse(self.path).path)
+        resolve = re.match(r"^/[^/]+/[^/]+/resolve/[^/]+/(.+)$", path)
+        if resolve:
+            return self._resolve(resolve.group(1))
+        if path.startswith("/cdn/"):
+            return self._cdn(path[len("/cdn/"):])
+        self._reply(404, b"Entry not found")
+
+    def _resolve(self, name):
+        fake = self.server_fake
+        fake.resolves.append((name, self.headers.get("Authorization")))
+        if fake.token and self.headers.get("Authorization") != f"Bearer {fake.token}":
+            return self._reply(401, b"Invalid credentials")
+        body = fake.files.get(name)
+        if body is None:
+            return self._reply(404, b"Entry not found")
+        sha256 = fake.linked_etags.get(name, hashlib.sha256(body).hexdigest())
+        # Another host name for the same server, like HuggingFace's CDN
+        location = f"http://localhost:{fake.port}/cdn/{name}"
+        self._reply(302, headers={"Location": location, "X-Linked-Etag": f'"{sha256}"', "X-Linked-Size": str(len(body))})
+
+    def _cdn(self, name):
+        fake = self.server_fake
+        range_header = self.headers.get("Range")
+        with fake._lock:
+            fake.gets.append((name, range_header, self.headers.get("Authorization")))
+            fake._parallel_gets += 1
+            fake.max_parallel_gets = max(fake.max_parallel_gets, fake._parallel_gets)
+            failing = fake.fail_ranges.get(range_header, 0) > 0
+            if failing:
+                fake.fail_ranges[range_header] -= 1
+        try:
+            if fake.latency:
+                time.sleep(fake.latency)
+            if failing:
+                return self._reply(500, b"Internal Error")
+            body = fake.files.get(name)
+            if body is None:
+                return self._reply(404, b"Not Found")
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            match = re.match(r"bytes=(\d+)-(\d+)", range_header or "")
+            if match and self.headers.get("If-Range") in (None, etag):
+                start, end = int(match.group(1)), min(int(match.group(2)), len(body) - 1)
+                if start >= len(body):
+                    return self._reply(416, headers={"Content-Range": f"bytes */{len(body)}"})
+                headers = {"ETag": etag, "Accept-Ranges": "bytes", "Content-Range": f"bytes {start}-{end}/{len(body)}"}
+                return self._reply(206, body[start:end + 1], headers)
+            return self._reply(200, body, {"ETag": etag, "Accept-Ranges": "bytes"})
+        finally:
+            with fake._lock:
+                fake._parallel_gets -= 1
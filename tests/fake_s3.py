@@ -0,0 +1,238 @@
+"""
+A small S3 stand-in for the upload tests.
+
+It understands the few path-style calls the worker makes (PutObject, the multipart
+upload calls, GetObject with ranges and conditions, and ListObjectsV2), can delay
+every request and can fail chosen parts or downloads a number of times. It runs in
+a background thread like fake_comfyui.
+"""
+
+import hashlib
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeS3:
+    """
+    Fake S3 server.
+
+    Args:
+        latency (float): Seconds every request is delayed by
+        fail_parts (dict, optional): Maps a part number to the number of times it fails with HTTP 500
+        fail_gets (dict, optional): Maps an object key to the number of times a GET of it fails with HTTP 500
+    """
+
+    def __init__(self, latency=0.0, fail_parts=None, fail_gets=None):
+        self.latency = latency
+        self.fail_parts = dict(fail_parts or {})
+        self.fail_gets = dict(fail_gets or {})
+        # (key, Range header or None) of every GetObject request
+        self.gets = []
+        self.max_parallel_gets = 0
+        self._parallel_gets = 0
+        self.objects = {}
+        self.content_types = {}
+        self.uploads = {}
+        self.aborted = []
+        self.part_attempts = {}
+        self.max_parallel_parts = 0
+        self._parallel_parts = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def endpoint_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        fake = self
+
+        class Handler(_Handler):
+            server_fake = fake
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def _parse(self):
+        url = urlparse(self.path)
+        # Bucket requests (listing) have no key
+        _, bucket, key = (url.path.split("/", 2) + [""])[:3]
+        return bucket, key, {name: values[0] for name, values in parse_qs(url.query, keep_blank_values=True).items()}
+
+    def _body(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if "aws-chunked" in self.headers.get("Content-Encoding", ""):
+            body = _decode_aws_chunked(body)
+        return body
+
+    def _reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, code):
+        body = f"<?xml version='1.0' encoding='UTF-8'?><Error><Code>{code}</Code><Message>{code}</Message></Error>"
+        self._reply(status, body.encode("utf-8"), {"Content-Type": "application/xml"})
+
+    def do_PUT(self):
+        fake = self.server_fake
+        bucket, key, query = self._parse()
+        body = self._body()
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        if "uploadId" not in query:
+            fake.objects[(bucket, key)] = body
+            fake.content_types[(bucket, key)] = self.headers.get("Content-Type")
+            return self._reply(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+        number = int(query["partNumber"])
+        with fake._lock:
+            fake.part_attempts[number] = fake.part_attempts.get(number, 0) + 1
+            fake._parallel_parts += 1
+            fake.max_parallel_parts = max(fake.max_parallel_parts, fake._parallel_parts)
+            failing = fake.fail_parts.get(number, 0) > 0
+            if failing:
+                fake.fail_parts[number] -= 1
+        try:
+            if fake.latency:
+                time.sleep(fake.latency)
+            if failing:
+                return self._error(500, "InternalError")
+            upload = fake.uploads.get(query["uploadId"])
+            if upload is None:
+                return self._error(404, "NoSuchUpload")
+            upload["parts"][number] = body
+            return self._reply(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+        finally:
+            with fake._lock:
+                fake._parallel_parts -= 1
+
+    def do_POST(self):
+        fake = self.server_fake
+        bucket, key, query = self._parse()
+        body = self._body()
+
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            fake.uploads[upload_id] = {"key": (bucket, key), "parts": {}, "content_type": self.headers.get("Content-Type")}
+            xml = (
+                "<?xml version='1.0' encoding='UTF-8'?><InitiateMultipartUploadResult>"
+                f"<Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId>"
+                "</InitiateMultipartUploadResult>"
+            )
+            return self._reply(200, xml.encode("utf-8"), {"Content-Type": "application/xml"})
+
+        upload = fake.uploads.pop(query.get("uploadId"), None)
+        if upload is None:
+            return self._error(404, "NoSuchUpload")
+        numbers = [int(n) for n in re.findall(rb"<PartNumber>(\d+)</PartNumber>", body)]
+        fake.objects[upload["key"]] = b"".join(upload["parts"][n] for n in numbers)
+        fake.content_types[upload["key"]] = upload["content_type"]
+        xml = (
+            "<?xml version='1.0' encoding='UTF-8'?><CompleteMultipartUploadResult>"
+            f"<Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>\"done\"</ETag>"
+            "</CompleteMultipartUploadResult>"
+        )
+        return self._reply(200, xml.encode("utf-8"), {"Content-Type": "application/xml"})
+
+    def do_DELETE(self):
+        fake = self.server_fake
+        _, _, query = self._parse()
+        if fake.uploads.pop(query.get("uploadId"), None) is not None:
+            fake.aborted.append(query["uploadId"])
+        return self._reply(204)
+
+    def do_GET(self):
+        fake = self.server_fake
+        bucket, key, query = self._parse()
+        if query.get("list-type") == "2":
+            return self._list(bucket, query.get("prefix", ""))
+
+        with fake._lock:
+            fake.gets.append((key, self.headers.get("Range")))
+            fake._parallel_gets += 1
+            fake.max_parallel_gets = max(fake.max_parallel_gets, fake._parallel_gets)
+            failing = fake.fail_gets.get(key, 0) > 0
+            if failing:
+                fake.fail_gets[key] -= 1
+        try:
+            if fake.latency:
+                time.sleep(fake.latency)
+            if failing:
+                return self._error(500, "InternalError")
+            body = fake.objects.get((bucket, key))
+            if body is None:
+                return self._error(404, "NoSuchKey")
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                return self._reply(304, headers={"ETag": etag})
+            if self.headers.get("If-Match") not in (None, etag):
+                return self._error(412, "PreconditionFailed")
+            match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range") or "")
+            if match:
+                start, end = int(match.group(1)), min(int(match.group(2)), len(body) - 1)
+                headers = {"ETag": etag, "Content-Range": f"bytes {start}-{end}/{len(body)}"}
+                return self._reply(206, body[start:end + 1], headers)
+            return self._reply(200, body, {"ETag": etag})
+        finally:
+            with fake._lock:
+                fake._parallel_gets -= 1
+
+    def _list(self, bucket, prefix):
+        contents = "".join(
+            f"<Contents><Key>{key}</Key><LastModified>2025-01-01T00:00:00.000Z</LastModified>"
+            f"<ETag>&quot;{hashlib.md5(body).hexdigest()}&quot;</ETag><Size>{len(body)}</Size>"
+            "<StorageClass>STANDARD</StorageClass></Contents>"
+            for (name, key), body in sorted(self.server_fake.objects.items())
+            if name == bucket and key.startswith(prefix)
+        )
+        xml = (
+            "<?xml version='1.0' encoding='UTF-8'?>"
+            "<ListBucketResult xmlns='http://s3.amazonaws.com/doc/2006-03-01/'>"
+            f"<Name>{bucket}</Name><Prefix>{prefix}</Prefix><MaxKeys>1000</MaxKeys>"
+            f"<IsTruncated>false</IsTruncated>{contents}</ListBucketResult>"
+        )
+        return self._reply(200, xml.encode("utf-8"), {"Content-Type": "application/xml"})
+
+
+def _decode_aws_chunked(body):
+    data = b""
+    while body:
+        header, _, body = body.partition(b"\r\n")
+        size = int(header.split(b";")[0], 16)
+        if size == 0:
+            break
+        data += body[:size]
+        body = body[size + 2:]
+    return data
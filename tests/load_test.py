@@ -0,0 +1,223 @@
+"""
+Handler load test: synthetic jobs through rp_handler.handler() against a fake ComfyUI.
+
+The fake ComfyUI runs in a child process, so it neither shares the handler's
+event loop and GIL nor counts towards its memory. Every job gets its own seed,
+so neither the result cache nor the deduplication of identical jobs kicks in.
+
+Reported per run:
+- throughput in jobs per second
+- latency: wall time of handler() per job
+- overhead: latency minus the time the job waited for a slot and spent in
+  ComfyUI's queue and execution (from the job's timings)
+- peak RSS of the handler process
+
+    python -m tests.load_test [--jobs 1000] [--concurrency 1] [--execution-time 0] [--images 0] [--json]
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from tests.fake_comfyui import FakeComfyUI
+from warmup import blank_png
+
+
+def serve_fake(conn, options):
+    """
+    Run a FakeComfyUI in this (child) process until the parent sends anything.
+    """
+    comfy = FakeComfyUI(**options).start()
+    conn.send(comfy.port)
+    conn.recv()
+    stats = {"prompts": len(comfy.prompts), "uploads": len(comfy.uploads), "max_queue_remaining": comfy.max_queue_remaining}
+    comfy.stop()
+    conn.send(stats)
+
+
+@contextlib.contextmanager
+def fake_comfyui_process(options):
+    """
+    Run a FakeComfyUI with the options in a child process.
+
+    Yields:
+        tuple: (its host, a dict that receives its request counts when the block is left)
+    """
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.get_context("spawn").Process(target=serve_fake, args=(child, options), daemon=True)
+    process.start()
+    stats = {}
+    try:
+        yield f"127.0.0.1:{parent.recv()}", stats
+    finally:
+        parent.send("stop")
+        stats.update(parent.recv() if parent.poll(10) else {})
+        process.join(timeout=10)
+
+
+def prepare_environment():
+    """
+    Point the handler at a temporary output directory, without relay and detailed logging, and import it.
+    """
+    os.environ.setdefault("COMFY_OUTPUT_PATH", tempfile.mkdtemp(prefix="load-test-"))
+    os.environ.setdefault("BACKEND_WS_URL", "")
+    os.environ.setdefault("DETAILED_COMFY_LOGGING", "false")
+    # Imported here, so it reads the settings above and counts towards the memory before the jobs
+    from src import rp_handler  # noqa: F401
+
+
+def synthetic_job(index, images):
+    """
+    Returns a job with a unique seed that loads every one of the images.
+
+    The filename prefix is unique as well: the fake ComfyUI, unlike ComfyUI, would
+    otherwise report the files of an earlier job for an unchanged save node.
+    """
+    workflow = {
+        "3": {"class_type": "KSampler", "inputs": {"seed": index, "steps": 20}},
+        "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": f"load_{index}"}},
+    }
+    for number, image in enumerate(images):
+        workflow[str(100 + number)] = {"class_type": "LoadImage", "inputs": {"image": image["name"]}}
+    job_input = {"workflow": workflow}
+    if images:
+        job_input["images"] = images
+    return {"id": f"load-{index}", "input": job_input}
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(len(ordered) * p + 0.5) - 1))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux, in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def run_jobs(host, jobs, concurrency, verbose=False):
+    """
+    Run the jobs through the handler, at most concurrency at a time.
+
+    Args:
+        host (str): The fake ComfyUI
+        jobs (list): (delay in seconds before the job is submitted, job) tuples
+        concurrency (int): Jobs running at the same time
+
+    Returns:
+        list: (latency in seconds, result) per job
+    """
+    from src import rp_handler
+
+    running = asyncio.Semaphore(concurrency)
+
+    async def one(delay, job):
+        if delay:
+            await asyncio.sleep(delay)
+        async with running:
+            started = time.perf_counter()
+            result = await rp_handler.handler(job)
+            return time.perf_counter() - started, result
+
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        # Restored afterwards, the handler's globals outlive the load test in the test suite
+        with output, patch.object(rp_handler, "COMFY_HOST", host), patch.object(rp_handler.job_concurrency, "max_jobs", concurrency):
+            return await asyncio.gather(*(one(delay, job) for delay, job in jobs))
+    finally:
+        await rp_handler.event_dispatcher.close()
+        await rp_handler.comfy_client.close()
+
+
+def report(samples, elapsed, fake_stats, rss_before_mb):
+    latencies = [latency for latency, _ in samples]
+    overheads = []
+    failed = 0
+    for latency, result in samples:
+        if result.get("status") != "success":
+            failed += 1
+        waited = sum(result.get("timings", {}).get(stage, 0) for stage in ("slot_wait", "queue_wait", "execution")) / 1000
+        overheads.append(max(0.0, latency - waited))
+
+    def ms(values, p):
+        return round(percentile(values, p) * 1000, 2)
+
+    return {
+        "jobs": len(samples),
+        "failed": failed,
+        "wall_s": round(elapsed, 3),
+        "throughput_jobs_per_s": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {"p50": ms(latencies, 0.5), "p99": ms(latencies, 0.99), "max": ms(latencies, 1)},
+        "overhead_ms": {"p50": ms(overheads, 0.5), "p99": ms(overheads, 0.99), "max": ms(overheads, 1)},
+        "rss_mb": {"before": rss_before_mb, "peak": peak_rss_mb()},
+        "comfyui": fake_stats,
+    }
+
+
+async def load_test(jobs=1000, concurrency=1, execution_time=0.0, latency=0.0, images=0, output_size=None, verbose=False):
+    """
+    Start a fake ComfyUI in a child process and run the jobs against it.
+
+    Returns:
+        dict: The report, see the module docstring
+    """
+    prepare_environment()
+    options = {
+        "output_dir": os.environ["COMFY_OUTPUT_PATH"],
+        "execution_time": execution_time,
+        "latency": latency,
+        "output_size": output_size,
+    }
+    png = base64.b64encode(blank_png(512, 512)).decode("utf-8")
+    job_images = [{"name": f"input_{number}.png", "image": png} for number in range(images)]
+
+    with fake_comfyui_process(options) as (host, fake_stats):
+        rss_before_mb = peak_rss_mb()
+        started = time.perf_counter()
+        samples = await run_jobs(host, [(0, synthetic_job(index, job_images)) for index in range(jobs)], concurrency, verbose)
+        elapsed = time.perf_counter() - started
+    return report(samples, elapsed, fake_stats, rss_before_mb)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=1000, help="number of jobs to run")
+    parser.add_argument("--concurrency", type=int, default=1, help="jobs running at the same time (MAX_CONCURRENT_JOBS)")
+    parser.add_argument("--execution-time", type=float, default=0.0, help="seconds the fake ComfyUI runs every prompt")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every fake ComfyUI response takes")
+    parser.add_argument("--images", type=int, default=0, help="input images (512x512 PNG) per job")
+    parser.add_argument("--output-size", type=int, default=None, help="size of every output file in bytes")
+    parser.add_argument("--verbose", action="store_true", help="show the handler's log")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(
+        load_test(args.jobs, args.concurrency, args.execution_time, args.latency, args.images, args.output_size, args.verbose)
+    )
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"jobs        {result['jobs']} ({result['failed']} failed) in {result['wall_s']} s")
+    print(f"throughput  {result['throughput_jobs_per_s']} jobs/s")
+    for name in ("latency_ms", "overhead_ms"):
+        values = result[name]
+        print(f"{name[:-3]:<11} p50 {values['p50']:8.2f} ms   p99 {values['p99']:8.2f} ms   max {values['max']:8.2f} ms")
+    print(f"peak RSS    {result['rss_mb']['peak']} MB (before the jobs: {result['rss_mb']['before']} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Replay recorded job traces through rp_handler.handler() against a fake ComfyUI.
+
+Traces are captured by a worker with TRACE_CAPTURE_PATH set. Every trace becomes
+a job with the recorded workflow shape and random input images of the recorded
+sizes; the fake ComfyUI runs each node for as long as it ran when the trace was
+recorded. Jobs are submitted with the recorded gaps between them.
+
+--speed divides both the gaps and the node run times, e.g. 10 replays an hour of
+traffic in six minutes; --speed 0 submits every job at once and skips the node
+run times, to measure the handler alone. The report is the one of
+tests.load_test, plus the latency recorded in production for comparison.
+
+    python -m tests.replay_traces traces.jsonl [--speed 1] [--concurrency 1] [--limit N] [--json]
+"""
+
+import argparse
+import asyncio
+import base64
+import copy
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from tests.load_test import fake_comfyui_process, peak_rss_mb, percentile, prepare_environment, report, run_jobs
+from trace_capture import node_durations, read_traces
+
+
+def replay_job(trace, index, speed):
+    """
+    Returns the job that replays a trace.
+    """
+    workflow = copy.deepcopy(trace["workflow"])
+    # Identical workflows share the prefix, so the fake reuses outputs exactly when ComfyUI would
+    prefix = "replay_" + hashlib.sha1(json.dumps(workflow, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+    for node in workflow.values():
+        if node.get("class_type") == "SaveImage":
+            node.setdefault("inputs", {})["filename_prefix"] = prefix
+
+    if speed:
+        for node_id, ms in node_durations(trace.get("events") or []).items():
+            if node_id in workflow:
+                workflow[node_id]["_meta"] = {"fake_seconds": ms / 1000 / speed}
+
+    job_input = {"workflow": workflow}
+    if trace.get("images"):
+        job_input["images"] = [
+            {"name": image["name"], "image": base64.b64encode(os.urandom(image.get("bytes") or 0)).decode("utf-8")}
+            for image in trace["images"]
+        ]
+    return {"id": f"replay-{index}-{trace.get('job_id')}", "input": job_input}
+
+
+def schedule(traces, speed):
+    """
+    Returns (delay in seconds, job) for every trace, keeping the recorded gaps divided by speed.
+    """
+    first = traces[0].get("recorded_at", 0) if traces else 0
+    return [
+        ((trace.get("recorded_at", first) - first) / speed if speed else 0, replay_job(trace, index, speed))
+        for index, trace in enumerate(traces)
+    ]
+
+
+async def replay(path, speed=1.0, concurrency=1, limit=None, verbose=False):
+    """
+    Replay the traces of a JSONL file.
+
+    Returns:
+        dict: The report of tests.load_test with the recorded latency added
+    """
+    traces = read_traces(path)[:limit] if limit else read_traces(path)
+    if not traces:
+        raise ValueError(f"No traces in {path}")
+
+    prepare_environment()
+    options = {"output_dir": os.environ["COMFY_OUTPUT_PATH"], "execution_time": 0}
+    jobs = schedule(traces, speed)
+
+    with fake_comfyui_process(options) as (host, fake_stats):
+        rss_before_mb = peak_rss_mb()
+        started = time.perf_counter()
+        samples = await run_jobs(host, jobs, concurrency, verbose)
+        elapsed = time.perf_counter() - started
+
+    result = report(samples, elapsed, fake_stats, rss_before_mb)
+    recorded = [trace["timings"]["total"] / 1000 for trace in traces if "total" in (trace.get("timings") or {})]
+    if recorded:
+        result["recorded_latency_ms"] = {
+            "p50": round(percentile(recorded, 0.5) * 1000, 2),
+            "p99": round(percentile(recorded, 0.99) * 1000, 2),
+            "max": round(percentile(recorded, 1) * 1000, 2),
+        }
+    result["speed"] = speed
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="JSONL file written by a worker with TRACE_CAPTURE_PATH")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster, 0: all at once")
+    parser.add_argument("--concurrency", type=int, default=1, help="jobs running at the same time (MAX_CONCURRENT_JOBS)")
+    parser.add_argument("--limit", type=int, default=None, help="replay only the first N traces")
+    parser.add_argument("--verbose", action="store_true", help="show the handler's log")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(replay(args.path, args.speed, args.concurrency, args.limit, args.verbose))
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"jobs        {result['jobs']} ({result['failed']} failed) in {result['wall_s']} s at speed {result['speed']}")
+    print(f"throughput  {result['throughput_jobs_per_s']} jobs/s")
+    for name in ("latency_ms", "overhead_ms", "recorded_latency_ms"):
+        if name in result:
+            values = result[name]
+            label = name[:-3].replace("_", " ")
+            print(f"{label:<16} p50 {values['p50']:8.2f} ms   p99 {values['p99']:8.2f} ms   max {values['max']:8.2f} ms")
+    print(f"peak RSS    {result['rss_mb']['peak']} MB (before the jobs: {result['rss_mb']['before']} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import asyncio
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import comfy_client
+from tests.fake_comfyui import FakeComfyUI
+from tests import bench_loop_lag
+
+from aiohttp import web
+
+
+class FlakyServer:
+    """
+    Answers 503 a given number of times before answering 200.
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+        self.peers = set()
+
+    async def handle(self, request):
+        self.calls += 1
+        self.peers.add(request.transport.get_extra_info("peername"))
+        if self.calls <= self.failures:
+            return web.Response(status=503, text="busy")
+        return web.json_response({"ok": True})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_route("*", "/", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+class TestComfyClient(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = comfy_client.ComfyClient(retries=2)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    @patch.object(comfy_client, "COMFY_HTTP_RETRY_BACKOFF_MS", 1)
+    async def test_get_is_retried_on_503(self):
+        async with FlakyServer(failures=2) as server:
+            result = await self.client.get_json(server.url)
+
+        self.assertEqual(result, {"ok": True})
+        self.assertEqual(server.calls, 3)
+
+    @patch.object(comfy_client, "COMFY_HTTP_RETRY_BACKOFF_MS", 1)
+    async def test_retries_are_bounded(self):
+        async with FlakyServer(failures=10) as server:
+            with self.assertRaises(comfy_client.ComfyHTTPError) as ctx:
+                await self.client.get_json(server.url)
+
+        self.assertEqual(ctx.exception.status, 503)
+        self.assertEqual(server.calls, 3)
+
+    async def test_post_is_not_retried_on_server_error(self):
+        async with FlakyServer(failures=1) as server:
+            with self.assertRaises(comfy_client.ComfyHTTPError):
+                await self.client.post_json(server.url, {"prompt": {}})
+
+        self.assertEqual(server.calls, 1)
+
+    async def test_connections_are_kept_alive(self):
+        async with FlakyServer(failures=0) as server:
+            for _ in range(5):
+                await self.client.get_json(server.url)
+
+        self.assertEqual(len(server.peers), 1)
+
+    @patch.object(comfy_client, "COMFY_HTTP_RETRY_BACKOFF_MS", 1)
+    async def test_connection_refused_raises_after_retries(self):
+        with self.assertRaises(comfy_client.aiohttp.ClientConnectorError):
+            await self.client.get_json("http://127.0.0.1:1/")
+
+
+class TestLoopLag(unittest.IsolatedAsyncioTestCase):
+    async def test_async_client_does_not_block_the_loop(self):
+        result = await bench_loop_lag.compare(latency=0.1, jobs=2)
+        print(f"loop lag before/after: {result['before']['max_loop_lag_s'] * 1000:.1f} ms / "
+              f"{result['after']['max_loop_lag_s'] * 1000:.1f} ms")
+
+        # The blocking variant stalls the loop for at least one full response
+        self.assertGreater(result["before"]["max_loop_lag_s"], 0.09)
+        self.assertLess(result["after"]["max_loop_lag_s"], 0.05)
@@ -0,0 +1,136 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import time
+import tempfile
+import asyncio
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import comfy_events
+from tests.fake_comfyui import FakeComfyUI
+from tests.comfy_helpers import fetch_history_from, queue_on
+
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI"}},
+}
+
+
+class TestCompletionTracker(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.3).start()
+
+    def tearDown(self):
+        self.comfy.stop()
+
+    async def test_completion_latency_over_websocket(self):
+        tracker = comfy_events.CompletionTracker(self.comfy.host, fetch_history_from(self.comfy.host))
+        self.assertTrue(await tracker.connect())
+
+        prompt_id = queue_on(self.comfy.host, WORKFLOW, tracker.client_id)
+        history = await tracker.wait(prompt_id, 100)
+        returned_at = time.monotonic()
+        await tracker.close()
+
+        latency_ms = (returned_at - self.comfy.completed_at[prompt_id]) * 1000
+        print(f"completion -> return latency: {latency_ms:.1f} ms (polling interval was 1000 ms)")
+
+        self.assertIn("9", history[prompt_id]["outputs"])
+        self.assertLess(latency_ms, 100)
+        # One request for the final history, none while the prompt was running
+        self.assertEqual(self.comfy.history_requests, 1)
+
+    async def test_messages_are_passed_on(self):
+        received = []
+        tracker = comfy_events.CompletionTracker(
+            self.comfy.host, fetch_history_from(self.comfy.host), on_message=received.append
+        )
+        await tracker.connect()
+        prompt_id = queue_on(self.comfy.host, WORKFLOW, tracker.client_id)
+        await tracker.wait(prompt_id, 100)
+        await tracker.close()
+
+        types = [msg["type"] for msg in received]
+        self.assertIn("progress", types)
+        self.assertIn("execution_success", types)
+
+    async def test_falls_back_to_polling_when_socket_drops(self):
+        tracker = comfy_events.CompletionTracker(
+            self.comfy.host, fetch_history_from(self.comfy.host), poll_interval_ms=100
+        )
+        await tracker.connect()
+        prompt_id = queue_on(self.comfy.host, WORKFLOW, tracker.client_id)
+
+        await asyncio.sleep(0.05)
+        self.comfy.drop_websockets()
+        history = await tracker.wait(prompt_id, 100)
+        await tracker.close()
+
+        self.assertIn(prompt_id, history)
+        self.assertGreater(self.comfy.history_requests, 1)
+
+    async def test_polls_when_socket_cannot_be_opened(self):
+        tracker = comfy_events.CompletionTracker("127.0.0.1:1", fetch_history_from(self.comfy.host))
+        self.assertFalse(await tracker.connect())
+
+        prompt_id = queue_on(self.comfy.host, WORKFLOW, tracker.client_id)
+        history = await tracker.wait(prompt_id, 100)
+
+        self.assertIn(prompt_id, history)
+
+    async def test_execution_error_is_raised(self):
+        self.comfy.fail_with = "CUDA out of memory"
+        tracker = comfy_events.CompletionTracker(self.comfy.host, fetch_history_from(self.comfy.host))
+        await tracker.connect()
+        prompt_id = queue_on(self.comfy.host, WORKFLOW, tracker.client_id)
+
+        with self.assertRaises(comfy_events.ExecutionError) as ctx:
+            await tracker.wait(prompt_id, 100)
+        await tracker.close()
+
+        self.assertIn("CUDA out of memory", str(ctx.exception))
+
+
+class TestHandlerWithFakeComfyUI(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.1).start()
+        self.env = patch.dict(
+            os.environ,
+            {
+                "COMFY_OUTPUT_PATH": self.output_dir,
+                "BACKEND_WS_URL": f"ws://{self.comfy.host}/relay",
+                "DETAILED_COMFY_LOGGING": "false",
+            },
+        )
+        self.env.start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        self.host.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_handler_returns_image_and_relays_progress(self):
+        result = await rp_handler.handler({"id": "job-1", "input": {"workflow": WORKFLOW}})
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(self.comfy.history_requests, 1)
+        relayed_types = [msg["comfy"]["type"] for msg in self.comfy.relayed]
+        self.assertIn("progress", relayed_types)
+        self.assertTrue(all(msg["job_id"] == "job-1" for msg in self.comfy.relayed))
+
+    async def test_handler_reports_execution_error(self):
+        self.comfy.fail_with = "boom"
+        result = await rp_handler.handler({"id": "job-2", "input": {"workflow": WORKFLOW}})
+
+        self.assertIn("boom", result["error"])
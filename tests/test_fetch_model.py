@@ -0,0 +1,180 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import hashlib
+import functools
+import subprocess
+import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import fetch_model
+from tests.fake_huggingface import FakeHuggingFace
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+PART_SIZE = 64 * 1024
+TOKEN = "hf_test_token"
+NAME = "checkpoints/sd_xl_turbo_1.0_fp16.safetensors"
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class ModelServer:
+    """
+    The local model server of start_model_server.sh (python -m http.server, no ranges).
+    """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=self.directory))
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def add(self, name, body):
+        os.makedirs(os.path.dirname(os.path.join(self.directory, name)), exist_ok=True)
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(body)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class TestFetchModel(unittest.TestCase):
+    def setUp(self):
+        self.hf = FakeHuggingFace(token=TOKEN).start()
+        self.body = os.urandom(5 * PART_SIZE + 123)
+        self.hf.files[NAME] = self.body
+        self.mirror = ModelServer()
+        self.dest = tempfile.mkdtemp()
+        self.backoff = patch.object(fetch_model, "FETCH_MODEL_RETRY_BACKOFF_MS", 1)
+        self.backoff.start()
+
+    def tearDown(self):
+        self.backoff.stop()
+        self.mirror.stop()
+        self.hf.stop()
+
+    def fetcher(self, **overrides):
+        options = {"dest": self.dest, "mirror": self.mirror.url, "cache_dir": "", "connections": 4, "part_size": PART_SIZE}
+        options.update(overrides)
+        return fetch_model.ModelFetcher(**options)
+
+    def local(self, name=NAME, dest=None):
+        with open(os.path.join(dest or self.dest, name), "rb") as f:
+            return f.read()
+
+    def leftovers(self):
+        return [name for _, _, names in os.walk(self.dest) for name in names if ".part" in name]
+
+    def test_ranged_download_from_huggingface(self):
+        self.hf.latency = 0.02
+
+        source = self.fetcher().fetch(self.hf.url(NAME), NAME, TOKEN)
+
+        self.assertEqual(source, "url")
+        self.assertEqual(self.local(), self.body)
+        # One probe, then the six parts
+        self.assertEqual(len(self.hf.gets), 7)
+        self.assertGreater(self.hf.max_parallel_gets, 1)
+        self.assertEqual(self.hf.resolves, [(NAME, f"Bearer {TOKEN}")])
+        # The token is not sent to the CDN
+        self.assertEqual({authorization for _, _, authorization in self.hf.gets}, {None})
+        self.assertEqual(self.leftovers(), [])
+
+    def test_model_server_is_tried_first(self):
+        self.mirror.add(NAME, self.body)
+
+        source = self.fetcher().fetch(self.hf.url(NAME), NAME, TOKEN)
+
+        self.assertEqual(source, "mirror")
+        self.assertEqual(self.local(), self.body)
+        self.assertEqual((self.hf.resolves, self.hf.gets), ([], []))
+
+    def test_model_server_miss_falls_back_to_the_url(self):
+        self.mirror.stop()
+
+        source = self.fetcher().fetch(self.hf.url(NAME), NAME, TOKEN)
+
+        self.assertEqual(source, "url")
+        self.assertEqual(self.local(), self.body)
+
+    def test_interrupted_download_resumes(self):
+        failing = f"bytes={2 * PART_SIZE}-{3 * PART_SIZE - 1}"
+        self.hf.fail_ranges[failing] = 1
+
+        with self.assertRaises(fetch_model.FetchError):
+            self.fetcher(retries=0).fetch(self.hf.url(NAME), NAME, TOKEN)
+        self.assertEqual(sorted(self.leftovers()), [os.path.basename(NAME) + ".part", os.path.basename(NAME) + ".part.json"])
+        self.hf.gets.clear()
+
+        self.fetcher(retries=0).fetch(self.hf.url(NAME), NAME, TOKEN)
+
+        self.assertEqual(self.local(), self.body)
+        # The probe, then only the part that failed
+        self.assertEqual([range_header for _, range_header, _ in self.hf.gets], ["bytes=0-0", failing])
+        self.assertEqual(self.leftovers(), [])
+
+    def test_failed_parts_are_resumed_within_one_call(self):
+        self.hf.fail_ranges[f"bytes={PART_SIZE}-{2 * PART_SIZE - 1}"] = 2
+
+        self.fetcher(retries=2).fetch(self.hf.url(NAME), NAME, TOKEN)
+
+        self.assertEqual(self.local(), self.body)
+
+    def test_checksum_mismatch_is_not_installed(self):
+        self.hf.linked_etags[NAME] = hashlib.sha256(b"other").hexdigest()
+
+        with self.assertRaises(fetch_model.FetchError):
+            self.fetcher().fetch(self.hf.url(NAME), NAME, TOKEN)
+
+        self.assertFalse(os.path.exists(os.path.join(self.dest, NAME)))
+        self.assertEqual(self.leftovers(), [])
+
+    def test_expected_checksum_also_checks_the_model_server(self):
+        self.mirror.add(NAME, os.urandom(100))
+
+        source = self.fetcher().fetch(self.hf.url(NAME), NAME, TOKEN, sha256=hashlib.sha256(self.body).hexdigest())
+
+        self.assertEqual(source, "url")
+        self.assertEqual(self.local(), self.body)
+
+    def test_cache_is_shared_between_builds(self):
+        cache_dir = tempfile.mkdtemp()
+        self.fetcher(cache_dir=cache_dir).fetch(self.hf.url(NAME), NAME, TOKEN)
+        self.hf.gets.clear()
+        other_build = tempfile.mkdtemp()
+
+        source = self.fetcher(cache_dir=cache_dir, dest=other_build).fetch(self.hf.url(NAME), NAME, TOKEN)
+
+        self.assertEqual(source, "cache")
+        self.assertEqual(self.local(dest=other_build), self.body)
+        self.assertEqual(self.hf.gets, [])
+        self.assertTrue(os.path.isfile(os.path.join(cache_dir, "blobs", hashlib.sha256(self.body).hexdigest())))
+
+    def test_command_line(self):
+        self.mirror.add("vae/sdxl_vae.safetensors", b"vae weights")
+        env = dict(os.environ, FETCH_MODEL_DEST=self.dest, FETCH_MODEL_MIRROR=self.mirror.url, FETCH_MODEL_CACHE_DIR="")
+
+        from_mirror = subprocess.run(
+            ["bash", os.path.join(ROOT, "fetch_model.sh"), self.hf.url("vae/sdxl_vae.safetensors"), "vae/sdxl_vae.safetensors", ""],
+            env=env,
+            capture_output=True,
+        )
+        from_url = subprocess.run(
+            [sys.executable, os.path.join(ROOT, "fetch_model.py"), self.hf.url(NAME), NAME, TOKEN], env=env, capture_output=True
+        )
+        missing = subprocess.run(
+            [sys.executable, os.path.join(ROOT, "fetch_model.py"), self.hf.url("missing.safetensors"), "missing.safetensors", TOKEN],
+            env=env,
+            capture_output=True,
+        )
+
+        self.assertEqual((from_mirror.returncode, from_url.returncode, missing.returncode), (0, 0, 1), missing.stdout)
+        self.assertEqual(self.local("vae/sdxl_vae.safetensors"), b"vae weights")
+        self.assertEqual(self.local(), self.body)
@@ -0,0 +1,173 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+import asyncio
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import inflight
+from src.job_stream import JobEvents
+from tests.fake_comfyui import FakeComfyUI
+from tests.fake_s3 import FakeS3
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {"seed": 42}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "shared"}},
+}
+
+
+class TestInflightJobs(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.jobs = inflight.InflightJobs()
+        self.renders = 0
+        self.release = asyncio.Event()
+
+    async def render(self, listeners):
+        self.renders += 1
+        await self.release.wait()
+        return {"status": "success", "render": self.renders}
+
+    async def test_identical_jobs_share_one_render(self):
+        waiting = [asyncio.create_task(self.jobs.run("key", self.render)) for _ in range(3)]
+        await asyncio.sleep(0)
+        self.release.set()
+        results = await asyncio.gather(*waiting)
+
+        self.assertEqual(self.renders, 1)
+        self.assertEqual([joined for _, joined in results], [False, True, True])
+        self.assertTrue(all(result == {"status": "success", "render": 1} for result, _ in results))
+        self.assertEqual(self.jobs.running(), 0)
+
+        # Once finished, the next job renders again
+        await self.jobs.run("key", self.render)
+        self.assertEqual(self.renders, 2)
+
+    async def test_errors_reach_every_job(self):
+        async def failing(listeners):
+            await asyncio.sleep(0.01)
+            raise RuntimeError("ComfyUI went away")
+
+        results = await asyncio.gather(
+            self.jobs.run("key", failing), self.jobs.run("key", failing), return_exceptions=True
+        )
+
+        self.assertEqual([str(result) for result in results], ["ComfyUI went away"] * 2)
+
+    async def test_cancelled_job_leaves_the_render_to_the_others(self):
+        first = asyncio.create_task(self.jobs.run("key", self.render))
+        second = asyncio.create_task(self.jobs.run("key", self.render))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        await asyncio.sleep(0)
+        self.release.set()
+
+        result, joined = await second
+        self.assertEqual(result["render"], 1)
+        self.assertTrue(joined)
+        self.assertTrue(first.cancelled())
+
+    async def test_render_is_cancelled_when_nobody_waits(self):
+        cancelled = asyncio.Event()
+
+        async def render(listeners):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiting = [asyncio.create_task(self.jobs.run("key", render)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for task in waiting:
+            task.cancel()
+
+        await asyncio.wait_for(cancelled.wait(), 1)
+        self.assertEqual(self.jobs.running(), 0)
+
+
+class TestHandlerDeduplication(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.2).start()
+        self.env = patch.dict(
+            os.environ,
+            {"COMFY_OUTPUT_PATH": self.output_dir, "BACKEND_WS_URL": "", "DETAILED_COMFY_LOGGING": "false"},
+        )
+        self.env.start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+        self.max_jobs = patch.object(rp_handler.job_concurrency, "max_jobs", 3)
+        self.max_jobs.start()
+        self.inflight = patch.object(rp_handler, "inflight_jobs", inflight.InflightJobs())
+        self.inflight.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.event_dispatcher.close()
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        self.inflight.stop()
+        self.max_jobs.stop()
+        self.host.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_identical_concurrent_jobs_render_once(self):
+        results = await asyncio.gather(
+            *(rp_handler.handler({"id": f"job-{i}", "input": {"workflow": WORKFLOW}}) for i in range(3))
+        )
+
+        self.assertEqual(len(self.comfy.prompts), 1)
+        self.assertTrue(all(result["status"] == "success" for result in results))
+        # Whichever job hashed its input first starts the render
+        self.assertEqual(sorted(result.get("deduplicated", False) for result in results), [False, True, True])
+        self.assertTrue(all(result["outputs"] == results[0]["outputs"] for result in results))
+
+    async def test_joined_jobs_deliver_and_stream_under_their_own_id(self):
+        s3 = FakeS3().start()
+        self.addCleanup(s3.stop)
+        bucket = patch.dict(
+            os.environ,
+            {"BUCKET_ENDPOINT_URL": s3.endpoint_url, "BUCKET_ACCESS_KEY_ID": "key", "BUCKET_SECRET_ACCESS_KEY": "secret"},
+        )
+        bucket.start()
+        self.addCleanup(bucket.stop)
+        events = [JobEvents(previews=False) for _ in range(2)]
+
+        results = await asyncio.gather(
+            *(rp_handler.run_job({"id": f"job-{i}", "input": {"workflow": WORKFLOW}}, events[i]) for i in range(2))
+        )
+
+        self.assertEqual(len(self.comfy.prompts), 1)
+        starter, joined = sorted(results, key=lambda result: result.get("deduplicated", False))
+        self.assertTrue(joined["deduplicated"])
+        self.assertEqual(sorted(key.split("/")[-2] for _, key in s3.objects), ["job-0", "job-1"])
+        self.assertNotEqual(starter["outputs"][0]["url"], joined["outputs"][0]["url"])
+        self.assertIn("execution", starter["timings"])
+        self.assertIn("shared_render", joined["timings"])
+        self.assertNotIn("execution", joined["timings"])
+        for job_events in events:
+            types = [job_events.queue.get_nowait()["type"] for _ in range(job_events.queue.qsize())]
+            self.assertIn("queued", types)
+            self.assertIn("executing", types)
+
+    async def test_render_keeps_its_slot_when_the_starter_is_cancelled(self):
+        first = asyncio.create_task(rp_handler.handler({"id": "job-0", "input": {"workflow": WORKFLOW}}))
+        while not self.comfy.prompts:
+            await asyncio.sleep(0.01)
+        second = asyncio.create_task(rp_handler.handler({"id": "job-1", "input": {"workflow": WORKFLOW}}))
+        await asyncio.sleep(0.05)
+
+        first.cancel()
+        await asyncio.sleep(0.01)
+        self.assertEqual(rp_handler.job_concurrency.running, 1)
+
+        result = await second
+        self.assertEqual(result["status"], "success")
+        self.assertTrue(result["deduplicated"])
+        self.assertEqual(len(self.comfy.prompts), 1)
+        self.assertEqual(rp_handler.job_concurrency.running, 0)
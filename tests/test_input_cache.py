@@ -0,0 +1,146 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import base64
+import tempfile
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import input_cache
+from tests.fake_comfyui import FakeComfyUI
+
+WORKFLOW = {
+    "142": {"class_type": "LoadImage", "inputs": {"image": "style.png"}},
+    "143": {"class_type": "LoadImage", "inputs": {"image": "frame.png"}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI", "images": ["142", 0]}},
+}
+
+
+def encoded(blob):
+    return base64.b64encode(blob).decode("utf-8")
+
+
+class TestInputImageCache(unittest.TestCase):
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+
+    def store(self, cache, blob, name="image.png"):
+        digest, size = input_cache.digest_b64(encoded(blob))
+        filename = input_cache.cache_filename(digest, name)
+        with open(os.path.join(self.input_dir, filename), "wb") as f:
+            f.write(blob)
+        cache.add(digest, filename, size)
+        return digest, filename
+
+    def test_hit_and_miss_counters(self):
+        cache = input_cache.InputImageCache(self.input_dir, max_bytes=10_000)
+        digest, filename = self.store(cache, b"a" * 100)
+
+        self.assertEqual(cache.lookup(digest), filename)
+        self.assertIsNone(cache.lookup("f" * 64))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_least_recently_used_is_evicted_over_budget(self):
+        cache = input_cache.InputImageCache(self.input_dir, max_bytes=250)
+        first, first_file = self.store(cache, b"a" * 100)
+        second, _ = self.store(cache, b"b" * 100)
+        cache.lookup(first)  # first is now the most recently used
+        self.store(cache, b"c" * 100)
+
+        self.assertEqual(cache.lookup(first), first_file)
+        self.assertIsNone(cache.lookup(second))
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.stats()["bytes"], 200)
+        self.assertEqual(len(os.listdir(self.input_dir)), 2)
+
+    def test_pinned_images_are_not_evicted(self):
+        cache = input_cache.InputImageCache(self.input_dir, max_bytes=150)
+        first, first_file = self.store(cache, b"a" * 100)
+        cache.pin([first])
+        self.store(cache, b"b" * 100)
+
+        self.assertEqual(cache.lookup(first), first_file)
+
+    def test_index_is_rebuilt_from_disk(self):
+        cache = input_cache.InputImageCache(self.input_dir, max_bytes=10_000)
+        digest, filename = self.store(cache, b"a" * 100)
+        with open(os.path.join(self.input_dir, "unrelated.png"), "wb") as f:
+            f.write(b"x")
+
+        reloaded = input_cache.InputImageCache(self.input_dir, max_bytes=10_000)
+
+        self.assertEqual(reloaded.lookup(digest), filename)
+        self.assertEqual(reloaded.stats()["entries"], 1)
+
+    def test_file_deleted_behind_our_back_is_a_miss(self):
+        cache = input_cache.InputImageCache(self.input_dir, max_bytes=10_000)
+        digest, filename = self.store(cache, b"a" * 100)
+        os.remove(os.path.join(self.input_dir, filename))
+
+        self.assertIsNone(cache.lookup(digest))
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+    def test_rewrite_image_inputs(self):
+        rewritten = input_cache.rewrite_image_inputs(WORKFLOW, {"style.png": "rp_1.png"})
+
+        self.assertEqual(rewritten["142"]["inputs"]["image"], "rp_1.png")
+        self.assertEqual(rewritten["143"]["inputs"]["image"], "frame.png")
+        # The original workflow is left alone
+        self.assertEqual(WORKFLOW["142"]["inputs"]["image"], "style.png")
+
+
+class TestStageInputImages(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(input_dir=self.input_dir).start()
+        self.patches = [
+            patch.object(rp_handler, "COMFY_HOST", self.comfy.host),
+            patch.object(rp_handler, "input_cache", input_cache.InputImageCache(self.input_dir, 10_000_000)),
+        ]
+        for p in self.patches:
+            p.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.comfy.stop()
+
+    async def test_repeated_images_are_not_uploaded_again(self):
+        style, frame = os.urandom(2000), os.urandom(3000)
+        images = [{"name": "style.png", "image": encoded(style)}, {"name": "frame.png", "image": encoded(frame)}]
+
+        result, workflow, pinned = await rp_handler.stage_input_images(images, WORKFLOW)
+        rp_handler.input_cache.unpin(pinned)
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(len(self.comfy.uploads), 2)
+        stored = workflow["142"]["inputs"]["image"]
+        self.assertTrue(stored.startswith("rp_"))
+        self.assertEqual(self.comfy.uploads[stored], style)
+
+        # Same content under a different name in the next job
+        images = [{"name": "frame.png", "image": encoded(style)}]
+        self.comfy.uploads.clear()
+        result, workflow, _ = await rp_handler.stage_input_images(images, WORKFLOW)
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(result["details"], ["Reused cached frame.png"])
+        self.assertEqual(self.comfy.uploads, {})
+        self.assertEqual(workflow["143"]["inputs"]["image"], stored)
+        self.assertEqual(rp_handler.input_cache.stats()["hits"], 1)
+
+    async def test_invalid_image_is_reported(self):
+        images = [{"name": "broken.png", "image": "not base64!"}]
+
+        result, workflow, pinned = await rp_handler.stage_input_images(images, WORKFLOW)
+
+        self.assertEqual(result["status"], "error")
+        self.assertTrue(result["details"][0].startswith("Error uploading broken.png: "))
+        self.assertIs(workflow, WORKFLOW)
+        self.assertEqual(pinned, [])
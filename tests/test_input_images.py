@@ -0,0 +1,93 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import base64
+import binascii
+import time
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import input_images
+from tests.fake_comfyui import FakeComfyUI
+
+
+class TestIterB64Decode(unittest.TestCase):
+    def test_chunks_concatenate_to_the_full_image(self):
+        blob = os.urandom(100_003)
+        encoded = base64.b64encode(blob).decode("utf-8")
+
+        chunks = list(input_images.iter_b64decode(encoded, chunk_chars=4096))
+
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= 3072 for chunk in chunks))
+        self.assertEqual(b"".join(chunks), blob)
+
+    def test_whitespace_is_ignored(self):
+        blob = os.urandom(5000)
+        encoded = base64.encodebytes(blob).decode("utf-8")  # wrapped at 76 characters
+
+        self.assertEqual(b"".join(input_images.iter_b64decode(encoded, chunk_chars=100)), blob)
+
+    def test_unaligned_chunk_size(self):
+        blob = os.urandom(1000)
+        encoded = base64.b64encode(blob).decode("utf-8")
+
+        self.assertEqual(b"".join(input_images.iter_b64decode(encoded, chunk_chars=7)), blob)
+
+    def test_invalid_data_raises(self):
+        with self.assertRaises(binascii.Error):
+            list(input_images.iter_b64decode("not base64!"))
+
+
+class TestUploadImages(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.comfy = FakeComfyUI(latency=0.2).start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        self.host.stop()
+        self.comfy.stop()
+
+    def images(self, count, size=300_000):
+        blobs = {f"image{i}.png": os.urandom(size) for i in range(count)}
+        return blobs, [{"name": name, "image": base64.b64encode(blob).decode("utf-8")} for name, blob in blobs.items()]
+
+    async def test_images_are_uploaded_concurrently(self):
+        blobs, images = self.images(4)
+
+        start = time.perf_counter()
+        result = await rp_handler.upload_images(images)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(self.comfy.uploads, blobs)
+        # Four uploads of 200 ms each take about as long as one
+        self.assertLess(elapsed, 0.6)
+
+    async def test_concurrency_limit_is_respected(self):
+        _, images = self.images(3, size=1000)
+
+        with patch.object(rp_handler, "COMFY_UPLOAD_CONCURRENCY", 1):
+            start = time.perf_counter()
+            result = await rp_handler.upload_images(images)
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(result["status"], "success")
+        self.assertGreaterEqual(elapsed, 0.6)
+
+    async def test_errors_are_reported_per_image(self):
+        blobs, images = self.images(2, size=1000)
+        images.insert(1, {"name": "broken.png", "image": "not base64!"})
+
+        result = await rp_handler.upload_images(images)
+
+        self.assertEqual(result["status"], "error")
+        self.assertEqual(len(result["details"]), 1)
+        self.assertTrue(result["details"][0].startswith("Error uploading broken.png: "))
+        self.assertEqual(self.comfy.uploads, blobs)
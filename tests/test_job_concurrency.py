@@ -0,0 +1,195 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+import asyncio
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import comfy_events
+from src import job_concurrency
+from runpod.serverless.modules import rp_scale
+from tests.fake_comfyui import FakeComfyUI
+from tests.comfy_helpers import fetch_history_from, queue_on
+
+
+def workflow(prefix):
+    return {
+        "3": {"class_type": "KSampler", "inputs": {"seed": hash(prefix) % 1000}},
+        "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": prefix}},
+    }
+
+
+class StubDispatcher:
+    queue_remaining = 0
+
+
+class TestJobConcurrency(unittest.IsolatedAsyncioTestCase):
+    async def test_slots_limit_running_jobs(self):
+        limiter = job_concurrency.JobConcurrency(StubDispatcher(), max_jobs=2)
+
+        async def job():
+            async with limiter.slot():
+                await asyncio.sleep(0.05)
+
+        await asyncio.gather(*(job() for _ in range(5)))
+
+        self.assertEqual(limiter.peak, 2)
+        self.assertEqual(limiter.running, 0)
+
+    def test_deep_comfy_queue_stops_taking_jobs(self):
+        dispatcher = StubDispatcher()
+        limiter = job_concurrency.JobConcurrency(dispatcher, max_jobs=4, max_queue_depth=2)
+        limiter.running = 1
+
+        self.assertEqual(limiter.concurrency_modifier(1), 4)
+        self.assertFalse(limiter.concurrency_controller())
+
+        dispatcher.queue_remaining = 2
+        self.assertEqual(limiter.concurrency_modifier(4), 1)
+        self.assertTrue(limiter.concurrency_controller())
+
+
+    async def test_sdk_stops_fetching_while_the_slots_are_full(self):
+        limiter = job_concurrency.JobConcurrency(StubDispatcher(), max_jobs=2)
+        counter = iter(range(100))
+
+        async def get_job(session):
+            return {"id": f"job-{next(counter)}", "input": {}}
+
+        fetched = []
+
+        async def worker_loop():
+            scaler = rp_scale.JobScaler(concurrency_controller=limiter.concurrency_controller)
+            while True:
+                async for job in scaler.get_jobs(None):
+                    fetched.append(job["id"])
+
+        with patch.object(rp_scale, "get_job", limiter.gate(get_job)), patch.object(rp_scale.JobScaler, "SLEEP_INTERVAL_SEC", 0.01):
+            loop = asyncio.create_task(worker_loop())
+            try:
+                await asyncio.sleep(0.2)
+                self.assertEqual(fetched, ["job-0", "job-1"])
+
+                limiter.finished("job-0")
+                await asyncio.sleep(0.2)
+                self.assertEqual(fetched, ["job-0", "job-1", "job-2"])
+            finally:
+                loop.cancel()
+
+
+class TestEventDispatcher(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.1, previews=True).start()
+        self.dispatcher = comfy_events.EventDispatcher(fetch_history_from(self.comfy.host))
+
+    async def asyncTearDown(self):
+        await self.dispatcher.close()
+
+    def tearDown(self):
+        self.comfy.stop()
+
+    async def test_events_are_routed_by_prompt(self):
+        await self.dispatcher.connect(self.comfy.host)
+        received = {"a": [], "b": []}
+        previews = {"a": 0, "b": 0}
+
+        def on_binary(name):
+            def count(frame):
+                previews[name] += 1
+
+            return count
+
+        for name in received:
+            self.dispatcher.subscribe(name, received[name].append, on_binary(name))
+        for name in received:
+            queue_on(self.comfy.host, workflow(name), self.dispatcher.client_id, name)
+
+        histories = await asyncio.gather(*(self.dispatcher.wait(name, 100) for name in received))
+
+        for name, history in zip(received, histories):
+            self.assertIn(name, history)
+            prompt_ids = {msg["data"]["prompt_id"] for msg in received[name] if "prompt_id" in msg["data"]}
+            self.assertEqual(prompt_ids, {name})
+            self.assertIn("execution_success", [msg["type"] for msg in received[name]])
+            self.assertEqual(previews[name], self.comfy.progress_steps)
+
+    async def test_queue_depth_follows_status_messages(self):
+        await self.dispatcher.connect(self.comfy.host)
+        for name in ("a", "b", "c"):
+            self.dispatcher.subscribe(name)
+            queue_on(self.comfy.host, workflow(name), self.dispatcher.client_id, name)
+
+        await self.dispatcher.wait("a", 100)
+        self.assertGreaterEqual(self.dispatcher.queue_remaining, 1)
+        await self.dispatcher.wait("c", 100)
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.dispatcher.queue_remaining, 0)
+
+    async def test_reconnects_after_the_socket_dropped(self):
+        await self.dispatcher.connect(self.comfy.host)
+        self.comfy.drop_websockets()
+        await asyncio.sleep(0.1)
+        self.assertFalse(self.dispatcher.connected)
+
+        self.assertTrue(await self.dispatcher.connect(self.comfy.host))
+        self.dispatcher.subscribe("a")
+        queue_on(self.comfy.host, workflow("a"), self.dispatcher.client_id, "a")
+
+        self.assertIn("a", await self.dispatcher.wait("a", 100))
+        self.assertEqual(self.dispatcher.connects, 2)
+
+
+class TestConcurrentJobs(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.2).start()
+        self.env = patch.dict(
+            os.environ,
+            {
+                "COMFY_OUTPUT_PATH": self.output_dir,
+                "BACKEND_WS_URL": f"ws://{self.comfy.host}/relay",
+                "DETAILED_COMFY_LOGGING": "false",
+            },
+        )
+        self.env.start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+        self.max_jobs = patch.object(rp_handler.job_concurrency, "max_jobs", 3)
+        self.max_jobs.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.event_dispatcher.close()
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        self.max_jobs.stop()
+        self.host.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_jobs_do_not_receive_each_others_outputs(self):
+        names = ["first", "second", "third"]
+        results = await asyncio.gather(
+            *(rp_handler.handler({"id": name, "input": {"workflow": workflow(name)}}) for name in names)
+        )
+
+        for name, result in zip(names, results):
+            self.assertEqual(result["status"], "success")
+            self.assertTrue(all(o["filename"].startswith(name) for o in result["outputs"]))
+        # The prompts were waiting in ComfyUI's queue side by side
+        self.assertEqual(self.comfy.max_queue_remaining, 3)
+        self.assertEqual(rp_handler.job_concurrency.peak, 3)
+
+        # Relayed progress is tagged with the job that owns the prompt
+        owners = {prompt_id: body["prompt"]["9"]["inputs"]["filename_prefix"] for prompt_id, body in self.comfy.prompts.items()}
+        tagged = [
+            (message["job_id"], message["comfy"]["data"]["prompt_id"])
+            for message in self.comfy.relayed
+            if "prompt_id" in message["comfy"].get("data", {})
+        ]
+        self.assertTrue(tagged)
+        self.assertTrue(all(owners[prompt_id] == job_id for job_id, prompt_id in tagged))
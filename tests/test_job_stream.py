@@ -0,0 +1,184 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import io
+import base64
+import functools
+import struct
+import tempfile
+import threading
+import time
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import job_stream
+from tests.fake_comfyui import FakeComfyUI, PNG_BYTES
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {"steps": 20}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI"}},
+}
+
+
+def progress(value, maximum=20, node="3", prompt_id="p1"):
+    return {"type": "progress", "data": {"value": value, "max": maximum, "node": node, "prompt_id": prompt_id}}
+
+
+def executing(node, prompt_id="p1"):
+    return {"type": "executing", "data": {"node": node, "prompt_id": prompt_id}}
+
+
+def drain(events):
+    items = []
+    while not events.queue.empty():
+        items.append(events.queue.get_nowait())
+    return items
+
+
+class TestPreviewFrames(unittest.TestCase):
+    def test_preview_image_frame(self):
+        frame = struct.pack(">II", 1, 2) + PNG_BYTES
+
+        self.assertEqual(job_stream.parse_preview(frame), ("image/png", PNG_BYTES, None))
+
+    def test_preview_with_metadata_frame(self):
+        metadata = b'{"node_id": "3", "image_type": "image/jpeg"}'
+        frame = struct.pack(">II", 4, len(metadata)) + metadata + b"jpeg"
+
+        self.assertEqual(job_stream.parse_preview(frame), ("image/jpeg", b"jpeg", "3"))
+
+    def test_other_frames_are_ignored(self):
+        self.assertIsNone(job_stream.parse_preview(struct.pack(">II", 3, 0) + b"text"))
+        self.assertIsNone(job_stream.parse_preview(b"\x00"))
+
+    @unittest.skipIf(job_stream.Image is None, "Pillow is not installed")
+    def test_large_preview_is_scaled_down(self):
+        buffer = io.BytesIO()
+        job_stream.Image.new("RGB", (1024, 512), "red").save(buffer, format="PNG")
+
+        mime, image = job_stream.downscale(buffer.getvalue(), "image/png", 256)
+
+        self.assertEqual(mime, "image/jpeg")
+        with job_stream.Image.open(io.BytesIO(image)) as picture:
+            self.assertEqual(picture.size, (256, 128))
+
+
+class TestJobEvents(unittest.IsolatedAsyncioTestCase):
+    async def test_progress_is_rate_limited(self):
+        events = job_stream.JobEvents(progress_interval_ms=60000)
+        events.started(WORKFLOW)
+        events.queued("p1")
+        events.on_message(executing("3"))
+        for value in range(1, 21):
+            events.on_message(progress(value))
+
+        items = drain(events)
+
+        self.assertEqual([item["type"] for item in items], ["queued", "executing", "progress", "progress"])
+        # The first and the last step always get through
+        self.assertEqual([(item["value"], item["max"]) for item in items[2:]], [(1, 20), (20, 20)])
+        self.assertEqual(items[1]["class_type"], "KSampler")
+        self.assertEqual((items[1]["step"], items[1]["steps"]), (1, 2))
+        self.assertEqual(events.dropped, 18)
+
+    async def test_new_node_resets_the_limit(self):
+        events = job_stream.JobEvents(progress_interval_ms=60000)
+        events.on_message(executing("3"))
+        events.on_message(progress(1))
+        events.on_message(executing("9"))
+        events.on_message(progress(1, node="9"))
+
+        self.assertEqual([item["type"] for item in drain(events)], ["executing", "progress"] * 2)
+
+    async def test_messages_of_other_prompts_are_ignored(self):
+        events = job_stream.JobEvents()
+        events.queued("p1")
+        events.on_message(executing("3", prompt_id="p2"))
+
+        self.assertEqual([item["type"] for item in drain(events)], ["queued"])
+
+    async def test_previews_are_off_by_default(self):
+        events = job_stream.JobEvents(previews=False)
+        events.on_binary(struct.pack(">II", 1, 2) + PNG_BYTES)
+
+        self.assertTrue(events.queue.empty())
+
+
+    @unittest.skipIf(job_stream.Image is None, "Pillow is not installed")
+    async def test_previews_are_scaled_down_off_the_event_loop(self):
+        events = job_stream.JobEvents(previews=True, preview_interval_ms=0)
+        threads = []
+
+        def downscale(image, mime, max_size):
+            threads.append(threading.current_thread())
+            return mime, image
+
+        with patch.object(job_stream, "downscale", side_effect=downscale):
+            events.on_binary(struct.pack(">II", 1, 2) + PNG_BYTES)
+            # Dropped, the first one is still being scaled down
+            events.on_binary(struct.pack(">II", 1, 2) + PNG_BYTES)
+            await events.flush()
+
+        items = drain(events)
+        self.assertEqual([(item["type"], item["mime"]) for item in items], [("preview", "image/png")])
+        self.assertEqual(base64.b64decode(items[0]["image"]), PNG_BYTES)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+        self.assertEqual(events.dropped, 1)
+
+
+class TestStreamHandler(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.3, progress_steps=10, previews=True).start()
+        self.env = patch.dict(
+            os.environ,
+            {
+                "COMFY_OUTPUT_PATH": self.output_dir,
+                "BACKEND_WS_URL": f"ws://{self.comfy.host}/relay",
+                "DETAILED_COMFY_LOGGING": "false",
+            },
+        )
+        self.env.start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        self.host.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_progress_and_previews_are_streamed_before_the_result(self):
+        job_events = functools.partial(
+            job_stream.JobEvents, previews=True, progress_interval_ms=0, preview_interval_ms=0
+        )
+        start = time.perf_counter()
+        first_event = None
+        items = []
+        with patch.object(rp_handler, "JobEvents", job_events):
+            async for item in rp_handler.stream_handler({"id": "job-1", "input": {"workflow": WORKFLOW}}):
+                if first_event is None:
+                    first_event = time.perf_counter() - start
+                items.append(item)
+
+        self.assertEqual(items[0]["type"], "queued")
+        self.assertLess(first_event, 0.3)
+        progress_values = [item["value"] for item in items if item.get("type") == "progress"]
+        self.assertEqual(progress_values, list(range(1, 11)))
+        previews = [item for item in items if item.get("type") == "preview"]
+        self.assertEqual(len(previews), 10)
+        self.assertEqual(previews[0]["node"], "9")
+        self.assertTrue(base64.b64decode(previews[0]["image"]))
+        # The result comes last and is the same as the plain handler's
+        self.assertEqual(items[-1]["status"], "success")
+        self.assertEqual(len(items[-1]["outputs"]), 1)
+
+    async def test_plain_handler_is_unchanged(self):
+        result = await rp_handler.handler({"id": "job-1", "input": {"workflow": WORKFLOW}})
+
+        self.assertEqual(result["status"], "success")
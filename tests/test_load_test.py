@@ -0,0 +1,95 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+import asyncio
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from comfy_client import ComfyClient
+from comfy_events import CompletionTracker
+from tests import load_test
+from tests.fake_comfyui import FakeComfyUI, PNG_BYTES
+
+WORKFLOW = {
+    "4": {"class_type": "CheckpointLoaderSimple", "inputs": {}},
+    "3": {"class_type": "KSampler", "inputs": {"seed": 1}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "scripted"}},
+}
+
+
+class TestFakeComfyUI(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.client = ComfyClient()
+        self.messages = []
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def run_prompt(self, comfy, interrupt_after=None):
+        tracker = CompletionTracker(
+            comfy.host,
+            lambda prompt_id: self.client.get_json(f"http://{comfy.host}/history/{prompt_id}"),
+            on_message=self.messages.append,
+        )
+        await tracker.connect()
+        try:
+            response = await self.client.post_json(
+                f"http://{comfy.host}/prompt", {"prompt": WORKFLOW, "client_id": tracker.client_id}
+            )
+            if interrupt_after is not None:
+                await asyncio.sleep(interrupt_after)
+                await self.client.request("POST", f"http://{comfy.host}/interrupt")
+            return await tracker.wait(response["prompt_id"], 100)
+        finally:
+            await tracker.close()
+
+    async def test_nodes_run_for_their_scripted_time(self):
+        with FakeComfyUI(output_dir=self.output_dir, execution_time=0, node_times={"CheckpointLoaderSimple": 0.2}) as comfy:
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            await self.run_prompt(comfy)
+            elapsed = loop.time() - started
+
+        self.assertGreaterEqual(elapsed, 0.2)
+        executing = [message["data"]["node"] for message in self.messages if message["type"] == "executing"]
+        self.assertEqual(executing, ["4", "3", "9", None])
+
+    async def test_interrupt_stops_the_running_prompt(self):
+        with FakeComfyUI(output_dir=self.output_dir, execution_time=10) as comfy:
+            with self.assertRaisesRegex(Exception, "interrupted"):
+                await asyncio.wait_for(self.run_prompt(comfy, interrupt_after=0.1), 5)
+            self.assertEqual(comfy.interrupts, 1)
+
+    async def test_output_files_have_the_configured_size(self):
+        with FakeComfyUI(output_dir=self.output_dir, execution_time=0, output_size=4096) as comfy:
+            history = await self.run_prompt(comfy)
+
+        (prompt,) = history.values()
+        filename = prompt["outputs"]["9"]["images"][0]["filename"]
+        with open(os.path.join(self.output_dir, filename), "rb") as f:
+            data = f.read()
+        self.assertEqual(len(data), 4096)
+        self.assertTrue(data.startswith(PNG_BYTES))
+
+
+class TestLoadTest(unittest.IsolatedAsyncioTestCase):
+    async def test_small_run_reports_throughput_latency_and_memory(self):
+        env = {"COMFY_OUTPUT_PATH": tempfile.mkdtemp(), "BACKEND_WS_URL": "", "DETAILED_COMFY_LOGGING": "false"}
+        host, max_jobs = rp_handler.COMFY_HOST, rp_handler.job_concurrency.max_jobs
+        with patch.dict(os.environ, env):
+            result = await load_test.load_test(jobs=20, concurrency=2, images=1)
+
+        # The handler's settings are restored for the tests that follow
+        self.assertEqual((rp_handler.COMFY_HOST, rp_handler.job_concurrency.max_jobs), (host, max_jobs))
+
+        self.assertEqual(result["jobs"], 20)
+        self.assertEqual(result["failed"], 0)
+        self.assertEqual(result["comfyui"]["prompts"], 20)
+        self.assertGreater(result["throughput_jobs_per_s"], 0)
+        self.assertLessEqual(result["overhead_ms"]["p50"], result["latency_ms"]["p50"])
+        self.assertLessEqual(result["latency_ms"]["p50"], result["latency_ms"]["p99"])
+        self.assertGreater(result["rss_mb"]["peak"], 0)
@@ -0,0 +1,169 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import json
+import base64
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import asyncio
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import metrics
+from src.warmup import blank_png
+from tests.fake_comfyui import FakeComfyUI
+
+WORKFLOW = {
+    "10": {"class_type": "LoadImage", "inputs": {"image": "input.png"}},
+    "3": {"class_type": "KSampler", "inputs": {"seed": 3}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "metered"}},
+}
+
+
+class TestWorkerMetrics(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram(buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.cumulative(), [(0.1, 2), (1, 3), (float("inf"), 4)])
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 3.65)
+
+    def test_prometheus_text(self):
+        worker_metrics = metrics.WorkerMetrics(
+            lambda: [metrics.family("relay_connected", "gauge", "Connected", [({}, True)])]
+        )
+        worker_metrics.job_started()
+        worker_metrics.job_finished({"status": "success"}, {"execution": 1500.0, "total": 1600.0})
+        worker_metrics.job_started()
+        worker_metrics.job_finished({"error": "ComfyUI API is not reachable"})
+        worker_metrics.add_bytes("input_upload", 1024)
+
+        text = worker_metrics.prometheus()
+
+        self.assertIn("# TYPE comfy_worker_jobs_started_total counter\ncomfy_worker_jobs_started_total 2\n", text)
+        self.assertIn("comfy_worker_jobs_completed_total 1\n", text)
+        self.assertIn("comfy_worker_jobs_failed_total 1\n", text)
+        self.assertIn('comfy_worker_transferred_bytes_total{kind="input_upload"} 1024\n', text)
+        self.assertIn("# TYPE comfy_worker_stage_seconds histogram\n", text)
+        self.assertIn('comfy_worker_stage_seconds_bucket{stage="execution",le="1"} 0\n', text)
+        self.assertIn('comfy_worker_stage_seconds_bucket{stage="execution",le="2.5"} 1\n', text)
+        self.assertIn('comfy_worker_stage_seconds_bucket{stage="execution",le="+Inf"} 1\n', text)
+        self.assertIn('comfy_worker_stage_seconds_sum{stage="execution"} 1.5\n', text)
+        self.assertIn('comfy_worker_stage_seconds_count{stage="total"} 1\n', text)
+        self.assertIn("comfy_worker_relay_connected 1\n", text)
+
+    def test_snapshot_is_json(self):
+        worker_metrics = metrics.WorkerMetrics()
+        worker_metrics.job_started()
+        worker_metrics.job_finished({"status": "success"}, {"queue": 20.0})
+        worker_metrics.add_bytes("storage_upload", 10)
+
+        snapshot = json.loads(json.dumps(worker_metrics.snapshot()))
+
+        self.assertEqual(snapshot["jobs_completed_total"], 1)
+        self.assertEqual(snapshot["transferred_bytes_total"], {"storage_upload": 10})
+        self.assertEqual(snapshot["stage_seconds"]["queue"]["count"], 1)
+        self.assertEqual(snapshot["stage_seconds"]["queue"]["buckets"]["0.025"], 1)
+
+    def test_system_stats_gauges(self):
+        families = metrics.system_stats_families(
+            {"system": {"ram_total": 100, "ram_free": 40}, "devices": [{"name": "cuda:0", "vram_total": 24, "vram_free": 8}]}
+        )
+
+        values = {item["name"]: item["samples"] for item in families}
+        self.assertEqual(values["ram_free_bytes"], [({}, 40)])
+        self.assertEqual(values["vram_free_bytes"], [({"device": "cuda:0"}, 8)])
+
+    def test_collect_errors_do_not_break_the_snapshot(self):
+        def collect():
+            raise RuntimeError("boom")
+
+        snapshot = metrics.WorkerMetrics(collect).snapshot()
+
+        self.assertEqual(snapshot["jobs_started_total"], 0)
+
+    def test_recording_overhead_is_negligible(self):
+        worker_metrics = metrics.WorkerMetrics()
+        stages = {name: 12.5 for name in ("validate", "upload", "queue", "queue_wait", "execution", "outputs", "total")}
+
+        start = time.perf_counter()
+        for _ in range(10000):
+            worker_metrics.job_started()
+            worker_metrics.job_finished({"status": "success"}, stages)
+        per_job = (time.perf_counter() - start) / 10000
+
+        self.assertLess(per_job, 0.0005)
+
+    def test_endpoint_and_jsonl_file(self):
+        path = os.path.join(tempfile.mkdtemp(), "metrics.jsonl")
+        worker_metrics = metrics.WorkerMetrics()
+        port = worker_metrics.serve(port=-1, jsonl_path=path, interval_s=0.05)
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+                self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+                self.assertIn("comfy_worker_jobs_started_total 0", response.read().decode("utf-8"))
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/other", timeout=5)
+
+            deadline = time.monotonic() + 5
+            while not os.path.exists(path) and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            worker_metrics.stop()
+
+        with open(path) as f:
+            self.assertIn("jobs_started_total", json.loads(f.readline()))
+
+
+class TestHandlerMetrics(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.05).start()
+        self.env = patch.dict(
+            os.environ,
+            {"COMFY_OUTPUT_PATH": self.output_dir, "BACKEND_WS_URL": "", "DETAILED_COMFY_LOGGING": "false"},
+        )
+        self.env.start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+        self.metrics = patch.object(rp_handler, "worker_metrics", metrics.WorkerMetrics(rp_handler.collect_metrics))
+        self.metrics.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.event_dispatcher.close()
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        self.metrics.stop()
+        self.host.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_jobs_are_counted_and_timed(self):
+        image = base64.b64encode(blank_png(8, 8)).decode("utf-8")
+        result = await rp_handler.handler(
+            {"id": "job-1", "input": {"workflow": WORKFLOW, "images": [{"name": "input.png", "image": image}], "cache": False}}
+        )
+        self.assertEqual(result["status"], "success")
+        await rp_handler.handler({"id": "job-2", "input": {"images": []}})
+
+        snapshot = await asyncio.to_thread(rp_handler.worker_metrics.snapshot)
+
+        self.assertEqual(snapshot["jobs_started_total"], 2)
+        self.assertEqual(snapshot["jobs_completed_total"], 1)
+        self.assertEqual(snapshot["jobs_failed_total"], 1)
+        self.assertEqual(snapshot["stage_seconds"]["execution"]["count"], 1)
+        self.assertEqual(snapshot["stage_seconds"]["validate"]["count"], 2)
+        self.assertEqual(snapshot["transferred_bytes_total"]["input_upload"], len(blank_png(8, 8)))
+        self.assertGreater(snapshot["transferred_bytes_total"]["output_encode"], 0)
+        self.assertEqual(snapshot["comfy_queue_remaining"], 0)
+        self.assertEqual(snapshot["jobs_running"], 0)
+        self.assertEqual(snapshot["vram_free_bytes"], {"cuda:0 Fake GPU": 20 * 2**30})
+        self.assertEqual(snapshot["ram_total_bytes"], 64 * 2**30)
+        self.assertIn("relay_dropped_total", snapshot)
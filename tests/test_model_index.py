@@ -0,0 +1,197 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import json
+import tempfile
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import model_index
+from tests.fake_comfyui import FakeComfyUI
+
+RESOURCES = os.path.join(os.path.dirname(__file__), "..", "test_resources")
+REF_DIR = os.path.join(os.path.dirname(__file__), "..", "ref")
+# Long ago, so the directories count as unchanged since they were scanned
+OLD_MTIME = 1_600_000_000
+
+
+def touch(*path):
+    os.makedirs(os.path.dirname(os.path.join(*path)), exist_ok=True)
+    with open(os.path.join(*path), "wb") as f:
+        f.write(b"weights")
+
+
+def age(root):
+    for path, _, _ in os.walk(root):
+        os.utime(path, (OLD_MTIME, OLD_MTIME))
+
+
+class ModelDirectories:
+    def make_models(self):
+        self.comfy_models = tempfile.mkdtemp()
+        self.volume = tempfile.mkdtemp()
+        touch(self.comfy_models, "checkpoints", "sd_xl_turbo_1.0_fp16.safetensors")
+        touch(self.comfy_models, "unet", "flux1-dev.safetensors")
+        touch(self.volume, "models", "loras", "style", "watercolor.safetensors")
+        touch(self.volume, "models", "checkpoints", "juggernautXL_v9.safetensors")
+        self.config = os.path.join(tempfile.mkdtemp(), "extra_model_paths.yaml")
+        with open(self.config, "w") as f:
+            f.write(
+                "runpod_worker_comfy:\n"
+                f"  base_path: {self.volume}\n"
+                "  checkpoints: models/checkpoints/\n"
+                "  loras: models/loras/\n"
+                "  unet: models/unet/\n"
+                "  clip_vision: models/clip_vision/\n"
+            )
+        return model_index.ModelIndex(self.comfy_models, self.config, rescan_min_s=0)
+
+
+class TestModelIndex(unittest.TestCase, ModelDirectories):
+    def setUp(self):
+        self.index = self.make_models()
+        self.index.build()
+
+    def test_roots_follow_comfyui(self):
+        roots = model_index.model_roots(self.comfy_models, self.config)
+
+        self.assertEqual(
+            roots["checkpoints"],
+            [os.path.join(self.comfy_models, "checkpoints"), os.path.join(self.volume, "models", "checkpoints")],
+        )
+        # Legacy folder names are merged into the current ones
+        self.assertEqual(
+            roots["diffusion_models"],
+            [os.path.join(self.comfy_models, "unet"), os.path.join(self.volume, "models", "unet")],
+        )
+
+    def test_find(self):
+        self.assertEqual(
+            self.index.find("checkpoints", "juggernautXL_v9.safetensors"),
+            os.path.join(self.volume, "models", "checkpoints", "juggernautXL_v9.safetensors"),
+        )
+        self.assertIsNotNone(self.index.find("loras", "style\\watercolor.safetensors"))
+        self.assertIsNotNone(self.index.find("unet", "flux1-dev.safetensors"))
+        self.assertIsNone(self.index.find("loras", "watercolor.safetensors"))
+        self.assertEqual(self.index.files("loras"), ["style/watercolor.safetensors"])
+
+    def test_missing_models(self):
+        workflow = {
+            "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sd_xl_turbo_1.0_fp16.safetensors"}},
+            "10": {"class_type": "LoraLoader", "inputs": {"model": ["4", 0], "lora_name": "style/ink.safetensors"}},
+            "11": {"class_type": "UNETLoader", "inputs": {"unet_name": "flux1-schnell.safetensors"}},
+            "12": {"class_type": "VAELoader", "inputs": {"vae_name": "taesdxl"}},
+            "13": {"class_type": "CLIPVisionLoader", "inputs": {"clip_name": "clip_vision_g.safetensors"}},
+        }
+
+        self.assertEqual(
+            self.index.missing(workflow),
+            [
+                "node 10 (LoraLoader): lora_name 'style/ink.safetensors' not found in loras",
+                "node 11 (UNETLoader): unet_name 'flux1-schnell.safetensors' not found in diffusion_models",
+            ],
+        )
+        # There is no clip_vision or vae directory, so those are left to ComfyUI
+        self.assertTrue(self.index.error_message(workflow).startswith("Missing model: node 10"))
+
+    def test_example_workflow_references(self):
+        with open(os.path.join(RESOURCES, "workflows", "workflow_flux1_dev.json")) as f:
+            workflow = json.load(f)["input"]["workflow"]
+
+        folders = {folder for _, _, _, folder, _ in model_index.model_references(workflow)}
+
+        self.assertIn("diffusion_models", folders)
+        self.assertIn("text_encoders", folders)
+
+    def test_only_loader_nodes_are_checked(self):
+        with open(os.path.join(REF_DIR, "wan_image_to_video_upscale_slow.json")) as f:
+            workflow = json.load(f)
+        for _, _, _, folder, name in model_index.model_references(workflow):
+            touch(self.comfy_models, folder, name)
+        self.index.build(force=True)
+
+        # FILM VFI loads its ckpt_name from the custom node's own directory, not from checkpoints
+        self.assertNotIn("FILM VFI", {class_type for _, class_type, _, _, _ in model_index.model_references(workflow)})
+        self.assertTrue(self.index.covers("checkpoints"))
+        self.assertEqual(self.index.missing(workflow), [])
+
+    def test_refresh_scans_only_changed_directories(self):
+        age(self.comfy_models)
+        age(self.volume)
+        self.index.build(force=True)
+        loras = os.path.join(self.volume, "models", "loras")
+
+        with patch.object(self.index, "_scan", wraps=self.index._scan) as scan:
+            self.assertFalse(self.index.refresh())
+            touch(loras, "style", "ink.safetensors")
+            touch(loras, "detail", "skin.safetensors")
+            self.assertTrue(self.index.refresh())
+
+        scanned = {call.args[2] for call in scan.call_args_list}
+        self.assertEqual(scanned, {os.path.join(loras, "style"), loras, os.path.join(loras, "detail")})
+        self.assertEqual(
+            self.index.files("loras"),
+            ["detail/skin.safetensors", "style/ink.safetensors", "style/watercolor.safetensors"],
+        )
+
+    def test_refresh_drops_deleted_files_and_finds_new_roots(self):
+        os.remove(os.path.join(self.volume, "models", "loras", "style", "watercolor.safetensors"))
+        os.rmdir(os.path.join(self.volume, "models", "loras", "style"))
+        touch(self.volume, "models", "clip_vision", "clip_vision_g.safetensors")
+
+        self.index.refresh()
+
+        self.assertEqual(self.index.files("loras"), [])
+        self.assertIsNotNone(self.index.find("clip_vision", "clip_vision_g.safetensors"))
+
+    def test_refresh_is_rate_limited(self):
+        self.index.rescan_min_s = 60
+        touch(self.volume, "models", "loras", "new.safetensors")
+
+        self.assertFalse(self.index.refresh())
+        self.assertTrue(self.index.refresh(force=True))
+        self.assertIsNotNone(self.index.find("loras", "new.safetensors"))
+
+
+class TestHandlerModelCheck(unittest.IsolatedAsyncioTestCase, ModelDirectories):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.05).start()
+        self.env = patch.dict(
+            os.environ,
+            {"COMFY_OUTPUT_PATH": self.output_dir, "BACKEND_WS_URL": "", "DETAILED_COMFY_LOGGING": "false"},
+        )
+        self.env.start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+        self.index = patch.object(rp_handler, "model_index", self.make_models())
+        self.index.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.event_dispatcher.close()
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        self.index.stop()
+        self.host.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_missing_lora_fails_before_queueing(self):
+        workflow = {
+            "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sd_xl_turbo_1.0_fp16.safetensors"}},
+            "10": {"class_type": "LoraLoader", "inputs": {"model": ["4", 0], "lora_name": "ink.safetensors"}},
+            "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "models", "images": ["10", 0]}},
+        }
+
+        result = await rp_handler.handler({"id": "job-1", "input": {"workflow": workflow}})
+
+        self.assertEqual(result["error"], "Missing model: node 10 (LoraLoader): lora_name 'ink.safetensors' not found in loras")
+        self.assertEqual(self.comfy.prompts, {})
+
+        # Copied to the network volume meanwhile
+        touch(self.volume, "models", "loras", "ink.safetensors")
+        result = await rp_handler.handler({"id": "job-2", "input": {"workflow": workflow}})
+        self.assertEqual(result["status"], "success")
@@ -0,0 +1,166 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+import threading
+import time
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import model_staging
+from src.model_index import ModelIndex
+from tests.fake_comfyui import FakeComfyUI
+
+MB = 1024**2
+
+
+def write(size, *path):
+    os.makedirs(os.path.dirname(os.path.join(*path)), exist_ok=True)
+    with open(os.path.join(*path), "wb") as f:
+        f.write(os.urandom(size))
+
+
+def loader(lora_name, ckpt_name="baked_in.safetensors"):
+    return {
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": ckpt_name}},
+        "10": {"class_type": "LoraLoader", "inputs": {"model": ["4", 0], "lora_name": lora_name}},
+        "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "staged", "images": ["10", 0]}},
+    }
+
+
+class StagingDirectories:
+    def make_staging(self, max_bytes=8 * MB):
+        self.comfy_models = tempfile.mkdtemp()
+        self.volume = os.path.join(tempfile.mkdtemp(), "models")
+        self.staged = os.path.join(tempfile.mkdtemp(), "models_staged")
+        write(1 * MB, self.comfy_models, "checkpoints", "baked_in.safetensors")
+        write(1 * MB, self.volume, "checkpoints", "juggernautXL_v9.safetensors")
+        for name in ("ink", "watercolor", "charcoal"):
+            write(3 * MB, self.volume, "loras", "style", f"{name}.safetensors")
+        config = os.path.join(tempfile.mkdtemp(), "extra_model_paths.yaml")
+        with open(config, "w") as f:
+            f.write(
+                f"volume:\n  base_path: {self.volume}\n  checkpoints: checkpoints/\n  loras: loras/\n"
+                f"staged:\n  base_path: {self.staged}\n  is_default: true\n  checkpoints: checkpoints/\n  loras: loras/\n"
+            )
+        self.index = ModelIndex(self.comfy_models, config, rescan_min_s=0)
+        self.index.build()
+        return model_staging.ModelStaging(self.index, self.volume, self.staged, max_bytes=max_bytes)
+
+    def staged_file(self, *name):
+        return os.path.join(self.staged, *name)
+
+
+class TestModelStaging(unittest.TestCase, StagingDirectories):
+    def setUp(self):
+        self.staging = self.make_staging()
+
+    def test_only_models_on_the_volume_are_copied(self):
+        pinned = self.staging.stage(loader("style/ink.safetensors"))
+
+        self.assertEqual(pinned, [os.path.join("loras", "style", "ink.safetensors")])
+        with open(self.staged_file("loras", "style", "ink.safetensors"), "rb") as staged, open(
+            os.path.join(self.volume, "loras", "style", "ink.safetensors"), "rb"
+        ) as source:
+            self.assertEqual(staged.read(), source.read())
+        self.assertFalse(os.path.exists(self.staged_file("checkpoints", "baked_in.safetensors")))
+        self.assertEqual(os.listdir(self.staged_file("loras", "style")), ["ink.safetensors"])
+
+        self.staging.unpin(pinned)
+        self.staging.stage(loader("style/ink.safetensors"))
+        stats = self.staging.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["bytes_copied"]), (1, 1, 3 * MB))
+
+    def test_least_recently_used_models_are_evicted(self):
+        for name in ("ink", "watercolor", "ink", "charcoal"):
+            self.staging.unpin(self.staging.stage(loader(f"style/{name}.safetensors")))
+
+        self.assertEqual(sorted(os.listdir(self.staged_file("loras", "style"))), ["charcoal.safetensors", "ink.safetensors"])
+        self.assertEqual(self.staging.stats()["evictions"], 1)
+        self.assertLessEqual(self.staging.total_bytes, self.staging.max_bytes)
+
+    def test_pinned_models_are_kept(self):
+        pinned = self.staging.stage(loader("style/ink.safetensors"))
+        self.staging.unpin(self.staging.stage(loader("style/watercolor.safetensors")))
+        self.staging.stage(loader("style/charcoal.safetensors"))
+
+        self.assertTrue(os.path.exists(self.staged_file("loras", "style", "ink.safetensors")))
+        self.assertFalse(os.path.exists(self.staged_file("loras", "style", "watercolor.safetensors")))
+        self.staging.unpin(pinned)
+
+    def test_models_that_do_not_fit_are_loaded_from_the_volume(self):
+        self.staging.max_bytes = 2 * MB
+
+        self.staging.stage(loader("style/ink.safetensors"))
+
+        self.assertEqual(self.staging.stats()["skipped"], 1)
+        self.assertFalse(os.path.exists(self.staged_file("loras", "style", "ink.safetensors")))
+
+    def test_concurrent_jobs_share_one_copy(self):
+        copy_file = self.staging._copy_file
+
+        def slow_copy(*args):
+            time.sleep(0.2)
+            copy_file(*args)
+
+        with patch.object(self.staging, "_copy_file", side_effect=slow_copy) as copy:
+            threads = [threading.Thread(target=self.staging.stage, args=(loader("style/ink.safetensors"),)) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(copy.call_count, 1)
+        self.assertEqual(self.staging._pins, {os.path.join("loras", "style", "ink.safetensors"): 3})
+
+    def test_staged_models_survive_a_restart(self):
+        self.staging.stage(loader("style/ink.safetensors"))
+        write(1 * MB, self.staged, "loras", "style", "watercolor.safetensors.1234abcd.staging")
+
+        restarted = model_staging.ModelStaging(self.index, self.volume, self.staged, max_bytes=8 * MB)
+
+        self.assertEqual(list(restarted.entries), [os.path.join("loras", "style", "ink.safetensors")])
+        self.assertEqual(restarted.total_bytes, 3 * MB)
+        self.assertEqual(os.listdir(self.staged_file("loras", "style")), ["ink.safetensors"])
+
+
+class TestHandlerStaging(unittest.IsolatedAsyncioTestCase, StagingDirectories):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.05).start()
+        self.env = patch.dict(
+            os.environ,
+            {"COMFY_OUTPUT_PATH": self.output_dir, "BACKEND_WS_URL": "", "DETAILED_COMFY_LOGGING": "false"},
+        )
+        self.env.start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+        self.staging = self.make_staging()
+        self.patches = [patch.object(rp_handler, "model_index", self.index), patch.object(rp_handler, "model_staging", self.staging)]
+        for patcher in self.patches:
+            patcher.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.event_dispatcher.close()
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        self.host.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_models_are_staged_before_queueing(self):
+        result = await rp_handler.handler(
+            {"id": "job-1", "input": {"workflow": loader("style/ink.safetensors", "juggernautXL_v9.safetensors")}}
+        )
+
+        self.assertEqual(result["status"], "success")
+        self.assertIn("models", result["timings"])
+        self.assertTrue(os.path.exists(self.staged_file("checkpoints", "juggernautXL_v9.safetensors")))
+        self.assertTrue(os.path.exists(self.staged_file("loras", "style", "ink.safetensors")))
+        # Released once the job is done
+        self.assertEqual(self.staging._pins, {})
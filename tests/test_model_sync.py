@@ -0,0 +1,151 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import json
+import hashlib
+import tempfile
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import model_sync
+from tests.fake_s3 import FakeS3
+
+BUCKET = "models-bucket"
+PART_SIZE = 64 * 1024
+
+
+class TestModelSync(unittest.TestCase):
+    def setUp(self):
+        self.s3 = FakeS3().start()
+        self.env = patch.dict(
+            os.environ,
+            {"AWS_ACCESS_KEY_ID": "key", "AWS_SECRET_ACCESS_KEY": "secret", "AWS_DEFAULT_REGION": "us-east-1"},
+        )
+        self.env.start()
+        self.backoff = patch.object(model_sync, "MODEL_SYNC_RETRY_BACKOFF_MS", 1)
+        self.backoff.start()
+        self.client = model_sync.get_client(self.s3.endpoint_url)
+        self.root = tempfile.mkdtemp()
+        self.objects = {
+            "models/checkpoints/sd_xl_turbo_1.0_fp16.safetensors": os.urandom(5 * PART_SIZE + 123),
+            "models/loras/style/ink.safetensors": os.urandom(PART_SIZE // 2),
+            "snapshots/2025-07-09_snapshot.json": b'{"comfyui": "v0.3.29"}',
+            "custom_nodes/empty.txt": b"",
+        }
+        for key, body in self.objects.items():
+            self.s3.objects[(BUCKET, key)] = body
+        self.publish_manifest()
+
+    def tearDown(self):
+        self.backoff.stop()
+        self.env.stop()
+        self.s3.stop()
+
+    def publish_manifest(self, **overrides):
+        manifest = model_sync.build_manifest(self.client, BUCKET)
+        for entry in manifest["objects"]:
+            entry.update(overrides.get(entry["key"], {}))
+        self.s3.objects[(BUCKET, "manifest.json")] = json.dumps(manifest).encode("utf-8")
+        return manifest
+
+    def syncer(self):
+        return model_sync.ModelSync(
+            self.client, BUCKET, self.root, os.path.join(self.root, ".state.json"), concurrency=8, part_size=PART_SIZE
+        )
+
+    def local(self, key):
+        with open(os.path.join(self.root, key), "rb") as f:
+            return f.read()
+
+    def test_first_sync_downloads_everything_in_ranged_parts(self):
+        self.s3.latency = 0.02
+
+        report = self.syncer().sync()
+
+        self.assertEqual((report["objects"], report["downloaded"], report["failed"]), (4, 4, []))
+        for key, body in self.objects.items():
+            self.assertEqual(self.local(key), body)
+        checkpoint_gets = [r for key, r in self.s3.gets if key.endswith("sd_xl_turbo_1.0_fp16.safetensors")]
+        self.assertEqual(len(checkpoint_gets), 6)
+        self.assertGreater(self.s3.max_parallel_gets, 1)
+        self.assertFalse([name for _, _, names in os.walk(self.root) for name in names if name.endswith(".sync")])
+        for step in ("manifest_ms", "plan_ms", "download_ms", "verify_ms", "delete_ms", "total_ms"):
+            self.assertIn(step, report)
+
+    def test_unchanged_manifest_costs_one_request(self):
+        self.syncer().sync()
+        self.s3.gets.clear()
+
+        report = self.syncer().sync()
+
+        self.assertFalse(report["manifest_changed"])
+        self.assertEqual((report["unchanged"], report["downloaded"]), (4, 0))
+        self.assertEqual(self.s3.gets, [("manifest.json", None)])
+
+    def test_only_changed_objects_are_fetched_and_removed_ones_deleted(self):
+        self.syncer().sync()
+        ink = "models/loras/style/ink.safetensors"
+        self.s3.objects[(BUCKET, ink)] = os.urandom(100)
+        del self.s3.objects[(BUCKET, "snapshots/2025-07-09_snapshot.json")]
+        self.publish_manifest()
+        self.s3.gets.clear()
+
+        report = self.syncer().sync()
+
+        self.assertEqual((report["downloaded"], report["deleted"], report["unchanged"]), (1, 1, 2))
+        self.assertEqual({key for key, _ in self.s3.gets}, {"manifest.json", ink})
+        self.assertEqual(self.local(ink), self.s3.objects[(BUCKET, ink)])
+        self.assertFalse(os.path.exists(os.path.join(self.root, "snapshots", "2025-07-09_snapshot.json")))
+
+    def test_files_removed_locally_are_fetched_again(self):
+        self.syncer().sync()
+        os.remove(os.path.join(self.root, "models/loras/style/ink.safetensors"))
+
+        report = self.syncer().sync()
+
+        self.assertEqual(report["downloaded"], 1)
+        self.assertEqual(self.local("models/loras/style/ink.safetensors"), self.objects["models/loras/style/ink.safetensors"])
+
+    def test_interrupted_download_resumes(self):
+        checkpoint = "models/checkpoints/sd_xl_turbo_1.0_fp16.safetensors"
+        # More failures than retries: one part of the checkpoint cannot be fetched on the first boot
+        self.s3.fail_gets[checkpoint] = model_sync.MODEL_SYNC_RETRIES + 1
+        syncer = self.syncer()
+        # One GET at a time, so all failures hit the same part
+        syncer.concurrency = 1
+        report = syncer.sync()
+        self.assertEqual(report["failed"], [checkpoint])
+        self.assertEqual(report["downloaded"], 3)
+        self.s3.gets.clear()
+
+        report = self.syncer().sync()
+
+        self.assertEqual((report["downloaded"], report["failed"]), (1, []))
+        self.assertEqual(self.local(checkpoint), self.objects[checkpoint])
+        # The parts fetched on the first boot were kept
+        self.assertEqual(len([key for key, _ in self.s3.gets if key == checkpoint]), 1)
+
+    def test_checksum_mismatch_is_not_installed(self):
+        ink = "models/loras/style/ink.safetensors"
+        self.publish_manifest(**{ink: {"sha256": hashlib.sha256(b"other").hexdigest()}})
+
+        report = self.syncer().sync()
+
+        self.assertEqual(report["failed"], [ink])
+        self.assertFalse(os.path.exists(os.path.join(self.root, ink)))
+        self.assertFalse(os.path.exists(os.path.join(self.root, ink + model_sync.PART_SUFFIX)))
+
+    def test_sha256_from_a_local_copy(self):
+        self.syncer().sync()
+
+        manifest = model_sync.build_manifest(self.client, BUCKET, sha256_root=self.root)
+
+        entry = next(entry for entry in manifest["objects"] if entry["key"] == "models/loras/style/ink.safetensors")
+        self.assertEqual(entry["sha256"], hashlib.sha256(self.objects[entry["key"]]).hexdigest())
+
+    def test_missing_manifest(self):
+        del self.s3.objects[(BUCKET, "manifest.json")]
+
+        with self.assertRaises(model_sync.NoManifest):
+            self.syncer().sync()
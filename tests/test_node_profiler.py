@@ -0,0 +1,164 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import io
+import json
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import node_profiler
+from tests.fake_comfyui import FakeComfyUI
+
+WORKFLOW = {
+    "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "model.safetensors"}},
+    "3": {"class_type": "KSampler", "inputs": {"seed": 1, "steps": 20}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "profiled"}},
+}
+
+
+def message(msg_type, **data):
+    return {"type": msg_type, "data": {"prompt_id": "p1", **data}}
+
+
+class TestJobProfile(unittest.TestCase):
+    def test_nodes_run_until_the_next_event(self):
+        profile = node_profiler.JobProfile(WORKFLOW)
+
+        profile.on_message(message("execution_start"))
+        profile.on_message(message("execution_cached", nodes=["4"]))
+        profile.on_message(message("executing", node="3"))
+        time.sleep(0.05)
+        profile.on_message(message("progress", node="3", value=20, max=20))
+        profile.on_message(message("executing", node="9"))
+        profile.on_message(message("executed", node="9", output={}))
+        profile.on_message(message("executing", node=None))
+
+        nodes = {entry["node"]: entry for entry in profile.nodes}
+        self.assertEqual(nodes["4"], {"node": "4", "class_type": "CheckpointLoaderSimple", "cached": True, "ms": 0.0})
+        self.assertEqual(nodes["3"]["class_type"], "KSampler")
+        self.assertFalse(nodes["3"]["cached"])
+        self.assertEqual(nodes["3"]["steps"], 20)
+        self.assertGreaterEqual(nodes["3"]["ms"], 50)
+        self.assertLess(nodes["9"]["ms"], 50)
+
+    def test_interrupted_node_is_not_recorded(self):
+        profile = node_profiler.JobProfile(WORKFLOW)
+
+        profile.on_message(message("executing", node="3"))
+        profile.on_message(message("execution_interrupted", node_id="3"))
+
+        self.assertEqual(profile.nodes, [])
+
+    def test_fingerprint_ignores_inputs(self):
+        other = {node_id: {**node, "inputs": {}} for node_id, node in WORKFLOW.items()}
+
+        self.assertEqual(node_profiler.workflow_fingerprint(WORKFLOW), node_profiler.workflow_fingerprint(other))
+        self.assertNotEqual(node_profiler.workflow_fingerprint(WORKFLOW), node_profiler.workflow_fingerprint({"3": WORKFLOW["3"]}))
+
+
+class TestNodeProfiler(unittest.TestCase):
+    def profile(self, sampler_ms):
+        profile = node_profiler.JobProfile(WORKFLOW)
+        profile.nodes = [
+            {"node": "4", "class_type": "CheckpointLoaderSimple", "cached": True, "ms": 0.0},
+            {"node": "3", "class_type": "KSampler", "cached": False, "ms": sampler_ms},
+            {"node": "9", "class_type": "SaveImage", "cached": False, "ms": 10.0},
+        ]
+        return profile
+
+    def test_aggregates_per_class_type_and_workflow(self):
+        profiler = node_profiler.NodeProfiler()
+        for sampler_ms in range(100, 1100, 10):
+            profiler.record(self.profile(float(sampler_ms)))
+
+        summary = profiler.summary()
+
+        self.assertEqual(summary["jobs"], 100)
+        self.assertEqual(list(summary["class_types"])[0], "KSampler")
+        sampler = summary["class_types"]["KSampler"]
+        self.assertEqual(sampler["count"], 100)
+        self.assertEqual(sampler["p50_ms"], 590.0)
+        self.assertEqual(sampler["p90_ms"], 990.0)
+        self.assertEqual(sampler["max_ms"], 1090.0)
+        self.assertEqual(summary["class_types"]["CheckpointLoaderSimple"], {"count": 0, "cached": 100, "total_ms": 0.0})
+
+        workflow = summary["workflows"][node_profiler.workflow_fingerprint(WORKFLOW)]
+        self.assertEqual(workflow["execution"]["count"], 100)
+        self.assertEqual(workflow["execution"]["max_ms"], 1100.0)
+        self.assertIn("3 KSampler", workflow["nodes"])
+
+    def test_percentiles_use_the_most_recent_samples(self):
+        profiler = node_profiler.NodeProfiler(max_samples=10)
+        for sampler_ms in [5000.0] * 10 + [100.0] * 10:
+            profiler.record(self.profile(sampler_ms))
+
+        sampler = profiler.summary()["class_types"]["KSampler"]
+
+        self.assertEqual(sampler["count"], 20)
+        self.assertEqual(sampler["max_ms"], 100.0)
+        self.assertEqual(sampler["total_ms"], 51000.0)
+
+    def test_dump_logs_and_writes_the_profile(self):
+        profiler = node_profiler.NodeProfiler()
+        profiler.record(self.profile(500.0))
+        path = os.path.join(tempfile.mkdtemp(), "profile.json")
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            profiler.dump(path)
+
+        logged = json.loads(output.getvalue())
+        self.assertEqual(logged["event"], "node_profile")
+        with open(path) as f:
+            self.assertEqual(json.load(f)["class_types"], logged["class_types"])
+
+
+class TestHandlerProfile(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.1).start()
+        self.env = patch.dict(
+            os.environ,
+            {"COMFY_OUTPUT_PATH": self.output_dir, "BACKEND_WS_URL": "", "DETAILED_COMFY_LOGGING": "false"},
+        )
+        self.env.start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+        self.profiler = patch.object(rp_handler, "node_profiler", node_profiler.NodeProfiler())
+        self.profiler.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.event_dispatcher.close()
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        self.profiler.stop()
+        self.host.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_profile_is_returned_on_request(self):
+        for seed in (1, 2):
+            workflow = {**WORKFLOW, "3": {"class_type": "KSampler", "inputs": {"seed": seed}}}
+            result = await rp_handler.handler({"id": f"job-{seed}", "input": {"workflow": workflow}})
+            self.assertEqual(result["status"], "success")
+
+        result = await rp_handler.handler({"id": "profile", "input": {"type": "node_profile"}})
+
+        profile = result["node_profile"]
+        self.assertEqual(profile["jobs"], 2)
+        self.assertEqual(set(profile["class_types"]), {"CheckpointLoaderSimple", "KSampler", "SaveImage"})
+        self.assertEqual(list(profile["workflows"]), [node_profiler.workflow_fingerprint(WORKFLOW)])
+        # The fake runs the last node of the workflow for 100 ms
+        self.assertGreaterEqual(profile["class_types"]["SaveImage"]["p50_ms"], 80)
+
+    async def test_request_fails_when_disabled(self):
+        with patch.object(rp_handler, "node_profiler", None):
+            result = await rp_handler.handler({"id": "profile", "input": {"type": "node_profile"}})
+
+        self.assertIn("disabled", result["error"])
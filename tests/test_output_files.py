@@ -0,0 +1,146 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import json
+import time
+import tempfile
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import output_files
+
+REF_WORKFLOW = os.path.join(os.path.dirname(__file__), "..", "ref", "wan_image_to_video_upscale_slow.json")
+
+
+def touch(path, mtime=None, data=b"video"):
+    with open(path, "wb") as f:
+        f.write(data)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+class TestVideoPrefixes(unittest.TestCase):
+    def test_prefix_of_video_combine_node(self):
+        with open(REF_WORKFLOW) as f:
+            workflow = json.load(f)
+
+        self.assertEqual(output_files.video_prefixes(workflow), ["output_video"])
+
+    def test_prefix_of_save_webm_placeholder(self):
+        workflow = {
+            "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI"}},
+            "12": {
+                "class_type": "SomeCustomSaver",
+                "inputs": {"filename_prefix": "output_video1a2b3c4d"},
+                "_meta": {"title": "Save {{SAVE-WEBM}}"},
+            },
+        }
+
+        self.assertEqual(output_files.video_prefixes(workflow), ["output_video1a2b3c4d"])
+
+
+class TestDirectoryIndex(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def test_directory_is_only_listed_again_after_it_changed(self):
+        touch(os.path.join(self.output_dir, "output_video_00001.mp4"))
+        index = output_files.DirectoryIndex(self.output_dir)
+
+        self.assertEqual(index.newest("output_video", "mp4"), "output_video_00001.mp4")
+        self.assertEqual(index.newest("output_video", "mp4"), "output_video_00001.mp4")
+        self.assertEqual(index.scans, 1)
+
+        touch(os.path.join(self.output_dir, "output_video_00002.mp4"), mtime=time.time() + 10)
+        # Make sure the directory mtime moves even on coarse clocks
+        os.utime(self.output_dir, ns=(0, os.stat(self.output_dir).st_mtime_ns + 1))
+
+        self.assertEqual(index.newest("output_video", "mp4"), "output_video_00002.mp4")
+        self.assertEqual(index.scans, 2)
+
+    def test_files_older_than_the_job_are_ignored(self):
+        touch(os.path.join(self.output_dir, "output_video_00001.mp4"), mtime=time.time() - 60)
+        index = output_files.DirectoryIndex(self.output_dir)
+
+        self.assertIsNone(index.newest("output_video", "mp4", since=time.time() - 10))
+
+    def test_find_video_prefers_mp4_and_the_job_prefix(self):
+        now = time.time()
+        touch(os.path.join(self.output_dir, "output_videoaaaa_00001.webm"), mtime=now)
+        touch(os.path.join(self.output_dir, "output_videoaaaa_00001.mp4"), mtime=now)
+        # Another job's video, written later
+        touch(os.path.join(self.output_dir, "output_videobbbb_00001.mp4"), mtime=now + 5)
+
+        path, ext, mime = output_files.find_video(self.output_dir, ["output_videoaaaa"])
+
+        self.assertEqual(os.path.basename(path), "output_videoaaaa_00001.mp4")
+        self.assertEqual((ext, mime), ("mp4", "video/mp4"))
+
+    def test_prefix_with_subfolder(self):
+        os.makedirs(os.path.join(self.output_dir, "videos"))
+        touch(os.path.join(self.output_dir, "videos", "clip_00001.webm"))
+
+        path, ext, _ = output_files.find_video(self.output_dir, ["videos/clip"])
+
+        self.assertEqual(path, os.path.join(self.output_dir, "videos", "clip_00001.webm"))
+        self.assertEqual(ext, "webm")
+
+
+class TestVideoOutputs(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.env = patch.dict(os.environ, {"COMFY_OUTPUT_PATH": self.output_dir, "DETAILED_COMFY_LOGGING": "false"})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+
+    def test_video_from_history_gifs(self):
+        touch(os.path.join(self.output_dir, "output_video_00001.mp4"))
+        outputs = {
+            "54": {"gifs": [{"filename": "output_video_00001.mp4", "subfolder": "", "type": "output",
+                             "format": "video/h264-mp4"}]}
+        }
+
+        result = rp_handler.process_output_images(outputs, "job-1")
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(
+            {k: result["outputs"][0][k] for k in ("node_id", "filename", "type", "mime")},
+            {"node_id": "54", "filename": "output_video_00001.mp4", "type": "video", "mime": "video/mp4"},
+        )
+
+    @patch.dict(os.environ, {"BUCKET_ENDPOINT_URL": "http://example.com"})
+    @patch("rp_handler.rp_upload.upload_file_to_bucket")
+    def test_video_is_uploaded_with_its_content_type(self, mock_upload):
+        mock_upload.return_value = "http://example.com/job-1/video.webm"
+        touch(os.path.join(self.output_dir, "clip_00001_.webm"))
+        outputs = {"7": {"images": [{"filename": "clip_00001_.webm", "subfolder": "", "type": "output"}],
+                         "animated": [True]}}
+
+        result = rp_handler.process_output_images(outputs, "job-1")
+
+        self.assertEqual(result["message"], "http://example.com/job-1/video.webm")
+        self.assertEqual(result["outputs"][0]["type"], "video")
+        self.assertEqual(mock_upload.call_args.kwargs["extra_args"], {"ContentType": "video/webm"})
+        self.assertEqual(mock_upload.call_args.kwargs["prefix"], "job-1")
+
+    @patch.dict(os.environ, {"BUCKET_ENDPOINT_URL": "http://example.com"})
+    @patch("rp_handler.rp_upload.upload_file_to_bucket")
+    def test_fallback_finds_this_jobs_video_by_prefix(self, mock_upload):
+        mock_upload.return_value = "http://example.com/job-1/video.mp4"
+        started = time.time()
+        touch(os.path.join(self.output_dir, "output_videoaaaa_00001.mp4"), mtime=started + 1)
+        touch(os.path.join(self.output_dir, "output_videobbbb_00001.mp4"), mtime=started + 2)
+        workflow = {"54": {"class_type": "VHS_VideoCombine", "inputs": {"filename_prefix": "output_videoaaaa"}}}
+        outputs = {"9": {"images": [{"filename": "missing.png", "subfolder": ""}]}}
+
+        result = rp_handler.process_output_images(outputs, "job-1", workflow, started)
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(
+            mock_upload.call_args.kwargs["file_location"],
+            os.path.join(self.output_dir, "output_videoaaaa_00001.mp4"),
+        )
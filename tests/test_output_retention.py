@@ -0,0 +1,212 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import time
+import tempfile
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import output_retention
+from tests.fake_comfyui import FakeComfyUI
+
+WORKFLOW = {"9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI"}}}
+
+
+def write(path, size=100, age=0):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    if age:
+        stamp = time.time() - age
+        os.utime(path, (stamp, stamp))
+    return path
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestOutputRetention(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.retention = output_retention.OutputRetention(
+            self.output_dir, max_bytes=10_000, max_age_s=3600, interval_s=3600, delete_delivered=True
+        )
+
+    def tearDown(self):
+        self.retention.stop()
+
+    def path(self, name):
+        return os.path.join(self.output_dir, name)
+
+    def test_delivered_files_are_deleted_in_the_background(self):
+        delivered = write(self.path("a.png"))
+        kept = write(self.path("b.png"))
+        self.retention.start()
+
+        self.retention.delivered([delivered])
+
+        self.assertTrue(wait_until(lambda: not os.path.exists(delivered)))
+        self.assertTrue(os.path.exists(kept))
+        self.assertEqual(self.retention.stats()["delivered_deleted"], 1)
+        self.assertEqual(self.retention.stats()["bytes_reclaimed"], 100)
+
+    def test_pinned_file_is_deleted_only_after_unpin(self):
+        delivered = write(self.path("a.png"))
+        self.retention.pin([delivered])
+        self.retention.delivered([delivered])
+
+        self.retention.delete_pending()
+        self.assertTrue(os.path.exists(delivered))
+
+        self.retention.unpin([delivered])
+        self.retention.delete_pending()
+        self.assertFalse(os.path.exists(delivered))
+
+    def test_file_pinned_during_a_sweep_is_kept(self):
+        old = write(self.path("old.png"), age=7200)
+        walk = os.walk
+
+        def walk_then_pin(top):
+            yield from walk(top)
+            # A job pins the file after the sweep has listed it
+            self.retention.pin([old])
+
+        with patch.object(output_retention.os, "walk", walk_then_pin):
+            self.retention.sweep()
+
+        self.assertTrue(os.path.exists(old))
+        self.assertEqual(self.retention.stats()["files"], 1)
+
+    def test_files_outside_the_output_directory_are_never_deleted(self):
+        outside = write(os.path.join(tempfile.mkdtemp(), "a.png"))
+
+        self.retention.delivered([outside, os.path.join(self.output_dir, "..", os.path.basename(outside))])
+        self.retention.delete_pending()
+
+        self.assertTrue(os.path.exists(outside))
+
+    def test_expired_files_are_removed(self):
+        old = write(self.path("old.png"), age=7200)
+        new = write(self.path("new.png"))
+
+        self.retention.sweep()
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        self.assertEqual(self.retention.stats()["expired"], 1)
+        self.assertEqual(self.retention.stats()["bytes"], 100)
+
+    def test_least_recently_used_files_are_evicted_over_budget(self):
+        os.makedirs(self.path("sub"))
+        oldest = write(self.path(os.path.join("sub", "a.png")), size=4000, age=300)
+        middle = write(self.path("b.png"), size=4000, age=200)
+        newest = write(self.path("c.png"), size=4000, age=100)
+
+        self.retention.sweep()
+
+        self.assertFalse(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(middle))
+        self.assertTrue(os.path.exists(newest))
+        stats = self.retention.stats()
+        self.assertEqual((stats["evicted"], stats["bytes"], stats["bytes_reclaimed"]), (1, 8000, 4000))
+
+    def test_files_of_running_jobs_are_kept(self):
+        write(self.path("earlier.png"), size=6000, age=300)
+        self.retention.job_started("job-1", time.time() - 10)
+        running = write(self.path("running.png"), size=6000)
+        self.retention.max_bytes = 1000
+
+        self.retention.sweep()
+
+        self.assertTrue(os.path.exists(running))
+        self.assertFalse(os.path.exists(self.path("earlier.png")))
+
+        self.retention.job_finished("job-1")
+        self.retention.sweep()
+        self.assertFalse(os.path.exists(running))
+
+
+class TestStaleOutputs(unittest.TestCase):
+    def test_stale_nodes_and_resave(self):
+        output_dir = tempfile.mkdtemp()
+        write(os.path.join(output_dir, "kept.png"))
+        outputs = {
+            "9": {"images": [{"filename": "kept.png", "subfolder": "", "type": "output"}]},
+            "12": {"images": [{"filename": "gone.png", "subfolder": "", "type": "output"}], "animated": [False]},
+            "20": {"images": [{"filename": "preview.png", "subfolder": "", "type": "temp"}]},
+        }
+        workflow = {"12": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI", "images": ["8", 0]}}}
+
+        self.assertEqual(output_retention.stale_nodes(outputs, output_dir), ["12"])
+        resaved = output_retention.resave_workflow(workflow, ["12"], "abc")
+        self.assertEqual(resaved["12"]["inputs"]["filename_prefix"], "ComfyUI_abc")
+        self.assertEqual(workflow["12"]["inputs"]["filename_prefix"], "ComfyUI")
+
+
+class TestHandlerRetention(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.05).start()
+        self.env = patch.dict(
+            os.environ,
+            {
+                "COMFY_OUTPUT_PATH": self.output_dir,
+                "BACKEND_WS_URL": f"ws://{self.comfy.host}/relay",
+                "DETAILED_COMFY_LOGGING": "false",
+            },
+        )
+        self.env.start()
+        self.retention = output_retention.OutputRetention(self.output_dir, interval_s=3600)
+        self.patches = [
+            patch.object(rp_handler, "COMFY_HOST", self.comfy.host),
+            patch.object(rp_handler, "output_retention", self.retention),
+        ]
+        for p in self.patches:
+            p.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        self.retention.stop()
+        for p in self.patches:
+            p.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_delivered_outputs_are_removed_and_cached_prompts_still_work(self):
+        first = await rp_handler.handler({"id": "job-1", "input": {"workflow": WORKFLOW}})
+        self.assertEqual(first["status"], "success")
+        self.assertTrue(wait_until(lambda: os.listdir(self.output_dir) == []))
+
+        # ComfyUI reports the deleted files of the first run for the identical prompt
+        second = await rp_handler.handler({"id": "job-2", "input": {"workflow": WORKFLOW}})
+
+        self.assertEqual(second["status"], "success")
+        self.assertEqual(len(self.comfy.prompts), 3)
+        self.assertNotEqual(second["outputs"][0]["filename"], first["outputs"][0]["filename"])
+        self.assertTrue(wait_until(lambda: os.listdir(self.output_dir) == []))
+
+    def test_outputs_are_pinned_before_they_are_checked(self):
+        path = write(os.path.join(self.output_dir, "ComfyUI_00001_.png"))
+        outputs = {"9": {"images": [{"filename": "ComfyUI_00001_.png", "subfolder": "", "type": "output"}]}}
+        exists = os.path.exists
+        pinned = []
+
+        def check(candidate):
+            pinned.append(os.path.realpath(candidate) in self.retention._pins)
+            return exists(candidate)
+
+        with patch.object(rp_handler.os.path, "exists", check):
+            result = rp_handler.process_output_images(outputs, "job-1", WORKFLOW)
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(pinned[0], True)
+        self.assertEqual(self.retention._pins, {})
+        self.retention.delete_pending()
+        self.assertFalse(os.path.exists(path))
@@ -0,0 +1,143 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import base64
+import tempfile
+import time
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from tests.fake_comfyui import FakeComfyUI, PNG_BYTES
+
+WORKFLOW = {
+    "5": {"class_type": "EmptyLatentImage", "inputs": {"width": 512, "height": 512, "batch_size": 4}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI"}},
+}
+
+
+class TestProcessOutputImages(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.output_dir, "sub"))
+        self.env = patch.dict(os.environ, {"COMFY_OUTPUT_PATH": self.output_dir, "DETAILED_COMFY_LOGGING": "false"})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+
+    def write(self, name, data=PNG_BYTES):
+        with open(os.path.join(self.output_dir, name), "wb") as f:
+            f.write(data)
+        return data
+
+    def test_every_output_is_returned(self):
+        first = self.write("a_00001_.png", b"first")
+        second = self.write("a_00002_.png", b"second")
+        third = self.write(os.path.join("sub", "b_00001_.jpg"), b"third")
+        outputs = {
+            "9": {"images": [{"filename": "a_00001_.png", "subfolder": "", "type": "output"},
+                             {"filename": "a_00002_.png", "subfolder": "", "type": "output"}]},
+            "12": {"images": [{"filename": "b_00001_.jpg", "subfolder": "sub", "type": "output"}]},
+            # Previews are not results
+            "20": {"images": [{"filename": "preview.png", "subfolder": "", "type": "temp"}]},
+        }
+
+        result = rp_handler.process_output_images(outputs, "job-1")
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(
+            [(o["node_id"], o["filename"], o["type"], o["mime"]) for o in result["outputs"]],
+            [
+                ("9", "a_00001_.png", "image", "image/png"),
+                ("9", "a_00002_.png", "image", "image/png"),
+                ("12", "b_00001_.jpg", "image", "image/jpeg"),
+            ],
+        )
+        self.assertEqual(
+            [base64.b64decode(o["data"]) for o in result["outputs"]], [first, second, third]
+        )
+        # The last output stays in "message" for existing clients
+        self.assertEqual(result["message"], result["outputs"][-1]["data"])
+        self.assertNotIn("errors", result)
+
+    def test_missing_files_are_reported_next_to_the_delivered_ones(self):
+        self.write("a_00001_.png")
+        outputs = {"9": {"images": [{"filename": "a_00001_.png", "subfolder": ""},
+                                    {"filename": "gone.png", "subfolder": ""}]}}
+
+        result = rp_handler.process_output_images(outputs, "job-1")
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(len(result["outputs"]), 1)
+        self.assertEqual(len(result["errors"]), 1)
+        self.assertIn("gone.png", result["errors"][0])
+
+    @patch.dict(os.environ, {"BUCKET_ENDPOINT_URL": "http://example.com"})
+    @patch("rp_handler.rp_upload.upload_image")
+    def test_uploads_run_in_parallel(self, mock_upload_image):
+        def slow_upload(job_id, path):
+            time.sleep(0.2)
+            return f"http://example.com/{job_id}/{os.path.basename(path)}"
+
+        mock_upload_image.side_effect = slow_upload
+        names = [f"a_{i:05}_.png" for i in range(4)]
+        for name in names:
+            self.write(name)
+        outputs = {"9": {"images": [{"filename": name, "subfolder": "", "type": "output"} for name in names]}}
+
+        start = time.perf_counter()
+        with patch.object(rp_handler, "_output_pool", None), patch.object(rp_handler, "COMFY_OUTPUT_WORKERS", 4):
+            result = rp_handler.process_output_images(outputs, "job-1")
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual([o["url"] for o in result["outputs"]], [f"http://example.com/job-1/{n}" for n in names])
+        # Four uploads of 200 ms each take about as long as one
+        self.assertLess(elapsed, 0.6)
+
+    @patch.dict(os.environ, {"BUCKET_ENDPOINT_URL": "http://example.com"})
+    @patch("rp_handler.rp_upload.upload_image")
+    def test_all_uploads_failing_is_an_error(self, mock_upload_image):
+        mock_upload_image.side_effect = RuntimeError("access denied")
+        self.write("a_00001_.png")
+        outputs = {"9": {"images": [{"filename": "a_00001_.png", "subfolder": ""}]}}
+
+        result = rp_handler.process_output_images(outputs, "job-1")
+
+        self.assertEqual(result["status"], "error")
+        self.assertIn("access denied", result["message"])
+
+
+class TestHandlerReturnsBatch(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.05).start()
+        self.env = patch.dict(
+            os.environ,
+            {
+                "COMFY_OUTPUT_PATH": self.output_dir,
+                "BACKEND_WS_URL": f"ws://{self.comfy.host}/relay",
+                "DETAILED_COMFY_LOGGING": "false",
+            },
+        )
+        self.env.start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        self.host.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_batch_of_four_returns_four_images(self):
+        result = await rp_handler.handler({"id": "job-1", "input": {"workflow": WORKFLOW}})
+
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(len(result["outputs"]), 4)
+        self.assertEqual(len({o["filename"] for o in result["outputs"]}), 4)
+        self.assertTrue(all(base64.b64decode(o["data"]) == PNG_BYTES for o in result["outputs"]))
@@ -0,0 +1,140 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import socket
+import tempfile
+import asyncio
+
+import aiohttp
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import readiness
+from src.comfy_client import ComfyClient
+from tests.fake_comfyui import FakeComfyUI
+
+WORKFLOW = {"9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI"}}}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestComfyReadiness(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.gate = readiness.ComfyReadiness(ComfyClient(retries=0), timeout_s=5)
+        self.gate.client.on_connection_error = self.gate.mark_down
+        self.fakes = []
+
+    async def asyncTearDown(self):
+        await self.gate.client.close()
+
+    def tearDown(self):
+        for fake in self.fakes:
+            fake.stop()
+
+    def start_fake(self):
+        fake = FakeComfyUI(port=self.port).start()
+        self.fakes.append(fake)
+        return fake
+
+    async def test_cold_start_waits_for_comfyui(self):
+        probe = asyncio.create_task(self.gate.ensure_ready(self.base_url))
+        await asyncio.sleep(0.3)
+        self.assertFalse(probe.done())
+        fake = await asyncio.to_thread(self.start_fake)
+
+        self.assertTrue(await asyncio.wait_for(probe, timeout=5))
+        self.assertTrue(self.gate.ready)
+        self.assertGreater(self.gate.probes, 1)
+        self.assertEqual(fake.system_stats_requests, 1)
+        self.assertEqual(self.gate.system_stats["system"]["comfyui_version"], "fake")
+
+    async def test_warm_path_makes_no_request(self):
+        fake = self.start_fake()
+        self.assertTrue(await self.gate.ensure_ready(self.base_url))
+
+        for _ in range(5):
+            self.assertTrue(await self.gate.ensure_ready(self.base_url))
+
+        self.assertEqual(fake.system_stats_requests, 1)
+
+    async def test_concurrent_callers_share_one_probe(self):
+        fake = self.start_fake()
+
+        results = await asyncio.gather(*(self.gate.ensure_ready(self.base_url) for _ in range(5)))
+
+        self.assertEqual(results, [True] * 5)
+        self.assertEqual(fake.system_stats_requests, 1)
+
+    async def test_reprobes_after_comfyui_crashed(self):
+        self.start_fake()
+        self.assertTrue(await self.gate.ensure_ready(self.base_url))
+
+        # ComfyUI dies, the next request of a job fails (on the pooled keep-alive
+        # connection this shows up as a disconnect rather than a refused connection)
+        self.fakes.pop().stop()
+        with self.assertRaises((aiohttp.ClientConnectorError, aiohttp.ServerDisconnectedError)):
+            await self.gate.client.get_json(f"{self.base_url}/history/123")
+        self.assertEqual(self.gate.state, readiness.DOWN)
+
+        # ... and is back up by the time the next job starts
+        restarted = self.start_fake()
+        self.assertTrue(await self.gate.ensure_ready(self.base_url))
+        self.assertEqual(restarted.system_stats_requests, 1)
+
+    async def test_gives_up_after_timeout(self):
+        self.gate.timeout_s = 0.3
+
+        self.assertFalse(await self.gate.ensure_ready(self.base_url))
+        self.assertEqual(self.gate.state, readiness.DOWN)
+
+
+class TestHandlerReadiness(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.05).start()
+        self.env = patch.dict(
+            os.environ,
+            {
+                "COMFY_OUTPUT_PATH": self.output_dir,
+                "BACKEND_WS_URL": f"ws://{self.comfy.host}/relay",
+                "DETAILED_COMFY_LOGGING": "false",
+            },
+        )
+        self.env.start()
+        self.patches = [
+            patch.object(rp_handler, "COMFY_HOST", self.comfy.host),
+            patch.object(rp_handler, "readiness", readiness.ComfyReadiness(rp_handler.comfy_client)),
+        ]
+        for p in self.patches:
+            p.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_warm_jobs_skip_the_probe(self):
+        for i in range(3):
+            result = await rp_handler.handler({"id": f"job-{i}", "input": {"workflow": WORKFLOW}})
+            self.assertEqual(result["status"], "success")
+
+        self.assertEqual(self.comfy.system_stats_requests, 1)
+
+    async def test_unreachable_comfyui_is_reported(self):
+        rp_handler.readiness.timeout_s = 0.2
+        with patch.object(rp_handler, "COMFY_HOST", f"127.0.0.1:{free_port()}"):
+            result = await rp_handler.handler({"id": "job-x", "input": {"workflow": WORKFLOW}})
+
+        self.assertEqual(result["error"], "ComfyUI API is not reachable")
@@ -0,0 +1,145 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import base64
+import tempfile
+import time
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import result_cache
+from tests.fake_comfyui import FakeComfyUI, PNG_BYTES
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {"seed": 1337, "steps": 20}, "_meta": {"title": "KSampler"}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI"}},
+}
+
+
+class TestResultKey(unittest.TestCase):
+    def test_titles_and_key_order_do_not_matter(self):
+        reordered = {
+            "9": {"inputs": {"filename_prefix": "ComfyUI"}, "class_type": "SaveImage", "_meta": {"title": "Save"}},
+            "3": {"inputs": {"steps": 20, "seed": 1337}, "class_type": "KSampler"},
+        }
+
+        self.assertEqual(result_cache.result_key(WORKFLOW), result_cache.result_key(reordered))
+
+    def test_inputs_change_the_key(self):
+        other_seed = {**WORKFLOW, "3": {**WORKFLOW["3"], "inputs": {"seed": 1338, "steps": 20}}}
+
+        self.assertNotEqual(result_cache.result_key(WORKFLOW), result_cache.result_key(other_seed))
+        self.assertNotEqual(result_cache.result_key(WORKFLOW), result_cache.result_key(WORKFLOW, delivery="bucket"))
+
+    def test_images_are_keyed_by_content(self):
+        workflow = {"1": {"class_type": "LoadImage", "inputs": {"image": "a.png"}}}
+        renamed = {"1": {"class_type": "LoadImage", "inputs": {"image": "b.png"}}}
+
+        self.assertEqual(
+            result_cache.result_key(workflow, {"a.png": "abc"}), result_cache.result_key(renamed, {"b.png": "abc"})
+        )
+        self.assertNotEqual(
+            result_cache.result_key(workflow, {"a.png": "abc"}), result_cache.result_key(workflow, {"a.png": "def"})
+        )
+
+
+class TestResultCache(unittest.TestCase):
+    def test_results_expire(self):
+        cache = result_cache.ResultCache(ttl_s=60)
+        cache.put("a", {"status": "success"}, ttl_s=0.05)
+
+        self.assertEqual(cache.get("a"), {"status": "success"})
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_least_recently_used_results_are_evicted(self):
+        cache = result_cache.ResultCache(ttl_s=60, max_bytes=100)
+        cache.put("a", {"data": "a" * 30})
+        cache.put("b", {"data": "b" * 30})
+        cache.get("a")
+        cache.put("c", {"data": "c" * 30})
+
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertLessEqual(cache.total_bytes, 100)
+        # Larger than the whole budget
+        cache.put("d", {"data": "d" * 200})
+        self.assertIsNone(cache.get("d"))
+
+
+class TestHandlerResultCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.2).start()
+        self.env = patch.dict(
+            os.environ,
+            {"COMFY_OUTPUT_PATH": self.output_dir, "BACKEND_WS_URL": "", "DETAILED_COMFY_LOGGING": "false"},
+        )
+        self.env.start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+        self.cache = patch.object(rp_handler, "result_cache", result_cache.ResultCache(ttl_s=60))
+        self.cache.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        self.cache.stop()
+        self.host.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_identical_job_is_answered_from_the_cache(self):
+        first = await rp_handler.handler({"id": "job-1", "input": {"workflow": WORKFLOW}})
+
+        start = time.perf_counter()
+        second = await rp_handler.handler({"id": "job-2", "input": {"workflow": WORKFLOW}})
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(first["status"], "success")
+        self.assertNotIn("cached", first)
+        self.assertTrue(second["cached"])
+        self.assertEqual(second["outputs"], first["outputs"])
+        self.assertEqual(len(self.comfy.prompts), 1)
+        self.assertLess(elapsed, 0.1)
+
+    async def test_same_image_under_another_name_is_a_hit(self):
+        image = base64.b64encode(PNG_BYTES).decode("utf-8")
+        workflow = {**WORKFLOW, "1": {"class_type": "LoadImage", "inputs": {"image": "a.png"}}}
+        renamed = {**WORKFLOW, "1": {"class_type": "LoadImage", "inputs": {"image": "b.png"}}}
+
+        await rp_handler.handler({"id": "job-1", "input": {"workflow": workflow, "images": [{"name": "a.png", "image": image}]}})
+        second = await rp_handler.handler(
+            {"id": "job-2", "input": {"workflow": renamed, "images": [{"name": "b.png", "image": image}]}}
+        )
+
+        self.assertTrue(second["cached"])
+        self.assertEqual(len(self.comfy.prompts), 1)
+
+    async def test_cache_can_be_skipped_per_job(self):
+        await rp_handler.handler({"id": "job-1", "input": {"workflow": WORKFLOW}})
+        second = await rp_handler.handler({"id": "job-2", "input": {"workflow": WORKFLOW, "cache": False}})
+
+        self.assertNotIn("cached", second)
+        self.assertEqual(len(self.comfy.prompts), 2)
+
+    async def test_images_are_hashed_once_per_job(self):
+        image = base64.b64encode(PNG_BYTES).decode("utf-8")
+        workflow = {**WORKFLOW, "1": {"class_type": "LoadImage", "inputs": {"image": "a.png"}}}
+        cache = rp_handler.InputImageCache(tempfile.mkdtemp(), 10_000_000)
+
+        with patch.object(rp_handler, "input_cache", cache), patch.object(
+            rp_handler, "digest_b64", wraps=rp_handler.digest_b64
+        ) as digest:
+            result = await rp_handler.handler(
+                {"id": "job-1", "input": {"workflow": workflow, "images": [{"name": "a.png", "image": image}]}}
+            )
+
+        self.assertEqual(result["status"], "success")
+        # The result cache key and the input image cache share the digest
+        self.assertEqual(digest.call_count, 1)
@@ -1,13 +1,15 @@
 import unittest
-from unittest.mock import patch, MagicMock, mock_open, Mock
+from unittest.mock import patch, MagicMock, mock_open, Mock, AsyncMock
 import sys
 import os
 import json
 import base64
+import asyncio
 
 # Make sure that "src" is known and can be used to import rp_handler.py
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
 from src import rp_handler
+from comfy_client import ComfyResponse, ComfyHTTPError
 
 # Local folder for test resources
 RUNPOD_WORKER_COMFY_TEST_RESOURCES_IMAGES = "./test_resources/images"
@@ -64,55 +66,30 @@ class TestRunpodWorkerComfy(unittest.TestCase):
         self.assertIsNotNone(error)
         self.assertEqual(error, "Please provide input")
 
-    @patch("rp_handler.requests.get")
-    def test_check_server_server_up(self, mock_requests):
-        mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_requests.return_value = mock_response
-
-        result = rp_handler.check_server("http://127.0.0.1:8188", 1, 50)
-        self.assertTrue(result)
-
-    @patch("rp_handler.requests.get")
-    def test_check_server_server_down(self, mock_requests):
-        mock_requests.get.side_effect = rp_handler.requests.RequestException()
-        result = rp_handler.check_server("http://127.0.0.1:8188", 1, 50)
-        self.assertFalse(result)
-
-    @patch("rp_handler.urllib.request.urlopen")
-    def test_queue_prompt(self, mock_urlopen):
-        mock_response = MagicMock()
-        mock_response.read.return_value = json.dumps({"prompt_id": "123"}).encode()
-        mock_urlopen.return_value = mock_response
-        result = rp_handler.queue_workflow({"prompt": "test"})
+    @patch.object(rp_handler.comfy_client, "request", new_callable=AsyncMock)
+    def test_queue_prompt(self, mock_request):
+        mock_request.return_value = ComfyResponse(200, json.dumps({"prompt_id": "123"}).encode())
+        result = asyncio.run(rp_handler.queue_workflow({"prompt": "test"}))
         self.assertEqual(result, {"prompt_id": "123"})
 
-    @patch("rp_handler.urllib.request.urlopen")
-    def test_get_history(self, mock_urlopen):
-        # Mock response data as a JSON string
-        mock_response_data = json.dumps({"key": "value"}).encode("utf-8")
-
-        # Define a mock response function for `read`
-        def mock_read():
-            return mock_response_data
-
-        # Create a mock response object
-        mock_response = Mock()
-        mock_response.read = mock_read
+    @patch.object(rp_handler.comfy_client, "request", new_callable=AsyncMock)
+    def test_queue_prompt_rejected(self, mock_request):
+        mock_request.return_value = ComfyResponse(400, b'{"error": "invalid prompt"}')
+        with self.assertRaises(ComfyHTTPError) as ctx:
+            asyncio.run(rp_handler.queue_workflow({"prompt": "test"}))
+        self.assertIn("invalid prompt", str(ctx.exception))
 
-        # Mock the __enter__ and __exit__ methods to support the context manager
-        mock_response.__enter__ = lambda s: s
-        mock_response.__exit__ = Mock()
-
-        # Set the return value of the urlopen mock
-        mock_urlopen.return_value = mock_response
+    @patch.object(rp_handler.comfy_client, "request", new_callable=AsyncMock)
+    def test_get_history(self, mock_request):
+        # Mock response data as a JSON string
+        mock_request.return_value = ComfyResponse(200, json.dumps({"key": "value"}).encode("utf-8"))
 
         # Call the function under test
-        result = rp_handler.get_history("123")
+        result = asyncio.run(rp_handler.get_history("123"))
 
         # Assertions
         self.assertEqual(result, {"key": "value"})
-        mock_urlopen.assert_called_with("http://127.0.0.1:8188/history/123")
+        mock_request.assert_called_with("GET", "http://127.0.0.1:8188/history/123")
 
     @patch("builtins.open", new_callable=mock_open, read_data=b"test")
     def test_base64_encode(self, mock_file):
@@ -201,34 +178,29 @@ class TestRunpodWorkerComfy(unittest.TestCase):
         self.assertIn("simulated_uploaded", result["message"])
         self.assertEqual(result["status"], "success")
 
-    @patch("rp_handler.requests.post")
-    def test_upload_images_successful(self, mock_post):
-        mock_response = unittest.mock.Mock()
-        mock_response.status_code = 200
-        mock_response.text = "Successfully uploaded"
-        mock_post.return_value = mock_response
+    @patch.object(rp_handler.comfy_client, "request", new_callable=AsyncMock)
+    def test_upload_images_successful(self, mock_request):
+        mock_request.return_value = ComfyResponse(200, b"Successfully uploaded")
 
         test_image_data = base64.b64encode(b"Test Image Data").decode("utf-8")
 
         images = [{"name": "test_image.png", "image": test_image_data}]
 
-        responses = rp_handler.upload_images(images)
+        responses = asyncio.run(rp_handler.upload_images(images))
 
         self.assertEqual(len(responses), 3)
         self.assertEqual(responses["status"], "success")
 
-    @patch("rp_handler.requests.post")
-    def test_upload_images_failed(self, mock_post):
-        mock_response = unittest.mock.Mock()
-        mock_response.status_code = 400
-        mock_response.text = "Error uploading"
-        mock_post.return_value = mock_response
+    @patch.object(rp_handler.comfy_client, "request", new_callable=AsyncMock)
+    def test_upload_images_failed(self, mock_request):
+        mock_request.return_value = ComfyResponse(400, b"Error uploading")
 
         test_image_data = base64.b64encode(b"Test Image Data").decode("utf-8")
 
         images = [{"name": "test_image.png", "image": test_image_data}]
 
-        responses = rp_handler.upload_images(images)
+        responses = asyncio.run(rp_handler.upload_images(images))
 
         self.assertEqual(len(responses), 3)
         self.assertEqual(responses["status"], "error")
+        self.assertEqual(responses["details"], ["Error uploading test_image.png: Error uploading"])
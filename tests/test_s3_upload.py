@@ -0,0 +1,114 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+import time
+import urllib.request
+
+from botocore.exceptions import ClientError
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import s3_upload
+from tests.fake_s3 import FakeS3
+
+
+class TestS3Upload(unittest.TestCase):
+    def setUp(self):
+        self.s3 = FakeS3().start()
+        self.env = patch.dict(
+            os.environ,
+            {
+                "BUCKET_ENDPOINT_URL": self.s3.endpoint_url,
+                "BUCKET_ACCESS_KEY_ID": "key",
+                "BUCKET_SECRET_ACCESS_KEY": "secret",
+            },
+        )
+        self.env.start()
+        self.backoff = patch.object(s3_upload, "S3_UPLOAD_RETRY_BACKOFF_MS", 1)
+        self.backoff.start()
+        self.client = s3_upload.get_client()
+
+    def tearDown(self):
+        self.backoff.stop()
+        self.env.stop()
+        self.s3.stop()
+
+    def file(self, size):
+        data = os.urandom(size)
+        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as f:
+            f.write(data)
+        self.addCleanup(os.remove, f.name)
+        return f.name, data
+
+    def test_client_is_reused(self):
+        self.assertIs(s3_upload.get_client(), self.client)
+
+    def test_small_file_is_uploaded_in_one_request(self):
+        path, data = self.file(1000)
+
+        stats = s3_upload.upload_file(self.client, path, "bucket", "job/a.mp4", "video/mp4", threshold=4096)
+
+        self.assertEqual(stats["parts"], 1)
+        self.assertEqual(self.s3.objects[("bucket", "job/a.mp4")], data)
+        self.assertEqual(self.s3.content_types[("bucket", "job/a.mp4")], "video/mp4")
+
+    def test_large_file_is_uploaded_in_parallel_parts(self):
+        path, data = self.file(8 * 65536 + 123)
+        self.s3.latency = 0.1
+
+        start = time.perf_counter()
+        stats = s3_upload.upload_file(
+            self.client, path, "bucket", "job/big.mp4", "video/mp4", part_size=65536, threshold=65536
+        )
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(stats["parts"], 9)
+        self.assertEqual(self.s3.objects[("bucket", "job/big.mp4")], data)
+        self.assertEqual(self.s3.content_types[("bucket", "job/big.mp4")], "video/mp4")
+        self.assertGreater(self.s3.max_parallel_parts, 1)
+        # Nine parts of 200 ms each (body and answer are delayed), sent side by side
+        self.assertLess(elapsed, 9 * 0.2 / 2)
+
+    def test_failed_part_is_retried_alone(self):
+        path, data = self.file(4 * 65536)
+        self.s3.fail_parts = {3: 2}
+
+        s3_upload.upload_file(self.client, path, "bucket", "job/big.mp4", "video/mp4", part_size=65536, threshold=0)
+
+        self.assertEqual(self.s3.objects[("bucket", "job/big.mp4")], data)
+        self.assertEqual(self.s3.part_attempts, {1: 1, 2: 1, 3: 3, 4: 1})
+
+    def test_upload_is_aborted_when_a_part_keeps_failing(self):
+        path, _ = self.file(4 * 65536)
+        self.s3.fail_parts = {2: 100}
+
+        with self.assertRaises(ClientError):
+            s3_upload.upload_file(self.client, path, "bucket", "job/big.mp4", "video/mp4", part_size=65536, threshold=0)
+
+        self.assertEqual(len(self.s3.aborted), 1)
+        self.assertNotIn(("bucket", "job/big.mp4"), self.s3.objects)
+
+    def test_upload_output_returns_a_working_presigned_url(self):
+        path, data = self.file(1000)
+
+        url = s3_upload.upload_output("job-1", path, "video/mp4")
+
+        self.assertTrue(url.startswith(f"{self.s3.endpoint_url}/{time.strftime('%m-%y')}/job-1/"))
+        with urllib.request.urlopen(url) as response:
+            self.assertEqual(response.read(), data)
+
+    def test_handler_outputs_go_through_the_engine(self):
+        output_dir = tempfile.mkdtemp()
+        with open(os.path.join(output_dir, "clip_00001.mp4"), "wb") as f:
+            f.write(b"video")
+        outputs = {"54": {"gifs": [{"filename": "clip_00001.mp4", "subfolder": "", "type": "output"}]}}
+
+        with patch.dict(os.environ, {"COMFY_OUTPUT_PATH": output_dir, "DETAILED_COMFY_LOGGING": "false"}):
+            result = rp_handler.process_output_images(outputs, "job-1")
+
+        self.assertEqual(result["status"], "success")
+        self.assertTrue(result["outputs"][0]["url"].startswith(self.s3.endpoint_url))
+        self.assertEqual(list(self.s3.objects.values()), [b"video"])
@@ -0,0 +1,125 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import io
+import json
+import functools
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import timings
+from tests.fake_comfyui import FakeComfyUI
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {"seed": 7}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "timed"}},
+}
+
+
+class TestJobTimings(unittest.TestCase):
+    def test_stages_add_up(self):
+        job_timings = timings.JobTimings(enabled=True)
+        for _ in range(2):
+            with job_timings.stage("upload"):
+                time.sleep(0.01)
+        job_timings.add("output_encode", 0.5)
+
+        stages = job_timings.as_dict()
+
+        self.assertGreaterEqual(stages["upload"], 20)
+        self.assertEqual(stages["output_encode"], 500)
+        self.assertGreaterEqual(stages["total"], stages["upload"])
+
+    def test_comfy_wait_is_split_at_execution_start(self):
+        job_timings = timings.JobTimings(enabled=True)
+        start = time.perf_counter()
+        job_timings.on_message({"type": "execution_start", "data": {"prompt_id": "p1"}})
+        job_timings.execution_started = start + 0.3
+
+        job_timings.comfy_wait(start, start + 1.0)
+
+        stages = job_timings.as_dict()
+        self.assertAlmostEqual(stages["queue_wait"], 300, delta=1)
+        self.assertAlmostEqual(stages["execution"], 700, delta=1)
+
+    def test_without_execution_start_everything_is_execution(self):
+        job_timings = timings.JobTimings(enabled=True)
+
+        job_timings.comfy_wait(10.0, 10.5)
+
+        self.assertNotIn("queue_wait", job_timings.as_dict())
+        self.assertEqual(job_timings.as_dict()["execution"], 500)
+
+    def test_disabled_timings_record_nothing(self):
+        job_timings = timings.JobTimings(enabled=False)
+        with job_timings.stage("upload"):
+            pass
+        job_timings.add("output_encode", 1)
+
+        self.assertEqual(job_timings.stages, {})
+
+    def test_overhead_is_negligible(self):
+        job_timings = timings.JobTimings(enabled=True)
+
+        start = time.perf_counter()
+        for _ in range(10000):
+            with job_timings.stage("queue"):
+                pass
+        per_stage = (time.perf_counter() - start) / 10000
+
+        # A job has about ten stages
+        self.assertLess(per_stage * 10, 0.001)
+
+
+class TestHandlerTimings(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.2).start()
+        self.env = patch.dict(
+            os.environ,
+            {"COMFY_OUTPUT_PATH": self.output_dir, "BACKEND_WS_URL": "", "DETAILED_COMFY_LOGGING": "false"},
+        )
+        self.env.start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.event_dispatcher.close()
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        self.host.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_result_and_log_carry_the_stages(self):
+        with patch.object(rp_handler, "JobTimings", functools.partial(timings.JobTimings, enabled=True)):
+            output = io.StringIO()
+            with redirect_stdout(output):
+                result = await rp_handler.handler({"id": "job-1", "input": {"workflow": WORKFLOW}})
+
+        self.assertEqual(result["status"], "success")
+        stages = result["timings"]
+        for stage in ("validate", "readiness", "upload", "queue", "queue_wait", "execution", "outputs", "output_encode", "total"):
+            self.assertIn(stage, stages)
+        # The fake takes 200 ms to run the prompt
+        self.assertGreaterEqual(stages["execution"], 150)
+        self.assertLess(stages["execution"], stages["total"])
+
+        lines = [json.loads(line) for line in output.getvalue().splitlines() if line.startswith('{"event": "job_timings"')]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]["job_id"], "job-1")
+        self.assertEqual(lines[0]["status"], "success")
+        self.assertEqual(lines[0]["timings_ms"], stages)
+
+    async def test_timings_can_be_turned_off(self):
+        with patch.object(rp_handler, "JobTimings", functools.partial(timings.JobTimings, enabled=False)):
+            result = await rp_handler.handler({"id": "job-1", "input": {"workflow": WORKFLOW}})
+
+        self.assertEqual(result["status"], "success")
+        self.assertNotIn("timings", result)
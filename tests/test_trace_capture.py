@@ -0,0 +1,160 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import json
+import base64
+import tempfile
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import trace_capture
+from src.warmup import blank_png
+from tests import replay_traces
+from tests.fake_comfyui import FakeComfyUI
+
+PROMPT = "a lighthouse on a cliff at dusk, volumetric fog, highly detailed, 35mm photograph, golden hour"
+WORKFLOW = {
+    "6": {"class_type": "CLIPTextEncode", "inputs": {"text": PROMPT, "clip": ["4", 1]}, "_meta": {"title": "Prompt"}},
+    "10": {"class_type": "LoadImage", "inputs": {"image": "photo.png"}},
+    "3": {"class_type": "KSampler", "inputs": {"seed": 5, "steps": 20, "sampler_name": "euler", "positive": ["6", 0]}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "traced", "images": ["3", 0]}},
+}
+
+
+class TestTraceCapture(unittest.TestCase):
+    def test_workflow_keeps_its_shape_without_prompts(self):
+        shape = trace_capture.sanitize_workflow(WORKFLOW)
+
+        self.assertEqual(shape["6"], {"class_type": "CLIPTextEncode", "inputs": {"text": f"<{len(PROMPT)} chars>", "clip": ["4", 1]}})
+        self.assertEqual(shape["3"]["inputs"]["sampler_name"], "euler")
+        self.assertEqual(shape["9"]["inputs"]["images"], ["3", 0])
+        self.assertEqual(shape["9"]["inputs"]["filename_prefix"], "<6 chars>")
+
+    def test_all_free_text_is_masked(self):
+        workflow = {
+            "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sd_xl_base_1.0.safetensors"}},
+            "7": {"class_type": "CLIPTextEncode", "inputs": {"text": "blurry", "clip": ["4", 1]}},
+            "12": {"class_type": "CustomPrompts", "inputs": {"prompts": ["red car", {"text": "at night", "weight": 0.5}]}},
+        }
+
+        shape = trace_capture.sanitize_workflow(workflow)
+
+        self.assertEqual(shape["4"]["inputs"]["ckpt_name"], "sd_xl_base_1.0.safetensors")
+        self.assertEqual(shape["7"]["inputs"]["text"], "<6 chars>")
+        self.assertEqual(shape["12"]["inputs"]["prompts"], ["<7 chars>", {"text": "<8 chars>", "weight": 0.5}])
+
+    def test_image_names_are_replaced_by_placeholders(self):
+        images = [{"name": "Holiday Photo.PNG", "image": base64.b64encode(bytes(10)).decode("utf-8")}]
+        workflow = {
+            "10": {"class_type": "LoadImage", "inputs": {"image": "Holiday Photo.PNG"}},
+            "11": {"class_type": "LoadImage", "inputs": {"image": "already_on_comfyui.png"}},
+        }
+        placeholders = trace_capture.image_placeholders(images)
+
+        shape = trace_capture.sanitize_workflow(workflow, placeholders)
+
+        self.assertEqual(shape["10"]["inputs"]["image"], "image_0.png")
+        self.assertEqual(shape["11"]["inputs"]["image"], "image.png")
+        self.assertEqual(trace_capture.image_sizes(images, placeholders), [{"name": "image_0.png", "bytes": 10}])
+
+    def test_image_sizes_without_payloads(self):
+        for size in (1, 2, 3, 100):
+            data = base64.b64encode(bytes(size)).decode("utf-8")
+            self.assertEqual(trace_capture.image_sizes([{"name": "a.png", "image": data}]), [{"name": "image_0.png", "bytes": size}])
+
+    def test_node_durations_from_the_timeline(self):
+        events = [
+            [0.0, "execution_start"],
+            [1.0, "execution_cached", ["4"]],
+            [2.0, "executing", "6"],
+            [12.0, "executing", "3"],
+            [500.0, "progress", "3"],
+            [1012.0, "executing", "9"],
+            [1040.0, "executed", "9"],
+            [1041.0, "execution_success"],
+            [1042.0, "executing", None],
+        ]
+
+        self.assertEqual(trace_capture.node_durations(events), {"6": 10.0, "3": 1000.0, "9": 28.0})
+
+    def test_sampling(self):
+        self.assertTrue(all(trace_capture.TraceWriter("unused", sample_rate=1).sample() for _ in range(100)))
+        self.assertFalse(any(trace_capture.TraceWriter("unused", sample_rate=0).sample() for _ in range(100)))
+
+
+class TestCaptureAndReplay(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.path = os.path.join(tempfile.mkdtemp(), "traces.jsonl")
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.1).start()
+        self.env = patch.dict(
+            os.environ,
+            {"COMFY_OUTPUT_PATH": self.output_dir, "BACKEND_WS_URL": "", "DETAILED_COMFY_LOGGING": "false"},
+        )
+        self.env.start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+        self.writer = patch.object(rp_handler, "trace_writer", trace_capture.TraceWriter(self.path))
+        self.writer.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.event_dispatcher.close()
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        self.writer.stop()
+        self.host.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_captured_traces_replay(self):
+        image = base64.b64encode(blank_png(16, 16)).decode("utf-8")
+        for seed in (1, 2):
+            workflow = {**WORKFLOW, "3": {**WORKFLOW["3"], "inputs": {**WORKFLOW["3"]["inputs"], "seed": seed}}}
+            result = await rp_handler.handler(
+                {"id": f"job-{seed}", "input": {"workflow": workflow, "images": [{"name": "photo.png", "image": image}]}}
+            )
+            self.assertEqual(result["status"], "success")
+
+        with open(self.path) as f:
+            content = f.read()
+        self.assertNotIn(image, content)
+        self.assertNotIn(PROMPT, content)
+
+        traces = trace_capture.read_traces(self.path)
+        self.assertEqual([trace["job_id"] for trace in traces], ["job-1", "job-2"])
+        trace = traces[0]
+        self.assertEqual(trace["status"], "success")
+        self.assertEqual(trace["images"], [{"name": "image_0.png", "bytes": len(blank_png(16, 16))}])
+        self.assertNotIn("photo.png", content)
+        self.assertEqual(trace["outputs"][0]["type"], "image")
+        self.assertIn("execution", trace["timings"])
+        self.assertEqual([event[2] for event in trace["events"] if event[1] == "executing"], ["6", "10", "3", "9", None])
+        # The fake runs the last node while "sampling"
+        self.assertGreaterEqual(trace_capture.node_durations(trace["events"])["9"], 80)
+
+        report = await replay_traces.replay(self.path, speed=10)
+
+        self.assertEqual(report["jobs"], 2)
+        self.assertEqual(report["failed"], 0)
+        self.assertEqual(report["comfyui"]["prompts"], 2)
+        self.assertIn("recorded_latency_ms", report)
+
+    def test_replayed_job_runs_nodes_for_the_recorded_time(self):
+        trace = {
+            "job_id": "a",
+            "recorded_at": 10.0,
+            "workflow": trace_capture.sanitize_workflow(WORKFLOW),
+            "images": [{"name": "photo.png", "bytes": 30}],
+            "events": [[0.0, "executing", "3"], [2000.0, "executing", "9"], [2100.0, "executing", None]],
+        }
+        later = {**trace, "job_id": "b", "recorded_at": 30.0}
+
+        (first_delay, job), (second_delay, _) = replay_traces.schedule([trace, later], speed=4)
+
+        self.assertEqual((first_delay, second_delay), (0, 5.0))
+        self.assertEqual(job["input"]["workflow"]["3"]["_meta"], {"fake_seconds": 0.5})
+        self.assertEqual(len(base64.b64decode(job["input"]["images"][0]["image"])), 30)
+        self.assertTrue(job["input"]["workflow"]["9"]["inputs"]["filename_prefix"].startswith("replay_"))
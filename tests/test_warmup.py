@@ -0,0 +1,141 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import io
+import json
+import tempfile
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import warmup
+from src import job_stream
+from tests.fake_comfyui import FakeComfyUI
+
+REF_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "ref"))
+
+
+def ref_workflow(name):
+    with open(os.path.join(REF_DIR, name)) as f:
+        return json.load(f)
+
+
+def nodes_of(workflow, class_type):
+    return [node for node in workflow.values() if node["class_type"] == class_type]
+
+
+class TestMinimalVariant(unittest.TestCase):
+    def test_image_workflow(self):
+        workflow = ref_workflow("flux_1_kontext_dev_1pic-l.json")
+
+        variant = warmup.minimal_variant(workflow, size=64)
+
+        self.assertEqual(nodes_of(variant, "KSampler")[0]["inputs"]["steps"], 1)
+        latent = nodes_of(variant, "EmptySD3LatentImage")[0]["inputs"]
+        self.assertEqual((latent["width"], latent["height"], latent["batch_size"]), (64, 64, 1))
+        self.assertEqual(nodes_of(variant, "LoadImage")[0]["inputs"]["image"], warmup.WARMUP_IMAGE_NAME)
+        self.assertEqual(nodes_of(variant, "SaveImage"), [])
+        self.assertEqual(nodes_of(variant, "PreviewImage")[0]["inputs"], {"images": ["191", 0]})
+        # The models stay the same
+        self.assertEqual(nodes_of(variant, "UNETLoader"), nodes_of(workflow, "UNETLoader"))
+        self.assertEqual(nodes_of(variant, "DualCLIPLoader"), nodes_of(workflow, "DualCLIPLoader"))
+        # The original is not modified
+        self.assertEqual(nodes_of(workflow, "KSampler")[0]["inputs"]["steps"], 30)
+
+    def test_video_workflow(self):
+        variant = warmup.minimal_variant(ref_workflow("wan_image_to_video_upscale_slow.json"), size=64)
+
+        video = nodes_of(variant, "WanImageToVideo")[0]["inputs"]
+        self.assertEqual((video["width"], video["height"], video["length"]), (64, 64, 1))
+        self.assertFalse(nodes_of(variant, "VHS_VideoCombine")[0]["inputs"]["save_output"])
+
+    def test_video_saves_become_previews(self):
+        workflow = {
+            "1": {"class_type": "SaveWEBM", "inputs": {"images": ["8", 0], "filename_prefix": "clip", "fps": 24.0}},
+            "2": {"class_type": "SaveAnimatedWEBP", "inputs": {"images": ["8", 0], "filename_prefix": "clip", "fps": 6.0}},
+            "3": {"class_type": "SaveVideo", "inputs": {"video": ["9", 0], "filename_prefix": "video/clip", "format": "auto"}},
+        }
+
+        variant = warmup.minimal_variant(workflow, size=64)
+
+        self.assertEqual(variant["1"], {"class_type": "PreviewImage", "inputs": {"images": ["8", 0]}})
+        self.assertEqual(variant["2"], {"class_type": "PreviewImage", "inputs": {"images": ["8", 0]}})
+        self.assertEqual(variant["3"], {"class_type": "PreviewAny", "inputs": {"source": ["9", 0]}})
+
+    def test_reference_workflows_are_loaded(self):
+        workflows = warmup.load_workflows(REF_DIR)
+
+        self.assertEqual(len(workflows), 8)
+        self.assertIn("sdxl-scale.json", [name for name, _ in workflows])
+
+    @unittest.skipIf(job_stream.Image is None, "Pillow is not installed")
+    def test_blank_png_is_valid(self):
+        with job_stream.Image.open(io.BytesIO(warmup.blank_png(64, 32))) as image:
+            self.assertEqual(image.size, (64, 32))
+
+
+class TestWarmUp(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.workflow_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.05).start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+        for name in ("flux_1_kontext_dev_1pic-l.json", "sdxl-scale.json"):
+            with open(os.path.join(self.workflow_dir, name), "w") as f:
+                json.dump(ref_workflow(name), f)
+
+    async def asyncTearDown(self):
+        await rp_handler.event_dispatcher.close()
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        self.host.stop()
+        self.comfy.stop()
+
+    async def test_minimal_variants_are_queued(self):
+        report = await rp_handler.warm_up_models(self.workflow_dir)
+
+        self.assertEqual(len(self.comfy.prompts), 2)
+        for body in self.comfy.prompts.values():
+            prompt = body["prompt"]
+            self.assertTrue(all(node["inputs"].get("steps", 1) == 1 for node in prompt.values()))
+            self.assertEqual(nodes_of(prompt, "SaveImage"), [])
+        self.assertIn(warmup.WARMUP_IMAGE_NAME, self.comfy.uploads)
+        self.assertEqual(sorted(report["workflows"]), ["flux_1_kontext_dev_1pic-l.json", "sdxl-scale.json"])
+        self.assertEqual(report["errors"], {})
+        self.assertGreater(report["total_s"], 0)
+
+    async def test_failures_are_reported_and_skipped(self):
+        self.comfy.fail_with = "CUDA out of memory"
+
+        report = await rp_handler.warm_up_models(self.workflow_dir)
+
+        self.assertEqual(len(self.comfy.prompts), 2)
+        self.assertEqual(len(report["errors"]), 2)
+        self.assertIn("CUDA out of memory", report["errors"]["sdxl-scale.json"])
+
+    async def test_failed_image_upload_skips_only_the_image_workflows(self):
+        with patch.object(rp_handler, "upload_warmup_image", side_effect=RuntimeError("HTTP 500")):
+            report = await rp_handler.warm_up_models(self.workflow_dir)
+
+        self.assertEqual(len(self.comfy.prompts), 1)
+        self.assertEqual(list(report["errors"]), ["flux_1_kontext_dev_1pic-l.json"])
+        self.assertIn("HTTP 500", report["errors"]["flux_1_kontext_dev_1pic-l.json"])
+        self.assertIn("sdxl-scale.json", report["workflows"])
+
+    async def test_timed_out_warm_up_is_removed_from_comfy(self):
+        self.comfy.execution_time = 5
+
+        with patch.object(rp_handler, "WARMUP_TIMEOUT_S", 0.2):
+            report = await rp_handler.warm_up_models(self.workflow_dir)
+
+        self.assertEqual(len(report["errors"]), 2)
+        self.assertEqual(sorted(self.comfy.deleted), sorted(self.comfy.prompts))
+        self.assertEqual(self.comfy.interrupts, 2)
+        self.assertLess(report["total_s"], 5)
+
+    async def test_nothing_to_warm_up(self):
+        self.assertIsNone(await rp_handler.warm_up_models(""))
+        self.assertEqual(self.comfy.prompts, {})
@@ -0,0 +1,247 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import json
+import copy
+import tempfile
+import asyncio
+import time
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import workflow_schema
+from src.readiness import ComfyReadiness
+from tests.fake_comfyui import FakeComfyUI
+
+RESOURCES = os.path.join(os.path.dirname(__file__), "..", "test_resources")
+
+
+def load_json(*path):
+    with open(os.path.join(RESOURCES, *path)) as f:
+        return json.load(f)
+
+
+def example_workflow(name):
+    return load_json("workflows", name)["input"]["workflow"]
+
+
+OBJECT_INFO = load_json("object_info.json")
+
+
+class TestWorkflowSchema(unittest.TestCase):
+    def setUp(self):
+        self.schema = workflow_schema.WorkflowSchema(OBJECT_INFO)
+        self.workflow = example_workflow("workflow_sdxl_turbo.json")
+
+    def test_example_workflows_pass(self):
+        for name in ("workflow_sdxl_turbo.json", "workflow_sd3.json", "workflow_flux1_dev.json", "workflow_flux1_schnell.json"):
+            with self.subTest(name):
+                self.assertEqual(self.schema.check(example_workflow(name)), [])
+
+    def test_missing_custom_node(self):
+        errors = self.schema.check(example_workflow("workflow_webp.json"))
+
+        self.assertEqual(len(errors), 1)
+        self.assertIn("unknown node type 'Image Save'", errors[0])
+
+    def test_enum_values(self):
+        self.workflow["3"]["inputs"]["sampler_name"] = "euler_a"
+        self.workflow["4"]["inputs"]["ckpt_name"] = "sd_xl_base_1.0.safetensors"
+
+        errors = self.schema.check(self.workflow)
+
+        self.assertEqual(
+            errors,
+            [
+                "node 3 (KSampler): 'euler_a' is not a valid sampler_name",
+                "node 4 (CheckpointLoaderSimple): 'sd_xl_base_1.0.safetensors' is not a valid ckpt_name",
+            ],
+        )
+
+    def test_enum_values_of_the_wrong_type(self):
+        self.workflow["3"]["inputs"]["sampler_name"] = ["euler"]
+        self.workflow["3"]["inputs"]["scheduler"] = {"name": "normal"}
+
+        errors = self.schema.check(self.workflow)
+
+        self.assertEqual(
+            errors,
+            [
+                "node 3 (KSampler): sampler_name must be one of its choices, not a list",
+                "node 3 (KSampler): scheduler must be one of its choices, not a dict",
+            ],
+        )
+
+    def test_enum_values_of_newer_combo_specs_and_subfolders(self):
+        workflow = {
+            "1": {"class_type": "LatentUpscaleBy", "inputs": {"samples": ["2", 0], "upscale_method": "bislerp", "scale_by": 2}},
+            "2": {"class_type": "EmptyLatentImage", "inputs": {"width": 64, "height": 64, "batch_size": 1}},
+            "3": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sdxl\\juggernautXL_v9.safetensors"}},
+            "4": {
+                "class_type": "LoraLoader",
+                "inputs": {
+                    "model": ["3", 0],
+                    "clip": ["3", 1],
+                    "lora_name": "loras/style/watercolor.safetensors",
+                    "strength_model": 1,
+                    "strength_clip": 1,
+                },
+            },
+        }
+        self.assertEqual(self.schema.check(workflow), [])
+
+        workflow["1"]["inputs"]["upscale_method"] = "lanczos"
+        self.assertEqual(self.schema.check(workflow), ["node 1 (LatentUpscaleBy): 'lanczos' is not a valid upscale_method"])
+
+    def test_uploaded_images_are_not_checked(self):
+        workflow = {"1": {"class_type": "LoadImage", "inputs": {"image": "uploaded_with_the_job.png"}}}
+
+        self.assertEqual(self.schema.check(workflow), [])
+
+    def test_required_inputs(self):
+        del self.workflow["3"]["inputs"]["scheduler"]
+
+        self.assertEqual(self.schema.check(self.workflow), ["node 3 (KSampler): missing required input 'scheduler'"])
+
+    def test_links(self):
+        self.workflow["3"]["inputs"]["model"] = ["40", 0]
+        self.workflow["8"]["inputs"]["vae"] = ["4", 3]
+
+        self.assertEqual(
+            self.schema.check(self.workflow),
+            [
+                "node 3 (KSampler): input 'model' is linked to missing node 40",
+                "node 8 (VAEDecode): input 'vae' is linked to output 3 of node 4 (CheckpointLoaderSimple), which has 3 output(s)",
+            ],
+        )
+
+    def test_error_message_lists_the_first_problems(self):
+        workflow = {str(i): {"class_type": "Missing"} for i in range(15)}
+
+        message = self.schema.error_message(workflow)
+
+        self.assertTrue(message.startswith("Invalid workflow: node 0: unknown node type 'Missing'"))
+        self.assertTrue(message.endswith("(and 5 more)"))
+        self.assertIsNone(self.schema.error_message(self.workflow))
+
+    def test_check_is_fast(self):
+        workflow = {}
+        for copy_number in range(100):
+            for node_id, node in self.workflow.items():
+                node = copy.deepcopy(node)
+                for name, value in node["inputs"].items():
+                    if isinstance(value, list):
+                        node["inputs"][name] = [f"{value[0]}_{copy_number}", value[1]]
+                workflow[f"{node_id}_{copy_number}"] = node
+
+        started = time.perf_counter()
+        for _ in range(10):
+            self.assertEqual(self.schema.check(workflow), [])
+        per_node = (time.perf_counter() - started) / 10 / len(workflow)
+
+        self.assertLess(per_node, 0.00005)
+
+
+class TestHandlerSchemaCheck(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.05, object_info=copy.deepcopy(OBJECT_INFO)).start()
+        self.env = patch.dict(
+            os.environ,
+            {"COMFY_OUTPUT_PATH": self.output_dir, "BACKEND_WS_URL": "", "DETAILED_COMFY_LOGGING": "false"},
+        )
+        self.env.start()
+        self.host = patch.object(rp_handler, "COMFY_HOST", self.comfy.host)
+        self.host.start()
+        self.readiness = ComfyReadiness(rp_handler.comfy_client)
+        self.schemas = workflow_schema.WorkflowSchemaCache(rp_handler.comfy_client, self.readiness, refresh_min_s=0)
+        self.patches = [
+            patch.object(rp_handler, "readiness", self.readiness),
+            patch.object(rp_handler, "workflow_schemas", self.schemas),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.event_dispatcher.close()
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        self.host.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def run_job(self, workflow):
+        return await rp_handler.handler({"id": "job-1", "input": {"workflow": workflow}})
+
+    async def test_invalid_workflow_is_rejected_before_queueing(self):
+        await self.readiness.ensure_ready(f"http://{self.comfy.host}")
+        workflow = example_workflow("workflow_sdxl_turbo.json")
+        workflow["3"]["inputs"]["sampler_name"] = "euler_a"
+
+        result = await self.run_job(workflow)
+
+        self.assertEqual(result["error"], "Invalid workflow: node 3 (KSampler): 'euler_a' is not a valid sampler_name")
+        self.assertEqual(self.comfy.prompts, {})
+
+        workflow["3"]["inputs"]["sampler_name"] = "euler"
+        result = await self.run_job(workflow)
+        self.assertEqual(result["status"], "success")
+        # The rejection fetched the definitions once more, in case they had changed
+        self.assertEqual(self.comfy.object_info_requests, 2)
+
+    async def test_new_models_are_picked_up(self):
+        await self.readiness.ensure_ready(f"http://{self.comfy.host}")
+        workflow = example_workflow("workflow_sdxl_turbo.json")
+        workflow["4"]["inputs"]["ckpt_name"] = "just_downloaded.safetensors"
+        self.assertIn("'just_downloaded.safetensors' is not a valid ckpt_name", (await self.run_job(workflow))["error"])
+
+        checkpoint = self.comfy.object_info["CheckpointLoaderSimple"]["input"]["required"]["ckpt_name"]
+        checkpoint[0].append("just_downloaded.safetensors")
+        result = await self.run_job(workflow)
+
+        self.assertEqual(result["status"], "success")
+
+    async def test_definitions_are_fetched_once_per_comfyui_start(self):
+        await self.readiness.ensure_ready(f"http://{self.comfy.host}")
+        workflow = example_workflow("workflow_sdxl_turbo.json")
+
+        for _ in range(3):
+            self.assertEqual((await self.run_job(workflow))["status"], "success")
+        self.assertEqual(self.comfy.object_info_requests, 1)
+
+        # ComfyUI went away and came back
+        self.readiness.mark_down("restart")
+        await self.readiness.ensure_ready(f"http://{self.comfy.host}")
+        self.assertEqual((await self.run_job(workflow))["status"], "success")
+        self.assertEqual(self.comfy.object_info_requests, 2)
+
+    async def test_without_object_info_workflows_are_not_checked(self):
+        self.comfy.object_info = None
+        await self.readiness.ensure_ready(f"http://{self.comfy.host}")
+
+        result = await self.run_job({"9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "unchecked"}}, "1": {"class_type": "Unknown"}})
+
+        self.assertEqual(result["status"], "success")
+
+    async def test_failed_fetch_is_retried_after_the_refresh_interval(self):
+        self.comfy.object_info = None
+        self.schemas.refresh_min_s = 0.2
+        await self.readiness.ensure_ready(f"http://{self.comfy.host}")
+        workflow = example_workflow("workflow_sdxl_turbo.json")
+        workflow["3"]["inputs"]["sampler_name"] = "euler_a"
+
+        self.assertEqual((await self.run_job(workflow))["status"], "success")
+        self.assertEqual((await self.run_job(workflow))["status"], "success")
+        self.assertEqual(self.comfy.object_info_requests, 1)
+
+        self.comfy.object_info = copy.deepcopy(OBJECT_INFO)
+        await asyncio.sleep(0.25)
+        result = await self.run_job(workflow)
+
+        self.assertIn("'euler_a' is not a valid sampler_name", result["error"])
+        self.assertEqual(self.comfy.object_info_requests, 2)
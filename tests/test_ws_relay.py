@@ -0,0 +1,161 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import time
+import tempfile
+import asyncio
+
+# Make sure that "src" is known and can be used to import rp_handler.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+from src import rp_handler
+from src import ws_relay
+from tests.fake_comfyui import FakeComfyUI
+
+WORKFLOW = {"9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI"}}}
+
+
+def progress(value, node="3", prompt_id="p1"):
+    return {"type": "progress", "data": {"value": value, "max": 20, "node": node, "prompt_id": prompt_id}}
+
+
+def executing(node, prompt_id="p1"):
+    return {"type": "executing", "data": {"node": node, "prompt_id": prompt_id}}
+
+
+async def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    return condition()
+
+
+class TestRelayQueue(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # Nothing listens there, so everything stays queued
+        self.relay = ws_relay.ProgressRelay(max_queue=5)
+        self.relay.start("ws://127.0.0.1:9/relay")
+
+    async def asyncTearDown(self):
+        await self.relay.close()
+
+    def queued(self):
+        return [(job_id, message) for job_id, message, _ in self.relay._queue]
+
+    async def test_progress_is_coalesced_per_job_and_node(self):
+        self.relay.publish("job-1", executing("3"))
+        for value in range(1, 21):
+            self.relay.publish("job-1", progress(value))
+        self.relay.publish("job-2", progress(7))
+        self.relay.publish("job-1", progress(1, node="8"))
+
+        self.assertEqual(
+            self.queued(),
+            [("job-1", executing("3")), ("job-1", progress(20)), ("job-2", progress(7)), ("job-1", progress(1, node="8"))],
+        )
+        self.assertEqual(self.relay.stats()["coalesced"], 19)
+
+    async def test_full_queue_drops_progress_first(self):
+        self.relay.publish("job-1", progress(1))
+        for node in "abcdef":
+            self.relay.publish("job-1", executing(node))
+
+        self.assertEqual(self.queued(), [("job-1", executing(node)) for node in "bcdef"])
+        self.assertEqual(self.relay.stats()["dropped"], 2)
+
+    async def test_publish_never_blocks(self):
+        start = time.perf_counter()
+        for value in range(10000):
+            self.relay.publish(f"job-{value % 50}", executing(str(value)))
+        elapsed = time.perf_counter() - start
+
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(self.relay.stats()["queued"], 5)
+
+
+class TestRelayConnection(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.comfy = FakeComfyUI().start()
+        self.uri = f"ws://{self.comfy.host}/relay"
+
+    async def asyncSetUp(self):
+        self.relay = ws_relay.ProgressRelay()
+
+    async def asyncTearDown(self):
+        await self.relay.close()
+
+    def tearDown(self):
+        self.comfy.stop()
+
+    async def test_messages_are_relayed_with_their_job_id(self):
+        self.relay.start(self.uri)
+        self.relay.publish("job-1", executing("3"))
+        self.relay.publish("job-1", progress(5))
+
+        self.assertTrue(await wait_until(lambda: len(self.comfy.relayed) == 2))
+        self.assertEqual(self.comfy.relayed, [{"job_id": "job-1", "comfy": executing("3")},
+                                              {"job_id": "job-1", "comfy": progress(5)}])
+        self.assertEqual(self.relay.stats()["sent"], 2)
+
+    async def test_reconnects_after_the_connection_dropped(self):
+        self.relay.start(self.uri)
+        self.relay.publish("job-1", executing("3"))
+        self.assertTrue(await wait_until(lambda: len(self.comfy.relayed) == 1))
+
+        await asyncio.to_thread(self.comfy.drop_websockets)
+        self.assertTrue(await wait_until(lambda: not self.relay.connected))
+        self.relay.publish("job-1", executing("4"))
+
+        self.assertTrue(await wait_until(lambda: len(self.comfy.relayed) == 2))
+        self.assertEqual(self.comfy.relayed[1]["comfy"], executing("4"))
+        self.assertEqual(self.comfy.relay_connections, 2)
+        self.assertGreaterEqual(self.relay.stats()["reconnects"], 1)
+
+    async def test_drain_waits_for_queued_messages(self):
+        self.relay.start(self.uri)
+        self.assertTrue(await wait_until(lambda: self.relay.connected))
+        for node in range(20):
+            self.relay.publish("job-1", executing(str(node)))
+
+        self.assertTrue(await self.relay.drain(timeout=2))
+        self.assertEqual(self.relay.stats()["queued"], 0)
+        self.assertEqual(self.relay.stats()["sent"], 20)
+
+
+class TestHandlerRelay(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.comfy = FakeComfyUI(output_dir=self.output_dir, execution_time=0.1, progress_steps=20).start()
+        self.env = patch.dict(
+            os.environ,
+            {
+                "COMFY_OUTPUT_PATH": self.output_dir,
+                "BACKEND_WS_URL": f"ws://{self.comfy.host}/relay",
+                "DETAILED_COMFY_LOGGING": "false",
+            },
+        )
+        self.env.start()
+        self.patches = [
+            patch.object(rp_handler, "COMFY_HOST", self.comfy.host),
+            patch.object(rp_handler, "progress_relay", ws_relay.ProgressRelay()),
+        ]
+        for p in self.patches:
+            p.start()
+
+    async def asyncTearDown(self):
+        await rp_handler.progress_relay.close()
+        await rp_handler.comfy_client.close()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.env.stop()
+        self.comfy.stop()
+
+    async def test_jobs_share_one_relay_connection(self):
+        for job_id in ("job-1", "job-2"):
+            result = await rp_handler.handler({"id": job_id, "input": {"workflow": WORKFLOW}})
+            self.assertEqual(result["status"], "success")
+
+        self.assertTrue(await wait_until(lambda: {m["job_id"] for m in self.comfy.relayed} == {"job-1", "job-2"}))
+        self.assertEqual(self.comfy.relay_connections, 1)